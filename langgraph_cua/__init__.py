@@ -1,4 +1,136 @@
-from langgraph_cua.graph import create_cua, graph
-from langgraph_cua.types import CUAState
+import importlib
+import sys
+import types
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["create_cua", "graph", "CUAState"]
+if TYPE_CHECKING:
+    from langgraph.graph.state import CompiledStateGraph
+
+    from langgraph_cua.backends import ComputerBackend, ScrapybaraBackend, XvfbBackend
+    from langgraph_cua.blobs import BlobStore, InMemoryBlobStore, LocalFileBlobStore
+    from langgraph_cua.cassettes import Cassette
+    from langgraph_cua.evals import EvalReport, EvalTask, EvalTaskResult, load_task_suite, run_eval
+    from langgraph_cua.graph import create_cua
+    from langgraph_cua.lifecycle import (
+        InstanceRegistry,
+        LocalFileInstanceRegistry,
+        sweep_instances,
+    )
+    from langgraph_cua.metrics import InMemoryMetricsSink, MetricsSink
+    from langgraph_cua.nodes.create_vm_instance import get_vm_pool_key
+    from langgraph_cua.pool import PoolKey, VMPool
+    from langgraph_cua.ratelimit import RateLimit, get_rate_limiter
+    from langgraph_cua.runner import RunStats, TaskResult, TaskRunner, run_many
+    from langgraph_cua.trajectories import (
+        InMemoryTrajectoryStore,
+        TrajectoryCache,
+        TrajectoryStore,
+    )
+    from langgraph_cua.types import CUAState
+
+# The module each export is defined in. Exports are imported on first access, so importing
+# the package (or a light module like `langgraph_cua.types`) doesn't load Scrapybara, OpenAI
+# or LangChain OpenAI, nor compile the graph.
+_EXPORTS = {
+    "create_cua": "langgraph_cua.graph",
+    "CUAState": "langgraph_cua.types",
+    "VMPool": "langgraph_cua.pool",
+    "PoolKey": "langgraph_cua.pool",
+    "get_vm_pool_key": "langgraph_cua.nodes.create_vm_instance",
+    "BlobStore": "langgraph_cua.blobs",
+    "InMemoryBlobStore": "langgraph_cua.blobs",
+    "LocalFileBlobStore": "langgraph_cua.blobs",
+    "TrajectoryCache": "langgraph_cua.trajectories",
+    "TrajectoryStore": "langgraph_cua.trajectories",
+    "InMemoryTrajectoryStore": "langgraph_cua.trajectories",
+    "MetricsSink": "langgraph_cua.metrics",
+    "InMemoryMetricsSink": "langgraph_cua.metrics",
+    "run_many": "langgraph_cua.runner",
+    "TaskRunner": "langgraph_cua.runner",
+    "TaskResult": "langgraph_cua.runner",
+    "RunStats": "langgraph_cua.runner",
+    "RateLimit": "langgraph_cua.ratelimit",
+    "get_rate_limiter": "langgraph_cua.ratelimit",
+    "ComputerBackend": "langgraph_cua.backends",
+    "ScrapybaraBackend": "langgraph_cua.backends",
+    "XvfbBackend": "langgraph_cua.backends",
+    "sweep_instances": "langgraph_cua.lifecycle",
+    "InstanceRegistry": "langgraph_cua.lifecycle",
+    "LocalFileInstanceRegistry": "langgraph_cua.lifecycle",
+    "Cassette": "langgraph_cua.cassettes",
+    "run_eval": "langgraph_cua.evals",
+    "load_task_suite": "langgraph_cua.evals",
+    "EvalTask": "langgraph_cua.evals",
+    "EvalTaskResult": "langgraph_cua.evals",
+    "EvalReport": "langgraph_cua.evals",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(__all__))
+
+
+class _Package(types.ModuleType):
+    """
+    `langgraph_cua.graph` is both a submodule, and the compiled graph exported by the
+    package. The compiled graph is served by a property, since the import system sets the
+    submodule as an attribute of the package once it's imported.
+    """
+
+    @property
+    def graph(self) -> "CompiledStateGraph":
+        from langgraph_cua.graph import get_graph
+
+        return get_graph()
+
+    @graph.setter
+    def graph(self, value: Any) -> None:
+        # Ignore the submodule being set, and keep serving the compiled graph.
+        pass
+
+
+sys.modules[__name__].__class__ = _Package
+
+__all__ = [
+    "create_cua",
+    "graph",
+    "CUAState",
+    "VMPool",
+    "PoolKey",
+    "get_vm_pool_key",
+    "BlobStore",
+    "InMemoryBlobStore",
+    "LocalFileBlobStore",
+    "TrajectoryCache",
+    "TrajectoryStore",
+    "InMemoryTrajectoryStore",
+    "MetricsSink",
+    "InMemoryMetricsSink",
+    "run_many",
+    "TaskRunner",
+    "TaskResult",
+    "RunStats",
+    "RateLimit",
+    "get_rate_limiter",
+    "ComputerBackend",
+    "ScrapybaraBackend",
+    "XvfbBackend",
+    "sweep_instances",
+    "InstanceRegistry",
+    "LocalFileInstanceRegistry",
+    "Cassette",
+    "run_eval",
+    "load_task_suite",
+    "EvalTask",
+    "EvalTaskResult",
+    "EvalReport",
+]
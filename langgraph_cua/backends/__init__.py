@@ -0,0 +1,58 @@
+from typing import Any, Dict, Tuple
+
+from langgraph_cua.backends.base import AsyncInstanceAdapter, ComputerBackend
+from langgraph_cua.backends.scrapybara import ScrapybaraBackend
+from langgraph_cua.backends.xvfb import XvfbBackend, XvfbInstance
+from langgraph_cua.images import DISPLAY_SIZE
+
+
+def get_computer_backend(configuration: Dict[str, Any]) -> ComputerBackend:
+    """
+    Gets the backend to start and look up instances with. Defaults to Scrapybara, using
+    the API key and rate limit in the configuration. If the configuration has a cassette,
+    the backend is wrapped so its calls are recorded to, or replayed from, the cassette.
+
+    Args:
+        configuration: The configuration, with defaults.
+
+    Returns:
+        The computer backend.
+    """
+    backend = configuration.get("computer_backend")
+    if backend is None:
+        backend = ScrapybaraBackend(
+            configuration.get("scrapybara_api_key"),
+            configuration.get("scrapybara_rate_limit"),
+            configuration.get("max_rate_limit_retries"),
+        )
+    cassette = configuration.get("cassette")
+    if cassette is not None:
+        return cassette.wrap_backend(backend)
+    return backend
+
+
+def get_display_size(configuration: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Gets the (width, height) of the display of the configured backend's instances.
+
+    Args:
+        configuration: The configuration, with defaults.
+
+    Returns:
+        The resolution of the display.
+    """
+    backend = configuration.get("computer_backend")
+    if backend is None:
+        return DISPLAY_SIZE
+    return tuple(backend.display_size)
+
+
+__all__ = [
+    "ComputerBackend",
+    "AsyncInstanceAdapter",
+    "ScrapybaraBackend",
+    "XvfbBackend",
+    "XvfbInstance",
+    "get_computer_backend",
+    "get_display_size",
+]
@@ -0,0 +1,98 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Sequence, Tuple
+
+from langgraph_cua.images import DISPLAY_SIZE
+
+
+class AsyncInstanceAdapter:
+    """
+    Async view of a sync instance, which runs each of its methods on a worker thread.
+    Used by the default async methods of `ComputerBackend`.
+    """
+
+    def __init__(self, instance: Any):
+        self._instance = instance
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._instance, name)
+        if not callable(attribute):
+            return attribute
+
+        async def acall(*args: Any, **kwargs: Any) -> Any:
+            return await asyncio.to_thread(attribute, *args, **kwargs)
+
+        return acall
+
+
+class ComputerBackend(ABC):
+    """
+    Starts and looks up the machines the agent controls. The default backend runs them
+    on Scrapybara. Implement this to run the agent on other machines.
+
+    Instances returned by a backend implement the parts of Scrapybara's instance API used
+    by the graph: an `id` attribute, and `computer`, `get_stream_url` and `stop` methods.
+    `computer` takes the keyword arguments built by `get_computer_call_kwargs`, and returns
+    a `ComputerResponse`. Instances of backends which set `supports_auth_states` also have
+    an `authenticate` method. Instances returned by `astart` and `aget` have the same
+    methods, as coroutines.
+    """
+
+    # Whether the backend's instances implement `authenticate`, so `auth_state_id` can be used.
+    supports_auth_states: bool = False
+
+    @property
+    def display_size(self) -> Tuple[int, int]:
+        """
+        The (width, height) of the instances' displays, and so of their screenshots.
+        """
+        return DISPLAY_SIZE
+
+    @abstractmethod
+    def start(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> Any:
+        """
+        Starts a new instance for the given environment.
+
+        Args:
+            environment: One of "web", "ubuntu", or "windows".
+            timeout_hours: The number of hours to keep the instance running before it times out.
+            blocked_domains: Domains to block. Only applies to the "web" environment.
+
+        Returns:
+            The newly started instance.
+        """
+
+    @abstractmethod
+    def get(self, instance_id: str) -> Any:
+        """
+        Gets a running instance by its ID.
+
+        Args:
+            instance_id: The ID of the instance.
+
+        Returns:
+            The instance.
+        """
+
+    async def astart(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> Any:
+        """
+        Async version of `start`. By default, runs `start` on a worker thread.
+        """
+        instance = await asyncio.to_thread(self.start, environment, timeout_hours, blocked_domains)
+        return AsyncInstanceAdapter(instance)
+
+    async def aget(self, instance_id: str) -> Any:
+        """
+        Async version of `get`. By default, runs `get` on a worker thread.
+        """
+        return AsyncInstanceAdapter(await asyncio.to_thread(self.get, instance_id))
@@ -0,0 +1,79 @@
+from typing import Any, Optional, Sequence
+
+from .. import utils
+from ..ratelimit import (
+    RateLimit,
+    RateLimiter,
+    acall_with_retries,
+    call_with_retries,
+    get_rate_limiter,
+)
+from .base import ComputerBackend
+
+
+class ScrapybaraBackend(ComputerBackend):
+    """
+    The default backend, which runs instances on Scrapybara. Every call to Scrapybara goes
+    through the rate limiter of the API key.
+    """
+
+    supports_auth_states = True
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        rate_limit: Optional[RateLimit] = None,
+        max_rate_limit_retries: int = 5,
+    ):
+        self.api_key = api_key
+        self.rate_limit = rate_limit
+        self.max_rate_limit_retries = max_rate_limit_retries
+
+    def _limiter(self) -> RateLimiter:
+        return get_rate_limiter("scrapybara", self.api_key, self.rate_limit)
+
+    def start(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> utils.Instance:
+        utils._validate_api_key(self.api_key)
+        return call_with_retries(
+            self._limiter(),
+            utils.start_instance,
+            utils.get_scrapybara_client(self.api_key),
+            environment,
+            timeout_hours,
+            blocked_domains,
+            max_retries=self.max_rate_limit_retries,
+        )
+
+    def get(self, instance_id: str) -> utils.Instance:
+        client = utils.get_scrapybara_client(self.api_key)
+        return call_with_retries(
+            self._limiter(), client.get, instance_id, max_retries=self.max_rate_limit_retries
+        )
+
+    async def astart(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> utils.AsyncInstance:
+        utils._validate_api_key(self.api_key)
+        return await acall_with_retries(
+            self._limiter(),
+            utils.astart_instance,
+            utils.get_async_scrapybara_client(self.api_key),
+            environment,
+            timeout_hours,
+            blocked_domains,
+            max_retries=self.max_rate_limit_retries,
+        )
+
+    async def aget(self, instance_id: str) -> Any:
+        client = utils.get_async_scrapybara_client(self.api_key)
+        return await acall_with_retries(
+            self._limiter(), client.get, instance_id, max_retries=self.max_rate_limit_retries
+        )
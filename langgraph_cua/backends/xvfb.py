@@ -0,0 +1,350 @@
+import base64
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from scrapybara.types import ComputerResponse, InstanceGetStreamUrlResponse
+
+from .base import ComputerBackend
+
+# The browser launched on the display of "web" instances. Any Chromium-based browser works,
+# since the window size, profile directory and blocked domains are passed as Chromium flags.
+DEFAULT_BROWSER_COMMAND = (
+    "chromium",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-dev-shm-usage",
+    "--disable-infobars",
+    "--kiosk",
+)
+
+# Captures the whole display as a PNG on stdout. Requires ImageMagick.
+DEFAULT_SCREENSHOT_COMMAND = ("import", "-window", "root", "png:-")
+
+# The X mouse buttons for each Scrapybara mouse button.
+MOUSE_BUTTONS = {"left": "1", "middle": "2", "right": "3", "back": "8", "forward": "9"}
+
+# The X mouse buttons which scroll up, down, left and right, one notch per click.
+SCROLL_UP, SCROLL_DOWN, SCROLL_LEFT, SCROLL_RIGHT = "4", "5", "6", "7"
+
+# The delay between keystrokes when typing text, in milliseconds.
+TYPING_DELAY_MS = 12
+
+# Displays in use by instances of this process, which may not have created their lock file yet.
+_used_displays: Set[int] = set()
+_displays_lock = threading.Lock()
+
+
+def get_xdotool_args(kwargs: Dict[str, Any]) -> List[str]:
+    """
+    Converts the arguments for Scrapybara's `instance.computer` method into the arguments
+    for one xdotool invocation. Keys are X keysyms, which is what `CUA_KEY_TO_SCRAPYBARA_KEY`
+    maps the model's key names to, so they're passed through as-is.
+
+    Args:
+        kwargs: The keyword arguments for `instance.computer`.
+
+    Returns:
+        The xdotool arguments, or an empty list if the action doesn't use the mouse or
+        keyboard.
+
+    Raises:
+        ValueError: If the action is unknown.
+    """
+    action = kwargs.get("action")
+
+    if action == "click_mouse":
+        x, y = kwargs["coordinates"]
+        button = MOUSE_BUTTONS.get(kwargs.get("button") or "left", "1")
+        repeat = str(kwargs.get("num_clicks") or 1)
+        return ["mousemove", str(x), str(y), "click", "--repeat", repeat, button]
+    elif action == "drag_mouse":
+        (x, y), *path = kwargs["path"]
+        args = ["mousemove", str(x), str(y), "mousedown", "1"]
+        for x, y in path:
+            args += ["mousemove", str(x), str(y)]
+        return args + ["mouseup", "1"]
+    elif action == "press_key":
+        return ["key", "--", "+".join(kwargs["keys"])]
+    elif action == "move_mouse":
+        x, y = kwargs["coordinates"]
+        return ["mousemove", str(x), str(y)]
+    elif action == "scroll":
+        x, y = kwargs["coordinates"]
+        args = ["mousemove", str(x), str(y)]
+        for delta, negative, positive in (
+            (kwargs.get("delta_y") or 0, SCROLL_UP, SCROLL_DOWN),
+            (kwargs.get("delta_x") or 0, SCROLL_LEFT, SCROLL_RIGHT),
+        ):
+            if delta:
+                button = positive if delta > 0 else negative
+                args += ["click", "--repeat", str(abs(delta)), button]
+        return args
+    elif action == "type_text":
+        return ["type", "--delay", str(TYPING_DELAY_MS), "--", kwargs["text"]]
+    elif action == "take_screenshot":
+        return []
+    raise ValueError(f"Unknown computer action: {action}")
+
+
+class XvfbInstance:
+    """
+    A machine running on a local Xvfb display. Actions are performed with xdotool, and
+    screenshots captured with `screenshot_command`.
+    """
+
+    def __init__(
+        self,
+        backend: "XvfbBackend",
+        display: int,
+        processes: List[subprocess.Popen],
+        profile_dir: Optional[str] = None,
+    ):
+        self._backend = backend
+        self._processes = processes
+        self._profile_dir = profile_dir
+        self._timer: Optional[threading.Timer] = None
+        self.id = f"xvfb-{display}-{uuid.uuid4().hex[:8]}"
+        self.display = display
+        self.status = "running"
+
+    @property
+    def env(self) -> Dict[str, str]:
+        return {**os.environ, "DISPLAY": f":{self.display}"}
+
+    def _run(self, args: Sequence[str]) -> bytes:
+        if self.status != "running":
+            raise RuntimeError(f"Instance {self.id} is not running")
+        try:
+            result = subprocess.run(
+                list(args),
+                env=self.env,
+                capture_output=True,
+                check=True,
+                timeout=self._backend.command_timeout_seconds,
+            )
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode("utf-8", "replace").strip()
+            raise RuntimeError(f"{args[0]} failed with exit code {e.returncode}: {stderr}") from e
+        return result.stdout
+
+    def screenshot(self) -> str:
+        """
+        Captures the display.
+
+        Returns:
+            The base64 encoded PNG image.
+        """
+        return base64.b64encode(self._run(self._backend.screenshot_command)).decode("ascii")
+
+    def computer(self, **kwargs: Any) -> ComputerResponse:
+        args = get_xdotool_args(kwargs)
+        if args:
+            self._run([self._backend.xdotool_command, *args])
+        if kwargs.get("screenshot") is False:
+            return ComputerResponse(output=None, error=None, base_64_image=None)
+        return ComputerResponse(output=None, error=None, base_64_image=self.screenshot())
+
+    def get_stream_url(self) -> InstanceGetStreamUrlResponse:
+        return InstanceGetStreamUrlResponse(
+            stream_url=self._backend.stream_url_template.format(display=self.display)
+        )
+
+    def stop(self) -> None:
+        if self.status != "running":
+            return
+        self.status = "terminated"
+        if self._timer is not None:
+            self._timer.cancel()
+        # Stop the browser before the display it's running on.
+        for process in reversed(self._processes):
+            _terminate(process)
+        if self._profile_dir is not None:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+        self._backend._release(self)
+
+
+def _terminate(process: subprocess.Popen, timeout: float = 5) -> None:
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class XvfbBackend(ComputerBackend):
+    """
+    A backend which runs each instance on a local Xvfb display, without any network round
+    trips. "web" instances run a Chromium-based browser on the display, and "ubuntu"
+    instances an empty desktop, to run other programs on. Windows is not supported.
+
+    Requires Linux, with Xvfb, xdotool, ImageMagick (for screenshots) and, for the "web"
+    environment, Chromium installed.
+    """
+
+    def __init__(
+        self,
+        width: int = 1024,
+        height: int = 768,
+        browser_command: Sequence[str] = DEFAULT_BROWSER_COMMAND,
+        screenshot_command: Sequence[str] = DEFAULT_SCREENSHOT_COMMAND,
+        xvfb_command: str = "Xvfb",
+        xdotool_command: str = "xdotool",
+        first_display: int = 99,
+        stream_url_template: str = "x11://localhost:{display}",
+        startup_timeout_seconds: float = 10,
+        command_timeout_seconds: float = 30,
+    ):
+        """
+        Args:
+            width: The width of the display, in pixels.
+            height: The height of the display, in pixels.
+            browser_command: The command which launches the browser of "web" instances.
+            screenshot_command: The command which writes a PNG of the display to stdout.
+            xvfb_command: The Xvfb executable.
+            xdotool_command: The xdotool executable.
+            first_display: The lowest display number to use. Instances use the next free one.
+            stream_url_template: The stream URL of an instance, formatted with its display
+                number. Point it at e.g. a VNC web client serving the displays.
+            startup_timeout_seconds: The longest to wait for a display to start.
+            command_timeout_seconds: The longest to wait for each xdotool or screenshot command.
+        """
+        self.width = width
+        self.height = height
+        self.browser_command = tuple(browser_command)
+        self.screenshot_command = tuple(screenshot_command)
+        self.xvfb_command = xvfb_command
+        self.xdotool_command = xdotool_command
+        self.first_display = first_display
+        self.stream_url_template = stream_url_template
+        self.startup_timeout_seconds = startup_timeout_seconds
+        self.command_timeout_seconds = command_timeout_seconds
+        self._instances: Dict[str, XvfbInstance] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def display_size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def _reserve_display(self) -> int:
+        with _displays_lock:
+            display = self.first_display
+            while display in _used_displays or os.path.exists(f"/tmp/.X{display}-lock"):
+                display += 1
+            _used_displays.add(display)
+        return display
+
+    def _start_display(self, display: int) -> subprocess.Popen:
+        process = subprocess.Popen(
+            [
+                self.xvfb_command,
+                f":{display}",
+                "-screen",
+                "0",
+                f"{self.width}x{self.height}x24",
+                "-nolisten",
+                "tcp",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + self.startup_timeout_seconds
+        while not os.path.exists(f"/tmp/.X11-unix/X{display}"):
+            if process.poll() is not None:
+                raise RuntimeError(f"Xvfb exited with code {process.returncode} on :{display}")
+            if time.monotonic() >= deadline:
+                _terminate(process)
+                raise TimeoutError(f"Xvfb did not start on :{display}")
+            time.sleep(0.05)
+        return process
+
+    def _start_browser(
+        self, display: int, profile_dir: str, blocked_domains: Sequence[str]
+    ) -> subprocess.Popen:
+        args = [
+            *self.browser_command,
+            f"--user-data-dir={profile_dir}",
+            "--window-position=0,0",
+            f"--window-size={self.width},{self.height}",
+        ]
+        if blocked_domains:
+            rules = ", ".join(
+                f"MAP {pattern} 0.0.0.0"
+                for domain in blocked_domains
+                for pattern in (domain, f"*.{domain}")
+            )
+            args.append(f"--host-resolver-rules={rules}")
+        return subprocess.Popen(
+            args,
+            env={**os.environ, "DISPLAY": f":{display}"},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def start(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> XvfbInstance:
+        if environment not in ("web", "ubuntu"):
+            raise ValueError(
+                f"The Xvfb backend only supports the 'web' and 'ubuntu' environments. Received: {environment}"
+            )
+        display = self._reserve_display()
+        processes: List[subprocess.Popen] = []
+        profile_dir: Optional[str] = None
+        try:
+            processes.append(self._start_display(display))
+            if environment == "web":
+                profile_dir = tempfile.mkdtemp(prefix="langgraph-cua-")
+                processes.append(
+                    self._start_browser(display, profile_dir, list(blocked_domains or []))
+                )
+        except BaseException:
+            for process in processes:
+                _terminate(process)
+            if profile_dir is not None:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+            with _displays_lock:
+                _used_displays.discard(display)
+            raise
+
+        instance = XvfbInstance(self, display, processes, profile_dir)
+        # Mirror Scrapybara, which stops instances once they time out.
+        instance._timer = threading.Timer(timeout_hours * 3600, instance.stop)
+        instance._timer.daemon = True
+        instance._timer.start()
+        with self._lock:
+            self._instances[instance.id] = instance
+        return instance
+
+    def get(self, instance_id: str) -> XvfbInstance:
+        with self._lock:
+            instance = self._instances.get(instance_id)
+        if instance is None:
+            raise ValueError(f"Instance {instance_id} not found")
+        return instance
+
+    def _release(self, instance: XvfbInstance) -> None:
+        with self._lock:
+            self._instances.pop(instance.id, None)
+        with _displays_lock:
+            _used_displays.discard(instance.display)
+
+    def stop_all(self) -> None:
+        """
+        Stops every instance started by this backend.
+        """
+        with self._lock:
+            instances = list(self._instances.values())
+        for instance in instances:
+            instance.stop()
@@ -0,0 +1,278 @@
+import base64
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from langchain_core.messages import AnyMessage
+
+from .images import EncodedScreenshot
+
+# Blob references mirror the syntax of data URLs, e.g. "blob:image/png;sha256,<hex digest>",
+# so the media type travels with the reference.
+BLOB_URL_SCHEME = "blob:"
+BLOB_DIGEST_ALGORITHM = "sha256"
+
+BlobData = Union[bytes, memoryview]
+
+
+class BlobStore(ABC):
+    """
+    A content-addressed store for screenshots. Blobs are keyed by the hex SHA-256
+    digest of their contents, so storing the same screenshot twice is free.
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """
+        Stores a blob.
+
+        Args:
+            data: The contents of the blob.
+
+        Returns:
+            The digest of the blob.
+        """
+
+    @abstractmethod
+    def get(self, digest: str) -> BlobData:
+        """
+        Reads a blob.
+
+        Args:
+            digest: The digest of the blob.
+
+        Returns:
+            The contents of the blob.
+
+        Raises:
+            KeyError: If the blob does not exist.
+        """
+
+    @abstractmethod
+    def delete(self, digest: str) -> None:
+        """
+        Deletes a blob, if it exists.
+        """
+
+    @abstractmethod
+    def __contains__(self, digest: str) -> bool: ...
+
+
+class InMemoryBlobStore(BlobStore):
+    """
+    A blob store which keeps blobs in a dictionary. Blobs are lost when the process exits.
+    """
+
+    def __init__(self):
+        self._blobs: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes) -> str:
+        digest = compute_digest(data)
+        with self._lock:
+            self._blobs.setdefault(digest, bytes(data))
+        return digest
+
+    def get(self, digest: str) -> BlobData:
+        with self._lock:
+            return self._blobs[digest]
+
+    def delete(self, digest: str) -> None:
+        with self._lock:
+            self._blobs.pop(digest, None)
+
+    def __contains__(self, digest: str) -> bool:
+        with self._lock:
+            return digest in self._blobs
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._blobs)
+
+
+class LocalFileBlobStore(BlobStore):
+    """
+    A blob store which writes each blob to its own file under `root`, sharded by
+    the first two characters of the digest. If `use_mmap` is True, blobs are read
+    through a memory map instead of being copied into memory.
+    """
+
+    def __init__(self, root: Union[str, Path], use_mmap: bool = False):
+        self.root = Path(root)
+        self.use_mmap = use_mmap
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str) -> Path:
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            raise KeyError(digest)
+        return self.root / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        digest = compute_digest(data)
+        path = self._path(digest)
+        if path.exists():
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so readers never see a partial blob.
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest: str) -> BlobData:
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                if not self.use_mmap:
+                    return f.read()
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError:
+            raise KeyError(digest) from None
+
+    def delete(self, digest: str) -> None:
+        try:
+            self._path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, digest: str) -> bool:
+        try:
+            return self._path(digest).exists()
+        except KeyError:
+            return False
+
+
+def compute_digest(data: bytes) -> str:
+    return hashlib.new(BLOB_DIGEST_ALGORITHM, data).hexdigest()
+
+
+def make_blob_url(digest: str, media_type: str) -> str:
+    """
+    Builds a reference to a blob, which can be stored in place of a data URL.
+
+    Args:
+        digest: The digest of the blob.
+        media_type: The media type of the blob, e.g. "image/png".
+
+    Returns:
+        The blob reference.
+    """
+    return f"{BLOB_URL_SCHEME}{media_type};{BLOB_DIGEST_ALGORITHM},{digest}"
+
+
+def parse_blob_url(url: str) -> Optional[Tuple[str, str]]:
+    """
+    Parses a blob reference built with `make_blob_url`.
+
+    Args:
+        url: The URL to parse.
+
+    Returns:
+        A tuple of (media type, digest), or None if the URL is not a blob reference.
+    """
+    if not isinstance(url, str) or not url.startswith(BLOB_URL_SCHEME):
+        return None
+    header, _, digest = url[len(BLOB_URL_SCHEME) :].partition(",")
+    media_type, _, algorithm = header.partition(";")
+    if algorithm != BLOB_DIGEST_ALGORITHM or not digest:
+        return None
+    return media_type, digest
+
+
+def store_screenshot(screenshot: EncodedScreenshot, blob_store: Optional[BlobStore]) -> str:
+    """
+    Returns the image URL to store in state for a screenshot. If a blob store is
+    given, the screenshot is written to it and a blob reference is returned,
+    otherwise the screenshot is inlined as a data URL.
+
+    Args:
+        screenshot: The screenshot to store.
+        blob_store: The blob store to write the screenshot to, if any.
+
+    Returns:
+        A blob reference or data URL for the screenshot.
+    """
+    if blob_store is None:
+        return screenshot.to_data_url()
+    digest = blob_store.put(base64.b64decode(screenshot.base64_image))
+    return make_blob_url(digest, screenshot.media_type)
+
+
+def read_image_url(url: str, blob_store: Optional[BlobStore]) -> BlobData:
+    """
+    Reads the bytes of an image from a data URL or a blob reference.
+
+    Args:
+        url: A base64 data URL, or a blob reference built with `make_blob_url`.
+        blob_store: The blob store blob references point to.
+
+    Returns:
+        The image bytes.
+
+    Raises:
+        ValueError: If the URL is neither a base64 data URL nor a blob reference.
+    """
+    parsed = parse_blob_url(url)
+    if parsed is not None:
+        if blob_store is None:
+            raise ValueError("Cannot read a blob reference without a blob store.")
+        return blob_store.get(parsed[1])
+    header, _, data = url.partition(",")
+    if not header.startswith("data:") or not header.endswith(";base64"):
+        raise ValueError("Image URL must be a base64 data URL or a blob reference.")
+    return base64.b64decode(data)
+
+
+def _rehydrate_content(content: List, blob_store: BlobStore) -> Optional[List]:
+    new_content = None
+    for index, block in enumerate(content):
+        if not isinstance(block, dict) or block.get("type") != "input_image":
+            continue
+        parsed = parse_blob_url(block.get("image_url"))
+        if parsed is None:
+            continue
+        media_type, digest = parsed
+        data = base64.b64encode(blob_store.get(digest)).decode("ascii")
+        if new_content is None:
+            new_content = list(content)
+        new_content[index] = {**block, "image_url": f"data:{media_type};base64,{data}"}
+    return new_content
+
+
+def rehydrate_messages(
+    messages: Sequence[AnyMessage], blob_store: Optional[BlobStore]
+) -> List[AnyMessage]:
+    """
+    Replaces blob references in image blocks with data URLs read from the blob store.
+    Messages which contain blob references are copied, the originals are never mutated.
+
+    Args:
+        messages: The messages to rehydrate. Non-message entries (e.g. a system prompt dict) are kept as-is.
+        blob_store: The blob store the references point to. If None, messages are returned as-is.
+
+    Returns:
+        The rehydrated messages.
+    """
+    if blob_store is None:
+        return list(messages)
+    rehydrated = []
+    for message in messages:
+        content = getattr(message, "content", None)
+        new_content = _rehydrate_content(content, blob_store) if isinstance(content, list) else None
+        if new_content is not None:
+            message = message.model_copy(update={"content": new_content})
+        rehydrated.append(message)
+    return rehydrated
@@ -0,0 +1,497 @@
+import asyncio
+import base64
+import binascii
+import inspect
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Literal, Optional, Sequence, Tuple, Union
+
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+from scrapybara.core.api_error import ApiError
+from scrapybara.types import ComputerResponse, InstanceGetStreamUrlResponse
+
+from .backends.base import ComputerBackend
+from .blobs import LocalFileBlobStore, make_blob_url
+
+# A cassette is a directory holding one JSON interaction per line, and the screenshots
+# they reference, each stored once under its digest.
+CASSETTE_FILE = "cassette.jsonl"
+CASSETTE_BLOBS_DIR = "blobs"
+
+# The instance methods whose calls are recorded and replayed.
+RECORDED_INSTANCE_METHODS = frozenset(["computer", "get_stream_url", "authenticate", "stop"])
+
+CassetteMode = Literal["record", "replay"]
+CassetteLatency = Literal["recorded", "none"]
+
+
+def _to_json(value: Any) -> Any:
+    # Normalizes a value the way a JSON round trip would, e.g. tuples to lists.
+    return json.loads(json.dumps(value, default=str))
+
+
+class Cassette:
+    """
+    Records the traffic of the graph to a directory, and replays it without network access.
+
+    In "record" mode, every model response (along with the request it answered) and every
+    call to the computer backend are written to `path`. Screenshots are written to a blob
+    store inside the cassette, so each distinct screenshot is stored once.
+
+    In "replay" mode, the recorded responses are served instead, with the latency they were
+    recorded with (`latency="recorded"`) or none at all (`latency="none"`). Model responses
+    are matched by task and step, so replays can change settings which only shape the
+    requests, e.g. the history or screenshot settings. Calls to an instance are matched in
+    the order they were recorded in. Screenshots the recording didn't take (e.g. extra polls
+    while waiting for the screen to settle) are served the last screenshot of the instance.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        mode: CassetteMode = "replay",
+        latency: CassetteLatency = "none",
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError('mode must be one of "record" or "replay"')
+        if latency not in ("recorded", "none"):
+            raise ValueError('latency must be one of "recorded" or "none"')
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self._file = self.path / CASSETTE_FILE
+        self._lock = threading.Lock()
+        self._size = 0
+        self._model_calls: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._starts: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._calls: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._last_screenshots: Dict[str, Dict[str, Any]] = {}
+
+        if mode == "record":
+            self.path.mkdir(parents=True, exist_ok=True)
+            # Re-recording replaces the interactions. Blobs are kept, since they're content-addressed.
+            self._file.write_text("")
+            self.blobs = LocalFileBlobStore(self.path / CASSETTE_BLOBS_DIR)
+            return
+
+        if not self._file.exists():
+            raise FileNotFoundError(f"No cassette found at {self.path}")
+        self.blobs = LocalFileBlobStore(self.path / CASSETTE_BLOBS_DIR)
+        with open(self._file, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def __len__(self) -> int:
+        """Returns the number of interactions recorded in, or loaded from, the cassette."""
+        with self._lock:
+            return self._size
+
+    def _index(self, interaction: Dict[str, Any]) -> None:
+        self._size += 1
+        kind = interaction["type"]
+        if kind == "model":
+            self._model_calls[interaction["key"]].append(interaction)
+        elif kind == "start":
+            self._starts[interaction["environment"]].append(interaction)
+        elif kind == "call":
+            self._calls[interaction["instance_id"]].append(interaction)
+
+    def _write(self, interaction: Dict[str, Any]) -> None:
+        line = json.dumps(interaction, separators=(",", ":"), default=str)
+        with self._lock:
+            with open(self._file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._size += 1
+
+    def _delay(self, interaction: Dict[str, Any]) -> float:
+        return interaction.get("seconds", 0.0) if self.latency == "recorded" else 0.0
+
+    def _store_image(self, data: str, media_type: str = "image/png") -> str:
+        return make_blob_url(self.blobs.put(base64.b64decode(data)), media_type)
+
+    def _load_image(self, url: str) -> str:
+        digest = url.rpartition(",")[2]
+        return base64.b64encode(bytes(self.blobs.get(digest))).decode("ascii")
+
+    def _dehydrate(self, value: Any) -> Any:
+        # Replaces every inline base64 image (i.e. data URL) with a reference to the blob store.
+        if isinstance(value, dict):
+            return {key: self._dehydrate(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._dehydrate(item) for item in value]
+        if isinstance(value, str) and value.startswith("data:image/") and ";base64," in value:
+            header, _, data = value.partition(",")
+            try:
+                return self._store_image(data, header[len("data:") : -len(";base64")])
+            except binascii.Error:
+                return value
+        return value
+
+    def record_model_call(
+        self,
+        key: str,
+        model_input: Sequence[Any],
+        invoke_kwargs: Dict[str, Any],
+        response: AIMessage,
+        seconds: float,
+    ) -> None:
+        """
+        Records a model response, and the request it answered.
+
+        Args:
+            key: The key to replay the response under, from `get_model_call_key`.
+            model_input: The messages sent to the model.
+            invoke_kwargs: The keyword arguments the model was invoked with.
+            response: The model's response.
+            seconds: How long the model took to respond.
+        """
+        messages = [
+            message_to_dict(message) if isinstance(message, BaseMessage) else message
+            for message in model_input
+        ]
+        self._write(
+            {
+                "type": "model",
+                "key": key,
+                "request": self._dehydrate({"messages": messages, "kwargs": invoke_kwargs}),
+                "response": message_to_dict(response),
+                "seconds": round(seconds, 6),
+            }
+        )
+
+    def replay_model_call(self, key: str) -> "ReplayedModel":
+        """
+        Gets the model which replays the next recorded response for a key.
+
+        Args:
+            key: The key the response was recorded under, from `get_model_call_key`.
+
+        Returns:
+            A stand-in for the model, which responds with the recorded response.
+
+        Raises:
+            KeyError: If there's no recorded response left for the key.
+        """
+        with self._lock:
+            queue = self._model_calls.get(key)
+            if not queue:
+                raise KeyError(f"No recorded model response left for {key!r} in {self.path}")
+            interaction = queue.popleft()
+        (response,) = messages_from_dict([interaction["response"]])
+        return ReplayedModel(response, self._delay(interaction))
+
+    def wrap_backend(self, backend: ComputerBackend) -> ComputerBackend:
+        """
+        Wraps a computer backend, so its calls are recorded to, or replayed from, the cassette.
+        When replaying, the backend is never called.
+        """
+        return CassetteBackend(self, backend)
+
+    def _record_start(self, environment: str, instance_id: str, seconds: float) -> None:
+        self._write(
+            {
+                "type": "start",
+                "environment": environment,
+                "instance_id": instance_id,
+                "seconds": round(seconds, 6),
+            }
+        )
+
+    def _replay_start(self, environment: str) -> Tuple[str, float]:
+        # Instances are handed out in the order they were started in, per environment.
+        with self._lock:
+            queue = self._starts.get(environment)
+            if not queue:
+                raise KeyError(f"No recorded {environment!r} instance left in {self.path}")
+            interaction = queue.popleft()
+        return interaction["instance_id"], self._delay(interaction)
+
+    def _record_call(
+        self,
+        instance_id: str,
+        method: str,
+        kwargs: Dict[str, Any],
+        response: Any,
+        error: Optional[ApiError],
+        seconds: float,
+    ) -> None:
+        interaction: Dict[str, Any] = {
+            "type": "call",
+            "instance_id": instance_id,
+            "method": method,
+            "kwargs": kwargs,
+            "seconds": round(seconds, 6),
+        }
+        if error is not None:
+            interaction["error"] = {"status_code": error.status_code, "body": error.body}
+        elif response is not None:
+            data = (
+                response.model_dump() if hasattr(response, "model_dump") else dict(vars(response))
+            )
+            if data.get("base_64_image"):
+                data["base_64_image"] = self._store_image(data["base_64_image"])
+            interaction["response"] = data
+        self._write(interaction)
+
+    def _replay_call(
+        self, instance_id: str, method: str, kwargs: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], float]:
+        """
+        Finds the next recorded call to an instance with the same method and arguments.
+        Recorded calls which are skipped over are dropped.
+        """
+        kwargs = _to_json(kwargs)
+        with self._lock:
+            queue = self._calls.get(instance_id, deque())
+            index = next(
+                (
+                    index
+                    for index, interaction in enumerate(queue)
+                    if interaction["method"] == method and interaction["kwargs"] == kwargs
+                ),
+                None,
+            )
+            if index is not None:
+                for _ in range(index):
+                    queue.popleft()
+                interaction = queue.popleft()
+                if method == "computer" and (interaction.get("response") or {}).get(
+                    "base_64_image"
+                ):
+                    self._last_screenshots[instance_id] = interaction
+                return interaction, self._delay(interaction)
+            if method == "computer" and instance_id in self._last_screenshots:
+                return self._last_screenshots[instance_id], 0.0
+        if method in ("authenticate", "stop"):
+            return {}, 0.0
+        raise KeyError(f"No recorded {method!r} call to {instance_id!r} left in {self.path}")
+
+    def _replay_response(self, method: str, interaction: Dict[str, Any]) -> Any:
+        error = interaction.get("error")
+        if error is not None:
+            raise ApiError(status_code=error["status_code"], body=error["body"])
+        data = interaction.get("response")
+        if data is None:
+            return None
+        if method == "get_stream_url":
+            return InstanceGetStreamUrlResponse(**data)
+        if data.get("base_64_image"):
+            data = {**data, "base_64_image": self._load_image(data["base_64_image"])}
+        return ComputerResponse(**data)
+
+
+class ReplayedModel:
+    """
+    A stand-in for the model, which responds to `ainvoke` and `astream` with a recorded
+    response after its recorded latency.
+    """
+
+    def __init__(self, response: AIMessage, delay_seconds: float = 0.0):
+        self.response = response
+        self.delay_seconds = delay_seconds
+
+    async def ainvoke(self, model_input: Any, **kwargs: Any) -> AIMessage:
+        await asyncio.sleep(self.delay_seconds)
+        return self.response
+
+    async def astream(self, model_input: Any, **kwargs: Any) -> Any:
+        await asyncio.sleep(self.delay_seconds)
+        yield AIMessageChunk(**self.response.model_dump(exclude={"type"}))
+
+
+class _RecordingInstance:
+    """Proxies a sync or async instance, recording calls to `RECORDED_INSTANCE_METHODS`."""
+
+    def __init__(self, cassette: Cassette, instance: Any):
+        self._cassette = cassette
+        self._instance = instance
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._instance, name)
+        if name not in RECORDED_INSTANCE_METHODS:
+            return attribute
+        cassette, instance_id = self._cassette, self._instance.id
+
+        if inspect.iscoroutinefunction(attribute):
+
+            async def acall(**kwargs: Any) -> Any:
+                started = time.monotonic()
+                try:
+                    response = await attribute(**kwargs)
+                except ApiError as e:
+                    cassette._record_call(
+                        instance_id, name, kwargs, None, e, time.monotonic() - started
+                    )
+                    raise
+                cassette._record_call(
+                    instance_id, name, kwargs, response, None, time.monotonic() - started
+                )
+                return response
+
+            return acall
+
+        def call(**kwargs: Any) -> Any:
+            started = time.monotonic()
+            try:
+                response = attribute(**kwargs)
+            except ApiError as e:
+                cassette._record_call(
+                    instance_id, name, kwargs, None, e, time.monotonic() - started
+                )
+                raise
+            cassette._record_call(
+                instance_id, name, kwargs, response, None, time.monotonic() - started
+            )
+            return response
+
+        return call
+
+
+class ReplayedInstance:
+    """
+    An instance which replays the calls recorded to an instance in a cassette.
+    """
+
+    def __init__(self, cassette: Cassette, id: str):
+        self._cassette = cassette
+        self.id = id
+        self.status = "running"
+
+    def _call(self, method: str, kwargs: Dict[str, Any]) -> Any:
+        interaction, delay = self._cassette._replay_call(self.id, method, kwargs)
+        time.sleep(delay)
+        return self._cassette._replay_response(method, interaction)
+
+    def computer(self, **kwargs: Any) -> Optional[ComputerResponse]:
+        return self._call("computer", kwargs)
+
+    def get_stream_url(self) -> InstanceGetStreamUrlResponse:
+        return self._call("get_stream_url", {})
+
+    def authenticate(self, **kwargs: Any) -> None:
+        self._call("authenticate", kwargs)
+
+    def stop(self) -> None:
+        self._call("stop", {})
+        self.status = "terminated"
+
+
+class AsyncReplayedInstance(ReplayedInstance):
+    """
+    Async version of `ReplayedInstance`, mirroring Scrapybara's async instances.
+    """
+
+    async def _acall(self, method: str, kwargs: Dict[str, Any]) -> Any:
+        interaction, delay = self._cassette._replay_call(self.id, method, kwargs)
+        await asyncio.sleep(delay)
+        return self._cassette._replay_response(method, interaction)
+
+    async def computer(self, **kwargs: Any) -> Optional[ComputerResponse]:
+        return await self._acall("computer", kwargs)
+
+    async def get_stream_url(self) -> InstanceGetStreamUrlResponse:
+        return await self._acall("get_stream_url", {})
+
+    async def authenticate(self, **kwargs: Any) -> None:
+        await self._acall("authenticate", kwargs)
+
+    async def stop(self) -> None:
+        await self._acall("stop", {})
+        self.status = "terminated"
+
+
+class CassetteBackend(ComputerBackend):
+    """
+    A computer backend which records the instances started by another backend, and every
+    call made to them, or replays them from a cassette without calling the other backend.
+    """
+
+    def __init__(self, cassette: Cassette, backend: ComputerBackend):
+        self.cassette = cassette
+        self.backend = backend
+
+    @property
+    def supports_auth_states(self) -> bool:
+        return self.backend.supports_auth_states
+
+    @property
+    def display_size(self) -> Tuple[int, int]:
+        return self.backend.display_size
+
+    def start(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> Any:
+        if self.cassette.replaying:
+            instance_id, delay = self.cassette._replay_start(environment)
+            time.sleep(delay)
+            return ReplayedInstance(self.cassette, instance_id)
+        started = time.monotonic()
+        instance = self.backend.start(environment, timeout_hours, blocked_domains)
+        self.cassette._record_start(environment, instance.id, time.monotonic() - started)
+        return _RecordingInstance(self.cassette, instance)
+
+    def get(self, instance_id: str) -> Any:
+        if self.cassette.replaying:
+            return ReplayedInstance(self.cassette, instance_id)
+        return _RecordingInstance(self.cassette, self.backend.get(instance_id))
+
+    async def astart(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> Any:
+        if self.cassette.replaying:
+            instance_id, delay = self.cassette._replay_start(environment)
+            await asyncio.sleep(delay)
+            return AsyncReplayedInstance(self.cassette, instance_id)
+        started = time.monotonic()
+        instance = await self.backend.astart(environment, timeout_hours, blocked_domains)
+        self.cassette._record_start(environment, instance.id, time.monotonic() - started)
+        return _RecordingInstance(self.cassette, instance)
+
+    async def aget(self, instance_id: str) -> Any:
+        if self.cassette.replaying:
+            return AsyncReplayedInstance(self.cassette, instance_id)
+        return _RecordingInstance(self.cassette, await self.backend.aget(instance_id))
+
+
+def get_model_call_key(messages: List[Any], configuration: Dict[str, Any]) -> str:
+    """
+    Returns the key a model call is recorded under: the task of the thread (see
+    `get_task_key`), and the number of model responses in the thread so far. The key
+    doesn't depend on how the history is shaped before it's sent to the model.
+
+    Args:
+        messages: The messages of the thread.
+        configuration: The configuration, with defaults.
+
+    Returns:
+        The key.
+    """
+    # Imported here, since the trajectory cache is built on the graph's nodes.
+    from .trajectories import get_task_key
+
+    step = sum(1 for message in messages if getattr(message, "type", None) == "ai")
+    return f"{get_task_key(messages, configuration) or ''}:{step}"
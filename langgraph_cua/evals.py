@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import importlib
+import json
+import re
+import sys
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from .fanout import is_completed
+from .metrics import (
+    MODEL_TOKENS,
+    NODE_SECONDS,
+    REQUEST_PAYLOAD_BYTES,
+    InMemoryMetricsSink,
+)
+from .runner import TaskResult, _percentile, run_many
+
+# The checks a task's `success` may combine. A task succeeds if every check it lists passes.
+SUCCESS_CHECKS = frozenset(["completed", "contains", "regex", "check"])
+
+# The percentiles reported for each distribution.
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass
+class EvalTask:
+    """
+    One task of an evaluation suite.
+    """
+
+    id: str  # A name for the task, unique within the suite
+    prompt: str  # The first user message
+    environment: str = "web"  # One of "web", "ubuntu", or "windows"
+    # The success criteria. "completed": the model finished the task. "contains": the final
+    # message contains the text (ignoring case). "regex": the final message matches the
+    # pattern. "check": "module:function", called with the final state. Defaults to
+    # {"completed": True}.
+    success: Dict[str, Any] = field(default_factory=lambda: {"completed": True})
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], index: int = 0) -> "EvalTask":
+        """
+        Builds a task from its entry in a suite file.
+
+        Args:
+            data: The entry, with a "prompt", and optionally an "id", "environment" and "success".
+            index: The position of the entry in the suite, used as its ID if it has none.
+
+        Returns:
+            The task.
+
+        Raises:
+            ValueError: If the entry has no prompt, or an unknown success check.
+        """
+        if not data.get("prompt"):
+            raise ValueError(f"Task {index} has no prompt")
+        success = data.get("success") or {"completed": True}
+        unknown = set(success) - SUCCESS_CHECKS
+        if unknown:
+            raise ValueError(f"Task {index} has unknown success checks: {sorted(unknown)}")
+        return cls(
+            id=str(data.get("id", index)),
+            prompt=data["prompt"],
+            environment=data.get("environment", "web"),
+            success=success,
+        )
+
+
+def load_task_suite(path: Union[str, Path]) -> List[EvalTask]:
+    """
+    Loads a suite of tasks from a JSON file, holding a list of tasks or an object with a
+    "tasks" list, or from a JSON Lines file with one task per line.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        The tasks, in the order of the file.
+    """
+    text = Path(path).read_text()
+    if Path(path).suffix == ".jsonl":
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        data = json.loads(text)
+        entries = data["tasks"] if isinstance(data, dict) else data
+    return [EvalTask.from_dict(entry, index) for index, entry in enumerate(entries)]
+
+
+def _final_text(state: Dict[str, Any]) -> str:
+    messages = state.get("messages") or []
+    if not messages:
+        return ""
+    content = messages[-1].content
+    if isinstance(content, str):
+        return content
+    return " ".join(
+        block.get("text", "") if isinstance(block, dict) else str(block) for block in content
+    )
+
+
+def _load_check(reference: str) -> Callable[[Dict[str, Any]], bool]:
+    module, _, name = reference.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def check_success(task: EvalTask, state: Dict[str, Any]) -> bool:
+    """
+    Returns whether a task's final state passes every check of its success criteria.
+    """
+    success = task.success
+    if success.get("completed") and not is_completed(state):
+        return False
+    if "contains" in success and success["contains"].lower() not in _final_text(state).lower():
+        return False
+    if "regex" in success and re.search(success["regex"], _final_text(state)) is None:
+        return False
+    if "check" in success and not _load_check(success["check"])(state):
+        return False
+    return True
+
+
+@dataclass
+class EvalTaskResult:
+    """
+    The outcome and cost of one task of an evaluation run.
+    """
+
+    id: str  # The ID of the task
+    success: bool  # Whether the task passed its success criteria
+    error: Optional[str]  # The exception the task (or its success check) raised, if any
+    steps: int  # The number of computer action steps taken
+    wall_seconds: float  # The time from acquiring a VM slot until the task finished
+    queued_seconds: float  # The time spent waiting for a VM slot
+    model_seconds: float  # The time spent in the call_model node
+    action_seconds: float  # The time spent in the take_computer_action node
+    payload_bytes: int  # The total size of the messages sent to the model
+    model_tokens: int  # The total tokens used by the model, if it reports usage
+    cached_tokens: int  # The input tokens served from the model provider's prompt cache
+
+
+def _summarize(values: Sequence[float]) -> Dict[str, float]:
+    summary = {f"p{p}": _percentile(list(values), p) for p in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else 0.0
+    return summary
+
+
+@dataclass
+class EvalReport:
+    """
+    The results of an evaluation run, with throughput and latency percentiles.
+    """
+
+    label: Optional[str]  # A name for the configuration which was evaluated
+    results: List[EvalTaskResult]  # The result of each task, in the order of the suite
+    elapsed_seconds: float  # The duration of the whole run
+
+    @property
+    def success_rate(self) -> float:
+        return sum(r.success for r in self.results) / len(self.results) if self.results else 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Finished tasks per second."""
+        return len(self.results) / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the report as a JSON-serializable dictionary, with a summary of the run and
+        the result of each task.
+        """
+        return {
+            "label": self.label,
+            "summary": {
+                "tasks": len(self.results),
+                "succeeded": sum(r.success for r in self.results),
+                "errors": sum(r.error is not None for r in self.results),
+                "success_rate": self.success_rate,
+                "elapsed_seconds": self.elapsed_seconds,
+                "throughput_tasks_per_second": self.throughput,
+                "wall_seconds": _summarize([r.wall_seconds for r in self.results]),
+                "model_seconds": _summarize([r.model_seconds for r in self.results]),
+                "action_seconds": _summarize([r.action_seconds for r in self.results]),
+                "steps": _summarize([r.steps for r in self.results]),
+                "payload_bytes": _summarize([r.payload_bytes for r in self.results]),
+                "model_tokens": sum(r.model_tokens for r in self.results),
+                "cached_tokens": sum(r.cached_tokens for r in self.results),
+            },
+            "tasks": [asdict(r) for r in self.results],
+        }
+
+    def write(self, path: Union[str, Path]) -> None:
+        """
+        Writes the report to a JSON file.
+        """
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+
+
+def _make_result(task: EvalTask, result: TaskResult, sink: InMemoryMetricsSink) -> EvalTaskResult:
+    error = repr(result.error) if result.error is not None else None
+    success = False
+    if result.state is not None:
+        try:
+            success = check_success(task, result.state)
+        except Exception as e:
+            error = f"Success check failed: {e!r}"
+    actions = sink.summary(NODE_SECONDS, node="take_computer_action")
+    return EvalTaskResult(
+        id=task.id,
+        success=success,
+        error=error,
+        steps=actions.count,
+        wall_seconds=result.latency_seconds,
+        queued_seconds=result.queued_seconds,
+        model_seconds=sink.summary(NODE_SECONDS, node="call_model").sum,
+        action_seconds=actions.sum,
+        payload_bytes=int(sink.summary(REQUEST_PAYLOAD_BYTES).sum),
+        model_tokens=int(sink.counter(MODEL_TOKENS, type="total")),
+        cached_tokens=int(sink.counter(MODEL_TOKENS, type="cached")),
+    )
+
+
+async def run_eval(
+    tasks: Iterable[EvalTask],
+    graph: Optional[Runnable] = None,
+    *,
+    max_vms: int = 10,
+    max_inflight_model_calls: Optional[int] = None,
+    config: Optional[RunnableConfig] = None,
+    label: Optional[str] = None,
+) -> EvalReport:
+    """
+    Runs a suite of tasks concurrently with `run_many`, and reports the outcome and cost
+    of each task. Each task records its metrics to a sink of its own, which replaces any
+    `metrics_sink` in the configuration.
+
+    Args:
+        tasks: The tasks to run, e.g. from `load_task_suite`.
+        graph: The graph to run each task with, e.g. one returned by `create_cua`.
+            Defaults to the default graph.
+        max_vms: The maximum number of tasks running at once. Default is 10.
+        max_inflight_model_calls: The maximum number of model requests in flight across
+            every task. Default is None.
+        config: The configuration to run each task with.
+        label: A name for the configuration, to tell reports apart.
+
+    Returns:
+        The report.
+    """
+    tasks = list(tasks)
+    sinks = [InMemoryMetricsSink() for _ in tasks]
+
+    def task_configurable(index: int, task: Any) -> Dict[str, Any]:
+        return {"environment": tasks[index].environment, "metrics_sink": sinks[index]}
+
+    runner = run_many(
+        [{"messages": [HumanMessage(content=task.prompt)]} for task in tasks],
+        graph,
+        max_vms=max_vms,
+        max_inflight_model_calls=max_inflight_model_calls,
+        config=config,
+        task_configurable=task_configurable,
+    )
+    results: List[Optional[EvalTaskResult]] = [None] * len(tasks)
+    async for result in runner:
+        results[result.index] = _make_result(tasks[result.index], result, sinks[result.index])
+    return EvalReport(label, [r for r in results if r is not None], runner.stats.elapsed_seconds)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    Runs a task suite from the command line, and writes the report as JSON.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m langgraph_cua.evals", description="Run a suite of tasks."
+    )
+    parser.add_argument("suite", help="A .json or .jsonl file of tasks")
+    parser.add_argument("--report", help="The file to write the report to. Default is stdout")
+    parser.add_argument("--label", help="A name for the configuration")
+    parser.add_argument("--max-vms", type=int, default=10)
+    parser.add_argument("--max-inflight-model-calls", type=int)
+    parser.add_argument(
+        "--config", default="{}", help="Keyword arguments for create_cua, as a JSON object"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Run against a SimulatedBackend and a ScriptedModel instead of Scrapybara and OpenAI",
+    )
+    parser.add_argument(
+        "--offline-steps", type=int, default=5, help="Steps the ScriptedModel takes per task"
+    )
+    args = parser.parse_args(argv)
+
+    from .graph import create_cua
+
+    kwargs = json.loads(args.config)
+    if args.offline:
+        from .simulator import ScriptedModel, SimulatedBackend
+
+        kwargs.update(
+            computer_backend=SimulatedBackend(), chat_model=ScriptedModel(steps=args.offline_steps)
+        )
+    report = asyncio.run(
+        run_eval(
+            load_task_suite(args.suite),
+            create_cua(**kwargs),
+            max_vms=args.max_vms,
+            max_inflight_model_calls=args.max_inflight_model_calls,
+            label=args.label,
+        )
+    )
+    if args.report:
+        report.write(args.report)
+    else:
+        json.dump(report.to_dict(), sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END
+
+from .backends import get_computer_backend
+from .lifecycle import instance_tracker, stop_instance_quietly
+from .metrics import (
+    FAN_OUT_BRANCH_FAILURES,
+    FAN_OUT_SECONDS,
+    FAN_OUTS,
+    get_instrumentation,
+    instrumented,
+)
+from .nodes.create_vm_instance import acreate_vm_instance
+from .nodes.take_computer_action import atake_computer_action
+from .trajectories import _make_computer_call_message, extract_trajectory
+from .types import CUAState, get_configuration_with_defaults
+from .utils import get_stream_writer_from_config, is_computer_tool_call
+
+logger = logging.getLogger(__name__)
+
+FAN_OUT_HINT = (
+    "You have been stuck, repeating the same actions while the screen did not change: {actions}\n"
+    "This is attempt {attempt} of {attempts} at a different approach, each running on its own "
+    "computer. Do not repeat those actions. Try something else, such as another element, a "
+    "keyboard shortcut, or navigating another way."
+)
+
+# A success criterion for a branch, given the branch's final state.
+SuccessCriterion = Callable[[Dict[str, Any]], bool]
+
+
+def is_branch(state: CUAState) -> bool:
+    """
+    Returns whether the state is that of a branch explored by `fan_out`.
+    """
+    return (state.get("fan_out_outcome") or {}).get("branch") is not None
+
+
+def reset_fan_out(state: CUAState) -> Dict[str, Any]:
+    """
+    Clears the outcome of the thread's previous fan-out when a new run starts, so every
+    run of the thread may fan out once. Branches keep theirs, which marks them as branches.
+    """
+    if is_branch(state) or state.get("fan_out_outcome") is None:
+        return {}
+    return {"fan_out_outcome": None}
+
+
+def should_fan_out(state: CUAState, config: Optional[RunnableConfig]) -> bool:
+    """
+    Returns whether a run which the stall detector ended should fan out into branches.
+    Each run fans out at most once, and branches never fan out themselves.
+    """
+    if config is None or not state.get("stall") or state.get("fan_out_outcome"):
+        return False
+    return get_configuration_with_defaults(config).get("fan_out_branches") is not None
+
+
+def is_completed(state: Dict[str, Any]) -> bool:
+    """
+    The default success criterion for a branch: the model finished the task, without the
+    stall detector ending the branch or a computer call failing.
+    """
+    messages = state.get("messages") or []
+    if state.get("stall") or not messages:
+        return False
+    last_message = messages[-1]
+    return getattr(last_message, "type", None) == "ai" and not is_computer_tool_call(
+        last_message.additional_kwargs.get("tool_outputs")
+    )
+
+
+def _make_hint(state: CUAState, attempt: int, attempts: int, image_url: Optional[str]) -> Any:
+    actions = json.dumps((state.get("stall") or {}).get("actions"))
+    text = FAN_OUT_HINT.format(actions=actions, attempt=attempt, attempts=attempts)
+    if image_url is None:
+        return HumanMessage(content=text)
+    return HumanMessage(
+        content=[
+            {"type": "input_text", "text": text},
+            {"type": "input_image", "image_url": image_url, "detail": "auto"},
+        ]
+    )
+
+
+def _get_branch_config(config: RunnableConfig, configuration: Dict[str, Any]) -> RunnableConfig:
+    # Branches run with the thread's configuration, but not its runtime config, so they're
+    # checkpointed and streamed apart from the thread. The thread decides what happens to the
+    # winning branch's instance, and records its trajectory, once the fan-out has finished.
+    return {
+        "configurable": {
+            **configuration,
+            "fan_out_branches": None,
+            "vm_end_policy": "keep",
+            "trajectory_cache": None,
+        },
+        "recursion_limit": config.get("recursion_limit", 100),
+    }
+
+
+async def _fork(
+    state: CUAState, config: RunnableConfig, creations: List[asyncio.Future]
+) -> Optional[Dict[str, Any]]:
+    """
+    Starts a new instance, and brings it to the thread's current screen by replaying the
+    thread's trajectory on it. Returns the state updates for the instance, along with the
+    URL of its last screenshot, or None if an action of the trajectory failed. The task
+    creating the instance is added to `creations` before it starts.
+    """
+    configuration = get_configuration_with_defaults(config)
+    creation = asyncio.ensure_future(acreate_vm_instance({**state, "instance_id": None}, config))
+    creations.append(creation)
+    # Shielded, so that cancelling the branch doesn't abandon an instance which is still
+    # starting. The fan-out waits for the creation to finish, and stops the instance.
+    updates = dict(await asyncio.shield(creation))
+    image_url: Optional[str] = None
+    for index, step in enumerate(extract_trajectory(state, configuration.get("blob_store"))):
+        step_state = {
+            **state,
+            **updates,
+            "messages": [_make_computer_call_message(index, step["actions"])],
+        }
+        result = await atake_computer_action(step_state, config)
+        updates.update({k: v for k, v in result.items() if k != "messages"})
+        if not result.get("messages"):
+            await _stop(updates["instance_id"], configuration)
+            return None
+        image_url = result["messages"][-1]["content"][0]["image_url"]
+    return {**updates, "image_url": image_url}
+
+
+async def _run_branch(
+    graph: Any,
+    branch: int,
+    state: CUAState,
+    config: RunnableConfig,
+    branches: int,
+    creations: List[asyncio.Future],
+) -> Dict[str, Any]:
+    """
+    Runs one branch to the end. Branch 0 carries on with the thread's own instance, and
+    the others with a fork of it.
+    """
+    if branch == 0:
+        instance = {
+            "instance_id": state.get("instance_id"),
+            "stream_url": state.get("stream_url"),
+            "authenticated_id": state.get("authenticated_id"),
+        }
+        image_url = None
+    else:
+        forked = await _fork(state, config, creations)
+        if forked is None:
+            raise RuntimeError(f"Failed to replay the thread's trajectory for branch {branch}")
+        image_url = forked.pop("image_url")
+        instance = forked
+    branch_state = {
+        **state,
+        **instance,
+        "messages": [*state["messages"], _make_hint(state, branch + 1, branches, image_url)],
+        "step_fingerprints": [],
+        # A branch which stalls again is a failed branch, rather than one to send hints to.
+        "stall_hints": get_configuration_with_defaults(config).get("stall_max_hints"),
+        "stall": None,
+        "fan_out_outcome": {"branch": branch},
+    }
+    return await graph.ainvoke(branch_state, config)
+
+
+async def _stop(instance_id: Optional[str], configuration: Dict[str, Any]) -> None:
+    if not instance_id:
+        return
+    instance_tracker.forget(instance_id)
+    await asyncio.to_thread(stop_instance_quietly, get_computer_backend(configuration), instance_id)
+
+
+@instrumented("fan_out")
+async def fan_out(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Explores `fan_out_branches` alternatives concurrently, once the stall detector has
+    ended the run. Branch 0 carries on with the thread's own instance, and every other
+    branch with a new instance, brought to the thread's current screen by replaying its
+    trajectory. Each branch runs through the graph with a hint to try something
+    different, and the first to meet the success criterion wins: the other branches are
+    cancelled and their instances stopped, and the thread continues as the winner. If no
+    branch succeeds, the thread continues as branch 0.
+
+    Args:
+        state: The current state of the thread.
+        config: The runnable configuration.
+
+    Returns:
+        The updated state, with the outcome of the fan-out under `fan_out_outcome`.
+    """
+    from .graph import get_graph
+
+    configuration = get_configuration_with_defaults(config)
+    branches: int = configuration.get("fan_out_branches")
+    success: SuccessCriterion = configuration.get("fan_out_success") or is_completed
+    branch_config = _get_branch_config(config, configuration)
+    writer = get_stream_writer_from_config(config)
+    metrics = get_instrumentation()
+    started = time.monotonic()
+    writer({"fan_out": {"branches": branches}})
+
+    graph = get_graph()
+    # The tasks starting instances for the branches, so that the instances can be stopped
+    # once the winner is known, even if their branch was cancelled while they started.
+    creations: List[asyncio.Future] = []
+    tasks = {
+        asyncio.ensure_future(
+            _run_branch(graph, branch, state, branch_config, branches, creations)
+        ): branch
+        for branch in range(branches)
+    }
+    results: Dict[int, Dict[str, Any]] = {}
+    branch_seconds: Dict[int, float] = {}
+    winner: Optional[int] = None
+    try:
+        pending: Set[asyncio.Future] = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                branch = tasks[task]
+                branch_seconds[branch] = time.monotonic() - started
+                if task.exception() is not None:
+                    metrics.increment(FAN_OUT_BRANCH_FAILURES)
+                    logger.warning("Branch %d failed", branch, exc_info=task.exception())
+                    continue
+                results[branch] = task.result()
+                if winner is None and success(results[branch]):
+                    winner = branch
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*creations, return_exceptions=True)
+        seconds = time.monotonic() - started
+        # Stop the losing branches' instances, even if the fan-out itself was cancelled.
+        adopted = winner if winner is not None else 0
+        adopted_state = results.get(adopted)
+        kept_instance = (adopted_state or state).get("instance_id")
+        branch_instances = {
+            state.get("instance_id"),
+            *(
+                creation.result().get("instance_id")
+                for creation in creations
+                if not creation.cancelled() and creation.exception() is None
+            ),
+            *(result.get("instance_id") for result in results.values()),
+        }
+        for instance_id in branch_instances - {kept_instance}:
+            await _stop(instance_id, configuration)
+
+    outcome = {
+        "branches": branches,
+        "winner": winner,
+        "seconds": round(seconds, 3),
+        # The VM time spent by every branch, including the ones which were cancelled.
+        "vm_seconds": round(sum(branch_seconds.get(b, seconds) for b in range(branches)), 3),
+    }
+    metrics.increment(FAN_OUTS, outcome="won" if winner is not None else "lost")
+    metrics.observe(FAN_OUT_SECONDS, seconds)
+    writer({"fan_out": outcome})
+
+    if adopted_state is None:
+        return {"fan_out_outcome": outcome}
+    if adopted_state.get("stream_url") != state.get("stream_url"):
+        writer({"stream_url": adopted_state.get("stream_url")})
+    return {
+        "messages": adopted_state["messages"][len(state["messages"]) :],
+        "instance_id": adopted_state.get("instance_id"),
+        "stream_url": adopted_state.get("stream_url"),
+        "authenticated_id": adopted_state.get("authenticated_id"),
+        "step_fingerprints": adopted_state.get("step_fingerprints"),
+        "stall_hints": adopted_state.get("stall_hints"),
+        "stall": adopted_state.get("stall"),
+        "fan_out_outcome": outcome,
+    }
+
+
+def end_fan_out(state: CUAState) -> str:
+    """
+    Routes a thread which fanned out to the record_trajectory node if a branch succeeded,
+    so its trajectory can be replayed later. Otherwise routes to END.
+
+    Args:
+        state: The current state of the thread.
+
+    Returns:
+        "record_trajectory" or END.
+    """
+    if (state.get("fan_out_outcome") or {}).get("winner") is not None:
+        return "record_trajectory"
+    return END
@@ -1,23 +1,76 @@
-from typing import Literal, Union
+import asyncio
+import threading
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
 
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import END, START, StateGraph
+from langgraph.graph.state import CompiledStateGraph
 
-from langgraph_cua.nodes import call_model, create_vm_instance, take_computer_action
+from langgraph_cua.backends import ComputerBackend, get_display_size
+from langgraph_cua.blobs import BlobStore
+from langgraph_cua.cassettes import Cassette
+from langgraph_cua.fanout import (
+    SuccessCriterion,
+    end_fan_out,
+    fan_out,
+    is_branch,
+    reset_fan_out,
+    should_fan_out,
+)
+from langgraph_cua.lifecycle import InstanceRegistry, instance_tracker
+from langgraph_cua.metrics import MetricsSink
+from langgraph_cua.nodes import (
+    acreate_vm_instance,
+    arelease_vm_instance,
+    atake_computer_action,
+    call_model,
+    create_vm_instance,
+    release_vm_instance,
+    take_computer_action,
+)
+from langgraph_cua.pool import VMPool
+from langgraph_cua.ratelimit import RateLimit
+from langgraph_cua.stall import detect_stall, reset_stall
+from langgraph_cua.trajectories import (
+    TrajectoryCache,
+    areplay_trajectory,
+    record_trajectory,
+    replay_trajectory,
+)
 from langgraph_cua.types import CUAConfiguration, CUAState
 from langgraph_cua.utils import is_computer_tool_call
 
 
+def start_run(state: CUAState) -> Dict[str, Any]:
+    """
+    Resets the parts of the thread's state which only apply to a single run, when a new
+    run of the thread starts.
+
+    Args:
+        state: The current state of the thread.
+
+    Returns:
+        The updated state.
+    """
+    if is_branch(state):
+        # Branches start from the state `fan_out` prepared for them.
+        return {}
+    return {**reset_fan_out(state), **reset_stall(state)}
+
+
 def take_action_or_end(state: CUAState):
     """
     Routes to the take_computer_action node if a computer call is present
-    in the last message, otherwise routes to END.
+    in the last message. Otherwise the model has completed the task, so routes
+    to the record_trajectory node, which then ends the run. Every END route goes
+    through the release_vm_instance node first.
 
     Args:
         state: The current state of the thread.
 
     Returns:
-        "take_computer_action" or END depending on if a computer call is present.
+        "take_computer_action", "create_vm_instance", "record_trajectory" or END.
     """
     if not state.get("messages", []):
         return END
@@ -26,33 +79,41 @@ def take_action_or_end(state: CUAState):
     additional_kwargs = getattr(last_message, "additional_kwargs", None)
 
     if not additional_kwargs:
-        return END
+        return "record_trajectory"
 
     tool_outputs = additional_kwargs.get("tool_outputs")
 
     if not is_computer_tool_call(tool_outputs):
-        return END
+        return "record_trajectory"
 
-    if not state.get("instance_id"):
-        # If the instance_id is not defined, create a new instance.
+    instance_id = state.get("instance_id")
+    if not instance_id or instance_tracker.is_stopped(instance_id):
+        # If the instance_id is not defined, or the instance was stopped after the
+        # previous turn, create a new instance.
         return "create_vm_instance"
 
     return "take_computer_action"
 
 
-def reinvoke_model_or_end(state: CUAState):
+def reinvoke_model_or_end(state: CUAState, config: Optional[RunnableConfig] = None):
     """
-    Routes to the call_model node if the last message is a tool message,
-    otherwise routes to END.
+    Routes to the call_model node if the last message is a tool message, or a hint
+    from the stall detector. If the stall detector ended the run, routes to the fan_out
+    node when `fan_out_branches` is set, and to END otherwise. Also routes to END if the
+    computer action failed.
 
     Args:
         state: The current state of the thread.
+        config: The runnable configuration.
 
     Returns:
-        "call_model" or END depending on if the last message is a tool message.
+        "call_model", "fan_out" or END depending on if the model has new messages to respond to.
     """
+    if state.get("stall"):
+        return "fan_out" if should_fan_out(state, config) else END
+
     messages = state.get("messages", [])
-    if messages and getattr(messages[-1], "type", None) == "tool":
+    if messages and getattr(messages[-1], "type", None) in ("tool", "human"):
         return "call_model"
 
     return END
@@ -60,17 +121,81 @@ def reinvoke_model_or_end(state: CUAState):
 
 workflow = StateGraph(CUAState, CUAConfiguration)
 
+workflow.add_node("start_run", start_run)
 workflow.add_node("call_model", call_model)
-workflow.add_node("create_vm_instance", create_vm_instance)
-workflow.add_node("take_computer_action", take_computer_action)
+# The VM nodes run the sync implementation when the graph is invoked synchronously,
+# and the async implementation when it's invoked asynchronously.
+workflow.add_node(
+    "create_vm_instance", RunnableLambda(create_vm_instance, afunc=acreate_vm_instance)
+)
+workflow.add_node(
+    "take_computer_action", RunnableLambda(take_computer_action, afunc=atake_computer_action)
+)
+
+workflow.add_node("detect_stall", detect_stall)
+workflow.add_node("replay_trajectory", RunnableLambda(replay_trajectory, afunc=areplay_trajectory))
+workflow.add_node("record_trajectory", record_trajectory)
+workflow.add_node("fan_out", fan_out)
+workflow.add_node(
+    "release_vm_instance", RunnableLambda(release_vm_instance, afunc=arelease_vm_instance)
+)
 
-workflow.add_edge(START, "call_model")
-workflow.add_conditional_edges("call_model", take_action_or_end)
+workflow.add_edge(START, "start_run")
+workflow.add_edge("start_run", "replay_trajectory")
+workflow.add_edge("replay_trajectory", "call_model")
+# Runs end by releasing the thread's instance, according to the `vm_end_policy`.
+workflow.add_conditional_edges(
+    "call_model",
+    take_action_or_end,
+    {
+        "take_computer_action": "take_computer_action",
+        "create_vm_instance": "create_vm_instance",
+        "record_trajectory": "record_trajectory",
+        END: "release_vm_instance",
+    },
+)
 workflow.add_edge("create_vm_instance", "take_computer_action")
-workflow.add_conditional_edges("take_computer_action", reinvoke_model_or_end)
+workflow.add_edge("take_computer_action", "detect_stall")
+workflow.add_conditional_edges(
+    "detect_stall",
+    reinvoke_model_or_end,
+    {"call_model": "call_model", "fan_out": "fan_out", END: "release_vm_instance"},
+)
+workflow.add_conditional_edges(
+    "fan_out",
+    end_fan_out,
+    {"record_trajectory": "record_trajectory", END: "release_vm_instance"},
+)
+workflow.add_edge("record_trajectory", "release_vm_instance")
+workflow.add_edge("release_vm_instance", END)
+
+_graph: Optional[CompiledStateGraph] = None
+_graph_lock = threading.Lock()
+
+
+def get_graph() -> CompiledStateGraph:
+    """
+    Returns the compiled graph, compiling it on first use. The graph is also available
+    as `graph`, from this module and the package.
+
+    Returns:
+        The compiled graph.
+    """
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                compiled = workflow.compile()
+                compiled.name = "Computer Use Agent"
+                _graph = compiled
+    return _graph
 
-graph = workflow.compile()
-graph.name = "Computer Use Agent"
+
+def __getattr__(name: str) -> Any:
+    # Compile the graph on first access, rather than when the module is imported.
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def create_cua(
@@ -82,6 +207,42 @@ def create_cua(
     auth_state_id: str = None,
     environment: Literal["web", "ubuntu", "windows"] = "web",
     prompt: Union[str, SystemMessage] = None,
+    vm_pool: Optional[VMPool] = None,
+    action_timeout_seconds: Optional[float] = None,
+    screenshot_format: Literal["png", "jpeg", "webp"] = "png",
+    screenshot_quality: int = 80,
+    blob_store: Optional[BlobStore] = None,
+    keep_last_screenshots: Optional[int] = None,
+    collapse_identical_screenshots: bool = False,
+    stall_threshold: Optional[int] = None,
+    stall_action: Literal["hint", "end"] = "hint",
+    stall_max_hints: int = 1,
+    trajectory_cache: Optional[TrajectoryCache] = None,
+    wait_mode: Literal["fixed", "adaptive"] = "adaptive",
+    wait_timeout_seconds: float = 5.0,
+    wait_poll_interval_seconds: float = 0.25,
+    wait_stable_polls: int = 2,
+    settle_after_actions: Optional[List[str]] = None,
+    stream_model: bool = False,
+    metrics_sink: Optional[MetricsSink] = None,
+    stream_metrics: bool = False,
+    model_call_semaphore: Optional[asyncio.Semaphore] = None,
+    openai_rate_limit: Optional[RateLimit] = None,
+    scrapybara_rate_limit: Optional[RateLimit] = None,
+    max_rate_limit_retries: int = 5,
+    computer_backend: Optional[ComputerBackend] = None,
+    vm_end_policy: Literal["keep", "stop", "return_to_pool"] = "keep",
+    vm_idle_timeout_seconds: Optional[float] = None,
+    vm_orphan_timeout_seconds: Optional[float] = None,
+    cassette: Optional[Cassette] = None,
+    model_display_size: Optional[Tuple[int, int]] = None,
+    vm_action_retries: int = 2,
+    vm_failover: bool = True,
+    fan_out_branches: Optional[int] = None,
+    fan_out_success: Optional[SuccessCriterion] = None,
+    chat_model: Optional[Any] = None,
+    prune_screenshots_every: Optional[int] = None,
+    instance_registry: Optional[InstanceRegistry] = None,
 ):
     """Configuration for the Computer Use Agent.
 
@@ -96,15 +257,191 @@ def create_cua(
             model, and only the latest message in the history will be passed. Default False.
         recursion_limit: The maximum number of recursive calls the agent can make. Default is 100.
         auth_state_id: The ID of the authentication state. If defined, it will be used to authenticate
-            with Scrapybara. Only applies if 'environment' is set to 'web'.
+            with Scrapybara. Only applies if 'environment' is set to 'web'. Can't be used with a
+            `computer_backend` which doesn't support auth states, e.g. an `XvfbBackend`.
         environment: The environment to use. Default is "web".
+        prompt: The initial prompt to use for the conversation. Will be passed as a system message.
+        vm_pool: A pool of pre-booted instances. If defined, new threads lease an instance
+            from the pool instead of booting one. Its `timeout_hours` must match `timeout_hours`.
+        action_timeout_seconds: The maximum number of seconds to wait for each call to the
+            virtual machine when the graph is run asynchronously. Default is None (no timeout).
+        screenshot_format: The format to re-encode screenshots to. One of "png", "jpeg" or "webp".
+            Default is "png", which keeps screenshots as-is. Other formats require Pillow.
+        screenshot_quality: The encoder quality used for "jpeg" and "webp" screenshots. Default is 80.
+        blob_store: A content-addressed store for screenshots. If defined, messages only hold a
+            reference to each screenshot, so state size doesn't grow with image size.
+        keep_last_screenshots: When the full message history is sent to the model (e.g. with ZDR
+            enabled), the number of most recent screenshots to send. Older screenshots are replaced
+            with a placeholder image. Default is None, which sends every screenshot.
+        collapse_identical_screenshots: When the full message history is sent to the model, whether
+            to replace a screenshot with a placeholder if the following screenshot is identical.
+            Default False.
+        stall_threshold: The number of times the agent can repeat the same action on an unchanged
+            screen before it's considered stalled. Default is None, which disables stall detection.
+        stall_action: What to do when the agent stalls. "hint" sends the agent a corrective hint,
+            and "end" ends the run. Default is "hint".
+        stall_max_hints: The number of hints to send before a stalled run is ended. Default is 1.
+        trajectory_cache: A cache of the actions taken by completed runs. If defined, later runs
+            of the same task replay the recorded actions without calling the model, for as long
+            as the screen matches the recording.
+        wait_mode: How to handle the "wait" action. "adaptive" takes screenshots until the screen
+            stops changing, and "fixed" always sleeps for 2 seconds. Default is "adaptive".
+        wait_timeout_seconds: The longest to wait for the screen to stop changing. Default is 5.
+        wait_poll_interval_seconds: The delay between screenshots while waiting for the screen
+            to stop changing. Default is 0.25.
+        wait_stable_polls: The number of consecutive unchanged screenshots after which the
+            screen counts as settled. Default is 2.
+        settle_after_actions: Action types (e.g. "click", "type", "keypress") after which to wait
+            for the screen to stop changing, in "adaptive" wait mode. Default is None.
+        stream_model: Whether to stream the model's response. If True, each computer call starts
+            executing as soon as it has been received, while the rest of the response streams
+            in. Default False.
+        metrics_sink: A sink to record per-node timings, Scrapybara call timings, screenshot and
+            request sizes, token usage and action counts to. Default is None.
+        stream_metrics: Whether to write the metrics recorded by each node to the custom stream,
+            under the "metrics" key. Default False.
+        model_call_semaphore: An asyncio semaphore which every model request is made under.
+            Share one between graphs to bound the model requests in flight across them.
+            Default is None.
+        openai_rate_limit: The requests and tokens per minute allowed by the OpenAI API key.
+            Model requests wait for quota, shared by every thread in the process. Default is
+            None (unlimited).
+        scrapybara_rate_limit: The requests per minute allowed by the Scrapybara API key. Every
+            Scrapybara call waits for quota, shared by every thread in the process. Default is
+            None (unlimited).
+        max_rate_limit_retries: The number of times to retry a call which was rate limited.
+            Default is 5.
+        computer_backend: The backend to start and control instances with, e.g. an
+            `XvfbBackend` to run them on local displays. Default is None, which uses Scrapybara.
+        vm_end_policy: What to do with the thread's instance when a run ends. "keep" keeps it
+            for the thread's next turn, "stop" stops it, and "return_to_pool" returns it to the
+            `vm_pool`. Default is "keep".
+        vm_idle_timeout_seconds: How long an instance kept at the end of a run may sit idle
+            before it's stopped. Default is None, which keeps it until `timeout_hours`.
+        vm_orphan_timeout_seconds: How long the instance of a run which hasn't ended may go
+            unused before it's stopped, e.g. because the run crashed. Default is None.
+        cassette: A `Cassette` to record the model's responses and the calls to the computer
+            backend to, or to replay them from without network access. Default is None.
+        model_display_size: The (width, height) of the display as seen by the model, e.g.
+            (768, 576). Screenshots are downscaled to this size, and the coordinates of the
+            model's actions are scaled back to the display's resolution. At most the display
+            size of the `computer_backend` (1024x768 on Scrapybara). Default is None, which
+            sends screenshots at the display's resolution. Requires Pillow.
+        vm_action_retries: The number of times to retry a step whose computer calls failed
+            with a transient error, e.g. a 502 from Scrapybara or a dropped connection.
+            Default is 2.
+        vm_failover: Whether to replace the thread's instance with a new one when it stops
+            responding mid-run. The new instance is authenticated with `auth_state_id`, and
+            its screenshot is returned to the model, which continues from there. Default True.
+        fan_out_branches: The number of branches to explore concurrently once the stall
+            detector would end the run, each on its own instance. Requires `stall_threshold`.
+            Default is None, which disables fan-out.
+        fan_out_success: A function of a branch's final state, which returns whether the
+            branch succeeded. Default is None, which counts a branch as successful once the
+            model has finished the task.
+        chat_model: The chat model to use instead of OpenAI's computer use model, e.g. a
+            `ScriptedModel` to run offline. The computer use tool is bound to it with
+            `bind_tools`. Default is None.
+        prune_screenshots_every: The number of screenshots to add between prunings by
+            `keep_last_screenshots` and `collapse_identical_screenshots`. Between prunings, the
+            history sent to the model only grows by appending messages, so the model provider's
+            prompt cache keeps matching its prefix. Default is None, which prunes every 5
+            screenshots with `zdr_enabled`, and every step otherwise. Set it to 1 to prune
+            every step with `zdr_enabled` too.
+        instance_registry: An `InstanceRegistry` shared by the processes running the graph,
+            e.g. a `LocalFileInstanceRegistry`. Every process heartbeats its instances in the
+            registry, and stops the instances which stopped getting heartbeats because their
+            process crashed. Default is None.
     """
     # Validate timeout_hours is within acceptable range
     if timeout_hours < 0.01 or timeout_hours > 24:
         raise ValueError("timeout_hours must be between 0.01 and 24")
 
+    if screenshot_quality < 1 or screenshot_quality > 100:
+        raise ValueError("screenshot_quality must be between 1 and 100")
+
+    if keep_last_screenshots is not None and keep_last_screenshots < 0:
+        raise ValueError("keep_last_screenshots must be greater than or equal to 0")
+
+    if prune_screenshots_every is not None and prune_screenshots_every < 1:
+        raise ValueError("prune_screenshots_every must be greater than or equal to 1")
+
+    if stall_threshold is not None and stall_threshold < 2:
+        raise ValueError("stall_threshold must be greater than or equal to 2")
+
+    if stall_action not in ("hint", "end"):
+        raise ValueError('stall_action must be one of "hint" or "end"')
+
+    if wait_mode not in ("fixed", "adaptive"):
+        raise ValueError('wait_mode must be one of "fixed" or "adaptive"')
+
+    if wait_poll_interval_seconds <= 0 or wait_timeout_seconds <= 0:
+        raise ValueError("wait_poll_interval_seconds and wait_timeout_seconds must be positive")
+
+    if wait_stable_polls < 1:
+        raise ValueError("wait_stable_polls must be greater than or equal to 1")
+
+    if max_rate_limit_retries < 0:
+        raise ValueError("max_rate_limit_retries must be greater than or equal to 0")
+
+    if vm_end_policy not in ("keep", "stop", "return_to_pool"):
+        raise ValueError('vm_end_policy must be one of "keep", "stop" or "return_to_pool"')
+
+    if vm_end_policy == "return_to_pool" and vm_pool is None:
+        raise ValueError('vm_end_policy "return_to_pool" requires a vm_pool')
+
+    if (vm_idle_timeout_seconds is not None and vm_idle_timeout_seconds <= 0) or (
+        vm_orphan_timeout_seconds is not None and vm_orphan_timeout_seconds <= 0
+    ):
+        raise ValueError("vm_idle_timeout_seconds and vm_orphan_timeout_seconds must be positive")
+
+    if vm_pool is not None and computer_backend is not None:
+        raise ValueError(
+            "vm_pool can't be used with a computer_backend, since pools hold Scrapybara instances"
+        )
+
+    if vm_pool is not None and timeout_hours != vm_pool.timeout_hours:
+        raise ValueError(
+            "timeout_hours must match the vm_pool's timeout_hours, since pooled instances are "
+            "booted with the pool's timeout"
+        )
+
+    if vm_pool is not None and cassette is not None:
+        raise ValueError(
+            "vm_pool can't be used with a cassette, since pooled instances aren't recorded"
+        )
+
+    if auth_state_id is not None and computer_backend is not None:
+        if not computer_backend.supports_auth_states:
+            raise ValueError(
+                f"auth_state_id can't be used with a {type(computer_backend).__name__}, "
+                "since its instances don't support auth states"
+            )
+
+    if model_display_size is not None:
+        width, height = model_display_size
+        display_width, display_height = get_display_size({"computer_backend": computer_backend})
+        if not (0 < width <= display_width and 0 < height <= display_height):
+            raise ValueError(
+                f"model_display_size must be positive, and at most {display_width}x{display_height}"
+            )
+
+    if vm_action_retries < 0:
+        raise ValueError("vm_action_retries must be greater than or equal to 0")
+
+    if fan_out_branches is not None:
+        if fan_out_branches < 2:
+            raise ValueError("fan_out_branches must be greater than or equal to 2")
+        if stall_threshold is None:
+            raise ValueError("fan_out_branches requires a stall_threshold")
+        if cassette is not None:
+            raise ValueError(
+                "fan_out_branches can't be used with a cassette, since branches make the same "
+                "model calls"
+            )
+
     # Configure the graph with the provided parameters
-    configured_graph = graph.with_config(
+    configured_graph = get_graph().with_config(
         config={
             "configurable": {
                 "scrapybara_api_key": scrapybara_api_key,
@@ -113,6 +450,42 @@ def create_cua(
                 "auth_state_id": auth_state_id,
                 "environment": environment,
                 "prompt": prompt,
+                "vm_pool": vm_pool,
+                "action_timeout_seconds": action_timeout_seconds,
+                "screenshot_format": screenshot_format,
+                "screenshot_quality": screenshot_quality,
+                "blob_store": blob_store,
+                "keep_last_screenshots": keep_last_screenshots,
+                "collapse_identical_screenshots": collapse_identical_screenshots,
+                "stall_threshold": stall_threshold,
+                "stall_action": stall_action,
+                "stall_max_hints": stall_max_hints,
+                "trajectory_cache": trajectory_cache,
+                "wait_mode": wait_mode,
+                "wait_timeout_seconds": wait_timeout_seconds,
+                "wait_poll_interval_seconds": wait_poll_interval_seconds,
+                "wait_stable_polls": wait_stable_polls,
+                "settle_after_actions": settle_after_actions,
+                "stream_model": stream_model,
+                "metrics_sink": metrics_sink,
+                "stream_metrics": stream_metrics,
+                "model_call_semaphore": model_call_semaphore,
+                "openai_rate_limit": openai_rate_limit,
+                "scrapybara_rate_limit": scrapybara_rate_limit,
+                "max_rate_limit_retries": max_rate_limit_retries,
+                "computer_backend": computer_backend,
+                "vm_end_policy": vm_end_policy,
+                "vm_idle_timeout_seconds": vm_idle_timeout_seconds,
+                "vm_orphan_timeout_seconds": vm_orphan_timeout_seconds,
+                "cassette": cassette,
+                "model_display_size": model_display_size,
+                "vm_action_retries": vm_action_retries,
+                "vm_failover": vm_failover,
+                "fan_out_branches": fan_out_branches,
+                "fan_out_success": fan_out_success,
+                "chat_model": chat_model,
+                "prune_screenshots_every": prune_screenshots_every,
+                "instance_registry": instance_registry,
             },
             "recursion_limit": recursion_limit,
         }
@@ -121,4 +494,5 @@ def create_cua(
     return configured_graph
 
 
-__all__ = ["create_cua", "graph"]
+# `graph` is provided by the module's `__getattr__`.
+__all__ = ["create_cua", "get_graph", "graph"]  # noqa: F822
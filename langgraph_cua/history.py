@@ -0,0 +1,98 @@
+from typing import List, Optional, Sequence
+
+from langchain_core.messages import AnyMessage
+
+# A 1x1 grey PNG. The Responses API requires every computer call to be paired with an
+# image output, so pruned screenshots are swapped for this instead of being removed.
+SCREENSHOT_PLACEHOLDER_URL = (
+    "data:image/png;base64,"
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGNoAAAAggCBd81ytgAAAABJRU5ErkJggg=="
+)
+
+# The number of screenshots to add between prunings when the full history is sent with
+# `zdr_enabled`, unless `prune_screenshots_every` is set. Pruning every step would change
+# the start of every request, so the prompt cache would never match past the first pruning.
+DEFAULT_ZDR_PRUNE_INTERVAL = 5
+
+
+def get_screenshot_url(message: AnyMessage) -> Optional[str]:
+    """
+    Returns the image URL of a computer call output message, or None if the
+    message is not a computer call output.
+    """
+    if getattr(message, "type", None) != "tool":
+        return None
+    if message.additional_kwargs.get("type") != "computer_call_output":
+        return None
+    if not isinstance(message.content, list):
+        return None
+    for block in message.content:
+        if isinstance(block, dict) and block.get("type") == "input_image":
+            return block.get("image_url")
+    return None
+
+
+def _with_placeholder(message: AnyMessage) -> AnyMessage:
+    content = [
+        {**block, "image_url": SCREENSHOT_PLACEHOLDER_URL}
+        if isinstance(block, dict) and block.get("type") == "input_image"
+        else block
+        for block in message.content
+    ]
+    return message.model_copy(update={"content": content})
+
+
+def shape_history(
+    messages: Sequence[AnyMessage],
+    keep_last_screenshots: Optional[int] = None,
+    collapse_identical_screenshots: bool = False,
+    prune_screenshots_every: Optional[int] = None,
+) -> List[AnyMessage]:
+    """
+    Shrinks the screenshots in a message history before it's sent to the model.
+    Messages are never removed or reordered, so every computer call stays paired
+    with its output. Messages with a pruned screenshot are copied, the originals
+    are never mutated.
+
+    Pruning a screenshot changes a message which was already sent, which invalidates the
+    model provider's prompt cache from that message on. With `prune_screenshots_every`,
+    screenshots are only pruned each time that many new screenshots have been added, and
+    the screenshots added since are always kept, so between prunings the shaped history
+    only grows by appending messages, and its prefix stays cached.
+
+    Args:
+        messages: The message history.
+        keep_last_screenshots: The number of most recent screenshots to keep. Older
+            screenshots are replaced with a placeholder. If None, all are kept.
+        collapse_identical_screenshots: Whether to replace a screenshot with a placeholder
+            when the next screenshot in the history is identical to it.
+        prune_screenshots_every: The number of screenshots to add between prunings. If None,
+            screenshots are pruned as soon as they're added.
+
+    Returns:
+        The shaped message history.
+    """
+    urls = [get_screenshot_url(message) for message in messages]
+    screenshot_indices = [
+        i for i, url in enumerate(urls) if url is not None and url != SCREENSHOT_PLACEHOLDER_URL
+    ]
+    if prune_screenshots_every is not None:
+        # Only the screenshots added up to the last pruning are considered, so which
+        # screenshots are pruned only changes once every `prune_screenshots_every`.
+        settled = len(screenshot_indices) // prune_screenshots_every * prune_screenshots_every
+        screenshot_indices = screenshot_indices[:settled]
+    pruned = set()
+
+    if collapse_identical_screenshots:
+        for current, following in zip(screenshot_indices, screenshot_indices[1:], strict=False):
+            if urls[current] == urls[following]:
+                pruned.add(current)
+
+    if keep_last_screenshots is not None:
+        remaining = [i for i in screenshot_indices if i not in pruned]
+        keep_from = max(len(remaining) - keep_last_screenshots, 0)
+        pruned.update(remaining[:keep_from])
+
+    return [
+        _with_placeholder(message) if i in pruned else message for i, message in enumerate(messages)
+    ]
@@ -0,0 +1,189 @@
+import asyncio
+import base64
+import hashlib
+import io
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Literal, NamedTuple, Optional, Tuple
+
+ScreenshotFormat = Literal["png", "jpeg", "webp"]
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+# Scrapybara always returns PNG screenshots.
+SOURCE_FORMAT: ScreenshotFormat = "png"
+DEFAULT_SCREENSHOT_QUALITY = 80
+
+# The resolution of the virtual machine's display, and so of its screenshots. Scrapybara
+# does not allow for configuring this.
+DISPLAY_SIZE: Tuple[int, int] = (1024, 768)
+
+_executor: Optional[Executor] = None
+
+
+class EncodedScreenshot(NamedTuple):
+    """
+    A screenshot, after it has been through the image pipeline.
+    """
+
+    base64_image: str  # The base64 encoded image
+    format: ScreenshotFormat  # The format of the encoded image
+    original_bytes: int  # Size of the screenshot returned by the computer, in bytes
+    encoded_bytes: int  # Size of the encoded screenshot, in bytes
+    size: Optional[Tuple[int, int]] = None  # The (width, height) it was resized to, if it was
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.encoded_bytes
+
+    def to_data_url(self) -> str:
+        return f"data:{self.media_type};base64,{self.base64_image}"
+
+
+def _import_pillow():
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise ImportError(
+            "Re-encoding screenshots requires Pillow. "
+            "Install it with `pip install 'langgraph-cua[images]'`."
+        ) from e
+    return Image
+
+
+def _base64_size(base64_image: str) -> int:
+    return len(base64_image) * 3 // 4 - base64_image[-2:].count("=")
+
+
+def encode_screenshot(
+    base64_image: str,
+    format: ScreenshotFormat = SOURCE_FORMAT,
+    quality: int = DEFAULT_SCREENSHOT_QUALITY,
+    size: Optional[Tuple[int, int]] = None,
+) -> EncodedScreenshot:
+    """
+    Re-encodes a base64 encoded PNG screenshot, optionally downscaling it first. If
+    `format` is "png" and there's no `size`, the screenshot is returned as-is, without
+    decoding it.
+
+    Args:
+        base64_image: The base64 encoded PNG screenshot.
+        format: The format to encode the screenshot to.
+        quality: The encoder quality, from 1 to 100. Ignored for PNG.
+        size: The (width, height) to resize the screenshot to, if any.
+
+    Returns:
+        The encoded screenshot.
+    """
+    if format not in MEDIA_TYPES:
+        raise ValueError(f"Invalid screenshot format. Must be one of {list(MEDIA_TYPES)}.")
+    original_bytes = _base64_size(base64_image)
+    if format == SOURCE_FORMAT and size is None:
+        return EncodedScreenshot(base64_image, format, original_bytes, original_bytes)
+
+    Image = _import_pillow()
+    with Image.open(io.BytesIO(base64.b64decode(base64_image))) as image:
+        if size is not None and image.size != tuple(size):
+            # Bicubic keeps text legible at about half the cost of Lanczos.
+            image = image.resize(tuple(size), Image.Resampling.BICUBIC, reducing_gap=3.0)
+        if format == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format=format.upper(), quality=quality)
+    encoded = buffer.getvalue()
+    return EncodedScreenshot(
+        base64.b64encode(encoded).decode("ascii"), format, original_bytes, len(encoded), size
+    )
+
+
+def set_image_executor(executor: Optional[Executor]) -> None:
+    """
+    Sets the executor `aencode_screenshot` runs on. Pass a `ProcessPoolExecutor` to
+    take encoding off the main process entirely. Defaults to a small thread pool,
+    created on first use.
+
+    Args:
+        executor: The executor to use, or None to restore the default.
+    """
+    global _executor
+    _executor = executor
+
+
+def _get_image_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="langgraph-cua-images")
+    return _executor
+
+
+async def aencode_screenshot(
+    base64_image: str,
+    format: ScreenshotFormat = SOURCE_FORMAT,
+    quality: int = DEFAULT_SCREENSHOT_QUALITY,
+    size: Optional[Tuple[int, int]] = None,
+) -> EncodedScreenshot:
+    """
+    Async version of `encode_screenshot`. Encoding runs on the image executor,
+    so it never blocks the event loop.
+    """
+    if format == SOURCE_FORMAT and size is None:
+        return encode_screenshot(base64_image, format, quality)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_image_executor(), encode_screenshot, base64_image, format, quality, size
+    )
+
+
+# The width and height of the grid used for perceptual hashes. Hashes are HASH_SIZE**2 bits long.
+HASH_SIZE = 16
+
+
+def fingerprint_screenshot(image: bytes) -> str:
+    """
+    Computes a fingerprint of a screenshot, for detecting when the screen changes.
+    If Pillow is installed, this is a 256 bit difference hash (dHash), so visually
+    identical screenshots get the same or a nearby fingerprint (see `hamming_distance`).
+    Otherwise it is an exact hash of the image bytes, prefixed with "sha1:".
+
+    Args:
+        image: The image bytes.
+
+    Returns:
+        The fingerprint, as a hex string.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return "sha1:" + hashlib.sha1(image).hexdigest()
+
+    with Image.open(io.BytesIO(image)) as source:
+        source.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+        pixels = (
+            source.convert("L")
+            .resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+            .tobytes()
+        )
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def hamming_distance(fingerprint: str, other: str) -> int:
+    """
+    Returns the number of differing bits between two perceptual fingerprints. Exact
+    ("sha1:") fingerprints are either identical (0) or maximally different.
+    """
+    if fingerprint.startswith("sha1:") or other.startswith("sha1:"):
+        return 0 if fingerprint == other else HASH_SIZE * HASH_SIZE
+    return bin(int(fingerprint, 16) ^ int(other, 16)).count("1")
@@ -0,0 +1,369 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import quote, unquote
+
+from .backends import get_computer_backend
+from .utils import invalidate_instance
+
+# How often the background sweeper looks for idle and orphaned instances, in seconds.
+SWEEP_INTERVAL_SECONDS = 30.0
+# The number of stopped instance IDs remembered, so threads holding them get a new instance.
+MAX_STOPPED_IDS = 10_000
+
+
+class InstanceRegistry(ABC):
+    """
+    Records the instances started by every process which shares the registry, along with
+    a heartbeat from the process using each. The background sweeper of every process
+    renews the heartbeats of its instances, so the instances of a process which crashed
+    stop getting them, and are stopped by the next process to sweep the registry.
+    """
+
+    def __init__(self, stale_after_seconds: float = 300.0):
+        """
+        Args:
+            stale_after_seconds: How long an instance may go without a heartbeat before
+                it's considered orphaned. Must be at least twice `SWEEP_INTERVAL_SECONDS`.
+        """
+        if stale_after_seconds < 2 * SWEEP_INTERVAL_SECONDS:
+            raise ValueError(
+                f"stale_after_seconds must be at least {2 * SWEEP_INTERVAL_SECONDS} seconds"
+            )
+        self.stale_after_seconds = stale_after_seconds
+
+    @abstractmethod
+    def heartbeat(self, instance_ids: Iterable[str]) -> None:
+        """
+        Records instances as in use by a live process, adding them if they're new.
+        """
+
+    @abstractmethod
+    def remove(self, instance_id: str) -> None:
+        """
+        Removes an instance, e.g. because it was stopped or returned to a pool.
+        """
+
+    @abstractmethod
+    def last_heartbeats(self) -> Dict[str, float]:
+        """
+        Returns the wall-clock time of each instance's last heartbeat.
+        """
+
+    def reclaim(self, backend: Any, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        Stops every instance whose last heartbeat is older than `stale_after_seconds`,
+        e.g. on startup, to stop the instances of a process which crashed.
+
+        Args:
+            backend: The computer backend to stop the instances with.
+            exclude: The IDs of instances which are known to be in use.
+
+        Returns:
+            The IDs of the stopped instances.
+        """
+        now = time.time()
+        excluded = set(exclude)
+        stale = [
+            instance_id
+            for instance_id, last_heartbeat in self.last_heartbeats().items()
+            if instance_id not in excluded and now - last_heartbeat >= self.stale_after_seconds
+        ]
+        for instance_id in stale:
+            stop_instance_quietly(backend, instance_id)
+            self.remove(instance_id)
+        return stale
+
+
+class LocalFileInstanceRegistry(InstanceRegistry):
+    """
+    An instance registry in a local directory, shared by the processes of one machine.
+    Each instance is a file, whose modification time is its last heartbeat.
+    """
+
+    def __init__(self, directory: Union[str, Path], stale_after_seconds: float = 300.0):
+        super().__init__(stale_after_seconds)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, instance_id: str) -> Path:
+        return self.directory / quote(instance_id, safe="")
+
+    def heartbeat(self, instance_ids: Iterable[str]) -> None:
+        for instance_id in instance_ids:
+            self._path(instance_id).touch()
+
+    def remove(self, instance_id: str) -> None:
+        self._path(instance_id).unlink(missing_ok=True)
+
+    def last_heartbeats(self) -> Dict[str, float]:
+        heartbeats = {}
+        for entry in os.scandir(self.directory):
+            try:
+                heartbeats[unquote(entry.name)] = entry.stat().st_mtime
+            except FileNotFoundError:
+                # Removed by another process since the directory was listed.
+                pass
+        return heartbeats
+
+
+@dataclass
+class _TrackedInstance:
+    backend: Any  # The `ComputerBackend` the instance was started with
+    last_active: float  # When the instance was last used by a run
+    idle: bool  # Whether the run using the instance has ended
+    idle_timeout_seconds: Optional[float]
+    orphan_timeout_seconds: Optional[float]
+    registry: Optional[InstanceRegistry] = None  # The registry the instance is recorded in
+
+
+class InstanceTracker:
+    """
+    Tracks the instances started by the graph, so that instances which are no longer
+    used can be stopped.
+
+    An instance is idle once the run using it has ended, and it was kept for follow-up
+    turns. Idle instances are stopped after `idle_timeout_seconds`. An instance whose run
+    hasn't ended, but which hasn't been used for `orphan_timeout_seconds`, belongs to a
+    run which crashed, and is stopped too.
+
+    Instances tracked with an `InstanceRegistry` are also recorded in it, and every sweep
+    renews their heartbeats and reclaims the registry's orphaned instances, including those
+    of processes which crashed.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._instances: Dict[str, _TrackedInstance] = {}
+        self._stopped: Dict[str, None] = {}
+        # The registries instances have been tracked with, and the backend to reclaim with.
+        self._registries: Dict[int, Tuple[InstanceRegistry, Any]] = {}
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+
+    def track(
+        self,
+        instance_id: str,
+        backend: Any,
+        idle_timeout_seconds: Optional[float] = None,
+        orphan_timeout_seconds: Optional[float] = None,
+        registry: Optional[InstanceRegistry] = None,
+    ) -> None:
+        """
+        Starts tracking an instance, as used by a run which hasn't ended.
+
+        Args:
+            instance_id: The ID of the instance.
+            backend: The computer backend the instance was started with.
+            idle_timeout_seconds: How long the instance may be idle before it's stopped.
+            orphan_timeout_seconds: How long the instance may go unused before it's stopped.
+            registry: The registry to record the instance in, if any.
+        """
+        with self._lock:
+            self._instances[instance_id] = _TrackedInstance(
+                backend,
+                self._clock(),
+                False,
+                idle_timeout_seconds,
+                orphan_timeout_seconds,
+                registry,
+            )
+            self._stopped.pop(instance_id, None)
+            if registry is not None:
+                self._registries[id(registry)] = (registry, backend)
+        if registry is not None:
+            registry.heartbeat([instance_id])
+        if (
+            idle_timeout_seconds is not None
+            or orphan_timeout_seconds is not None
+            or registry is not None
+        ):
+            self._ensure_sweeper()
+
+    def touch(self, instance_id: str) -> None:
+        """
+        Records that an instance was used by a run, which also makes an idle instance active.
+        """
+        with self._lock:
+            tracked = self._instances.get(instance_id)
+            if tracked is not None:
+                tracked.last_active = self._clock()
+                tracked.idle = False
+
+    def mark_idle(self, instance_id: str) -> None:
+        """
+        Records that the run using an instance has ended, and the instance was kept.
+        """
+        with self._lock:
+            tracked = self._instances.get(instance_id)
+            if tracked is not None:
+                tracked.last_active = self._clock()
+                tracked.idle = True
+
+    def forget(self, instance_id: str) -> None:
+        """
+        Stops tracking an instance, e.g. because it was stopped or returned to a pool.
+        """
+        with self._lock:
+            tracked = self._instances.pop(instance_id, None)
+        if tracked is not None and tracked.registry is not None:
+            tracked.registry.remove(instance_id)
+
+    def is_stopped(self, instance_id: str) -> bool:
+        """
+        Returns whether the tracker stopped an instance. Threads holding a stopped
+        instance need a new one.
+        """
+        with self._lock:
+            return instance_id in self._stopped
+
+    def _mark_stopped(self, instance_ids: Iterable[str]) -> None:
+        # Called with the lock held. The oldest IDs are forgotten first.
+        self._stopped.update(dict.fromkeys(instance_ids))
+        while len(self._stopped) > MAX_STOPPED_IDS:
+            del self._stopped[next(iter(self._stopped))]
+
+    def _expired(self, tracked: _TrackedInstance, now: float) -> bool:
+        timeout = tracked.idle_timeout_seconds if tracked.idle else tracked.orphan_timeout_seconds
+        return timeout is not None and now - tracked.last_active >= timeout
+
+    def sweep(self) -> List[str]:
+        """
+        Stops every idle instance which has outlived its idle timeout, and every orphaned
+        instance, including the orphaned instances of other processes in the registries
+        instances were tracked with.
+
+        Returns:
+            The IDs of the stopped instances.
+        """
+        now = self._clock()
+        with self._lock:
+            expired = [
+                (instance_id, tracked)
+                for instance_id, tracked in self._instances.items()
+                if self._expired(tracked, now)
+            ]
+            for instance_id, _ in expired:
+                del self._instances[instance_id]
+            self._mark_stopped(instance_id for instance_id, _ in expired)
+            registries = list(self._registries.values())
+            alive = {
+                id(tracked.registry): [
+                    instance_id
+                    for instance_id, other in self._instances.items()
+                    if other.registry is tracked.registry
+                ]
+                for tracked in self._instances.values()
+                if tracked.registry is not None
+            }
+        for instance_id, tracked in expired:
+            stop_instance_quietly(tracked.backend, instance_id)
+            if tracked.registry is not None:
+                tracked.registry.remove(instance_id)
+        stopped = [instance_id for instance_id, _ in expired]
+        for registry, backend in registries:
+            in_use = alive.get(id(registry), [])
+            registry.heartbeat(in_use)
+            stopped.extend(registry.reclaim(backend, exclude=in_use))
+        return stopped
+
+    def stop_all(self) -> List[str]:
+        """
+        Stops every tracked instance, e.g. on shutdown.
+
+        Returns:
+            The IDs of the stopped instances.
+        """
+        with self._lock:
+            instances = list(self._instances.items())
+            self._instances.clear()
+            self._mark_stopped(instance_id for instance_id, _ in instances)
+        for instance_id, tracked in instances:
+            stop_instance_quietly(tracked.backend, instance_id)
+            if tracked.registry is not None:
+                tracked.registry.remove(instance_id)
+        return [instance_id for instance_id, _ in instances]
+
+    def close(self) -> None:
+        """
+        Stops the background sweeper. Tracked instances are left running.
+        """
+        self._closed.set()
+
+    def _ensure_sweeper(self) -> None:
+        with self._lock:
+            if self._sweeper is not None or self._closed.is_set():
+                return
+            self._sweeper = threading.Thread(
+                target=self._sweep_periodically, name="langgraph-cua-sweeper", daemon=True
+            )
+        self._sweeper.start()
+
+    def _sweep_periodically(self) -> None:
+        while not self._closed.wait(SWEEP_INTERVAL_SECONDS):
+            try:
+                self.sweep()
+            except Exception:
+                # Keep sweeping, even if one instance can't be looked up.
+                pass
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._instances)
+
+
+def stop_instance_quietly(backend: Any, instance_id: str) -> None:
+    """
+    Stops an instance, ignoring errors, e.g. if it was already stopped.
+
+    Args:
+        backend: The computer backend the instance was started with.
+        instance_id: The ID of the instance.
+    """
+    invalidate_instance(instance_id)
+    try:
+        backend.get(instance_id).stop()
+    except Exception:
+        pass
+
+
+# Process-wide tracker of the instances started by the graph.
+instance_tracker = InstanceTracker()
+
+
+def track_instance(instance_id: str, configuration: Dict[str, Any]) -> None:
+    """
+    Tracks a newly created instance, if the configuration sets an idle or orphan timeout,
+    or an instance registry.
+
+    Args:
+        instance_id: The ID of the instance.
+        configuration: The configuration, with defaults.
+    """
+    idle_timeout = configuration.get("vm_idle_timeout_seconds")
+    orphan_timeout = configuration.get("vm_orphan_timeout_seconds")
+    registry = configuration.get("instance_registry")
+    if idle_timeout is None and orphan_timeout is None and registry is None:
+        return
+    instance_tracker.track(
+        instance_id, get_computer_backend(configuration), idle_timeout, orphan_timeout, registry
+    )
+
+
+def sweep_instances() -> List[str]:
+    """
+    Stops the instances of this process which have been idle for longer than
+    `vm_idle_timeout_seconds`, or orphaned by a crashed run for longer than
+    `vm_orphan_timeout_seconds`, along with the instances of crashed processes in the
+    `instance_registry`. This also happens every `SWEEP_INTERVAL_SECONDS` in the
+    background, once either timeout or a registry is set.
+
+    Returns:
+        The IDs of the stopped instances.
+    """
+    return instance_tracker.sweep()
@@ -0,0 +1,396 @@
+import contextvars
+import functools
+import inspect
+import json
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from langchain_core.messages import BaseMessage, message_to_dict
+from langchain_core.runnables import RunnableConfig
+
+from .utils import get_stream_writer_from_config
+
+# Metric names. Durations are in seconds, and sizes in bytes.
+NODE_SECONDS = "cua_node_seconds"  # Labels: node
+SCRAPYBARA_CALL_SECONDS = "cua_scrapybara_call_seconds"  # Labels: node, call
+SCRAPYBARA_CALL_ERRORS = "cua_scrapybara_call_errors_total"  # Labels: node, call
+COMPUTER_CALL_FAILURES = "cua_computer_call_failures_total"  # Labels: node
+COMPUTER_CALL_RETRIES = "cua_computer_call_retries_total"  # Labels: node
+VM_FAILOVERS = "cua_vm_failovers_total"  # Labels: node
+VM_FAILOVER_SECONDS = "cua_vm_failover_seconds"  # Labels: node
+VM_FAILOVER_FAILURES = "cua_vm_failover_failures_total"  # Labels: node
+FAN_OUTS = "cua_fan_outs_total"  # Labels: outcome
+FAN_OUT_SECONDS = "cua_fan_out_seconds"
+FAN_OUT_BRANCH_FAILURES = "cua_fan_out_branch_failures_total"
+ACTIONS = "cua_actions_total"  # Labels: action
+SCREENSHOT_BYTES = "cua_screenshot_bytes"  # Labels: node
+REQUEST_PAYLOAD_BYTES = "cua_request_payload_bytes"
+MODEL_TOKENS = "cua_model_tokens_total"  # Labels: type
+
+# The Scrapybara instance methods which are timed.
+INSTRUMENTED_INSTANCE_METHODS = frozenset(["computer", "get_stream_url", "authenticate", "stop"])
+
+Labels = Tuple[Tuple[str, str], ...]
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class MetricsSink(ABC):
+    """
+    Receives the metrics recorded by the graph's nodes. Implement this to export
+    metrics to a monitoring system.
+    """
+
+    @abstractmethod
+    def increment(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        """
+        Adds to a counter.
+
+        Args:
+            name: The name of the counter.
+            value: The amount to add.
+            labels: The labels of the counter.
+        """
+
+    @abstractmethod
+    def observe(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        """
+        Records one observation of a distribution, e.g. a duration or a size.
+
+        Args:
+            name: The name of the distribution.
+            value: The observed value.
+            labels: The labels of the distribution.
+        """
+
+
+@dataclass
+class MetricSummary:
+    """
+    Summary statistics of the observations of one distribution.
+    """
+
+    count: int = 0
+    sum: float = 0.0
+    min: float = math.inf
+    max: float = -math.inf
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class InMemoryMetricsSink(MetricsSink):
+    """
+    A metrics sink which aggregates metrics in memory, and can export them in the
+    Prometheus text format.
+    """
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._summaries: Dict[Tuple[str, Labels], MetricSummary] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        key = (name, _freeze(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        key = (name, _freeze(labels))
+        with self._lock:
+            summary = self._summaries.setdefault(key, MetricSummary())
+            summary.count += 1
+            summary.sum += value
+            summary.min = min(summary.min, value)
+            summary.max = max(summary.max, value)
+
+    def counter(self, name: str, **labels: str) -> float:
+        """
+        Returns the value of a counter, or 0 if it was never incremented.
+        """
+        with self._lock:
+            return self._counters.get((name, _freeze(labels)), 0)
+
+    def summary(self, name: str, **labels: str) -> MetricSummary:
+        """
+        Returns a snapshot of the observations of a distribution.
+        """
+        with self._lock:
+            return replace(self._summaries.get((name, _freeze(labels)), MetricSummary()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def to_prometheus(self) -> str:
+        """
+        Exports every metric in the Prometheus text exposition format. Distributions
+        are exported as summaries, with `_count` and `_sum` series.
+
+        Returns:
+            The exported metrics.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            summaries = sorted((key, replace(value)) for key, value in self._summaries.items())
+
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), summary in summaries:
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            lines.append(f"{name}_count{_format_labels(labels)} {summary.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(summary.sum)}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def _freeze(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Instrumentation:
+    """
+    Records the metrics of one node run. Every metric is sent to the sink as soon as
+    it's recorded, and, if streaming is enabled, written to the custom stream under the
+    `metrics` key when the node finishes.
+    """
+
+    enabled = True
+
+    def __init__(
+        self, node: str, sink: Optional[MetricsSink], writer: Optional[Callable[[Any], None]]
+    ):
+        self.node = node
+        self._sink = sink
+        self._writer = writer
+        self._records: List[Dict[str, Any]] = []
+
+    def _record(self, kind: str, name: str, value: float, labels: Dict[str, str]) -> None:
+        if self._sink is not None:
+            if kind == "counter":
+                self._sink.increment(name, value, labels)
+            else:
+                self._sink.observe(name, value, labels)
+        if self._writer is not None:
+            self._records.append({"name": name, "value": value, "labels": labels})
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        self._record("counter", name, value, labels)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        self._record("summary", name, value, labels)
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        """
+        Records how long the block takes, in seconds, as an observation of `name`.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def scrapybara_call(self, call: str) -> Iterator[None]:
+        """
+        Times a call to Scrapybara, and counts it as an error if it raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.increment(SCRAPYBARA_CALL_ERRORS, node=self.node, call=call)
+            raise
+        finally:
+            self.observe(
+                SCRAPYBARA_CALL_SECONDS, time.perf_counter() - started, node=self.node, call=call
+            )
+
+    def wrap_instance(self, instance: Any) -> Any:
+        """
+        Wraps a sync or async Scrapybara instance, so calls to it are timed.
+        """
+        return _InstrumentedInstance(instance, self)
+
+    def observe_request(self, messages: List[Any]) -> None:
+        # The system prompt may be a dict rather than a message, which is serialized as-is.
+        entries = [
+            message_to_dict(message) if isinstance(message, BaseMessage) else message
+            for message in messages
+        ]
+        self.observe(REQUEST_PAYLOAD_BYTES, len(json.dumps(entries, default=str).encode("utf-8")))
+
+    def observe_response(self, message: BaseMessage) -> None:
+        usage = getattr(message, "usage_metadata", None) or message.response_metadata.get("usage")
+        if not usage:
+            return
+        for kind in ("input_tokens", "output_tokens", "total_tokens"):
+            if usage.get(kind):
+                self.increment(MODEL_TOKENS, usage[kind], type=kind.rsplit("_", 1)[0])
+        # Input tokens served from the provider's prompt cache. LangChain reports them under
+        # `input_token_details`, and the raw Responses API usage under `input_tokens_details`.
+        cached = (usage.get("input_token_details") or {}).get("cache_read") or (
+            usage.get("input_tokens_details") or {}
+        ).get("cached_tokens")
+        if cached:
+            self.increment(MODEL_TOKENS, cached, type="cached")
+
+    def flush(self) -> None:
+        if self._writer is not None and self._records:
+            self._writer({"metrics": {"node": self.node, "records": self._records}})
+            self._records = []
+
+
+class _DisabledInstrumentation(Instrumentation):
+    """Instrumentation which records nothing, used when metrics are disabled."""
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__("", None, None)
+
+    def _record(self, kind: str, name: str, value: float, labels: Dict[str, str]) -> None:
+        pass
+
+    def time(self, name: str, **labels: str) -> ContextManager[None]:
+        return nullcontext()
+
+    def scrapybara_call(self, call: str) -> ContextManager[None]:
+        return nullcontext()
+
+    def wrap_instance(self, instance: Any) -> Any:
+        return instance
+
+    def observe_request(self, messages: List[BaseMessage]) -> None:
+        pass
+
+    def observe_response(self, message: BaseMessage) -> None:
+        pass
+
+
+DISABLED = _DisabledInstrumentation()
+
+_current: contextvars.ContextVar[Instrumentation] = contextvars.ContextVar(
+    "cua_instrumentation", default=DISABLED
+)
+
+
+class _InstrumentedInstance:
+    """Proxies a Scrapybara instance, timing calls to `INSTRUMENTED_INSTANCE_METHODS`."""
+
+    def __init__(self, instance: Any, instrumentation: Instrumentation):
+        self._instance = instance
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._instance, name)
+        if name not in INSTRUMENTED_INSTANCE_METHODS:
+            return attribute
+
+        if inspect.iscoroutinefunction(attribute):
+
+            async def acall(*args: Any, **kwargs: Any) -> Any:
+                with self._instrumentation.scrapybara_call(name):
+                    return await attribute(*args, **kwargs)
+
+            return acall
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            with self._instrumentation.scrapybara_call(name):
+                return attribute(*args, **kwargs)
+
+        return call
+
+
+def get_instrumentation() -> Instrumentation:
+    """
+    Returns the instrumentation of the node currently running, which is a no-op
+    if metrics are disabled.
+    """
+    return _current.get()
+
+
+def _create_instrumentation(node: str, config: RunnableConfig) -> Instrumentation:
+    # Read directly from the configurable fields, to keep the disabled path cheap.
+    configurable = config.get("configurable", {})
+    sink = configurable.get("metrics_sink")
+    stream_metrics = configurable.get("stream_metrics", False)
+    if sink is None and not stream_metrics:
+        return DISABLED
+    writer = get_stream_writer_from_config(config) if stream_metrics else None
+    return Instrumentation(node, sink, writer)
+
+
+def instrumented(node: str) -> Callable[[F], F]:
+    """
+    Decorates a sync or async node, so it's timed, and the metrics recorded while it
+    runs are attributed to it. Nodes record metrics via `get_instrumentation`.
+
+    Args:
+        node: The name of the node.
+
+    Returns:
+        The decorator.
+    """
+
+    def decorator(func: F) -> F:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(state: Any, config: RunnableConfig) -> Any:
+                instrumentation = _create_instrumentation(node, config)
+                if not instrumentation.enabled:
+                    return await func(state, config)
+                token = _current.set(instrumentation)
+                try:
+                    with instrumentation.time(NODE_SECONDS, node=node):
+                        return await func(state, config)
+                finally:
+                    _current.reset(token)
+                    instrumentation.flush()
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(func)
+        def wrapper(state: Any, config: RunnableConfig) -> Any:
+            instrumentation = _create_instrumentation(node, config)
+            if not instrumentation.enabled:
+                return func(state, config)
+            token = _current.set(instrumentation)
+            try:
+                with instrumentation.time(NODE_SECONDS, node=node):
+                    return func(state, config)
+            finally:
+                _current.reset(token)
+                instrumentation.flush()
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
@@ -1,5 +1,14 @@
 from langgraph_cua.nodes.call_model import call_model
-from langgraph_cua.nodes.create_vm_instance import create_vm_instance
-from langgraph_cua.nodes.take_computer_action import take_computer_action
+from langgraph_cua.nodes.create_vm_instance import acreate_vm_instance, create_vm_instance
+from langgraph_cua.nodes.release_vm_instance import arelease_vm_instance, release_vm_instance
+from langgraph_cua.nodes.take_computer_action import atake_computer_action, take_computer_action
 
-__all__ = ["call_model", "create_vm_instance", "take_computer_action"]
+__all__ = [
+    "call_model",
+    "create_vm_instance",
+    "acreate_vm_instance",
+    "take_computer_action",
+    "atake_computer_action",
+    "release_vm_instance",
+    "arelease_vm_instance",
+]
@@ -1,10 +1,41 @@
-from typing import Any, Dict, Optional, Union
+import asyncio
+import os
+import time
+import weakref
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from langchain_core.messages import AIMessageChunk, SystemMessage
+import httpx
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    SystemMessage,
+    message_chunk_to_message,
+)
+from langchain_core.runnables import Runnable
 from langchain_core.runnables.config import RunnableConfig
 from langchain_openai import ChatOpenAI
 
+from ..backends import get_display_size
+from ..blobs import rehydrate_messages
+from ..cassettes import get_model_call_key
+from ..history import DEFAULT_ZDR_PRUNE_INTERVAL, shape_history
+from ..images import DISPLAY_SIZE
+from ..metrics import get_instrumentation, instrumented
+from ..ratelimit import (
+    TRANSIENT_OPENAI_ERRORS,
+    RateLimiter,
+    acall_with_retries,
+    get_rate_limiter,
+)
 from ..types import CUAState, get_configuration_with_defaults
+from ..utils import get_openai_http_client, get_stream_writer_from_config, is_computer_tool_call
+from .take_computer_action import (
+    can_dispatch_early,
+    cancel_dispatched_calls,
+    discard_dispatched_calls,
+    dispatch_computer_call,
+)
 
 
 def get_openai_env_from_state_env(env: str) -> str:
@@ -28,9 +59,87 @@ def get_openai_env_from_state_env(env: str) -> str:
         return "windows"
 
 
-# Scrapybara does not allow for configuring this. Must use a hardcoded value.
-DEFAULT_DISPLAY_WIDTH = 1024
-DEFAULT_DISPLAY_HEIGHT = 768
+# The resolution of Scrapybara's displays, which does not allow for configuring it. Other
+# backends may have displays of other resolutions.
+DEFAULT_DISPLAY_WIDTH, DEFAULT_DISPLAY_HEIGHT = DISPLAY_SIZE
+TRUNCATION = "auto"
+
+# Models with the computer use tool bound, cached per event loop (since they hold the loop's
+# HTTP client) and keyed by the static parts of the request.
+_chat_models: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Tuple[httpx.AsyncClient, Runnable]]]" = weakref.WeakKeyDictionary()
+
+
+def get_computer_use_tool(
+    environment: str, display_size: Optional[Tuple[int, int]] = None
+) -> Dict[str, Any]:
+    """
+    Gets the definition of the computer use tool for the given environment.
+
+    Args:
+        environment: One of "web", "ubuntu", or "windows".
+        display_size: The (width, height) of the display, as seen by the model. Defaults
+            to the resolution of the virtual machine.
+
+    Returns:
+        The tool, to bind to the model.
+    """
+    display_width, display_height = display_size or (DEFAULT_DISPLAY_WIDTH, DEFAULT_DISPLAY_HEIGHT)
+    return {
+        "type": "computer_use_preview",
+        "display_width": display_width,
+        "display_height": display_height,
+        "environment": get_openai_env_from_state_env(environment),
+    }
+
+
+def get_chat_model(environment: str, display_size: Optional[Tuple[int, int]] = None) -> Runnable:
+    """
+    Gets the computer use model, with the computer use tool bound, for the given
+    environment. Models are created once per event loop and shared by every thread,
+    so they reuse the same client and connection pool.
+
+    Args:
+        environment: One of "web", "ubuntu", or "windows".
+        display_size: The (width, height) of the display, as seen by the model. Defaults
+            to the resolution of the virtual machine.
+
+    Returns:
+        The model, with the computer use tool bound.
+    """
+    http_client = get_openai_http_client()
+    tool = get_computer_use_tool(environment, display_size)
+    key = (environment, tool["display_width"], tool["display_height"], TRUNCATION)
+    models = _chat_models.setdefault(asyncio.get_running_loop(), {})
+    cached = models.get(key)
+    # The HTTP client is replaced when its limits change, so rebuild the model along with it.
+    if cached is not None and cached[0] is http_client:
+        return cached[1]
+
+    llm = ChatOpenAI(
+        model="computer-use-preview",
+        truncation=TRUNCATION,
+        # Retries go through the shared rate limiter instead, in `call_model`.
+        max_retries=0,
+        http_async_client=http_client,
+    )
+    model = llm.bind_tools([tool])
+    models[key] = (http_client, model)
+    return model
+
+
+def clear_chat_models() -> None:
+    """
+    Forgets every cached model, e.g. after changing the OpenAI API key.
+    """
+    _chat_models.clear()
+
+
+class DispatchedStreamError(RuntimeError):
+    """
+    Raised when a streamed model response fails after some of its computer calls were
+    dispatched. The request isn't retried, since a new response would dispatch its calls
+    again, and the dispatched actions may already have been taken.
+    """
 
 
 def _prompt_to_sys_message(prompt: Union[str, SystemMessage, None]):
@@ -41,6 +150,119 @@ def _prompt_to_sys_message(prompt: Union[str, SystemMessage, None]):
     return prompt
 
 
+def _get_pending_tool_messages(messages: List[Any]) -> List[Any]:
+    """
+    Returns the messages added since the model's last response, if they include tool
+    outputs for it. These are the only messages to send when continuing the last
+    response with `previous_response_id`.
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if getattr(messages[index], "type", None) == "ai":
+            pending = messages[index + 1 :]
+            if any(getattr(message, "type", None) == "tool" for message in pending):
+                return pending
+            return []
+    return []
+
+
+def _without_index(block: Any) -> Any:
+    if not isinstance(block, dict) or "index" not in block:
+        return block
+    return {key: value for key, value in block.items() if key != "index"}
+
+
+def _finalize_streamed_message(message: AIMessageChunk) -> AIMessage:
+    """
+    Converts the aggregated chunks of a streamed response into the message `ainvoke`
+    would have returned, dropping the indexes used to merge the chunks.
+    """
+    content = message.content
+    if isinstance(content, list):
+        content = [_without_index(block) for block in content]
+        for block in content:
+            if isinstance(block, dict) and block.get("type") == "text":
+                block.setdefault("annotations", [])
+    additional_kwargs = dict(message.additional_kwargs)
+    if "tool_outputs" in additional_kwargs:
+        additional_kwargs["tool_outputs"] = [
+            _without_index(output) for output in additional_kwargs["tool_outputs"]
+        ]
+    return message_chunk_to_message(
+        message.model_copy(update={"content": content, "additional_kwargs": additional_kwargs})
+    )
+
+
+async def _astream_and_dispatch(
+    llm: Runnable,
+    model_input: List[Any],
+    state: CUAState,
+    config: RunnableConfig,
+    **kwargs: Any,
+) -> AIMessage:
+    """
+    Streams the model response, and dispatches each computer call to the virtual
+    machine as soon as it has been parsed, while the rest of the response arrives.
+    """
+    dispatching = can_dispatch_early(state, config)
+    instance_id = state.get("instance_id")
+    started = time.monotonic()
+    first_dispatched_at: Optional[float] = None
+    dispatched_call_ids: List[str] = []
+    last_task: Optional[asyncio.Task] = None
+    aggregate: Optional[AIMessageChunk] = None
+
+    try:
+        async for chunk in llm.astream(model_input, **kwargs):
+            aggregate = chunk if aggregate is None else aggregate + chunk
+            for output in chunk.additional_kwargs.get("tool_outputs") or []:
+                if not dispatching or not is_computer_tool_call([output]):
+                    continue
+                if output.get("pending_safety_checks"):
+                    # Calls with pending safety checks must be acknowledged before they're executed.
+                    # Calls must also run in order, so stop dispatching here.
+                    dispatching = False
+                    continue
+                last_task = dispatch_computer_call(state, output, config, after=last_task)
+                dispatched_call_ids.append(output.get("call_id"))
+                if first_dispatched_at is None:
+                    first_dispatched_at = time.monotonic()
+    except Exception as e:
+        cancel_dispatched_calls(instance_id, dispatched_call_ids)
+        if dispatched_call_ids:
+            raise DispatchedStreamError(
+                f"The model response failed after {len(dispatched_call_ids)} computer calls "
+                "were dispatched"
+            ) from e
+        raise
+    except BaseException:
+        cancel_dispatched_calls(instance_id, dispatched_call_ids)
+        raise
+
+    if first_dispatched_at is not None:
+        writer = get_stream_writer_from_config(config)
+        writer(
+            {
+                "early_dispatch": {
+                    "dispatched_calls": len(dispatched_call_ids),
+                    "time_to_action_seconds": round(first_dispatched_at - started, 3),
+                    "saved_seconds": round(time.monotonic() - first_dispatched_at, 3),
+                }
+            }
+        )
+    return _finalize_streamed_message(aggregate)
+
+
+async def _ainvoke(
+    llm: Runnable,
+    model_input: List[Any],
+    state: CUAState,
+    config: RunnableConfig,
+    **kwargs: Any,
+) -> AIMessage:
+    return await llm.ainvoke(model_input, **kwargs)
+
+
+@instrumented("call_model")
 async def call_model(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
     """
     Invokes the computer preview model with the given messages.
@@ -54,49 +276,101 @@ async def call_model(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
     configuration = get_configuration_with_defaults(config)
     environment = configuration.get("environment")
     zdr_enabled = configuration.get("zdr_enabled")
+    blob_store = configuration.get("blob_store")
     prompt = _prompt_to_sys_message(configuration.get("prompt"))
+    cassette = configuration.get("cassette")
+    # The display as seen by the model: downscaled to `model_display_size`, if it's set.
+    display_size = configuration.get("model_display_size") or get_display_size(configuration)
     messages = state.get("messages", [])
     previous_response_id: Optional[str] = None
-    last_message = messages[-1] if messages else None
-
-    # Check if the last message is a tool message
-    if last_message and getattr(last_message, "type", None) == "tool" and zdr_enabled is False:
-        # If it's a tool message, check if the second-to-last message is an AI message
-        if (
-            len(messages) >= 2
-            and getattr(messages[-2], "type", None) == "ai"
-            and hasattr(messages[-2], "response_metadata")
-        ):
-            previous_response_id = messages[-2].response_metadata["id"]
+    # Tool outputs (and any messages added alongside them) for the model's last response
+    pending_messages = _get_pending_tool_messages(messages) if zdr_enabled is False else []
 
-    llm = ChatOpenAI(
-        model="computer-use-preview",
-        model_kwargs={"truncation": "auto", "previous_response_id": previous_response_id},
-    )
+    if pending_messages:
+        # If there are pending tool messages, continue from the AI message which precedes them
+        last_ai_message = messages[-len(pending_messages) - 1]
+        if hasattr(last_ai_message, "response_metadata"):
+            previous_response_id = last_ai_message.response_metadata.get("id")
 
-    tool = {
-        "type": "computer_use_preview",
-        "display_width": DEFAULT_DISPLAY_WIDTH,
-        "display_height": DEFAULT_DISPLAY_HEIGHT,
-        "environment": get_openai_env_from_state_env(environment),
-    }
-    llm_with_tools = llm.bind_tools([tool])
+    cassette_key = get_model_call_key(messages, configuration) if cassette is not None else None
+    llm_with_tools: Any
+    if cassette is not None and cassette.replaying:
+        llm_with_tools = cassette.replay_model_call(cassette_key)
+    elif configuration.get("chat_model") is not None:
+        llm_with_tools = configuration["chat_model"].bind_tools(
+            [get_computer_use_tool(environment, display_size)]
+        )
+    else:
+        llm_with_tools = get_chat_model(environment, display_size)
+    # The previous response ID changes every step, so it's passed per call rather than
+    # baked into the shared model.
+    invoke_kwargs = (
+        {"previous_response_id": previous_response_id} if previous_response_id is not None else {}
+    )
 
-    response: AIMessageChunk
+    model_input: List[Any]
 
-    # Check if the last message is a tool message
-    if last_message and getattr(last_message, "type", None) == "tool" and zdr_enabled is False:
+    if pending_messages:
         if previous_response_id is None:
             raise ValueError("Cannot process tool message without a previous_response_id")
 
-        # Only pass the tool message to the model
-        response = await llm_with_tools.ainvoke([last_message])
+        # Only pass the pending messages to the model
+        model_input = rehydrate_messages(pending_messages, blob_store)
     else:
-        # Pass all messages to the model
-        if prompt is None:
-            response = await llm_with_tools.ainvoke(messages)
-        else:
-            response = await llm_with_tools.ainvoke([prompt, *messages])
+        # Pass all messages to the model, pruning old screenshots before any are read from the blob store.
+        prune_screenshots_every = configuration.get("prune_screenshots_every")
+        if prune_screenshots_every is None and zdr_enabled:
+            prune_screenshots_every = DEFAULT_ZDR_PRUNE_INTERVAL
+        shaped_messages = shape_history(
+            messages,
+            keep_last_screenshots=configuration.get("keep_last_screenshots"),
+            collapse_identical_screenshots=configuration.get("collapse_identical_screenshots"),
+            prune_screenshots_every=prune_screenshots_every,
+        )
+        model_input = rehydrate_messages(shaped_messages, blob_store)
+        # The system prompt always comes first, followed by the messages in order, so each
+        # request starts with the previous one and the provider's prompt cache can match it.
+        if prompt is not None:
+            model_input = [prompt, *model_input]
+
+    metrics = get_instrumentation()
+    metrics.observe_request(model_input)
+
+    response: AIMessage
+    # Bounds the model requests in flight across every thread sharing the semaphore.
+    semaphore = configuration.get("model_call_semaphore")
+    # Replayed responses don't use the API key's quota.
+    limiter = (
+        RateLimiter()
+        if cassette is not None and cassette.replaying
+        else get_rate_limiter(
+            "openai", os.environ.get("OPENAI_API_KEY"), configuration.get("openai_rate_limit")
+        )
+    )
+    if configuration.get("stream_model") and state.get("instance_id"):
+        # Calls dispatched by an earlier response which were never picked up, e.g. because
+        # the run was interrupted before the computer action was taken.
+        discard_dispatched_calls(state["instance_id"])
+    started = time.monotonic()
+    async with semaphore if semaphore is not None else nullcontext():
+        response = await acall_with_retries(
+            limiter,
+            _astream_and_dispatch if configuration.get("stream_model") else _ainvoke,
+            llm_with_tools,
+            model_input,
+            state,
+            config,
+            max_retries=configuration.get("max_rate_limit_retries"),
+            transient=TRANSIENT_OPENAI_ERRORS,
+            **invoke_kwargs,
+        )
+    if cassette is not None and cassette.recording:
+        cassette.record_model_call(
+            cassette_key, model_input, invoke_kwargs, response, time.monotonic() - started
+        )
+    usage = response.usage_metadata or {}
+    limiter.record_tokens(usage.get("total_tokens", 0))
+    metrics.observe_response(response)
 
     return {
         "messages": response,
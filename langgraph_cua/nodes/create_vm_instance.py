@@ -1,8 +1,16 @@
+import asyncio
+from typing import Any, Dict, Optional
+
 from langchain_core.runnables.config import RunnableConfig
 from scrapybara.client import BrowserInstance, UbuntuInstance, WindowsInstance
 
+from ..backends import get_computer_backend
+from ..lifecycle import instance_tracker, track_instance
+from ..metrics import get_instrumentation, instrumented
+from ..pool import PoolKey, VMPool
+from ..ratelimit import rate_limit_instance
 from ..types import CUAState
-from ..utils import get_configuration_with_defaults, get_scrapybara_client
+from ..utils import get_async_instance_cache, get_configuration_with_defaults, instance_cache
 
 # Copied from the OpenAI example repository
 # https://github.com/openai/openai-cua-sample-app/blob/eb2d58ba77ffd3206d3346d6357093647d29d99c/utils.py#L13
@@ -16,46 +24,142 @@ BLOCKED_DOMAINS = [
 ]
 
 
-def create_vm_instance(state: CUAState, config: RunnableConfig):
+def get_blocked_domains() -> list[str]:
+    """
+    Returns the blocked domains, normalized to the format Scrapybara expects.
+    """
+    return [domain.replace("https://", "").replace("www.", "") for domain in BLOCKED_DOMAINS]
+
+
+def get_vm_pool_key(environment: str, auth_state_id: Optional[str] = None) -> PoolKey:
+    """
+    Returns the key `create_vm_instance` leases instances with from a `VMPool`,
+    for the given environment and auth state. Use this to pre-warm a pool.
+
+    Args:
+        environment: One of "web", "ubuntu", or "windows".
+        auth_state_id: The ID of the auth state, if any. Only applies to the "web" environment.
+
+    Returns:
+        The pool key.
+    """
+    return PoolKey.create(environment, get_blocked_domains(), auth_state_id)
+
+
+def _validate_environment(environment: str) -> None:
+    if environment not in ("web", "ubuntu", "windows"):
+        raise ValueError(
+            f"Invalid environment. Must be one of 'web', 'ubuntu', or 'windows'. Received: {environment}"
+        )
+
+
+def _validate_pool_timeout(vm_pool: VMPool, timeout_hours: float) -> None:
+    if timeout_hours != vm_pool.timeout_hours:
+        raise ValueError(
+            "timeout_hours must match the vm_pool's timeout_hours, since pooled instances are "
+            f"booted with the pool's timeout. Received: {timeout_hours}, "
+            f"pool: {vm_pool.timeout_hours}"
+        )
+
+
+@instrumented("create_vm_instance")
+def create_vm_instance(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
     instance_id = state.get("instance_id")
     configuration = get_configuration_with_defaults(config)
-    scrapybara_api_key = configuration.get("scrapybara_api_key")
     timeout_hours = configuration.get("timeout_hours")
     environment = configuration.get("environment")
+    auth_state_id = configuration.get("auth_state_id")
+    vm_pool = configuration.get("vm_pool")
+    metrics = get_instrumentation()
 
-    if instance_id is not None:
+    if instance_id is not None and not instance_tracker.is_stopped(instance_id):
         # If the instance_id already exists in state, do nothing.
         return {}
 
-    if not scrapybara_api_key:
-        raise ValueError(
-            "Scrapybara API key not provided. Please provide one in the configurable fields, "
-            "or set it as an environment variable (SCRAPYBARA_API_KEY)"
-        )
-
-    client = get_scrapybara_client(scrapybara_api_key)
+    _validate_environment(environment)
 
     instance: UbuntuInstance | BrowserInstance | WindowsInstance
+    # A new instance replacing one which was stopped while idle isn't authenticated yet.
+    updates: Dict[str, Any] = {"authenticated_id": None} if instance_id is not None else {}
 
-    if environment == "ubuntu":
-        instance = client.start_ubuntu(timeout_hours=timeout_hours)
-    elif environment == "windows":
-        instance = client.start_windows(timeout_hours=timeout_hours)
-    elif environment == "web":
-        blocked_domains = [
-            domain.replace("https://", "").replace("www.", "") for domain in BLOCKED_DOMAINS
-        ]
-        instance = client.start_browser(
-            timeout_hours=timeout_hours, blocked_domains=blocked_domains
-        )
+    if vm_pool is not None:
+        _validate_pool_timeout(vm_pool, timeout_hours)
+        pool_key = get_vm_pool_key(environment, auth_state_id)
+        instance = vm_pool.lease(pool_key)
+        if pool_key.auth_state_id is not None:
+            # Pooled instances are authenticated before they are handed out.
+            updates["authenticated_id"] = pool_key.auth_state_id
     else:
-        raise ValueError(
-            f"Invalid environment. Must be one of 'web', 'ubuntu', or 'windows'. Received: {environment}"
-        )
+        with metrics.scrapybara_call("start"):
+            instance = get_computer_backend(configuration).start(
+                environment, timeout_hours, get_blocked_domains()
+            )
 
-    stream_url = instance.get_stream_url().stream_url
+    # Prime the handle cache, so the first action doesn't need to look the instance up.
+    instance_cache.put(instance, configuration.get("scrapybara_api_key"))
+    track_instance(instance.id, configuration)
+    with metrics.scrapybara_call("get_stream_url"):
+        stream_url = rate_limit_instance(instance, configuration).get_stream_url().stream_url
 
     return {
         "instance_id": instance.id,
         "stream_url": stream_url,
+        **updates,
+    }
+
+
+@instrumented("create_vm_instance")
+async def acreate_vm_instance(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Async version of `create_vm_instance`, built on the computer backend's async methods.
+    Leasing from a `VMPool` happens on a worker thread, since the pool is synchronous.
+    """
+    instance_id = state.get("instance_id")
+    configuration = get_configuration_with_defaults(config)
+    timeout_hours = configuration.get("timeout_hours")
+    environment = configuration.get("environment")
+    auth_state_id = configuration.get("auth_state_id")
+    vm_pool = configuration.get("vm_pool")
+    metrics = get_instrumentation()
+    timeout = configuration.get("action_timeout_seconds")
+
+    if instance_id is not None and not instance_tracker.is_stopped(instance_id):
+        return {}
+
+    _validate_environment(environment)
+
+    updates: Dict[str, Any] = {"authenticated_id": None} if instance_id is not None else {}
+
+    if vm_pool is not None:
+        _validate_pool_timeout(vm_pool, timeout_hours)
+        pool_key = get_vm_pool_key(environment, auth_state_id)
+        pooled_instance = await asyncio.to_thread(vm_pool.lease, pool_key)
+        instance_cache.put(pooled_instance, configuration.get("scrapybara_api_key"))
+        track_instance(pooled_instance.id, configuration)
+        if pool_key.auth_state_id is not None:
+            updates["authenticated_id"] = pool_key.auth_state_id
+        with metrics.scrapybara_call("get_stream_url"):
+            stream_url_response = await asyncio.to_thread(pooled_instance.get_stream_url)
+        return {
+            "instance_id": pooled_instance.id,
+            "stream_url": stream_url_response.stream_url,
+            **updates,
+        }
+
+    # Booting is not bounded by `action_timeout_seconds`, as it routinely takes longer than an action.
+    with metrics.scrapybara_call("start"):
+        instance = await get_computer_backend(configuration).astart(
+            environment, timeout_hours, get_blocked_domains()
+        )
+    get_async_instance_cache().put(instance, configuration.get("scrapybara_api_key"))
+    track_instance(instance.id, configuration)
+    with metrics.scrapybara_call("get_stream_url"):
+        stream_url_response = await asyncio.wait_for(
+            rate_limit_instance(instance, configuration).get_stream_url(), timeout
+        )
+
+    return {
+        "instance_id": instance.id,
+        "stream_url": stream_url_response.stream_url,
+        **updates,
     }
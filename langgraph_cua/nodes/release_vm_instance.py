@@ -0,0 +1,114 @@
+import asyncio
+from typing import Any, Dict
+
+from langchain_core.runnables.config import RunnableConfig
+
+from ..lifecycle import instance_tracker
+from ..metrics import get_instrumentation, instrumented
+from ..ratelimit import rate_limit_instance
+from ..types import CUAState
+from ..utils import (
+    aget_instance,
+    get_configuration_with_defaults,
+    get_instance,
+    invalidate_instance,
+)
+from .create_vm_instance import get_vm_pool_key
+from .take_computer_action import discard_dispatched_calls
+
+# The state update once a thread's instance has been stopped or returned to the pool, so
+# the next turn of the thread starts a new one.
+RELEASED_INSTANCE_STATE: Dict[str, Any] = {
+    "instance_id": None,
+    "stream_url": None,
+    "authenticated_id": None,
+}
+
+
+@instrumented("release_vm_instance")
+def release_vm_instance(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Runs at the end of every run, and releases the thread's instance according to the
+    `vm_end_policy`: "keep" keeps it for the next turn of the thread, "stop" stops it,
+    and "return_to_pool" returns it to the `vm_pool` for other threads to lease.
+
+    Args:
+        state: The current state of the thread.
+        config: The runnable configuration.
+
+    Returns:
+        A dictionary with updated state information.
+    """
+    instance_id = state.get("instance_id")
+    if not instance_id:
+        return {}
+    discard_dispatched_calls(instance_id)
+    configuration = get_configuration_with_defaults(config)
+    policy = configuration.get("vm_end_policy")
+    vm_pool = configuration.get("vm_pool")
+    metrics = get_instrumentation()
+
+    if policy == "keep":
+        instance_tracker.mark_idle(instance_id)
+        return {}
+
+    instance_tracker.forget(instance_id)
+    try:
+        if policy == "return_to_pool" and vm_pool is not None:
+            with metrics.scrapybara_call("get"):
+                instance = get_instance(instance_id, config)
+            pool_key = get_vm_pool_key(
+                configuration.get("environment"), state.get("authenticated_id")
+            )
+            vm_pool.release(instance, pool_key)
+        else:
+            with metrics.scrapybara_call("stop"):
+                rate_limit_instance(get_instance(instance_id, config), configuration).stop()
+    except Exception:
+        # The run has already finished, so don't fail it. The instance may have been stopped
+        # already, and otherwise stops once it times out.
+        pass
+    invalidate_instance(instance_id)
+    return dict(RELEASED_INSTANCE_STATE)
+
+
+@instrumented("release_vm_instance")
+async def arelease_vm_instance(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Async version of `release_vm_instance`. Returning an instance to a `VMPool` happens
+    on a worker thread, since the pool is synchronous.
+    """
+    instance_id = state.get("instance_id")
+    if not instance_id:
+        return {}
+    discard_dispatched_calls(instance_id)
+    configuration = get_configuration_with_defaults(config)
+    policy = configuration.get("vm_end_policy")
+    vm_pool = configuration.get("vm_pool")
+    timeout = configuration.get("action_timeout_seconds")
+    metrics = get_instrumentation()
+
+    if policy == "keep":
+        instance_tracker.mark_idle(instance_id)
+        return {}
+
+    instance_tracker.forget(instance_id)
+    try:
+        if policy == "return_to_pool" and vm_pool is not None:
+            with metrics.scrapybara_call("get"):
+                instance = await asyncio.to_thread(get_instance, instance_id, config)
+            pool_key = get_vm_pool_key(
+                configuration.get("environment"), state.get("authenticated_id")
+            )
+            await asyncio.to_thread(vm_pool.release, instance, pool_key)
+        else:
+            with metrics.scrapybara_call("stop"):
+                instance = rate_limit_instance(
+                    await asyncio.wait_for(aget_instance(instance_id, config), timeout),
+                    configuration,
+                )
+                await asyncio.wait_for(instance.stop(), timeout)
+    except Exception:
+        pass
+    invalidate_instance(instance_id)
+    return dict(RELEASED_INSTANCE_STATE)
@@ -1,14 +1,44 @@
+import asyncio
+import logging
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 
-from langchain_core.messages import AnyMessage, ToolMessage
+import httpx
+from langchain_core.messages import AnyMessage
 from langchain_core.runnables import RunnableConfig
-from langgraph.config import get_stream_writer
 from openai.types.responses.response_computer_tool_call import ResponseComputerToolCall
+from scrapybara.core.api_error import ApiError
 from scrapybara.types import ComputerResponse, InstanceGetStreamUrlResponse
 
+from ..backends import get_computer_backend, get_display_size
+from ..blobs import store_screenshot
+from ..history import SCREENSHOT_PLACEHOLDER_URL
+from ..images import DISPLAY_SIZE, EncodedScreenshot, aencode_screenshot, encode_screenshot
+from ..lifecycle import instance_tracker, stop_instance_quietly
+from ..metrics import (
+    ACTIONS,
+    COMPUTER_CALL_FAILURES,
+    COMPUTER_CALL_RETRIES,
+    SCREENSHOT_BYTES,
+    VM_FAILOVER_FAILURES,
+    VM_FAILOVER_SECONDS,
+    VM_FAILOVERS,
+    get_instrumentation,
+    instrumented,
+)
+from ..ratelimit import _backoff_seconds, rate_limit_instance
+from ..settle import WaitResult, WaitSettings, await_stable_screen, wait_for_stable_screen
 from ..types import CUAState, get_configuration_with_defaults
-from ..utils import get_instance, is_computer_tool_call
+from ..utils import (
+    aget_instance,
+    get_instance,
+    get_stream_writer_from_config,
+    invalidate_instance,
+    is_computer_tool_call,
+)
+from .create_vm_instance import acreate_vm_instance, create_vm_instance
+
+logger = logging.getLogger(__name__)
 
 # Copied from the OpenAI example repository
 # https://github.com/openai/openai-cua-sample-app/blob/eb2d58ba77ffd3206d3346d6357093647d29d99c/computers/scrapybara.py#L10
@@ -35,18 +65,28 @@ CUA_KEY_TO_SCRAPYBARA_KEY = {
     "win": "Meta_L",
 }
 
+# The number of seconds to wait before taking a screenshot, for the "wait" action in "fixed" wait mode.
+WAIT_ACTION_SECONDS = 2
 
-def take_computer_action(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
-    """
-    Executes computer actions based on the tool call in the last message.
+# Scrapybara responses which mean the request didn't reach the instance, so the failed
+# computer call can be retried. A 504 isn't one of them: the gateway gave up waiting, but
+# the instance may still have performed the action.
+TRANSIENT_STATUS_CODES = frozenset([502, 503])
+# Errors which mean the request was never sent.
+TRANSIENT_CONNECTION_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Scrapybara responses which mean the instance is gone, e.g. because it was stopped or timed out.
+INSTANCE_GONE_STATUS_CODES = frozenset([404, 409, 410])
 
-    Args:
-        state: The current state of the CUA agent.
-        config: The runnable configuration.
+T = TypeVar("T")
 
-    Returns:
-        A dictionary with updated state information.
-    """
+# Computer calls dispatched by `call_model` while the model response was still streaming,
+# keyed by (instance ID, call ID). They're awaited, and removed, by `atake_computer_action`.
+_dispatched: Dict[
+    Tuple[str, str], "asyncio.Task[Tuple[Optional[ComputerResponse], _WaitStats]]"
+] = {}
+
+
+def _get_computer_calls(state: CUAState) -> List[ResponseComputerToolCall]:
     message: AnyMessage = state.get("messages", [])[-1]
     assert message.type == "ai", "Last message must be an AI message"
     tool_outputs = message.additional_kwargs.get("tool_outputs")
@@ -55,27 +95,692 @@ def take_computer_action(state: CUAState, config: RunnableConfig) -> Dict[str, A
         # This should never happen, but include the check for proper type safety.
         raise ValueError("Cannot take computer action without a computer call in the last message.")
 
-    # Cast tool_outputs as list[ResponseComputerToolCall] since is_computer_tool_call is true
-    tool_outputs: list[ResponseComputerToolCall] = tool_outputs
+    # The model can return several computer calls in one response, which are executed in order.
+    return [
+        output
+        for output in tool_outputs
+        if isinstance(output, dict) and output.get("type") == "computer_call"
+    ]
+
+
+def _should_authenticate(
+    environment: str, auth_state_id: Optional[str], authenticated_id: Optional[str]
+) -> bool:
+    return environment == "web" and auth_state_id is not None and authenticated_id != auth_state_id
+
+
+def get_computer_call_kwargs(action: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converts a computer use action from OpenAI into the arguments for Scrapybara's
+    `instance.computer` method. For the "wait" action, the caller is responsible for
+    waiting before making the call, which only takes a screenshot.
+
+    Args:
+        action: The action from the computer call.
+
+    Returns:
+        The keyword arguments for `instance.computer`.
+
+    Raises:
+        ValueError: If the action type is unknown.
+    """
+    action_type = action.get("type")
+
+    if action_type == "click":
+        return {
+            "action": "click_mouse",
+            "button": "middle" if action.get("button") == "wheel" else action.get("button"),
+            "coordinates": [action.get("x"), action.get("y")],
+        }
+    elif action_type == "double_click":
+        return {
+            "action": "click_mouse",
+            "button": "left",
+            "coordinates": [action.get("x"), action.get("y")],
+            "num_clicks": 2,
+        }
+    elif action_type == "drag":
+        return {
+            "action": "drag_mouse",
+            "path": [[point.get("x"), point.get("y")] for point in action.get("path")],
+        }
+    elif action_type == "keypress":
+        mapped_keys = [
+            CUA_KEY_TO_SCRAPYBARA_KEY.get(key.lower(), key.lower()) for key in action.get("keys")
+        ]
+        return {"action": "press_key", "keys": mapped_keys}
+    elif action_type == "move":
+        return {"action": "move_mouse", "coordinates": [action.get("x"), action.get("y")]}
+    elif action_type in ("screenshot", "wait"):
+        return {"action": "take_screenshot"}
+    elif action_type == "scroll":
+        return {
+            "action": "scroll",
+            "delta_x": action.get("scroll_x") // 20,
+            "delta_y": action.get("scroll_y") // 20,
+            "coordinates": [action.get("x"), action.get("y")],
+        }
+    elif action_type == "type":
+        return {"action": "type_text", "text": action.get("text")}
+    raise ValueError(f"Unknown computer action received: {action}")
+
+
+def _scale_point(
+    x: Any, y: Any, model_display_size: Tuple[int, int], display_size: Tuple[int, int]
+) -> Tuple[Any, Any]:
+    if x is None or y is None:
+        return x, y
+    (width, height), (model_width, model_height) = display_size, model_display_size
+    # Map the centre of the model's pixel to the centre of the pixels it covers on the display.
+    scaled_x = round((x + 0.5) * width / model_width - 0.5)
+    scaled_y = round((y + 0.5) * height / model_height - 0.5)
+    return min(max(scaled_x, 0), width - 1), min(max(scaled_y, 0), height - 1)
+
+
+def scale_action(
+    action: Dict[str, Any],
+    model_display_size: Optional[Tuple[int, int]],
+    display_size: Tuple[int, int] = DISPLAY_SIZE,
+) -> Dict[str, Any]:
+    """
+    Maps the coordinates of an action from the model's view of the display, whose
+    resolution is `model_display_size`, to the pixels of the virtual machine's display.
+
+    Args:
+        action: The action from the computer call.
+        model_display_size: The (width, height) of the screenshots sent to the model, or
+            None if they're sent at the resolution of the display.
+        display_size: The (width, height) of the virtual machine's display.
+
+    Returns:
+        The action, with its coordinates and scroll distances scaled. The original action is
+        never mutated.
+    """
+    if model_display_size is None or tuple(model_display_size) == tuple(display_size):
+        return action
+    scaled = dict(action)
+    if "x" in action or "y" in action:
+        scaled["x"], scaled["y"] = _scale_point(
+            action.get("x"), action.get("y"), model_display_size, display_size
+        )
+    if action.get("path"):
+        path = []
+        for point in action["path"]:
+            x, y = _scale_point(point.get("x"), point.get("y"), model_display_size, display_size)
+            path.append({**point, "x": x, "y": y})
+        scaled["path"] = path
+    # Scroll distances are in the model's pixels too, but aren't clamped to the display.
+    (width, height), (model_width, model_height) = display_size, model_display_size
+    if action.get("scroll_x") is not None:
+        scaled["scroll_x"] = round(action["scroll_x"] * width / model_width)
+    if action.get("scroll_y") is not None:
+        scaled["scroll_y"] = round(action["scroll_y"] * height / model_height)
+    return scaled
+
+
+def _make_tool_message(output: ResponseComputerToolCall, image_url: str) -> Dict[str, Any]:
+    output_content = {
+        "type": "input_image",
+        "image_url": image_url,
+    }
+    return {
+        "role": "tool",
+        "content": [output_content],
+        "tool_call_id": output.get("call_id"),
+        "additional_kwargs": {"type": "computer_call_output"},
+    }
+
+
+def _write_screenshot_stats(config: RunnableConfig, screenshot: EncodedScreenshot) -> None:
+    writer = get_stream_writer_from_config(config)
+    writer(
+        {
+            "screenshot": {
+                "format": screenshot.format,
+                "original_bytes": screenshot.original_bytes,
+                "encoded_bytes": screenshot.encoded_bytes,
+                "bytes_saved": screenshot.bytes_saved,
+            }
+        }
+    )
+
+
+def _log_failure(error: Exception, outputs: List[ResponseComputerToolCall]) -> None:
+    logger.warning("Failed to execute computer calls %s", outputs, exc_info=error)
+
+
+def _make_tool_messages(
+    outputs: List[ResponseComputerToolCall], image_url: str
+) -> List[Dict[str, Any]]:
+    # Every computer call needs an image output, but only the last call captures a screenshot.
+    return [
+        *(_make_tool_message(output, SCREENSHOT_PLACEHOLDER_URL) for output in outputs[:-1]),
+        _make_tool_message(outputs[-1], image_url),
+    ]
+
+
+class _WaitStats:
+    """Accumulates the time spent waiting for the screen during one step."""
+
+    def __init__(self):
+        self.waited_seconds = 0.0
+        self.polls = 0
+        self.stable = True
+
+    def add(self, result: WaitResult) -> ComputerResponse:
+        self.waited_seconds += result.waited_seconds
+        self.polls += result.polls
+        self.stable = self.stable and result.stable
+        return result.response
+
+    def merge(self, other: "_WaitStats") -> None:
+        self.waited_seconds += other.waited_seconds
+        self.polls += other.polls
+        self.stable = self.stable and other.stable
+
+
+class _StepProgress:
+    """
+    Tracks the computer calls of one step which have been performed, so a retry after a
+    transient error resumes from the call which failed instead of repeating the others.
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.response: Optional[ComputerResponse] = None
+
+
+def _run_computer_calls(
+    instance: Any,
+    outputs: List[ResponseComputerToolCall],
+    wait: WaitSettings,
+    stats: _WaitStats,
+    model_display_size: Optional[Tuple[int, int]] = None,
+    progress: Optional[_StepProgress] = None,
+    display_size: Tuple[int, int] = DISPLAY_SIZE,
+) -> Optional[ComputerResponse]:
+    """
+    Executes computer calls in order, skipping the ones `progress` has recorded as
+    performed. A screenshot is only captured after the last call, and intermediate
+    "screenshot" and "wait" calls don't call the virtual machine at all, unless the screen
+    is being polled to see when it settles. Coordinates are scaled from
+    `model_display_size` to the display's resolution, `display_size`.
+    """
+    progress = progress or _StepProgress()
+    for index, output in enumerate(outputs):
+        if index < progress.completed:
+            continue
+        action = output.get("action")
+        action_type = action.get("type")
+        computer_call_kwargs = get_computer_call_kwargs(
+            scale_action(action, model_display_size, display_size)
+        )
+        is_last = index == len(outputs) - 1
+        if action_type == "wait":
+            if wait.mode == "adaptive":
+                progress.response = stats.add(wait_for_stable_screen(instance, wait))
+                progress.completed = index + 1
+                continue
+            time.sleep(WAIT_ACTION_SECONDS)
+            stats.waited_seconds += WAIT_ACTION_SECONDS
+        settle = wait.mode == "adaptive" and action_type in wait.settle_after_actions
+        if is_last or settle:
+            progress.response = instance.computer(**computer_call_kwargs)
+            # The action has been performed, even if waiting for the screen to settle fails.
+            progress.completed = index + 1
+            if settle:
+                progress.response = stats.add(
+                    wait_for_stable_screen(instance, wait, progress.response)
+                )
+        elif computer_call_kwargs["action"] != "take_screenshot":
+            instance.computer(**computer_call_kwargs, screenshot=False)
+        progress.completed = index + 1
+    return progress.response
+
+
+async def _arun_computer_calls(
+    instance: Any,
+    outputs: List[ResponseComputerToolCall],
+    wait: WaitSettings,
+    stats: _WaitStats,
+    timeout: Optional[float],
+    model_display_size: Optional[Tuple[int, int]] = None,
+    progress: Optional[_StepProgress] = None,
+    display_size: Tuple[int, int] = DISPLAY_SIZE,
+) -> Optional[ComputerResponse]:
+    """
+    Async version of `_run_computer_calls`. `timeout` applies to each call separately.
+    """
+    progress = progress or _StepProgress()
+    for index, output in enumerate(outputs):
+        if index < progress.completed:
+            continue
+        action = output.get("action")
+        action_type = action.get("type")
+        computer_call_kwargs = get_computer_call_kwargs(
+            scale_action(action, model_display_size, display_size)
+        )
+        is_last = index == len(outputs) - 1
+        if action_type == "wait":
+            if wait.mode == "adaptive":
+                progress.response = stats.add(
+                    await await_stable_screen(instance, wait, call_timeout=timeout)
+                )
+                progress.completed = index + 1
+                continue
+            await asyncio.sleep(WAIT_ACTION_SECONDS)
+            stats.waited_seconds += WAIT_ACTION_SECONDS
+        settle = wait.mode == "adaptive" and action_type in wait.settle_after_actions
+        if is_last or settle:
+            progress.response = await _with_timeout(
+                instance.computer(**computer_call_kwargs), timeout
+            )
+            progress.completed = index + 1
+            if settle:
+                progress.response = stats.add(
+                    await await_stable_screen(instance, wait, progress.response, timeout)
+                )
+        elif computer_call_kwargs["action"] != "take_screenshot":
+            await _with_timeout(
+                instance.computer(**computer_call_kwargs, screenshot=False), timeout
+            )
+        progress.completed = index + 1
+    return progress.response
+
+
+def _write_wait_stats(config: RunnableConfig, stats: _WaitStats) -> None:
+    if stats.waited_seconds == 0:
+        return
+    writer = get_stream_writer_from_config(config)
+    writer(
+        {
+            "wait": {
+                "waited_seconds": round(stats.waited_seconds, 3),
+                "polls": stats.polls,
+                "stable": stats.stable,
+            }
+        }
+    )
+
+
+async def _with_timeout(awaitable: Awaitable[T], timeout: Optional[float]) -> T:
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Returns whether a computer call failed before it reached the instance, so it can be
+    retried without its action being performed twice.
+    """
+    if isinstance(error, ApiError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(error, TRANSIENT_CONNECTION_ERRORS)
+
+
+def _is_instance_gone(error: BaseException) -> bool:
+    return isinstance(error, ApiError) and error.status_code in INSTANCE_GONE_STATUS_CODES
+
+
+def _retry_transient(func: Callable[[], T], retries: int) -> T:
+    """
+    Calls `func`, and retries it after a jittered exponential backoff if it raises a
+    transient error, up to `retries` times.
+    """
+    metrics = get_instrumentation()
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= retries or not is_transient_error(e):
+                raise
+        metrics.increment(COMPUTER_CALL_RETRIES, node=metrics.node)
+        time.sleep(_backoff_seconds(attempt))
+        attempt += 1
+
+
+async def _aretry_transient(func: Callable[[], Awaitable[T]], retries: int) -> T:
+    """
+    Async version of `_retry_transient`. `func` is called again for each attempt.
+    """
+    metrics = get_instrumentation()
+    attempt = 0
+    while True:
+        try:
+            return await func()
+        except Exception as e:
+            if attempt >= retries or not is_transient_error(e):
+                raise
+        metrics.increment(COMPUTER_CALL_RETRIES, node=metrics.node)
+        await asyncio.sleep(_backoff_seconds(attempt))
+        attempt += 1
+
+
+def _report_failover(
+    config: RunnableConfig, previous_instance_id: str, created: Dict[str, Any], seconds: float
+) -> None:
+    metrics = get_instrumentation()
+    metrics.increment(VM_FAILOVERS, node=metrics.node)
+    metrics.observe(VM_FAILOVER_SECONDS, seconds, node=metrics.node)
+    writer = get_stream_writer_from_config(config)
+    writer({"stream_url": created["stream_url"]})
+    writer(
+        {
+            "failover": {
+                "previous_instance_id": previous_instance_id,
+                "instance_id": created["instance_id"],
+                "seconds": round(seconds, 3),
+            }
+        }
+    )
+
+
+def _fail_over(
+    instance_id: str, state: CUAState, config: RunnableConfig
+) -> Tuple[ComputerResponse, Dict[str, Any]]:
+    """
+    Replaces an instance which stopped responding with a new one, authenticated like the
+    old one was, and takes a screenshot of it for the model to continue from.
+
+    Returns:
+        The screenshot of the new instance, and the state updates which switch the thread
+        over to it.
+    """
+    started = time.monotonic()
+    configuration = get_configuration_with_defaults(config)
+    auth_state_id = configuration.get("auth_state_id")
+    metrics = get_instrumentation()
+
+    instance_tracker.forget(instance_id)
+    stop_instance_quietly(get_computer_backend(configuration), instance_id)
+    created = create_vm_instance({**state, "instance_id": None}, config)
+    try:
+        with metrics.scrapybara_call("get"):
+            instance = metrics.wrap_instance(
+                rate_limit_instance(get_instance(created["instance_id"], config), configuration)
+            )
+        authenticated_id = created.get("authenticated_id")
+        if _should_authenticate(configuration.get("environment"), auth_state_id, authenticated_id):
+            instance.authenticate(auth_state_id=auth_state_id)
+            authenticated_id = auth_state_id
+        computer_response = instance.computer(action="take_screenshot")
+    except Exception:
+        instance_tracker.forget(created["instance_id"])
+        stop_instance_quietly(get_computer_backend(configuration), created["instance_id"])
+        raise
+
+    _report_failover(config, instance_id, created, time.monotonic() - started)
+    return computer_response, {
+        "instance_id": created["instance_id"],
+        "stream_url": created["stream_url"],
+        "authenticated_id": authenticated_id,
+    }
+
+
+async def _afail_over(
+    instance_id: str, state: CUAState, config: RunnableConfig
+) -> Tuple[ComputerResponse, Dict[str, Any]]:
+    """
+    Async version of `_fail_over`.
+    """
+    started = time.monotonic()
+    configuration = get_configuration_with_defaults(config)
+    auth_state_id = configuration.get("auth_state_id")
+    timeout = configuration.get("action_timeout_seconds")
+    metrics = get_instrumentation()
+    backend = get_computer_backend(configuration)
+
+    instance_tracker.forget(instance_id)
+    # Calls dispatched to the replaced instance will never be picked up.
+    discard_dispatched_calls(instance_id)
+    await asyncio.to_thread(stop_instance_quietly, backend, instance_id)
+    created = await acreate_vm_instance({**state, "instance_id": None}, config)
+    try:
+        with metrics.scrapybara_call("get"):
+            instance = metrics.wrap_instance(
+                rate_limit_instance(
+                    await _with_timeout(aget_instance(created["instance_id"], config), timeout),
+                    configuration,
+                )
+            )
+        authenticated_id = created.get("authenticated_id")
+        if _should_authenticate(configuration.get("environment"), auth_state_id, authenticated_id):
+            await _with_timeout(instance.authenticate(auth_state_id=auth_state_id), timeout)
+            authenticated_id = auth_state_id
+        computer_response = await _with_timeout(
+            instance.computer(action="take_screenshot"), timeout
+        )
+    except Exception:
+        instance_tracker.forget(created["instance_id"])
+        await asyncio.to_thread(stop_instance_quietly, backend, created["instance_id"])
+        raise
+
+    _report_failover(config, instance_id, created, time.monotonic() - started)
+    return computer_response, {
+        "instance_id": created["instance_id"],
+        "stream_url": created["stream_url"],
+        "authenticated_id": authenticated_id,
+    }
+
+
+def _recover(
+    instance: Any, instance_id: str, error: Exception, state: CUAState, config: RunnableConfig
+) -> Tuple[Optional[ComputerResponse], Dict[str, Any]]:
+    """
+    Recovers from a step whose computer calls failed. If the instance still takes
+    screenshots, its screen is returned to the model, which can see what the failed calls
+    did. Otherwise, the instance is replaced, if `vm_failover` is enabled.
+
+    Returns:
+        The screenshot to return to the model, or None if the step can't be recovered, and
+        the state updates of the step.
+    """
+    configuration = get_configuration_with_defaults(config)
+    if not _is_instance_gone(error):
+        try:
+            return _retry_transient(
+                lambda: instance.computer(action="take_screenshot"),
+                configuration.get("vm_action_retries"),
+            ), {}
+        except Exception:
+            pass
+    if not configuration.get("vm_failover"):
+        return None, {}
+    try:
+        return _fail_over(instance_id, state, config)
+    except Exception:
+        metrics = get_instrumentation()
+        metrics.increment(VM_FAILOVER_FAILURES, node=metrics.node)
+        logger.exception("Failed to replace instance %s", instance_id)
+        return None, {}
+
+
+async def _arecover(
+    instance: Any, instance_id: str, error: Exception, state: CUAState, config: RunnableConfig
+) -> Tuple[Optional[ComputerResponse], Dict[str, Any]]:
+    """
+    Async version of `_recover`.
+    """
+    configuration = get_configuration_with_defaults(config)
+    timeout = configuration.get("action_timeout_seconds")
+    if not _is_instance_gone(error):
+        try:
+            return await _aretry_transient(
+                lambda: _with_timeout(instance.computer(action="take_screenshot"), timeout),
+                configuration.get("vm_action_retries"),
+            ), {}
+        except Exception:
+            pass
+    if not configuration.get("vm_failover"):
+        return None, {}
+    try:
+        return await _afail_over(instance_id, state, config)
+    except Exception:
+        metrics = get_instrumentation()
+        metrics.increment(VM_FAILOVER_FAILURES, node=metrics.node)
+        logger.exception("Failed to replace instance %s", instance_id)
+        return None, {}
+
+
+def can_dispatch_early(state: CUAState, config: RunnableConfig) -> bool:
+    """
+    Returns whether computer calls can be dispatched before the model response has
+    finished streaming. This requires a running instance which needs no further setup,
+    and which hasn't been stopped, e.g. by the idle sweeper.
+    """
+    configuration = get_configuration_with_defaults(config)
+    instance_id = state.get("instance_id")
+    return (
+        bool(instance_id)
+        and not instance_tracker.is_stopped(instance_id)
+        and bool(state.get("stream_url"))
+        and not _should_authenticate(
+            configuration.get("environment"),
+            configuration.get("auth_state_id"),
+            state.get("authenticated_id"),
+        )
+    )
+
+
+def dispatch_computer_call(
+    state: CUAState,
+    output: ResponseComputerToolCall,
+    config: RunnableConfig,
+    after: Optional[asyncio.Task] = None,
+) -> asyncio.Task:
+    """
+    Starts executing a computer call in the background, before the rest of the model
+    response has arrived. The next `atake_computer_action` step picks up the result
+    instead of executing the call again.
+
+    Args:
+        state: The current state of the thread.
+        output: The computer call to execute.
+        config: The runnable configuration.
+        after: A previously dispatched call from the same response, which must finish first.
+
+    Returns:
+        The task executing the call.
+    """
+    instance_id = state.get("instance_id")
+    configuration = get_configuration_with_defaults(config)
+    timeout = configuration.get("action_timeout_seconds")
+    wait = WaitSettings.from_configuration(configuration)
+
+    async def run() -> Tuple[Optional[ComputerResponse], _WaitStats]:
+        if after is not None:
+            await after
+        instance = rate_limit_instance(
+            await _with_timeout(aget_instance(instance_id, config), timeout), configuration
+        )
+        stats = _WaitStats()
+        response = await _arun_computer_calls(
+            instance,
+            [output],
+            wait,
+            stats,
+            timeout,
+            configuration.get("model_display_size"),
+            display_size=get_display_size(configuration),
+        )
+        return response, stats
+
+    task = asyncio.ensure_future(run())
+    _dispatched[(instance_id, output.get("call_id"))] = task
+    return task
+
+
+def cancel_dispatched_calls(instance_id: str, call_ids: List[str]) -> None:
+    """
+    Cancels dispatched computer calls which will never be picked up, e.g. because
+    the model response failed part way through.
+    """
+    for call_id in call_ids:
+        task = _dispatched.pop((instance_id, call_id), None)
+        if task is not None:
+            task.cancel()
+
+
+def discard_dispatched_calls(instance_id: str) -> None:
+    """
+    Cancels and forgets every dispatched computer call for an instance, e.g. once the run
+    using it has ended, so calls which were never picked up don't linger.
+    """
+    for key in [key for key in _dispatched if key[0] == instance_id]:
+        _dispatched.pop(key).cancel()
+
+
+async def _arun_dispatched_calls(
+    instance: Any,
+    instance_id: str,
+    outputs: List[ResponseComputerToolCall],
+    wait: WaitSettings,
+    stats: _WaitStats,
+    timeout: Optional[float],
+    model_display_size: Optional[Tuple[int, int]] = None,
+    progress: Optional[_StepProgress] = None,
+    display_size: Tuple[int, int] = DISPLAY_SIZE,
+) -> Optional[ComputerResponse]:
+    """
+    Awaits the computer calls dispatched while the model response was streaming, then
+    executes the rest. Calls are always dispatched in order, so the dispatched calls
+    are a prefix of `outputs`. Dispatched calls are only picked up once, so a retry
+    resumes from `progress` with the calls which haven't been performed.
+    """
+    progress = progress or _StepProgress()
+    tasks = [_dispatched.pop((instance_id, output.get("call_id")), None) for output in outputs]
+    try:
+        for index, task in enumerate(tasks):
+            if task is None:
+                break
+            progress.response, task_stats = await task
+            stats.merge(task_stats)
+            progress.completed = index + 1
+    except BaseException:
+        for task in tasks:
+            if task is not None:
+                task.cancel()
+        raise
+    return await _arun_computer_calls(
+        instance, outputs, wait, stats, timeout, model_display_size, progress, display_size
+    )
+
+
+@instrumented("take_computer_action")
+def take_computer_action(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Executes computer actions based on the tool calls in the last message. If the model
+    returned several computer calls, they are all executed in order. Calls which fail with
+    a transient error are retried, and if the instance stops responding, it's replaced by
+    a new one when `vm_failover` is enabled.
+
+    Args:
+        state: The current state of the CUA agent.
+        config: The runnable configuration.
+
+    Returns:
+        A dictionary with updated state information.
+    """
+    outputs = _get_computer_calls(state)
 
     instance_id = state.get("instance_id")
     if not instance_id:
         raise ValueError("Instance ID not found in state.")
-    instance = get_instance(instance_id, config)
-
+    instance_tracker.touch(instance_id)
     configuration = get_configuration_with_defaults(config)
+    metrics = get_instrumentation()
+    with metrics.scrapybara_call("get"):
+        instance = metrics.wrap_instance(
+            rate_limit_instance(get_instance(instance_id, config), configuration)
+        )
+
     environment = configuration.get("environment")
     auth_state_id = configuration.get("auth_state_id")
     authenticated_id = state.get("authenticated_id")
 
-    if (
-        environment == "web"
-        and auth_state_id is not None
-        and (
-            (authenticated_id is None)
-            or (authenticated_id is not None and authenticated_id != auth_state_id)
-        )
-    ):
+    if _should_authenticate(environment, auth_state_id, authenticated_id):
         instance.authenticate(auth_state_id=auth_state_id)
         authenticated_id = auth_state_id
 
@@ -86,82 +791,173 @@ def take_computer_action(state: CUAState, config: RunnableConfig) -> Dict[str, A
         stream_url_response: InstanceGetStreamUrlResponse = instance.get_stream_url()
         stream_url = stream_url_response.stream_url
 
-        writer = get_stream_writer()
+        writer = get_stream_writer_from_config(config)
         writer({"stream_url": stream_url})
 
-    output = tool_outputs[-1]
-    action = output.get("action")
-    tool_message: Optional[ToolMessage] = None
+    for output in outputs:
+        metrics.increment(ACTIONS, action=output.get("action", {}).get("type"))
+
+    tool_messages: Optional[List[Dict[str, Any]]] = None
+    wait = WaitSettings.from_configuration(configuration)
+    model_display_size = configuration.get("model_display_size")
+    wait_stats = _WaitStats()
+    updates: Dict[str, Any] = {}
 
+    # A retry resumes from the call which failed, so earlier actions aren't performed twice.
+    progress = _StepProgress()
     try:
-        computer_response: Optional[ComputerResponse] = None
-        action_type = action.get("type")
+        computer_response = _retry_transient(
+            lambda: _run_computer_calls(
+                instance,
+                outputs,
+                wait,
+                wait_stats,
+                model_display_size,
+                progress,
+                get_display_size(configuration),
+            ),
+            configuration.get("vm_action_retries"),
+        )
+    except Exception as e:
+        # The instance may have been stopped or errored, so look it up again on the next step.
+        invalidate_instance(instance_id)
+        metrics.increment(COMPUTER_CALL_FAILURES, node=metrics.node)
+        _log_failure(e, outputs)
+        computer_response, updates = _recover(instance, instance_id, e, state, config)
 
-        if action_type == "click":
-            computer_response = instance.computer(
-                action="click_mouse",
-                button="middle" if action.get("button") == "wheel" else action.get("button"),
-                coordinates=[action.get("x"), action.get("y")],
-            )
-        elif action_type == "double_click":
-            computer_response = instance.computer(
-                action="click_mouse",
-                button="left",
-                coordinates=[action.get("x"), action.get("y")],
-                num_clicks=2,
-            )
-        elif action_type == "drag":
-            computer_response = instance.computer(
-                action="drag_mouse",
-                path=[[point.get("x"), point.get("y")] for point in action.get("path")],
-            )
-        elif action_type == "keypress":
-            mapped_keys = [
-                CUA_KEY_TO_SCRAPYBARA_KEY.get(key.lower(), key.lower())
-                for key in action.get("keys")
-            ]
-            computer_response = instance.computer(action="press_key", keys=mapped_keys)
-        elif action_type == "move":
-            computer_response = instance.computer(
-                action="move_mouse", coordinates=[action.get("x"), action.get("y")]
+    try:
+        _write_wait_stats(config, wait_stats)
+        if computer_response:
+            screenshot = encode_screenshot(
+                computer_response.base_64_image,
+                configuration.get("screenshot_format"),
+                configuration.get("screenshot_quality"),
+                configuration.get("model_display_size"),
             )
-        elif action_type == "screenshot":
-            computer_response = instance.computer(action="take_screenshot")
-        elif action_type == "wait":
-            # Sleep for 2000ms (2 seconds)
-            time.sleep(2)
-            # Take a screenshot after waiting
-            computer_response = instance.computer(action="take_screenshot")
-        elif action_type == "scroll":
-            computer_response = instance.computer(
-                action="scroll",
-                delta_x=action.get("scroll_x") // 20,
-                delta_y=action.get("scroll_y") // 20,
-                coordinates=[action.get("x"), action.get("y")],
+            _write_screenshot_stats(config, screenshot)
+            metrics.observe(SCREENSHOT_BYTES, screenshot.encoded_bytes, node=metrics.node)
+            image_url = store_screenshot(screenshot, configuration.get("blob_store"))
+            tool_messages = _make_tool_messages(outputs, image_url)
+    except Exception as e:
+        metrics.increment(COMPUTER_CALL_FAILURES, node=metrics.node)
+        _log_failure(e, outputs)
+
+    if tool_messages:
+        updates["messages"] = tool_messages
+    # Without tool messages, the run ends, since the last message is still the computer call.
+    return {
+        "instance_id": instance.id,
+        "stream_url": stream_url,
+        "authenticated_id": authenticated_id,
+        **updates,
+    }
+
+
+@instrumented("take_computer_action")
+async def atake_computer_action(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Async version of `take_computer_action`, built on the async Scrapybara client.
+    Used when the graph is run asynchronously, so waiting on the virtual machine
+    never blocks an executor thread.
+
+    Args:
+        state: The current state of the CUA agent.
+        config: The runnable configuration.
+
+    Returns:
+        A dictionary with updated state information.
+    """
+    outputs = _get_computer_calls(state)
+
+    instance_id = state.get("instance_id")
+    if not instance_id:
+        raise ValueError("Instance ID not found in state.")
+    instance_tracker.touch(instance_id)
+    configuration = get_configuration_with_defaults(config)
+    timeout = configuration.get("action_timeout_seconds")
+    metrics = get_instrumentation()
+    with metrics.scrapybara_call("get"):
+        instance = metrics.wrap_instance(
+            rate_limit_instance(
+                await _with_timeout(aget_instance(instance_id, config), timeout), configuration
             )
-        elif action_type == "type":
-            computer_response = instance.computer(action="type_text", text=action.get("text"))
-        else:
-            raise ValueError(f"Unknown computer action received: {action}")
+        )
+
+    environment = configuration.get("environment")
+    auth_state_id = configuration.get("auth_state_id")
+    authenticated_id = state.get("authenticated_id")
+
+    if _should_authenticate(environment, auth_state_id, authenticated_id):
+        await _with_timeout(instance.authenticate(auth_state_id=auth_state_id), timeout)
+        authenticated_id = auth_state_id
+
+    stream_url: Optional[str] = state.get("stream_url")
+    if not stream_url:
+        stream_url_response: InstanceGetStreamUrlResponse = await _with_timeout(
+            instance.get_stream_url(), timeout
+        )
+        stream_url = stream_url_response.stream_url
+
+        writer = get_stream_writer_from_config(config)
+        writer({"stream_url": stream_url})
 
+    for output in outputs:
+        metrics.increment(ACTIONS, action=output.get("action", {}).get("type"))
+
+    tool_messages: Optional[List[Dict[str, Any]]] = None
+    wait = WaitSettings.from_configuration(configuration)
+    model_display_size = configuration.get("model_display_size")
+    wait_stats = _WaitStats()
+    updates: Dict[str, Any] = {}
+
+    # A retry resumes from the call which failed, so earlier actions aren't performed twice.
+    progress = _StepProgress()
+    try:
+        computer_response = await _aretry_transient(
+            lambda: _arun_dispatched_calls(
+                instance,
+                instance_id,
+                outputs,
+                wait,
+                wait_stats,
+                timeout,
+                model_display_size,
+                progress,
+                get_display_size(configuration),
+            ),
+            configuration.get("vm_action_retries"),
+        )
+    except Exception as e:
+        invalidate_instance(instance_id)
+        metrics.increment(COMPUTER_CALL_FAILURES, node=metrics.node)
+        _log_failure(e, outputs)
+        computer_response, updates = await _arecover(instance, instance_id, e, state, config)
+
+    try:
+        _write_wait_stats(config, wait_stats)
         if computer_response:
-            output_content = {
-                "type": "input_image",
-                "image_url": f"data:image/png;base64,{computer_response.base_64_image}",
-            }
-            tool_message = {
-                "role": "tool",
-                "content": [output_content],
-                "tool_call_id": output.get("call_id"),
-                "additional_kwargs": {"type": "computer_call_output"},
-            }
+            screenshot = await aencode_screenshot(
+                computer_response.base_64_image,
+                configuration.get("screenshot_format"),
+                configuration.get("screenshot_quality"),
+                configuration.get("model_display_size"),
+            )
+            _write_screenshot_stats(config, screenshot)
+            metrics.observe(SCREENSHOT_BYTES, screenshot.encoded_bytes, node=metrics.node)
+            image_url = await asyncio.to_thread(
+                store_screenshot, screenshot, configuration.get("blob_store")
+            )
+            tool_messages = _make_tool_messages(outputs, image_url)
     except Exception as e:
-        print(f"\n\nFailed to execute computer call: {e}\n\n")
-        print(f"Computer call details: {output}\n\n")
+        metrics.increment(COMPUTER_CALL_FAILURES, node=metrics.node)
+        _log_failure(e, outputs)
 
+    if tool_messages:
+        updates["messages"] = tool_messages
+    # Without tool messages, the run ends, since the last message is still the computer call.
     return {
-        "messages": tool_message if tool_message else None,
         "instance_id": instance.id,
         "stream_url": stream_url,
         "authenticated_id": authenticated_id,
+        **updates,
     }
@@ -0,0 +1,422 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+from scrapybara import Scrapybara
+
+from .ratelimit import RateLimiter, call_with_retries
+from .utils import Instance, invalidate_instance, start_instance
+
+T = TypeVar("T")
+
+
+class PoolKey(NamedTuple):
+    """
+    Identifies a set of interchangeable instances in the pool. Two instances
+    with the same key can be handed out to any thread requesting that key.
+    """
+
+    environment: str  # One of "web", "ubuntu", or "windows"
+    blocked_domains: Tuple[str, ...] = ()  # Sorted, de-duplicated blocked domains
+    auth_state_id: Optional[str] = None  # Auth state the instance is authenticated with
+
+    @classmethod
+    def create(
+        cls,
+        environment: str,
+        blocked_domains: Optional[Sequence[str]] = None,
+        auth_state_id: Optional[str] = None,
+    ) -> "PoolKey":
+        """
+        Builds a normalized pool key. Blocked domains and auth states only apply
+        to the "web" environment, so they are dropped for every other environment.
+
+        Args:
+            environment: The environment of the instance.
+            blocked_domains: The domains blocked on the instance.
+            auth_state_id: The ID of the auth state the instance is authenticated with.
+
+        Returns:
+            The pool key.
+        """
+        if environment != "web":
+            return cls(environment)
+        return cls(environment, tuple(sorted(set(blocked_domains or []))), auth_state_id)
+
+
+@dataclass
+class PoolMetrics:
+    """
+    Counters describing how the pool has been used.
+    """
+
+    hits: int = 0  # Leases served from a warm instance
+    misses: int = 0  # Leases which had to cold-boot an instance
+    boots: int = 0  # Instances booted, both on the critical path and in the background
+    boot_failures: int = 0  # Background boots which raised
+    evictions: int = 0  # Warm instances stopped because they sat idle past the TTL
+    health_check_failures: int = 0  # Warm instances discarded because they were not running
+    releases: int = 0  # Instances returned to the pool after use
+    reset_failures: int = 0  # Returned instances stopped because they couldn't be reset
+
+    @property
+    def hit_rate(self) -> float:
+        leases = self.hits + self.misses
+        return self.hits / leases if leases else 0.0
+
+
+@dataclass
+class _WarmInstance:
+    instance: Instance
+    idle_since: float
+
+
+class VMPool:
+    """
+    A bounded pool of pre-booted Scrapybara instances, keyed by `PoolKey`.
+
+    For every key the pool has been asked for, it tries to keep at least `min_size`
+    idle instances booted, and never holds more than `max_size` instances (idle or
+    booting). Instances which sit idle for longer than `idle_ttl_seconds` are stopped,
+    and every instance is health checked before it is handed out. Once the pool is first
+    used, a background thread calls `maintain` every `maintain_interval_seconds`.
+
+    Example:
+        ```python
+        from scrapybara import Scrapybara
+        from langgraph_cua import VMPool, create_cua, get_vm_pool_key
+
+        pool = VMPool(Scrapybara(api_key="..."), min_size=2, max_size=8)
+        pool.warm(get_vm_pool_key("web"))
+        cua_graph = create_cua(vm_pool=pool)
+        ```
+    """
+
+    def __init__(
+        self,
+        client: Scrapybara,
+        *,
+        min_size: int = 1,
+        max_size: int = 4,
+        idle_ttl_seconds: float = 15 * 60,
+        timeout_hours: float = 1.0,
+        health_check: bool = True,
+        background_refill: bool = True,
+        max_boot_workers: int = 4,
+        maintain_interval_seconds: Optional[float] = 60.0,
+        reset: Optional[Callable[[Instance], None]] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_rate_limit_retries: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            client: The Scrapybara client used to boot, check and stop instances.
+            min_size: The number of idle instances to keep warm for each key.
+            max_size: The maximum number of instances held by the pool for each key.
+            idle_ttl_seconds: How long an instance may sit idle in the pool before it is stopped.
+                Must be shorter than `timeout_hours`, so leased instances are never about to expire.
+            timeout_hours: The timeout to boot pooled instances with. Must be between 0.01 and 24.
+            health_check: Whether to check an instance is still running before handing it out.
+            background_refill: Whether to boot replacement instances on a background thread.
+                If False, the pool is only refilled when `refill` is called.
+            max_boot_workers: The maximum number of instances booted concurrently in the background.
+            maintain_interval_seconds: How often the background thread calls `maintain`, to evict
+                idle instances and refill the pool. If None, `maintain` must be called by the owner
+                of the pool, or idle instances are only evicted when the pool is leased from.
+            reset: Restores a used instance to a clean state, e.g. by closing its windows and
+                clearing its browser data, before it's returned to the pool. It should raise if
+                the instance can't be reset. Without it, used instances are stopped instead of
+                being returned, since the next thread would inherit the previous task's state.
+            rate_limiter: The rate limiter every call to Scrapybara goes through. Pass
+                `get_rate_limiter("scrapybara", api_key)` to share the quota of the graph's API key.
+                Defaults to an unlimited limiter, which still retries rate limited calls.
+            max_rate_limit_retries: The number of times to retry a call which was rate limited.
+            clock: Monotonic clock used for idle tracking. Mostly useful for tests.
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("VMPool requires 0 <= min_size <= max_size and max_size >= 1")
+        if timeout_hours < 0.01 or timeout_hours > 24:
+            raise ValueError("timeout_hours must be between 0.01 and 24")
+        if idle_ttl_seconds >= timeout_hours * 3600:
+            raise ValueError("idle_ttl_seconds must be shorter than timeout_hours")
+        if maintain_interval_seconds is not None and maintain_interval_seconds <= 0:
+            raise ValueError("maintain_interval_seconds must be positive")
+
+        self._client = client
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.timeout_hours = timeout_hours
+        self.health_check = health_check
+        self.background_refill = background_refill
+        self.maintain_interval_seconds = maintain_interval_seconds
+        self.reset = reset
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._idle: Dict[PoolKey, List[_WarmInstance]] = {}
+        self._pending: Dict[PoolKey, int] = {}
+        self._metrics = PoolMetrics()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_boot_workers, thread_name_prefix="langgraph-cua-vm-pool"
+        )
+        self._closed = False
+        self._maintainer: Optional[threading.Thread] = None
+        self._stop_maintainer = threading.Event()
+
+    @property
+    def metrics(self) -> PoolMetrics:
+        """A snapshot of the pool's counters."""
+        with self._lock:
+            return replace(self._metrics)
+
+    def size(self, key: PoolKey) -> int:
+        """
+        Returns the number of idle instances held for the given key.
+        """
+        with self._lock:
+            return len(self._idle.get(key, []))
+
+    def lease(self, key: PoolKey) -> Instance:
+        """
+        Hands out a running instance for the given key. A warm instance is used if one
+        passes its health check, otherwise a new instance is booted on the caller's thread.
+        Either way, the pool is topped back up to `min_size` afterwards.
+
+        Args:
+            key: The key of the instance to lease.
+
+        Returns:
+            A running instance, which now belongs to the caller.
+        """
+        self._ensure_open()
+        self._ensure_maintainer()
+        self.evict_idle()
+
+        while True:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                warm = idle.pop() if idle else None
+            if warm is None:
+                break
+            if self._is_healthy(warm.instance):
+                with self._lock:
+                    self._metrics.hits += 1
+                self._schedule_refill(key)
+                return warm.instance
+            with self._lock:
+                self._metrics.health_check_failures += 1
+            self._stop_quietly(warm.instance)
+
+        with self._lock:
+            self._metrics.misses += 1
+        instance = self._boot(key)
+        self._schedule_refill(key)
+        return instance
+
+    def release(self, instance: Instance, key: PoolKey) -> bool:
+        """
+        Resets a used instance with `reset`, and returns it to the pool so it can be leased
+        again. If the pool has no `reset`, the instance can't be reset, or the pool is full
+        for this key, the instance is stopped instead.
+
+        Args:
+            instance: The instance to return.
+            key: The key the instance was leased with.
+
+        Returns:
+            True if the instance was pooled, False if it was stopped.
+        """
+        if self.reset is None:
+            self._stop_quietly(instance)
+            return False
+        self._ensure_maintainer()
+        try:
+            self.reset(instance)
+        except Exception:
+            with self._lock:
+                self._metrics.reset_failures += 1
+            self._stop_quietly(instance)
+            return False
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if not self._closed and len(idle) + self._pending.get(key, 0) < self.max_size:
+                idle.append(_WarmInstance(instance, self._clock()))
+                self._metrics.releases += 1
+                return True
+        self._stop_quietly(instance)
+        return False
+
+    def warm(self, key: PoolKey, wait: bool = False) -> List[Future]:
+        """
+        Boots instances until `min_size` instances are idle (or booting) for the key.
+
+        Args:
+            key: The key to warm up.
+            wait: Whether to block until the instances have booted.
+
+        Returns:
+            The futures of the boots which were started.
+        """
+        self._ensure_open()
+        self._ensure_maintainer()
+        futures = self._schedule_refill(key, force=True)
+        if wait:
+            for future in futures:
+                future.result()
+        return futures
+
+    def refill(self, key: PoolKey) -> List[Future]:
+        """
+        Alias of `warm` which blocks until the pool is refilled.
+        """
+        return self.warm(key, wait=True)
+
+    def evict_idle(self) -> int:
+        """
+        Stops every idle instance which has outlived `idle_ttl_seconds`.
+
+        Returns:
+            The number of evicted instances.
+        """
+        now = self._clock()
+        expired: List[Instance] = []
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep: List[_WarmInstance] = []
+                for warm in idle:
+                    if now - warm.idle_since < self.idle_ttl_seconds:
+                        keep.append(warm)
+                    else:
+                        expired.append(warm.instance)
+                self._idle[key] = keep
+            self._metrics.evictions += len(expired)
+        for instance in expired:
+            self._stop_quietly(instance)
+        return len(expired)
+
+    def maintain(self) -> None:
+        """
+        Evicts expired instances, and tops every known key back up to `min_size`.
+        Called periodically by the background thread, unless `maintain_interval_seconds`
+        is None, in which case it should be called periodically by the owner of the pool.
+        """
+        self.evict_idle()
+        with self._lock:
+            keys = list(self._idle.keys())
+        for key in keys:
+            self._schedule_refill(key, force=True)
+
+    def close(self, stop_instances: bool = True) -> None:
+        """
+        Shuts down the pool. Idle instances are stopped unless `stop_instances` is False.
+        """
+        with self._lock:
+            self._closed = True
+            idle = [w.instance for instances in self._idle.values() for w in instances]
+            self._idle.clear()
+            maintainer = self._maintainer
+        self._stop_maintainer.set()
+        if maintainer is not None and maintainer is not threading.current_thread():
+            maintainer.join()
+        self._executor.shutdown(wait=True)
+        if stop_instances:
+            for instance in idle:
+                self._stop_quietly(instance)
+
+    def _ensure_open(self) -> None:
+        if self._closed:
+            raise RuntimeError("Cannot use a VMPool after it has been closed.")
+
+    def _ensure_maintainer(self) -> None:
+        if self.maintain_interval_seconds is None:
+            return
+        with self._lock:
+            if self._maintainer is not None or self._closed:
+                return
+            self._maintainer = threading.Thread(
+                target=self._maintain_periodically, name="langgraph-cua-vm-pool", daemon=True
+            )
+        self._maintainer.start()
+
+    def _maintain_periodically(self) -> None:
+        while not self._stop_maintainer.wait(self.maintain_interval_seconds):
+            try:
+                if self.background_refill:
+                    self.maintain()
+                else:
+                    self.evict_idle()
+            except Exception:
+                # Keep maintaining the pool, even if one boot can't be scheduled.
+                pass
+
+    def _boot(self, key: PoolKey) -> Instance:
+        instance = self._call(
+            start_instance, self._client, key.environment, self.timeout_hours, key.blocked_domains
+        )
+        with self._lock:
+            self._metrics.boots += 1
+        if key.auth_state_id is not None:
+            try:
+                self._call(instance.authenticate, auth_state_id=key.auth_state_id)
+            except Exception:
+                self._stop_quietly(instance)
+                raise
+        return instance
+
+    def _boot_into_pool(self, key: PoolKey) -> None:
+        try:
+            instance = self._boot(key)
+        except Exception:
+            with self._lock:
+                self._pending[key] -= 1
+                self._metrics.boot_failures += 1
+            raise
+        with self._lock:
+            self._pending[key] -= 1
+            if self._closed:
+                instance_to_stop: Optional[Instance] = instance
+            else:
+                self._idle.setdefault(key, []).append(_WarmInstance(instance, self._clock()))
+                instance_to_stop = None
+        if instance_to_stop is not None:
+            self._stop_quietly(instance_to_stop)
+
+    def _schedule_refill(self, key: PoolKey, force: bool = False) -> List[Future]:
+        if not self.background_refill and not force:
+            return []
+        with self._lock:
+            if self._closed:
+                return []
+            idle = len(self._idle.setdefault(key, []))
+            pending = self._pending.get(key, 0)
+            deficit = min(self.min_size - idle - pending, self.max_size - idle - pending)
+            if deficit <= 0:
+                return []
+            self._pending[key] = pending + deficit
+        return [self._executor.submit(self._boot_into_pool, key) for _ in range(deficit)]
+
+    def _is_healthy(self, instance: Instance) -> bool:
+        if not self.health_check:
+            return True
+        try:
+            return self._call(self._client.get, instance.id).status == "running"
+        except Exception:
+            return False
+
+    def _stop_quietly(self, instance: Instance) -> None:
+        invalidate_instance(instance.id)
+        try:
+            self._call(instance.stop)
+        except Exception:
+            pass
+
+    def _call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return call_with_retries(
+            self._rate_limiter, func, *args, max_retries=self.max_rate_limit_retries, **kwargs
+        )
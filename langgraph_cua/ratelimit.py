@@ -0,0 +1,406 @@
+import asyncio
+import hashlib
+import inspect
+import random
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, TypeVar
+
+import httpx
+import openai
+from scrapybara.core.api_error import ApiError
+
+# Backoff before retrying a rate limited call, when the response has no Retry-After header.
+# The delay before retry n is drawn uniformly from [0, min(MAX_BACKOFF_SECONDS, BASE * 2^n)].
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+
+# The Scrapybara instance methods which go through the rate limiter.
+RATE_LIMITED_INSTANCE_METHODS = frozenset(["computer", "get_stream_url", "authenticate", "stop"])
+
+# Errors from OpenAI which are retried with backoff, without slowing down other threads.
+# These were retried by the OpenAI SDK before its retries were replaced by the rate limiter's.
+TRANSIENT_OPENAI_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.ConflictError,
+)
+
+T = TypeVar("T")
+
+
+class RateLimit(NamedTuple):
+    """
+    The quota of an API key. None means unlimited.
+    """
+
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None  # Only applies to OpenAI
+
+
+@dataclass
+class RateLimiterStats:
+    """
+    Counters describing how a rate limiter has been used.
+    """
+
+    requests: int = 0  # Requests let through, including retries
+    waits: int = 0  # Requests which had to wait for quota
+    waited_seconds: float = 0.0  # Total time requests spent waiting for quota
+    rate_limited: int = 0  # Responses which were rate limited (HTTP 429)
+    retries: int = 0  # Calls retried after being rate limited, or a transient error
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_seconds(self, amount: float) -> float:
+        # Requests for more than the capacity wait for a full bucket, rather than forever.
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+
+class RateLimiter:
+    """
+    A token-bucket rate limiter for one API key, shared by every thread in the process.
+    Requests wait until there's quota for them, and a rate limited response pauses every
+    request using the key until its Retry-After has passed.
+
+    Token usage is only known once a response arrives, so it's recorded afterwards with
+    `record_tokens`, and requests wait while the tokens bucket is in debt.
+    """
+
+    def __init__(self, limit: Optional[RateLimit] = None):
+        self._lock = threading.Lock()
+        self._requests: Optional[_TokenBucket] = None
+        self._tokens: Optional[_TokenBucket] = None
+        self._paused_until = 0.0
+        self._stats = RateLimiterStats()
+        self.limit = RateLimit()
+        self.set_limit(limit or RateLimit())
+
+    @property
+    def stats(self) -> RateLimiterStats:
+        with self._lock:
+            return replace(self._stats)
+
+    def set_limit(self, limit: RateLimit) -> None:
+        """
+        Changes the quota. Buckets are only replaced for the limits which changed.
+        """
+        with self._lock:
+            if limit.requests_per_minute != self.limit.requests_per_minute:
+                self._requests = (
+                    _TokenBucket(limit.requests_per_minute) if limit.requests_per_minute else None
+                )
+            if limit.tokens_per_minute != self.limit.tokens_per_minute:
+                self._tokens = (
+                    _TokenBucket(limit.tokens_per_minute) if limit.tokens_per_minute else None
+                )
+            self.limit = limit
+
+    def _reserve(self) -> float:
+        """Takes a request from the bucket if there's quota, else returns how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._paused_until - now
+            if self._requests is not None:
+                self._requests.refill(now)
+                wait = max(wait, self._requests.wait_seconds(1))
+            if self._tokens is not None:
+                self._tokens.refill(now)
+                wait = max(wait, self._tokens.wait_seconds(0))
+            if wait > 0:
+                return wait
+            if self._requests is not None:
+                self._requests.level -= 1
+            self._stats.requests += 1
+            return 0.0
+
+    def _record_wait(self, waited: float) -> None:
+        if waited:
+            with self._lock:
+                self._stats.waits += 1
+                self._stats.waited_seconds += waited
+
+    def acquire(self) -> None:
+        """
+        Blocks until there's quota for a request.
+        """
+        waited = 0.0
+        while (wait := self._reserve()) > 0:
+            time.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+
+    async def aacquire(self) -> None:
+        """
+        Async version of `acquire`.
+        """
+        waited = 0.0
+        while (wait := self._reserve()) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record_wait(waited)
+
+    def record_tokens(self, tokens: int) -> None:
+        """
+        Records the tokens used by a response.
+        """
+        if self._tokens is None or not tokens:
+            return
+        with self._lock:
+            self._tokens.refill(time.monotonic())
+            self._tokens.level -= tokens
+
+    def pause(self, seconds: float) -> None:
+        """
+        Pauses every request using this key for `seconds`, e.g. after a rate limited response.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats.rate_limited += 1
+
+    def _record_retry(self) -> None:
+        with self._lock:
+            self._stats.retries += 1
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    service: str, api_key: Optional[str], limit: Optional[RateLimit] = None
+) -> RateLimiter:
+    """
+    Gets the process-wide rate limiter for an API key, creating it if needed. If `limit`
+    is given, it replaces the limiter's current limit.
+
+    Args:
+        service: The service the API key belongs to, e.g. "openai" or "scrapybara".
+        api_key: The API key.
+        limit: The quota of the API key.
+
+    Returns:
+        The rate limiter.
+    """
+    # Keys are hashed, so they aren't held in memory in the clear any longer than needed.
+    key = (service, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest())
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(limit)
+            return limiter
+    if limit is not None and limit != limiter.limit:
+        limiter.set_limit(limit)
+    return limiter
+
+
+def clear_rate_limiters() -> None:
+    """
+    Forgets every rate limiter.
+    """
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def _parse_retry_after(headers: Any) -> Optional[float]:
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        # Retry-After may also be an HTTP date, but neither API sends one.
+        return None
+
+
+def get_rate_limit_delay(error: BaseException) -> Optional[float]:
+    """
+    Returns how long to wait before retrying a call which raised `error`, if it was
+    rate limited. The delay comes from the Retry-After header when there is one.
+
+    Scrapybara's `ApiError` only carries the status code and body of the response, not
+    its headers, so rate limited Scrapybara calls always return 0 and back off instead.
+
+    Args:
+        error: The error the call raised.
+
+    Returns:
+        The number of seconds to wait, 0 if the response didn't say, or None if the
+        call was not rate limited.
+    """
+    if isinstance(error, openai.RateLimitError):
+        return _parse_retry_after(error.response.headers) or 0.0
+    if isinstance(error, ApiError) and error.status_code == 429:
+        return 0.0
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+        return _parse_retry_after(error.response.headers) or 0.0
+    return None
+
+
+def _backoff_seconds(attempt: int) -> float:
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2**attempt))
+
+
+def _retry_delay(
+    limiter: RateLimiter, error: Exception, attempt: int, transient: Tuple[type, ...]
+) -> Optional[float]:
+    """
+    Returns how long to sleep before retrying, or None if the error isn't retryable.
+    Rate limited calls pause the limiter instead, so they sleep while acquiring it.
+    """
+    delay = get_rate_limit_delay(error)
+    if delay is not None:
+        # Other threads sharing the key would be rate limited too, so pause them as well.
+        limiter.pause(delay or _backoff_seconds(attempt))
+        return 0.0
+    if transient and isinstance(error, transient):
+        return _backoff_seconds(attempt)
+    return None
+
+
+def call_with_retries(
+    limiter: RateLimiter,
+    func: Callable[..., T],
+    *args: Any,
+    max_retries: int = 5,
+    transient: Tuple[type, ...] = (),
+    **kwargs: Any,
+) -> T:
+    """
+    Calls `func` once the rate limiter allows it. If the call is rate limited, or raises
+    one of the `transient` errors, it's retried after a jittered exponential backoff, up
+    to `max_retries` times.
+
+    Args:
+        limiter: The rate limiter of the API key the call uses.
+        func: The function to call.
+        max_retries: The maximum number of retries.
+        transient: Other errors to retry, without slowing down other threads.
+
+    Returns:
+        The result of the call.
+    """
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            delay = _retry_delay(limiter, e, attempt, transient)
+            if delay is None or attempt >= max_retries:
+                raise
+        time.sleep(delay)
+        limiter._record_retry()
+        attempt += 1
+
+
+async def acall_with_retries(
+    limiter: RateLimiter,
+    func: Callable[..., Awaitable[T]],
+    *args: Any,
+    max_retries: int = 5,
+    transient: Tuple[type, ...] = (),
+    **kwargs: Any,
+) -> T:
+    """
+    Async version of `call_with_retries`. `func` is called again for each attempt.
+    """
+    attempt = 0
+    while True:
+        await limiter.aacquire()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            delay = _retry_delay(limiter, e, attempt, transient)
+            if delay is None or attempt >= max_retries:
+                raise
+        await asyncio.sleep(delay)
+        limiter._record_retry()
+        attempt += 1
+
+
+class _RateLimitedInstance:
+    """Proxies a Scrapybara instance, sending calls to `RATE_LIMITED_INSTANCE_METHODS` through a rate limiter."""
+
+    def __init__(self, instance: Any, limiter: RateLimiter, max_retries: int):
+        self._instance = instance
+        self._limiter = limiter
+        self._max_retries = max_retries
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._instance, name)
+        if name not in RATE_LIMITED_INSTANCE_METHODS:
+            return attribute
+
+        if inspect.iscoroutinefunction(attribute):
+
+            async def acall(*args: Any, **kwargs: Any) -> Any:
+                return await acall_with_retries(
+                    self._limiter, attribute, *args, max_retries=self._max_retries, **kwargs
+                )
+
+            return acall
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            return call_with_retries(
+                self._limiter, attribute, *args, max_retries=self._max_retries, **kwargs
+            )
+
+        return call
+
+
+def get_scrapybara_rate_limiter(configuration: Dict[str, Any]) -> RateLimiter:
+    """
+    Gets the rate limiter for the Scrapybara API key in the configuration.
+    """
+    return get_rate_limiter(
+        "scrapybara",
+        configuration.get("scrapybara_api_key"),
+        configuration.get("scrapybara_rate_limit"),
+    )
+
+
+def rate_limit_instance(instance: Any, configuration: Dict[str, Any]) -> Any:
+    """
+    Wraps a sync or async Scrapybara instance, so every call to it goes through the rate
+    limiter of the Scrapybara API key in the configuration. Instances of other computer
+    backends, and instances replayed from a cassette, are returned as-is.
+
+    Args:
+        instance: The instance to wrap.
+        configuration: The configuration, with defaults.
+
+    Returns:
+        The wrapped instance.
+    """
+    cassette = configuration.get("cassette")
+    if (
+        isinstance(instance, _RateLimitedInstance)
+        or configuration.get("computer_backend")
+        or (cassette is not None and cassette.replaying)
+    ):
+        return instance
+    return _RateLimitedInstance(
+        instance,
+        get_scrapybara_rate_limiter(configuration),
+        configuration.get("max_rate_limit_retries"),
+    )
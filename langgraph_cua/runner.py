@@ -0,0 +1,294 @@
+import asyncio
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Union
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from .backends import get_computer_backend
+from .lifecycle import instance_tracker, stop_instance_quietly
+from .types import get_configuration_with_defaults
+
+# A task is either the text of the first user message, or an input state for the graph.
+Task = Union[str, Dict[str, Any]]
+
+# Returns the configurable fields to run a task with, given its index and the task.
+TaskConfigurable = Callable[[int, Task], Dict[str, Any]]
+
+
+@dataclass
+class TaskResult:
+    """
+    The outcome of one task run by `run_many`.
+    """
+
+    index: int  # The position of the task in the tasks passed to `run_many`
+    task: Task  # The task, as it was passed to `run_many`
+    state: Optional[Dict[str, Any]]  # The final state of the thread, unless the task failed
+    error: Optional[BaseException]  # The exception the task raised, if any
+    queued_seconds: float  # The time spent waiting for a VM slot
+    latency_seconds: float  # The time from acquiring a VM slot until the task finished
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(percentile / 100 * len(ordered)) - 1)]
+
+
+@dataclass
+class RunStats:
+    """
+    Throughput and latency of a `run_many` run so far.
+    """
+
+    completed: int = 0  # Tasks which finished without raising
+    failed: int = 0  # Tasks which raised
+    cancelled: int = 0  # Tasks cancelled before they finished
+    elapsed_seconds: float = 0.0  # Time since the run started, or its total duration once done
+    latencies: List[float] = field(default_factory=list, repr=False)  # Per-task latencies
+
+    @property
+    def throughput(self) -> float:
+        """Finished tasks per second."""
+        finished = self.completed + self.failed
+        return finished / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def p50_latency_seconds(self) -> float:
+        return _percentile(self.latencies, 50)
+
+    @property
+    def p95_latency_seconds(self) -> float:
+        return _percentile(self.latencies, 95)
+
+    @property
+    def p99_latency_seconds(self) -> float:
+        return _percentile(self.latencies, 99)
+
+
+class TaskRunner:
+    """
+    Runs many tasks concurrently, each in its own thread of the graph. Iterate over the
+    runner to receive each task's result as it finishes, in completion order.
+
+    At most `max_vms` tasks run at a time, since each running task holds a virtual
+    machine, and at most `max_inflight_model_calls` model requests are in flight across
+    every task. Tasks are only started once a VM slot is free, so very long task lists
+    don't create a coroutine per task up front.
+    """
+
+    def __init__(
+        self,
+        tasks: Iterable[Task],
+        graph: Runnable,
+        max_vms: int,
+        max_inflight_model_calls: Optional[int],
+        config: Optional[RunnableConfig],
+        task_configurable: Optional[TaskConfigurable] = None,
+    ):
+        if max_vms < 1:
+            raise ValueError("max_vms must be greater than or equal to 1")
+        if max_inflight_model_calls is not None and max_inflight_model_calls < 1:
+            raise ValueError("max_inflight_model_calls must be greater than or equal to 1")
+        self._tasks = tasks
+        self._graph = graph
+        self._max_vms = max_vms
+        self._max_inflight_model_calls = max_inflight_model_calls
+        self._config = config or {}
+        self._task_configurable = task_configurable
+        self._stats = RunStats()
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        self._producer: Optional[asyncio.Task] = None
+        self._iterating = False
+
+    @property
+    def stats(self) -> RunStats:
+        """
+        A snapshot of the run's throughput and latency.
+        """
+        if self._started is not None:
+            self._stats.elapsed_seconds = (self._finished or time.monotonic()) - self._started
+        return RunStats(
+            self._stats.completed,
+            self._stats.failed,
+            self._stats.cancelled,
+            self._stats.elapsed_seconds,
+            list(self._stats.latencies),
+        )
+
+    def cancel(self) -> None:
+        """
+        Cancels the run. Running tasks are cancelled, tasks which haven't started are
+        never started, and iteration ends once the running tasks have stopped.
+        """
+        if self._producer is not None:
+            self._producer.cancel()
+        for task in list(self._running.values()):
+            task.cancel()
+
+    def _task_config(self, model_semaphore: Optional[asyncio.Semaphore]) -> RunnableConfig:
+        # Configurable fields passed at run time replace those bound to the graph (e.g. by
+        # `create_cua`), rather than being merged with them, so merge them here.
+        graph_config = getattr(self._graph, "config", None) or {}
+        configurable = {
+            **graph_config.get("configurable", {}),
+            **self._config.get("configurable", {}),
+        }
+        if model_semaphore is not None:
+            configurable["model_call_semaphore"] = model_semaphore
+        return {**self._config, "configurable": configurable}
+
+    async def _run_task(
+        self, index: int, task: Task, queued_seconds: float, config: RunnableConfig
+    ) -> TaskResult:
+        started = time.monotonic()
+        graph_input = {"messages": [HumanMessage(content=task)]} if isinstance(task, str) else task
+        configurable = dict(config["configurable"])
+        if self._task_configurable is not None:
+            configurable.update(self._task_configurable(index, task))
+        # A VM slot bounds the instances which exist, not just the tasks running, so a
+        # task's instance is stopped when it ends rather than kept for a next turn.
+        if configurable.get("vm_end_policy", "keep") == "keep":
+            configurable["vm_end_policy"] = "stop"
+        config = {**config, "configurable": configurable}
+        # The last state the thread reached, to stop its instance if the task fails.
+        state: Optional[Dict[str, Any]] = None
+        error: Optional[BaseException] = None
+        try:
+            async for values in self._graph.astream(graph_input, config, stream_mode="values"):
+                state = values
+        except asyncio.CancelledError:
+            await self._stop_instance(state, config)
+            raise
+        except Exception as e:
+            await self._stop_instance(state, config)
+            error = e
+            state = None
+        return TaskResult(index, task, state, error, queued_seconds, time.monotonic() - started)
+
+    async def _stop_instance(self, state: Optional[Dict[str, Any]], config: RunnableConfig) -> None:
+        instance_id = (state or {}).get("instance_id")
+        if not instance_id:
+            return
+        instance_tracker.forget(instance_id)
+        backend = get_computer_backend(get_configuration_with_defaults(config))
+        await asyncio.to_thread(stop_instance_quietly, backend, instance_id)
+
+    async def _produce(
+        self,
+        results: "asyncio.Queue[Optional[TaskResult]]",
+        vm_slots: asyncio.Semaphore,
+        config: RunnableConfig,
+    ) -> None:
+        def on_done(index: int, task: asyncio.Task) -> None:
+            self._running.pop(index, None)
+            vm_slots.release()
+            if task.cancelled():
+                self._stats.cancelled += 1
+                return
+            result = task.result()
+            if result.error is None:
+                self._stats.completed += 1
+            else:
+                self._stats.failed += 1
+            self._stats.latencies.append(result.latency_seconds)
+            results.put_nowait(result)
+
+        try:
+            for index, task in enumerate(self._tasks):
+                queued = time.monotonic()
+                await vm_slots.acquire()
+                running = asyncio.ensure_future(
+                    self._run_task(index, task, time.monotonic() - queued, config)
+                )
+                self._running[index] = running
+                running.add_done_callback(lambda done, index=index: on_done(index, done))
+        finally:
+            # Wait for the running tasks to finish, cancelling them if the run is cancelled.
+            while self._running:
+                try:
+                    await asyncio.gather(*self._running.values(), return_exceptions=True)
+                except asyncio.CancelledError:
+                    for running in self._running.values():
+                        running.cancel()
+            results.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[TaskResult]:
+        if self._iterating:
+            raise RuntimeError("A TaskRunner can only be iterated once.")
+        self._iterating = True
+        self._started = time.monotonic()
+        results: "asyncio.Queue[Optional[TaskResult]]" = asyncio.Queue()
+        model_semaphore = (
+            asyncio.Semaphore(self._max_inflight_model_calls)
+            if self._max_inflight_model_calls is not None
+            else None
+        )
+        self._producer = asyncio.ensure_future(
+            self._produce(
+                results, asyncio.Semaphore(self._max_vms), self._task_config(model_semaphore)
+            )
+        )
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+        finally:
+            # Closing the iterator before the run has finished cancels the rest of the run.
+            if not self._producer.done():
+                self.cancel()
+                await asyncio.gather(self._producer, return_exceptions=True)
+            self._finished = time.monotonic()
+
+
+def run_many(
+    tasks: Iterable[Task],
+    graph: Optional[Runnable] = None,
+    *,
+    max_vms: int = 10,
+    max_inflight_model_calls: Optional[int] = None,
+    config: Optional[RunnableConfig] = None,
+    task_configurable: Optional[TaskConfigurable] = None,
+) -> TaskRunner:
+    """
+    Runs many independent tasks concurrently, each in its own thread of the graph, with
+    bounded VM and model concurrency.
+
+    ```python
+    runner = run_many(tasks, create_cua(), max_vms=20, max_inflight_model_calls=10)
+    async for result in runner:
+        ...
+    print(runner.stats.throughput, runner.stats.p95_latency_seconds)
+    ```
+
+    Args:
+        tasks: The tasks to run. Each is either the text of the first user message, or an
+            input state for the graph.
+        graph: The graph to run each task with, e.g. one returned by `create_cua`.
+            Defaults to the default graph.
+        max_vms: The maximum number of tasks running at once, since each holds a virtual
+            machine. Default is 10. Each task's instance is stopped when the task ends, or
+            returned to the `vm_pool` with the "return_to_pool" `vm_end_policy`, so at most
+            `max_vms` instances are running at once.
+        max_inflight_model_calls: The maximum number of model requests in flight across
+            every task. Default is None, which only bounds them by `max_vms`.
+        config: The configuration to run each task with.
+        task_configurable: A function of each task's index and the task, which returns
+            configurable fields to run the task with, on top of those in `config`.
+
+    Returns:
+        A runner, to iterate over for each task's result as it finishes.
+    """
+    if graph is None:
+        from .graph import graph as default_graph
+
+        graph = default_graph
+    return TaskRunner(tasks, graph, max_vms, max_inflight_model_calls, config, task_configurable)
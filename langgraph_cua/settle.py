@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import time
+from typing import Any, Dict, FrozenSet, Literal, NamedTuple, Optional
+
+from scrapybara.types import ComputerResponse
+
+from .images import fingerprint_screenshot, hamming_distance
+
+WaitMode = Literal["fixed", "adaptive"]
+
+# The maximum number of differing bits for two consecutive screenshots to count as unchanged.
+STABLE_HASH_TOLERANCE = 2
+
+
+class WaitSettings(NamedTuple):
+    """
+    How to wait for the screen to settle, built from the graph configuration.
+    """
+
+    mode: WaitMode  # "fixed" sleeps for the "wait" action, "adaptive" polls until the screen is stable
+    timeout_seconds: float  # The longest to wait for the screen to settle
+    poll_interval_seconds: float  # The delay between screenshots while waiting
+    stable_polls: int  # The number of consecutive unchanged screenshots which count as stable
+    settle_after_actions: FrozenSet[str]  # Action types to wait for the screen to settle after
+
+    @classmethod
+    def from_configuration(cls, configuration: Dict[str, Any]) -> "WaitSettings":
+        return cls(
+            configuration.get("wait_mode"),
+            configuration.get("wait_timeout_seconds"),
+            configuration.get("wait_poll_interval_seconds"),
+            configuration.get("wait_stable_polls"),
+            frozenset(configuration.get("settle_after_actions") or ()),
+        )
+
+
+class WaitResult(NamedTuple):
+    """
+    The outcome of waiting for the screen to settle.
+    """
+
+    response: ComputerResponse  # The response holding the last screenshot taken
+    waited_seconds: float  # The time spent waiting, including taking screenshots
+    polls: int  # The number of screenshots taken
+    stable: bool  # False if the timeout was hit before the screen settled
+
+
+class _StabilityTracker:
+    def __init__(self, settings: WaitSettings):
+        self.settings = settings
+        self.previous: Optional[str] = None
+        self.unchanged = 0
+
+    def observe(self, response: ComputerResponse) -> None:
+        current = fingerprint_screenshot(base64.b64decode(response.base_64_image))
+        if (
+            self.previous is not None
+            and hamming_distance(self.previous, current) <= STABLE_HASH_TOLERANCE
+        ):
+            self.unchanged += 1
+        else:
+            self.unchanged = 0
+        self.previous = current
+
+    @property
+    def stable(self) -> bool:
+        return self.previous is not None and self.unchanged >= self.settings.stable_polls
+
+
+def wait_for_stable_screen(
+    instance: Any,
+    settings: WaitSettings,
+    response: Optional[ComputerResponse] = None,
+) -> WaitResult:
+    """
+    Takes screenshots every `poll_interval_seconds` until `stable_polls` consecutive
+    screenshots are unchanged, or `timeout_seconds` have passed.
+
+    Args:
+        instance: The instance to take screenshots of.
+        settings: How to wait for the screen to settle.
+        response: The response of an action which was just taken, if any. Its screenshot
+            is used as the first poll.
+
+    Returns:
+        The last screenshot taken, and how long it took to settle.
+    """
+    started = time.monotonic()
+    tracker = _StabilityTracker(settings)
+    polls = 0
+    if response is not None:
+        tracker.observe(response)
+
+    while not tracker.stable:
+        elapsed = time.monotonic() - started
+        if response is not None and elapsed >= settings.timeout_seconds:
+            break
+        if response is not None:
+            time.sleep(min(settings.poll_interval_seconds, settings.timeout_seconds - elapsed))
+        response = instance.computer(action="take_screenshot")
+        polls += 1
+        tracker.observe(response)
+
+    return WaitResult(response, time.monotonic() - started, polls, tracker.stable)
+
+
+async def await_stable_screen(
+    instance: Any,
+    settings: WaitSettings,
+    response: Optional[ComputerResponse] = None,
+    call_timeout: Optional[float] = None,
+) -> WaitResult:
+    """
+    Async version of `wait_for_stable_screen`. Screenshots are fingerprinted on a
+    worker thread, and `call_timeout` applies to each screenshot separately.
+    """
+    started = time.monotonic()
+    tracker = _StabilityTracker(settings)
+    polls = 0
+    if response is not None:
+        await asyncio.to_thread(tracker.observe, response)
+
+    while not tracker.stable:
+        elapsed = time.monotonic() - started
+        if response is not None and elapsed >= settings.timeout_seconds:
+            break
+        if response is not None:
+            await asyncio.sleep(
+                min(settings.poll_interval_seconds, settings.timeout_seconds - elapsed)
+            )
+        response = await asyncio.wait_for(instance.computer(action="take_screenshot"), call_timeout)
+        polls += 1
+        await asyncio.to_thread(tracker.observe, response)
+
+    return WaitResult(response, time.monotonic() - started, polls, tracker.stable)
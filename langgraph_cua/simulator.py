@@ -0,0 +1,398 @@
+import asyncio
+import base64
+import itertools
+import random
+import struct
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from scrapybara.core.api_error import ApiError
+from scrapybara.types import ComputerResponse, InstanceGetStreamUrlResponse
+
+from .backends.base import ComputerBackend
+
+# Actions which change what's on the simulated screen. Every other action leaves it as-is.
+SCREEN_CHANGING_ACTIONS = frozenset(
+    ["click_mouse", "drag_mouse", "scroll", "type_text", "press_key"]
+)
+
+# The number of blocks the synthetic screenshots are divided into, across and down.
+SCREEN_BLOCKS = (16, 12)
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    )
+
+
+@lru_cache(maxsize=64)
+def render_screenshot(width: int, height: int, screen: int) -> str:
+    """
+    Renders a synthetic grayscale screenshot, made of blocks whose shades are derived
+    from `screen`. The same screen always renders to the same image, and different
+    screens render to images with different perceptual hashes.
+
+    Args:
+        width: The width of the screenshot, in pixels.
+        height: The height of the screenshot, in pixels.
+        screen: The number of the screen to render.
+
+    Returns:
+        The base64 encoded PNG image.
+    """
+    rng = random.Random(screen)
+    columns, rows = SCREEN_BLOCKS
+    block_width, block_height = width // columns, height // rows
+    scanlines = []
+    for row in range(rows):
+        shades = [rng.randrange(256) for _ in range(columns)]
+        line = b"".join(bytes([shade]) * block_width for shade in shades)
+        # The last block absorbs the remainder of the width.
+        line = b"\x00" + line + bytes([shades[-1]]) * (width - len(line))
+        lines = height - block_height * row if row == rows - 1 else block_height
+        scanlines.append(line * lines)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(b"".join(scanlines), 1))
+        + _png_chunk(b"IEND", b"")
+    )
+    return base64.b64encode(png).decode("ascii")
+
+
+class SimulatedInstance:
+    """
+    A simulated Scrapybara instance. Implements the parts of the instance API used by the
+    graph: `computer`, `get_stream_url`, `authenticate` and `stop`.
+    """
+
+    def __init__(self, simulator: "SimulatedScrapybara", id: str, instance_type: str):
+        self._simulator = simulator
+        self.id = id
+        self.instance_type = instance_type
+        self.status = "running"
+        self.screen = 0
+        self.calls: List[Dict[str, Any]] = []
+        self.auth_state_id: Optional[str] = None
+
+    def _computer(self, kwargs: Dict[str, Any]) -> ComputerResponse:
+        self._simulator._maybe_fail(self)
+        self.calls.append(kwargs)
+        if kwargs.get("action") in SCREEN_CHANGING_ACTIONS:
+            self.screen += 1
+        if kwargs.get("screenshot") is False:
+            return ComputerResponse(output=None, error=None, base_64_image=None)
+        image = render_screenshot(self._simulator.width, self._simulator.height, self.screen)
+        return ComputerResponse(output=None, error=None, base_64_image=image)
+
+    def computer(self, **kwargs: Any) -> ComputerResponse:
+        time.sleep(self._simulator._latency())
+        return self._computer(kwargs)
+
+    def get_stream_url(self) -> InstanceGetStreamUrlResponse:
+        return InstanceGetStreamUrlResponse(stream_url=f"https://stream.simulator/{self.id}")
+
+    def authenticate(self, *, auth_state_id: str) -> None:
+        time.sleep(self._simulator._latency())
+        self.auth_state_id = auth_state_id
+
+    def stop(self) -> None:
+        self.status = "terminated"
+
+
+class AsyncSimulatedInstance:
+    """
+    Async view of a `SimulatedInstance`, mirroring Scrapybara's async instances.
+    """
+
+    def __init__(self, instance: SimulatedInstance):
+        self._instance = instance
+        self.id = instance.id
+        self.instance_type = instance.instance_type
+
+    @property
+    def status(self) -> str:
+        return self._instance.status
+
+    async def computer(self, **kwargs: Any) -> ComputerResponse:
+        await asyncio.sleep(self._instance._simulator._latency())
+        return self._instance._computer(kwargs)
+
+    async def get_stream_url(self) -> InstanceGetStreamUrlResponse:
+        return self._instance.get_stream_url()
+
+    async def authenticate(self, *, auth_state_id: str) -> None:
+        await asyncio.sleep(self._instance._simulator._latency())
+        self._instance.auth_state_id = auth_state_id
+
+    async def stop(self) -> None:
+        self._instance.stop()
+
+
+class SimulatedScrapybara:
+    """
+    A local stand-in for the Scrapybara client, whose instances render synthetic
+    screenshots. Used to measure the overhead of the graph itself, without network access.
+
+    Every call to an instance sleeps for `latency_seconds`, plus up to `jitter_seconds`,
+    and raises an `ApiError` with probability `failure_rate`.
+    """
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        jitter_seconds: float = 0.0,
+        failure_rate: float = 0.0,
+        width: int = 1024,
+        height: int = 768,
+        seed: Optional[int] = None,
+    ):
+        if not 0 <= failure_rate <= 1:
+            raise ValueError("failure_rate must be between 0 and 1.")
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.failure_rate = failure_rate
+        self.width = width
+        self.height = height
+        self.failures = 0
+        self.instances: Dict[str, SimulatedInstance] = {}
+        self._random = random.Random(seed)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _latency(self) -> float:
+        if not self.jitter_seconds:
+            return self.latency_seconds
+        with self._lock:
+            return self.latency_seconds + self._random.uniform(0, self.jitter_seconds)
+
+    def _maybe_fail(self, instance: SimulatedInstance) -> None:
+        if instance.status != "running":
+            raise ApiError(status_code=409, body=f"Instance {instance.id} is not running")
+        if not self.failure_rate:
+            return
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        if failed:
+            raise ApiError(status_code=500, body="Simulated failure")
+
+    def _start(self, instance_type: str) -> SimulatedInstance:
+        with self._lock:
+            instance = SimulatedInstance(self, f"{instance_type}-{next(self._ids)}", instance_type)
+            self.instances[instance.id] = instance
+        return instance
+
+    def start_browser(self, **kwargs: Any) -> SimulatedInstance:
+        time.sleep(self._latency())
+        return self._start("browser")
+
+    def start_ubuntu(self, **kwargs: Any) -> SimulatedInstance:
+        time.sleep(self._latency())
+        return self._start("ubuntu")
+
+    def start_windows(self, **kwargs: Any) -> SimulatedInstance:
+        time.sleep(self._latency())
+        return self._start("windows")
+
+    def get(self, instance_id: str) -> SimulatedInstance:
+        instance = self.instances.get(instance_id)
+        if instance is None:
+            raise ApiError(status_code=404, body=f"Instance {instance_id} not found")
+        return instance
+
+
+class AsyncSimulatedScrapybara:
+    """
+    Async view of a `SimulatedScrapybara`, sharing its instances.
+    """
+
+    def __init__(self, simulator: SimulatedScrapybara):
+        self._simulator = simulator
+
+    async def _start(self, instance_type: str) -> AsyncSimulatedInstance:
+        await asyncio.sleep(self._simulator._latency())
+        return AsyncSimulatedInstance(self._simulator._start(instance_type))
+
+    async def start_browser(self, **kwargs: Any) -> AsyncSimulatedInstance:
+        return await self._start("browser")
+
+    async def start_ubuntu(self, **kwargs: Any) -> AsyncSimulatedInstance:
+        return await self._start("ubuntu")
+
+    async def start_windows(self, **kwargs: Any) -> AsyncSimulatedInstance:
+        return await self._start("windows")
+
+    async def get(self, instance_id: str) -> AsyncSimulatedInstance:
+        return AsyncSimulatedInstance(self._simulator.get(instance_id))
+
+
+class SimulatedBackend(ComputerBackend):
+    """
+    A computer backend whose instances are simulated by a `SimulatedScrapybara`, to run
+    the graph offline, e.g. `create_cua(computer_backend=SimulatedBackend())`.
+    """
+
+    supports_auth_states = True
+
+    def __init__(self, simulator: Optional[SimulatedScrapybara] = None):
+        self.simulator = simulator or SimulatedScrapybara()
+        self._async_simulator = AsyncSimulatedScrapybara(self.simulator)
+
+    @property
+    def display_size(self) -> Tuple[int, int]:
+        return self.simulator.width, self.simulator.height
+
+    def start(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> SimulatedInstance:
+        time.sleep(self.simulator._latency())
+        return self.simulator._start("browser" if environment == "web" else environment)
+
+    def get(self, instance_id: str) -> SimulatedInstance:
+        return self.simulator.get(instance_id)
+
+    async def astart(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> AsyncSimulatedInstance:
+        return await self._async_simulator._start(
+            "browser" if environment == "web" else environment
+        )
+
+    async def aget(self, instance_id: str) -> AsyncSimulatedInstance:
+        return await self._async_simulator.get(instance_id)
+
+
+def computer_call_message(
+    response_id: str, actions: Sequence[Dict[str, Any]], content: Union[str, List[Any]] = ""
+) -> AIMessage:
+    """
+    Builds a model response holding a computer call for each action, in the format
+    returned by `ChatOpenAI` for the Responses API.
+
+    Args:
+        response_id: The ID of the response.
+        actions: The actions to call.
+        content: The content of the message.
+
+    Returns:
+        The model response.
+    """
+    return AIMessage(
+        content=content,
+        response_metadata={"id": response_id},
+        additional_kwargs={
+            "tool_outputs": [
+                {
+                    "type": "computer_call",
+                    "id": f"cu_{response_id}_{index}",
+                    "call_id": f"call_{response_id}_{index}",
+                    "action": action,
+                    "pending_safety_checks": [],
+                    "status": "completed",
+                }
+                for index, action in enumerate(actions)
+            ]
+        },
+    )
+
+
+def _default_action(step: int) -> Dict[str, Any]:
+    if step % 2:
+        return {"type": "type", "text": f"step {step}"}
+    return {"type": "click", "button": "left", "x": 10 + step % 500, "y": 10 + step % 300}
+
+
+class ScriptedModel:
+    """
+    A stand-in for `ChatOpenAI`, which replies to each request of a thread with the next
+    response of a script, after `latency_seconds`. By default, each thread clicks or types
+    for `steps` responses, then replies with a final message.
+
+    Instances are callable with the `ChatOpenAI` constructor's arguments and return
+    themselves, so the model can be swapped in for the `ChatOpenAI` class.
+    """
+
+    def __init__(
+        self,
+        steps: int = 10,
+        script: Optional[Callable[[int], AIMessage]] = None,
+        latency_seconds: float = 0.0,
+    ):
+        self.steps = steps
+        self.script = script
+        self.latency_seconds = latency_seconds
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs: Any) -> "ScriptedModel":
+        return self
+
+    def bind_tools(self, tools: List[Any], **kwargs: Any) -> "ScriptedModel":
+        return self
+
+    def _step(self, messages: Sequence[BaseMessage]) -> int:
+        # Threads are independent, so the step is the number of computer call outputs sent
+        # in this thread so far. In non-ZDR mode only the outputs of the last step are sent,
+        # so the step is carried in the previous response ID instead.
+        # The system prompt may be a dict rather than a message.
+        return sum(1 for message in messages if getattr(message, "type", None) == "tool")
+
+    def _respond(
+        self, messages: Sequence[BaseMessage], previous_response_id: Optional[str]
+    ) -> AIMessage:
+        with self._lock:
+            self.requests += 1
+        step = self._step(messages)
+        if previous_response_id:
+            step = int(previous_response_id.rsplit("_", 1)[-1]) + 1
+        response_id = f"resp_{step}"
+        if self.script is not None:
+            return self.script(step)
+        if step >= self.steps:
+            return AIMessage(content="Done.", response_metadata={"id": response_id})
+        return computer_call_message(response_id, [_default_action(step)])
+
+    def invoke(
+        self,
+        messages: Sequence[BaseMessage],
+        previous_response_id: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AIMessage:
+        time.sleep(self.latency_seconds)
+        return self._respond(messages, previous_response_id)
+
+    async def ainvoke(
+        self,
+        messages: Sequence[BaseMessage],
+        previous_response_id: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AIMessage:
+        await asyncio.sleep(self.latency_seconds)
+        return self._respond(messages, previous_response_id)
+
+    async def astream(
+        self,
+        messages: Sequence[BaseMessage],
+        previous_response_id: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Any:
+        response = await self.ainvoke(messages, previous_response_id)
+        yield AIMessageChunk(**response.model_dump(exclude={"type"}))
@@ -0,0 +1,195 @@
+import json
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+
+from .blobs import read_image_url
+from .history import get_screenshot_url
+from .images import fingerprint_screenshot, hamming_distance
+from .types import CUAState, get_configuration_with_defaults
+from .utils import get_stream_writer_from_config
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of differing bits for two screenshots to count as the same screen.
+# Leaves room for small changes such as a blinking cursor or a clock ticking over.
+STALL_HASH_TOLERANCE = 10
+# Each step is remembered for this many multiples of the stall threshold.
+STALL_WINDOW_MULTIPLIER = 4
+# Each model call costs this many graph steps: call_model, take_computer_action, detect_stall.
+STEPS_PER_MODEL_CALL = 3
+
+STALL_HINT = (
+    "You have repeated the same action {repeats} times, and the screen has not changed. "
+    "That approach is not working. Try something different, such as another element, "
+    "a keyboard shortcut, or navigating another way."
+)
+
+
+@dataclass
+class StallMetrics:
+    """
+    Counters describing how often runs stalled, across every thread in the process.
+    """
+
+    checks: int = 0  # Steps inspected by the detector
+    detections: int = 0  # Steps where a stall was detected
+    hints_injected: int = 0  # Stalls answered with a corrective hint
+    runs_ended: int = 0  # Stalls which ended the run
+    model_calls_saved: int = 0  # Upper bound on model calls avoided by ending runs early
+    fingerprint_failures: int = 0  # Steps skipped because their screenshot couldn't be read
+
+
+_metrics = StallMetrics()
+_metrics_lock = threading.Lock()
+
+
+def get_stall_metrics() -> StallMetrics:
+    """
+    Returns a snapshot of the stall detector's counters.
+    """
+    with _metrics_lock:
+        return replace(_metrics)
+
+
+def reset_stall_metrics() -> None:
+    """
+    Resets the stall detector's counters to zero.
+    """
+    global _metrics
+    with _metrics_lock:
+        _metrics = StallMetrics()
+
+
+def _record(**increments: int) -> None:
+    with _metrics_lock:
+        for name, value in increments.items():
+            setattr(_metrics, name, getattr(_metrics, name) + value)
+
+
+def _get_last_step(messages: List[Any]) -> Optional[tuple]:
+    """
+    Returns the (AI message, latest computer call output) pair for the last step,
+    or None if the last step did not produce a screenshot.
+    """
+    if not messages or getattr(messages[-1], "type", None) != "tool":
+        return None
+    for message in reversed(messages):
+        if getattr(message, "type", None) == "ai":
+            return message, messages[-1]
+    return None
+
+
+def get_action_signature(message: Any) -> str:
+    """
+    Returns a canonical signature of the computer actions in an AI message. Two
+    steps which performed the same actions have the same signature.
+    """
+    tool_outputs = message.additional_kwargs.get("tool_outputs") or []
+    actions = [
+        output.get("action")
+        for output in tool_outputs
+        if isinstance(output, dict) and output.get("type") == "computer_call"
+    ]
+    return json.dumps(actions, sort_keys=True)
+
+
+def _count_repeats(window: List[Dict[str, str]], step: Dict[str, str]) -> int:
+    return sum(
+        1
+        for previous in window
+        if previous["action"] == step["action"]
+        and hamming_distance(previous["screen"], step["screen"]) <= STALL_HASH_TOLERANCE
+    )
+
+
+def _model_calls_left(config: RunnableConfig) -> int:
+    recursion_limit = config.get("recursion_limit")
+    step = config.get("metadata", {}).get("langgraph_step")
+    if recursion_limit is None or step is None:
+        return 0
+    return max(recursion_limit - step, 0) // STEPS_PER_MODEL_CALL
+
+
+def reset_stall(state: CUAState) -> Dict[str, Any]:
+    """
+    Clears the steps recorded by the stall detector, and the hints it sent, when a new run
+    of the thread starts, so the run is neither flagged by the previous task's steps, nor
+    denied hints because an earlier run used them up.
+    """
+    if (
+        not state.get("step_fingerprints")
+        and not state.get("stall_hints")
+        and not state.get("stall")
+    ):
+        return {}
+    return {"step_fingerprints": [], "stall_hints": 0, "stall": None}
+
+
+def detect_stall(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Detects when the agent is stuck, repeating the same action while the screen
+    does not change. Each step is recorded as an (action, screen fingerprint) pair,
+    and once the same pair has been seen `stall_threshold` times, the agent is sent
+    a corrective hint, or the run is ended with the reason stored under `stall`.
+
+    Args:
+        state: The current state of the thread.
+        config: The runnable configuration.
+
+    Returns:
+        The updated state.
+    """
+    configuration = get_configuration_with_defaults(config)
+    threshold = configuration.get("stall_threshold")
+    if threshold is None:
+        return {"stall": None}
+
+    last_step = _get_last_step(state.get("messages", []))
+    if last_step is None:
+        return {"stall": None}
+    ai_message, tool_message = last_step
+
+    try:
+        image = read_image_url(get_screenshot_url(tool_message), configuration.get("blob_store"))
+        screen = fingerprint_screenshot(bytes(image))
+    except (KeyError, TypeError, ValueError, OSError):
+        _record(fingerprint_failures=1)
+        logger.warning("Failed to fingerprint screenshot, skipping stall detection", exc_info=True)
+        return {"stall": None}
+
+    step = {"action": get_action_signature(ai_message), "screen": screen}
+    window = [*(state.get("step_fingerprints") or []), step][-threshold * STALL_WINDOW_MULTIPLIER :]
+    repeats = _count_repeats(window, step)
+    _record(checks=1)
+
+    if repeats < threshold:
+        return {"step_fingerprints": window, "stall": None}
+
+    hints = state.get("stall_hints") or 0
+    writer = get_stream_writer_from_config(config)
+    if configuration.get("stall_action") == "hint" and hints < configuration.get("stall_max_hints"):
+        _record(detections=1, hints_injected=1)
+        writer({"stall": {"action": "hint", "repeats": repeats}})
+        return {
+            "messages": HumanMessage(content=STALL_HINT.format(repeats=repeats)),
+            # Start over, so the agent gets `stall_threshold` steps to act on the hint.
+            "step_fingerprints": [],
+            "stall_hints": hints + 1,
+            "stall": None,
+        }
+
+    stall = {
+        "reason": "repeated_action",
+        "repeats": repeats,
+        "actions": json.loads(step["action"]),
+        "screen_fingerprint": screen,
+        "hints": hints,
+    }
+    _record(detections=1, runs_ended=1, model_calls_saved=_model_calls_left(config))
+    writer({"stall": {"action": "end", **stall}})
+    return {"step_fingerprints": window, "stall": stall}
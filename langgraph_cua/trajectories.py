@@ -0,0 +1,435 @@
+import asyncio
+import hashlib
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+
+from .blobs import BlobStore, read_image_url
+from .history import SCREENSHOT_PLACEHOLDER_URL, get_screenshot_url
+from .images import fingerprint_screenshot, hamming_distance
+from .nodes.create_vm_instance import acreate_vm_instance, create_vm_instance
+from .nodes.take_computer_action import atake_computer_action, take_computer_action
+from .types import CUAState, get_configuration_with_defaults
+
+# A recorded step is {"screen": <fingerprint of the screen before the step, or None>, "actions": [...]}.
+# The first step of a run has no screen, since the model picks it from the task alone.
+Trajectory = List[Dict[str, Any]]
+
+# Returns whether a run should be recorded, given its final state.
+RecordCriterion = Callable[[Dict[str, Any]], bool]
+
+# The maximum number of differing bits for an observed screen to match a recorded one.
+TRAJECTORY_HASH_TOLERANCE = 10
+
+REPLAY_MESSAGE = (
+    "The following actions were already taken for this task, and the current screen "
+    "is attached. Continue the task from here.\n{actions}"
+)
+
+
+class TrajectoryStore(ABC):
+    """
+    Storage for recorded trajectories, keyed by task.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Trajectory]:
+        """
+        Reads a trajectory.
+
+        Args:
+            key: The task key.
+
+        Returns:
+            The recorded trajectory, or None if there isn't one.
+        """
+
+    @abstractmethod
+    def put(self, key: str, trajectory: Trajectory) -> None:
+        """
+        Stores a trajectory, replacing any trajectory already stored for the key.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Deletes a trajectory, if it exists.
+        """
+
+
+class InMemoryTrajectoryStore(TrajectoryStore):
+    """
+    A trajectory store which keeps trajectories in a dictionary. Trajectories are lost
+    when the process exits.
+    """
+
+    def __init__(self):
+        self._trajectories: Dict[str, Trajectory] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Trajectory]:
+        with self._lock:
+            return self._trajectories.get(key)
+
+    def put(self, key: str, trajectory: Trajectory) -> None:
+        with self._lock:
+            self._trajectories[key] = trajectory
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._trajectories.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._trajectories)
+
+
+@dataclass
+class TrajectoryCacheStats:
+    """
+    Counters describing how the trajectory cache has been used.
+    """
+
+    hits: int = 0  # Runs which replayed at least one recorded step
+    misses: int = 0  # Runs with no recorded trajectory for their task
+    steps_replayed: int = 0  # Steps executed without calling the model
+    mismatches: int = 0  # Replays which fell back to the model before the end of the trajectory
+    recorded: int = 0  # Trajectories recorded from completed runs
+    evictions: int = 0  # Trajectories evicted to stay within `max_entries`
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TrajectoryCache:
+    """
+    Records the actions taken by completed runs, and replays them for later runs of
+    the same task without calling the model. Each recorded step is replayed only
+    while the observed screen keeps matching the screen it was recorded on, and the
+    model takes over from the first mismatch.
+
+    At most `max_entries` trajectories are kept, evicting the least recently used.
+    Trajectories are stored in `store`, which defaults to an `InMemoryTrajectoryStore`.
+
+    A run which the model finished is only recorded if `record_if`, given the run's final
+    state, returns True. Finishing doesn't mean the task succeeded, since the model may have
+    given up or answered wrongly, so pass a check of the outcome. Without `record_if`, every
+    finished run is recorded.
+    """
+
+    def __init__(
+        self,
+        store: Optional[TrajectoryStore] = None,
+        max_entries: int = 1000,
+        record_if: Optional[RecordCriterion] = None,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be greater than or equal to 1")
+        self.store = store if store is not None else InMemoryTrajectoryStore()
+        self.max_entries = max_entries
+        self.record_if = record_if
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+        self._stats = TrajectoryCacheStats()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> TrajectoryCacheStats:
+        """A snapshot of the cache's counters."""
+        with self._lock:
+            return replace(self._stats)
+
+    def lookup(self, key: str) -> Optional[Trajectory]:
+        """
+        Returns the trajectory recorded for a task, or None if there isn't one.
+        """
+        trajectory = self.store.get(key)
+        with self._lock:
+            if trajectory:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            else:
+                self._stats.misses += 1
+        return trajectory or None
+
+    def record(self, key: str, trajectory: Trajectory) -> None:
+        """
+        Records the trajectory of a completed run, evicting the least recently used
+        trajectory if the cache is full.
+        """
+        evicted: List[str] = []
+        with self._lock:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_entries:
+                evicted.append(self._keys.popitem(last=False)[0])
+            self._stats.recorded += 1
+            self._stats.evictions += len(evicted)
+        self.store.put(key, trajectory)
+        for evicted_key in evicted:
+            self.store.delete(evicted_key)
+
+    def _record_replay(self, steps_replayed: int, complete: bool) -> None:
+        with self._lock:
+            if steps_replayed:
+                self._stats.hits += 1
+                self._stats.steps_replayed += steps_replayed
+            else:
+                self._stats.misses += 1
+            if not complete:
+                self._stats.mismatches += 1
+
+
+def _get_text(message: Any) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return " ".join(
+        block.get("text", "") if isinstance(block, dict) else str(block)
+        for block in message.content
+    )
+
+
+def get_task_key(messages: List[Any], configuration: Dict[str, Any]) -> Optional[str]:
+    """
+    Returns the key trajectories are recorded under for a thread: a digest of the
+    environment, the prompt and the first user message, and the model's display size
+    if it's set. Returns None if the thread has no user message.
+    """
+    task = next((m for m in messages if getattr(m, "type", None) == "human"), None)
+    if task is None:
+        return None
+    prompt = configuration.get("prompt")
+    if prompt is not None and not isinstance(prompt, str):
+        prompt = _get_text(prompt)
+    normalized = [
+        configuration.get("environment"),
+        " ".join((prompt or "").split()),
+        # Only whitespace is normalized, since the task's text may be typed as-is.
+        " ".join(_get_text(task).split()),
+    ]
+    # Recorded coordinates are in the model's view of the display.
+    if configuration.get("model_display_size") is not None:
+        normalized.append(list(configuration["model_display_size"]))
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+
+def _fingerprint_url(url: str, blob_store: Optional[BlobStore]) -> Optional[str]:
+    try:
+        return fingerprint_screenshot(bytes(read_image_url(url, blob_store)))
+    except (KeyError, ValueError, OSError):
+        return None
+
+
+def _get_computer_actions(message: Any) -> List[Dict[str, Any]]:
+    tool_outputs = message.additional_kwargs.get("tool_outputs") or []
+    return [
+        output.get("action")
+        for output in tool_outputs
+        if isinstance(output, dict) and output.get("type") == "computer_call"
+    ]
+
+
+def _get_replay_screenshot_url(message: Any) -> Optional[str]:
+    if not message.additional_kwargs.get("replayed_trajectory") or isinstance(message.content, str):
+        return None
+    for block in message.content:
+        if isinstance(block, dict) and block.get("type") == "input_image":
+            return block.get("image_url")
+    return None
+
+
+def extract_trajectory(state: CUAState, blob_store: Optional[BlobStore]) -> Trajectory:
+    """
+    Builds the trajectory of a run from its messages: every set of computer actions
+    the model took, along with the fingerprint of the screen it saw before taking them.
+    Steps replayed from the cache are included.
+    """
+    trajectory: Trajectory = list(state.get("replayed_steps") or [])
+    screen_url: Optional[str] = None
+    for message in state.get("messages", []):
+        message_type = getattr(message, "type", None)
+        if message_type == "tool":
+            url = get_screenshot_url(message)
+            if url is not None and url != SCREENSHOT_PLACEHOLDER_URL:
+                screen_url = url
+        elif message_type == "human":
+            screen_url = _get_replay_screenshot_url(message) or screen_url
+        elif message_type == "ai":
+            actions = _get_computer_actions(message)
+            if actions:
+                screen = _fingerprint_url(screen_url, blob_store) if screen_url else None
+                trajectory.append({"screen": screen, "actions": actions})
+    return trajectory
+
+
+def _screen_matches(recorded: Optional[str], observed: Optional[str]) -> bool:
+    if recorded is None:
+        return True
+    return (
+        observed is not None and hamming_distance(recorded, observed) <= TRAJECTORY_HASH_TOLERANCE
+    )
+
+
+def _make_computer_call_message(step: int, actions: List[Dict[str, Any]]) -> AIMessage:
+    return AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {
+                    "type": "computer_call",
+                    "id": f"replay_{step}_{index}",
+                    "call_id": f"replay_{step}_{index}",
+                    "action": action,
+                    "pending_safety_checks": [],
+                    "status": "completed",
+                }
+                for index, action in enumerate(actions)
+            ]
+        },
+    )
+
+
+def _should_replay(state: CUAState) -> bool:
+    # Only replay at the start of a task, before the model has responded.
+    messages = state.get("messages", [])
+    return bool(messages) and not any(getattr(m, "type", None) == "ai" for m in messages)
+
+
+def _make_replay_update(
+    replayed: Trajectory, image_url: Optional[str], updates: Dict[str, Any]
+) -> Dict[str, Any]:
+    if not replayed:
+        return updates
+    actions = "\n".join(json.dumps(step["actions"]) for step in replayed)
+    message = HumanMessage(
+        content=[
+            {"type": "input_text", "text": REPLAY_MESSAGE.format(actions=actions)},
+            {"type": "input_image", "image_url": image_url, "detail": "auto"},
+        ],
+        additional_kwargs={"replayed_trajectory": True},
+    )
+    return {**updates, "messages": message, "replayed_steps": replayed}
+
+
+def _get_replay_context(
+    state: CUAState, config: RunnableConfig
+) -> Optional[Tuple[TrajectoryCache, Trajectory, Optional[BlobStore]]]:
+    configuration = get_configuration_with_defaults(config)
+    cache: Optional[TrajectoryCache] = configuration.get("trajectory_cache")
+    if cache is None or not _should_replay(state):
+        return None
+    key = get_task_key(state.get("messages", []), configuration)
+    trajectory = cache.lookup(key) if key is not None else None
+    if trajectory is None:
+        return None
+    return cache, trajectory, configuration.get("blob_store")
+
+
+def replay_trajectory(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Replays the trajectory recorded for this task, if there is one, executing each
+    step directly on the virtual machine for as long as the screen matches the
+    recording. The model is then sent the replayed actions and the current screen.
+
+    Args:
+        state: The current state of the thread.
+        config: The runnable configuration.
+
+    Returns:
+        The updated state.
+    """
+    context = _get_replay_context(state, config)
+    if context is None:
+        return {}
+    cache, trajectory, blob_store = context
+
+    updates: Dict[str, Any] = create_vm_instance(state, config)
+    replayed: Trajectory = []
+    screen: Optional[str] = None
+    image_url: Optional[str] = None
+    for index, step in enumerate(trajectory):
+        if not _screen_matches(step["screen"], screen):
+            break
+        step_state = {
+            **state,
+            **updates,
+            "messages": [_make_computer_call_message(index, step["actions"])],
+        }
+        result = take_computer_action(step_state, config)
+        if not result.get("messages"):
+            break
+        updates.update({k: v for k, v in result.items() if k != "messages"})
+        image_url = result["messages"][-1]["content"][0]["image_url"]
+        screen = _fingerprint_url(image_url, blob_store)
+        replayed.append(step)
+
+    cache._record_replay(len(replayed), complete=len(replayed) == len(trajectory))
+    return _make_replay_update(replayed, image_url, updates)
+
+
+async def areplay_trajectory(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Async version of `replay_trajectory`.
+    """
+    context = _get_replay_context(state, config)
+    if context is None:
+        return {}
+    cache, trajectory, blob_store = context
+
+    updates: Dict[str, Any] = await acreate_vm_instance(state, config)
+    replayed: Trajectory = []
+    screen: Optional[str] = None
+    image_url: Optional[str] = None
+    for index, step in enumerate(trajectory):
+        if not _screen_matches(step["screen"], screen):
+            break
+        step_state = {
+            **state,
+            **updates,
+            "messages": [_make_computer_call_message(index, step["actions"])],
+        }
+        result = await atake_computer_action(step_state, config)
+        if not result.get("messages"):
+            break
+        updates.update({k: v for k, v in result.items() if k != "messages"})
+        image_url = result["messages"][-1]["content"][0]["image_url"]
+        screen = await asyncio.to_thread(_fingerprint_url, image_url, blob_store)
+        replayed.append(step)
+
+    cache._record_replay(len(replayed), complete=len(replayed) == len(trajectory))
+    return _make_replay_update(replayed, image_url, updates)
+
+
+def record_trajectory(state: CUAState, config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Records the trajectory of a run which the model completed, so it can be replayed
+    for later runs of the same task. Runs ended by the stall detector are not recorded,
+    nor runs which the cache's `record_if` rejects.
+
+    Args:
+        state: The current state of the thread.
+        config: The runnable configuration.
+
+    Returns:
+        An empty state update.
+    """
+    configuration = get_configuration_with_defaults(config)
+    cache: Optional[TrajectoryCache] = configuration.get("trajectory_cache")
+    if cache is None or state.get("stall"):
+        return {}
+    if cache.record_if is not None and not cache.record_if(state):
+        return {}
+    key = get_task_key(state.get("messages", []), configuration)
+    if key is None:
+        return {}
+    trajectory = extract_trajectory(state, configuration.get("blob_store"))
+    if trajectory:
+        cache.record(key, trajectory)
+    return {}
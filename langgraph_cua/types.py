@@ -1,10 +1,33 @@
+import asyncio
 import os
-from typing import Annotated, Any, Dict, List, Literal, Optional, TypedDict, Union
+from typing import (
+    TYPE_CHECKING,
+    Annotated,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    TypedDict,
+    Union,
+)
 
 from langchain_core.messages import AnyMessage, SystemMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import add_messages
 
+if TYPE_CHECKING:
+    from langgraph_cua.backends import ComputerBackend
+    from langgraph_cua.blobs import BlobStore
+    from langgraph_cua.cassettes import Cassette
+    from langgraph_cua.lifecycle import InstanceRegistry
+    from langgraph_cua.metrics import MetricsSink
+    from langgraph_cua.pool import VMPool
+    from langgraph_cua.ratelimit import RateLimit
+    from langgraph_cua.trajectories import TrajectoryCache
+
 
 class Output(TypedDict):
     """
@@ -52,12 +75,22 @@ class CUAState(TypedDict):
 
         stream_url: The URL to the live-stream of the virtual machine.
         authenticated_id: The ID of the auth state currently in use.
+        step_fingerprints: The (action, screen fingerprint) pairs of recent steps, used to detect stalls.
+        stall_hints: The number of corrective hints sent to the agent after it stalled.
+        stall: Why the run was ended early by the stall detector, if it was.
+        replayed_steps: The steps replayed from the trajectory cache at the start of the run.
+        fan_out_outcome: The outcome of exploring branches after the run stalled, if it did.
     """
 
     messages: Annotated[list[AnyMessage], add_messages] = []
     instance_id: Annotated[Optional[str], None] = None
     stream_url: Annotated[Optional[str], None] = None
     authenticated_id: Annotated[Optional[str], None] = None
+    step_fingerprints: Annotated[Optional[List[Dict[str, str]]], None] = None
+    stall_hints: Annotated[Optional[int], None] = None
+    stall: Annotated[Optional[Dict[str, Any]], None] = None
+    replayed_steps: Annotated[Optional[List[Dict[str, Any]]], None] = None
+    fan_out_outcome: Annotated[Optional[Dict[str, Any]], None] = None
 
 
 class CUAConfiguration(TypedDict):
@@ -77,6 +110,95 @@ class CUAConfiguration(TypedDict):
         environment: The environment to use. Default is "web".
         prompt: The initial prompt to use for the conversation. Will
             be passed as a system message
+        vm_pool: A pool of pre-booted instances. If defined, new threads lease an instance
+            from the pool instead of booting one.
+        action_timeout_seconds: The maximum number of seconds to wait for each call to the
+            virtual machine when the graph is run asynchronously. Default is None (no timeout).
+        screenshot_format: The format to re-encode screenshots to before they're stored in state
+            and sent to the model. One of "png", "jpeg" or "webp". Default is "png", which keeps
+            screenshots as-is. Other formats require Pillow.
+        screenshot_quality: The encoder quality used for "jpeg" and "webp" screenshots, from 1 to 100.
+            Default is 80.
+        blob_store: A content-addressed store for screenshots. If defined, screenshots are written
+            to the store, and messages only hold a reference to them. Images are read back from
+            the store when they're sent to the model.
+        keep_last_screenshots: When the full message history is sent to the model (e.g. with ZDR enabled),
+            the number of most recent screenshots to send. Older screenshots are replaced with a
+            placeholder image. Default is None, which sends every screenshot.
+        collapse_identical_screenshots: When the full message history is sent to the model, whether to
+            replace a screenshot with a placeholder if the following screenshot is identical. Default False.
+        stall_threshold: The number of times the agent can repeat the same action on an unchanged screen
+            before it's considered stalled. Default is None, which disables stall detection.
+        stall_action: What to do when the agent stalls. "hint" sends the agent a corrective hint, and
+            "end" ends the run. Default is "hint".
+        stall_max_hints: The number of hints to send before the run is ended. Default is 1.
+        trajectory_cache: A cache of the actions taken by completed runs. If defined, runs of a
+            task which has been completed before replay the recorded actions without calling the
+            model, for as long as the screen matches the recording.
+        wait_mode: How to handle the "wait" action. "adaptive" takes screenshots until the screen
+            stops changing, and "fixed" always sleeps for 2 seconds. Default is "adaptive".
+        wait_timeout_seconds: The longest to wait for the screen to stop changing. Default is 5.
+        wait_poll_interval_seconds: The delay between screenshots while waiting for the screen to
+            stop changing. Default is 0.25.
+        wait_stable_polls: The number of consecutive unchanged screenshots after which the screen
+            counts as settled. Default is 2.
+        settle_after_actions: Action types (e.g. "click", "type", "keypress") after which to wait for
+            the screen to stop changing, in "adaptive" wait mode. Default is None.
+        stream_model: Whether to stream the model's response. If True, each computer call starts
+            executing as soon as it has been received, while the rest of the response streams in.
+            Default False.
+        metrics_sink: A sink to record per-node timings, Scrapybara call timings, screenshot and
+            request sizes, token usage and action counts to. Default is None, which disables metrics
+            unless 'stream_metrics' is True.
+        stream_metrics: Whether to write the metrics recorded by each node to the custom stream,
+            under the "metrics" key. Default False.
+        model_call_semaphore: An asyncio semaphore which every model request is made under. Share
+            one between threads to bound the number of model requests in flight across them, as
+            `run_many` does. Default is None.
+        openai_rate_limit: The requests and tokens per minute allowed by the OpenAI API key. Model
+            requests wait for quota, shared by every thread in the process. Default is None (unlimited).
+        scrapybara_rate_limit: The requests per minute allowed by the Scrapybara API key. Every
+            Scrapybara call waits for quota, shared by every thread in the process. Default is None
+            (unlimited).
+        max_rate_limit_retries: The number of times to retry a call which was rate limited, after a
+            jittered exponential backoff, or the Retry-After of the response. Default is 5.
+        computer_backend: The backend to start and control instances with, e.g. an `XvfbBackend`
+            to run them on local displays. Default is None, which uses Scrapybara.
+        vm_end_policy: What to do with the thread's instance when a run ends. "keep" keeps it for
+            the thread's next turn, "stop" stops it, and "return_to_pool" returns it to the
+            'vm_pool' (or stops it, if there's no pool). Default is "keep".
+        vm_idle_timeout_seconds: How long an instance kept at the end of a run may sit idle before
+            it's stopped. Default is None, which keeps it until it times out after 'timeout_hours'.
+        vm_orphan_timeout_seconds: How long the instance of a run which hasn't ended may go unused
+            before it's stopped, e.g. because the run crashed. Default is None.
+        cassette: A cassette to record the model's responses and the calls to the computer backend
+            to, or to replay them from without network access. Default is None.
+        model_display_size: The (width, height) of the display as seen by the model. Screenshots
+            are downscaled to this size before they're sent to the model, and the coordinates of
+            the model's actions are scaled back to the display's resolution. Default is None,
+            which sends screenshots at the display's resolution (1024x768 on Scrapybara, or the
+            size of the computer backend's display). Requires Pillow.
+        vm_action_retries: The number of times to retry a step whose computer calls failed with
+            a transient error, e.g. a 502 from Scrapybara or a dropped connection. Default is 2.
+        vm_failover: Whether to replace the thread's instance with a new one when it stops
+            responding mid-run, so the model can continue on the new instance. Default is True.
+        fan_out_branches: The number of branches to explore concurrently, each on its own
+            instance, once the stall detector would end the run. Default is None, which disables
+            fan-out.
+        fan_out_success: A function of a branch's final state, which returns whether the branch
+            succeeded. Default is None, which counts a branch as successful once the model has
+            finished the task.
+        chat_model: The chat model to use instead of OpenAI's computer use model, e.g. a
+            `ScriptedModel` to run offline. The computer use tool is bound to it with
+            `bind_tools`. Default is None.
+        prune_screenshots_every: The number of screenshots to add between prunings by
+            `keep_last_screenshots` and `collapse_identical_screenshots`. Between prunings, the
+            history sent to the model only grows by appending messages, so the model provider's
+            prompt cache keeps matching its prefix. Default is None, which prunes every 5
+            screenshots when 'zdr_enabled' is True, and every step otherwise.
+        instance_registry: A registry shared by the processes running the graph, which records
+            their instances so that the instances of a process which crashed are stopped by
+            the others. Default is None.
     """
 
     scrapybara_api_key: Optional[str]  # API key for Scrapybara
@@ -87,6 +209,50 @@ class CUAConfiguration(TypedDict):
         Literal["web", "ubuntu", "windows"]
     ]  # The environment to use. Default is "web".
     prompt: Optional[Union[str, SystemMessage]]  # The initial prompt to use for the conversation
+    vm_pool: Optional["VMPool"]  # Pool of pre-booted instances to lease from.
+    action_timeout_seconds: Optional[float]  # Per-call timeout for VM calls in async runs.
+    screenshot_format: Optional[Literal["png", "jpeg", "webp"]]  # Screenshot encoding.
+    screenshot_quality: Optional[int]  # Encoder quality for "jpeg" and "webp" (1-100).
+    blob_store: Optional["BlobStore"]  # Store to write screenshots to, instead of inlining them.
+    keep_last_screenshots: Optional[
+        int
+    ]  # Number of recent screenshots to send in full history mode.
+    collapse_identical_screenshots: Optional[bool]  # Whether to drop repeated screenshots.
+    stall_threshold: Optional[int]  # Repeats of an action on an unchanged screen before stalling.
+    stall_action: Optional[Literal["hint", "end"]]  # What to do when the agent stalls.
+    stall_max_hints: Optional[int]  # Hints to send before ending a stalled run.
+    trajectory_cache: Optional["TrajectoryCache"]  # Cache of recorded trajectories to replay.
+    wait_mode: Optional[Literal["fixed", "adaptive"]]  # How to handle the "wait" action.
+    wait_timeout_seconds: Optional[float]  # The longest to wait for the screen to settle.
+    wait_poll_interval_seconds: Optional[float]  # Delay between screenshots while waiting.
+    wait_stable_polls: Optional[int]  # Consecutive unchanged screenshots which count as settled.
+    settle_after_actions: Optional[
+        List[str]
+    ]  # Action types to wait for the screen to settle after.
+    stream_model: Optional[bool]  # Whether to stream the model's response.
+    metrics_sink: Optional["MetricsSink"]  # Sink to record metrics to.
+    stream_metrics: Optional[bool]  # Whether to write metrics to the custom stream.
+    model_call_semaphore: Optional[asyncio.Semaphore]  # Bounds concurrent model requests.
+    openai_rate_limit: Optional["RateLimit"]  # Quota of the OpenAI API key.
+    scrapybara_rate_limit: Optional["RateLimit"]  # Quota of the Scrapybara API key.
+    max_rate_limit_retries: Optional[int]  # Retries for rate limited calls.
+    computer_backend: Optional["ComputerBackend"]  # Backend to run instances on.
+    vm_end_policy: Optional[
+        Literal["keep", "stop", "return_to_pool"]
+    ]  # What to do with the instance when a run ends.
+    vm_idle_timeout_seconds: Optional[float]  # Idle time before a kept instance is stopped.
+    vm_orphan_timeout_seconds: Optional[float]  # Unused time before a running instance is stopped.
+    cassette: Optional["Cassette"]  # Cassette to record traffic to, or replay it from.
+    model_display_size: Optional[Tuple[int, int]]  # Resolution of the model's view of the display.
+    vm_action_retries: Optional[int]  # Retries of a step after a transient error.
+    vm_failover: Optional[bool]  # Whether to replace an instance which stopped responding.
+    fan_out_branches: Optional[int]  # Branches to explore once the run stalls.
+    fan_out_success: Optional[
+        Callable[[Dict[str, Any]], bool]
+    ]  # Whether a branch's final state counts as a success.
+    chat_model: Optional[Any]  # Chat model to use instead of the computer use model.
+    prune_screenshots_every: Optional[int]  # Screenshots to add between prunings.
+    instance_registry: Optional["InstanceRegistry"]  # Registry of every process's instances.
 
 
 def get_configuration_with_defaults(config: RunnableConfig) -> Dict[str, Any]:
@@ -111,6 +277,44 @@ def get_configuration_with_defaults(config: RunnableConfig) -> Dict[str, Any]:
     auth_state_id = configurable_fields.get("auth_state_id", None)
     environment = configurable_fields.get("environment", "web")
     prompt = configurable_fields.get("prompt", None)
+    vm_pool = configurable_fields.get("vm_pool", None)
+    action_timeout_seconds = configurable_fields.get("action_timeout_seconds", None)
+    screenshot_format = configurable_fields.get("screenshot_format", "png")
+    screenshot_quality = configurable_fields.get("screenshot_quality", 80)
+    blob_store = configurable_fields.get("blob_store", None)
+    keep_last_screenshots = configurable_fields.get("keep_last_screenshots", None)
+    collapse_identical_screenshots = configurable_fields.get(
+        "collapse_identical_screenshots", False
+    )
+    stall_threshold = configurable_fields.get("stall_threshold", None)
+    stall_action = configurable_fields.get("stall_action", "hint")
+    stall_max_hints = configurable_fields.get("stall_max_hints", 1)
+    trajectory_cache = configurable_fields.get("trajectory_cache", None)
+    wait_mode = configurable_fields.get("wait_mode", "adaptive")
+    wait_timeout_seconds = configurable_fields.get("wait_timeout_seconds", 5)
+    wait_poll_interval_seconds = configurable_fields.get("wait_poll_interval_seconds", 0.25)
+    wait_stable_polls = configurable_fields.get("wait_stable_polls", 2)
+    settle_after_actions = configurable_fields.get("settle_after_actions", None)
+    stream_model = configurable_fields.get("stream_model", False)
+    metrics_sink = configurable_fields.get("metrics_sink", None)
+    stream_metrics = configurable_fields.get("stream_metrics", False)
+    model_call_semaphore = configurable_fields.get("model_call_semaphore", None)
+    openai_rate_limit = configurable_fields.get("openai_rate_limit", None)
+    scrapybara_rate_limit = configurable_fields.get("scrapybara_rate_limit", None)
+    max_rate_limit_retries = configurable_fields.get("max_rate_limit_retries", 5)
+    computer_backend = configurable_fields.get("computer_backend", None)
+    vm_end_policy = configurable_fields.get("vm_end_policy", "keep")
+    vm_idle_timeout_seconds = configurable_fields.get("vm_idle_timeout_seconds", None)
+    vm_orphan_timeout_seconds = configurable_fields.get("vm_orphan_timeout_seconds", None)
+    cassette = configurable_fields.get("cassette", None)
+    model_display_size = configurable_fields.get("model_display_size", None)
+    vm_action_retries = configurable_fields.get("vm_action_retries", 2)
+    vm_failover = configurable_fields.get("vm_failover", True)
+    fan_out_branches = configurable_fields.get("fan_out_branches", None)
+    fan_out_success = configurable_fields.get("fan_out_success", None)
+    chat_model = configurable_fields.get("chat_model", None)
+    prune_screenshots_every = configurable_fields.get("prune_screenshots_every", None)
+    instance_registry = configurable_fields.get("instance_registry", None)
 
     return {
         "scrapybara_api_key": scrapybara_api_key,
@@ -119,4 +323,40 @@ def get_configuration_with_defaults(config: RunnableConfig) -> Dict[str, Any]:
         "auth_state_id": auth_state_id,
         "environment": environment,
         "prompt": prompt,
+        "vm_pool": vm_pool,
+        "action_timeout_seconds": action_timeout_seconds,
+        "screenshot_format": screenshot_format,
+        "screenshot_quality": screenshot_quality,
+        "blob_store": blob_store,
+        "keep_last_screenshots": keep_last_screenshots,
+        "collapse_identical_screenshots": collapse_identical_screenshots,
+        "stall_threshold": stall_threshold,
+        "stall_action": stall_action,
+        "stall_max_hints": stall_max_hints,
+        "trajectory_cache": trajectory_cache,
+        "wait_mode": wait_mode,
+        "wait_timeout_seconds": wait_timeout_seconds,
+        "wait_poll_interval_seconds": wait_poll_interval_seconds,
+        "wait_stable_polls": wait_stable_polls,
+        "settle_after_actions": settle_after_actions,
+        "stream_model": stream_model,
+        "metrics_sink": metrics_sink,
+        "stream_metrics": stream_metrics,
+        "model_call_semaphore": model_call_semaphore,
+        "openai_rate_limit": openai_rate_limit,
+        "scrapybara_rate_limit": scrapybara_rate_limit,
+        "max_rate_limit_retries": max_rate_limit_retries,
+        "computer_backend": computer_backend,
+        "vm_end_policy": vm_end_policy,
+        "vm_idle_timeout_seconds": vm_idle_timeout_seconds,
+        "vm_orphan_timeout_seconds": vm_orphan_timeout_seconds,
+        "cassette": cassette,
+        "model_display_size": model_display_size,
+        "vm_action_retries": vm_action_retries,
+        "vm_failover": vm_failover,
+        "fan_out_branches": fan_out_branches,
+        "fan_out_success": fan_out_success,
+        "chat_model": chat_model,
+        "prune_screenshots_every": prune_screenshots_every,
+        "instance_registry": instance_registry,
     }
@@ -1,15 +1,69 @@
-from typing import Any, Union
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Optional, Sequence, Tuple, TypeVar, Union
 
+import httpx
 from langchain_core.runnables import RunnableConfig
-from scrapybara import Scrapybara
-from scrapybara.client import BrowserInstance, UbuntuInstance, WindowsInstance
+from langgraph.constants import CONFIG_KEY_STREAM_WRITER
+from langgraph.types import StreamWriter
+from scrapybara import AsyncScrapybara, Scrapybara
+from scrapybara.client import (
+    AsyncBrowserInstance,
+    AsyncUbuntuInstance,
+    AsyncWindowsInstance,
+    BrowserInstance,
+    UbuntuInstance,
+    WindowsInstance,
+)
 
 from .types import get_configuration_with_defaults
 
+Instance = Union[UbuntuInstance, BrowserInstance, WindowsInstance]
+AsyncInstance = Union[AsyncUbuntuInstance, AsyncBrowserInstance, AsyncWindowsInstance]
+InstanceT = TypeVar("InstanceT", Instance, AsyncInstance)
+
+# Connection pool limits for the shared Scrapybara HTTP clients. Every thread using the
+# same API key shares one client, so keep enough connections alive for concurrent runs.
+SCRAPYBARA_HTTP_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=20, keepalive_expiry=60
+)
+# Matches the Scrapybara SDK default, which is not applied when passing a custom httpx client.
+SCRAPYBARA_HTTP_TIMEOUT = 600
+
+# Connection pool limits for the shared OpenAI HTTP clients, used by every model call on
+# the same event loop. Change them with `set_openai_http_limits`.
+OPENAI_HTTP_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=20, keepalive_expiry=60
+)
+# Matches the OpenAI SDK default.
+OPENAI_HTTP_TIMEOUT = httpx.Timeout(600, connect=5.0)
+
+_clients: Dict[str, Scrapybara] = {}
+# The HTTP clients of `_clients`, kept so they can be closed without reaching into the SDK.
+_http_clients: Dict[str, httpx.Client] = {}
+_clients_lock = threading.Lock()
+# Async clients hold connections bound to the event loop that opened them, so they are
+# cached per event loop, and dropped along with it.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncScrapybara]]" = weakref.WeakKeyDictionary()
+
+
+def _validate_api_key(api_key: Optional[str]) -> None:
+    if not api_key:
+        raise ValueError(
+            "Scrapybara API key not provided. Please provide one in the configurable fields, "
+            "or set it as an environment variable (SCRAPYBARA_API_KEY)"
+        )
+
 
 def get_scrapybara_client(api_key: str) -> Scrapybara:
     """
-    Gets the Scrapybara client, using the API key provided.
+    Gets the Scrapybara client, using the API key provided. Clients are cached
+    per API key for the lifetime of the process, so that every thread shares
+    the same keep-alive connection pool.
 
     Args:
         api_key: The API key for Scrapybara.
@@ -17,20 +71,202 @@ def get_scrapybara_client(api_key: str) -> Scrapybara:
     Returns:
         The Scrapybara client.
     """
-    if not api_key:
-        raise ValueError(
-            "Scrapybara API key not provided. Please provide one in the configurable fields, "
-            "or set it as an environment variable (SCRAPYBARA_API_KEY)"
-        )
-    client = Scrapybara(api_key=api_key)
+    _validate_api_key(api_key)
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=SCRAPYBARA_HTTP_LIMITS,
+                timeout=SCRAPYBARA_HTTP_TIMEOUT,
+                follow_redirects=True,
+            )
+            client = Scrapybara(
+                api_key=api_key, timeout=SCRAPYBARA_HTTP_TIMEOUT, httpx_client=http_client
+            )
+            _clients[api_key] = client
+            _http_clients[api_key] = http_client
     return client
 
 
-def get_instance(
-    id: str, config: RunnableConfig
-) -> Union[UbuntuInstance, BrowserInstance, WindowsInstance]:
+def get_async_scrapybara_client(api_key: str) -> AsyncScrapybara:
     """
-    Gets an instance by its ID from Scrapybara.
+    Gets the async Scrapybara client, using the API key provided. Clients are
+    cached per API key and event loop.
+
+    Args:
+        api_key: The API key for Scrapybara.
+
+    Returns:
+        The async Scrapybara client.
+    """
+    _validate_api_key(api_key)
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(api_key)
+        if client is None:
+            client = AsyncScrapybara(
+                api_key=api_key,
+                timeout=SCRAPYBARA_HTTP_TIMEOUT,
+                httpx_client=httpx.AsyncClient(
+                    limits=SCRAPYBARA_HTTP_LIMITS,
+                    timeout=SCRAPYBARA_HTTP_TIMEOUT,
+                    follow_redirects=True,
+                ),
+            )
+            clients[api_key] = client
+    return client
+
+
+_openai_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_openai_http_client() -> httpx.AsyncClient:
+    """
+    Gets the HTTP client used for requests to OpenAI. One client, and so one
+    connection pool, is shared by every model call on the running event loop.
+
+    Returns:
+        The async HTTP client.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _openai_http_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+            _openai_http_clients[loop] = client
+    return client
+
+
+def set_openai_http_limits(limits: httpx.Limits, timeout: Optional[httpx.Timeout] = None) -> None:
+    """
+    Sets the connection pool limits, and optionally the timeout, of the HTTP clients
+    used for requests to OpenAI. Clients created after this call use the new limits.
+
+    Args:
+        limits: The connection pool limits.
+        timeout: The request timeout. If None, the current timeout is kept.
+    """
+    global OPENAI_HTTP_LIMITS, OPENAI_HTTP_TIMEOUT
+    with _clients_lock:
+        OPENAI_HTTP_LIMITS = limits
+        if timeout is not None:
+            OPENAI_HTTP_TIMEOUT = timeout
+        _openai_http_clients.clear()
+
+
+def clear_scrapybara_clients() -> None:
+    """
+    Closes and forgets every cached Scrapybara client. Async clients are
+    forgotten, but not closed, since they belong to their event loop.
+    """
+    with _clients_lock:
+        http_clients = list(_http_clients.values())
+        _clients.clear()
+        _http_clients.clear()
+        _async_clients.clear()
+    for http_client in http_clients:
+        http_client.close()
+
+
+def _hash_api_key(api_key: Optional[str]) -> str:
+    # Keys are hashed, so they aren't held in memory in the clear any longer than needed.
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+class InstanceCache(Generic[InstanceT]):
+    """
+    A thread-safe LRU cache of instance handles, keyed by the API key the handle's
+    client uses and the instance ID, so a handle is only served to callers using the
+    same API key. Entries expire after `ttl_seconds`, so that an instance which was
+    stopped elsewhere is eventually looked up again.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl_seconds: float = 5 * 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # Keyed by (API key hash, instance ID).
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[InstanceT, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, instance_id: str, api_key: Optional[str] = None) -> Optional[InstanceT]:
+        key = (_hash_api_key(api_key), instance_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            instance, expires_at = entry
+            if self._clock() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return instance
+
+    def put(self, instance: InstanceT, api_key: Optional[str] = None) -> None:
+        key = (_hash_api_key(api_key), instance.id)
+        with self._lock:
+            self._entries[key] = (instance, self._clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, instance_id: str) -> None:
+        """Drops the handles of an instance, for every API key."""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == instance_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+# Process-wide cache of instance handles used by `get_instance`.
+instance_cache: InstanceCache[Instance] = InstanceCache()
+# Async handles are bound to their client's event loop, so they are cached per loop.
+_async_instance_caches: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, InstanceCache[AsyncInstance]]" = weakref.WeakKeyDictionary()
+
+
+def get_async_instance_cache() -> InstanceCache[AsyncInstance]:
+    """
+    Returns the cache of async instance handles for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        return _async_instance_caches.setdefault(loop, InstanceCache())
+
+
+def invalidate_instance(instance_id: str) -> None:
+    """
+    Drops the cached handle for an instance. Call this after stopping an instance,
+    or when a call to it fails, so the next lookup goes back to the computer backend.
+
+    Args:
+        instance_id: The ID of the instance to invalidate.
+    """
+    instance_cache.invalidate(instance_id)
+    with _clients_lock:
+        async_caches = list(_async_instance_caches.values())
+    for cache in async_caches:
+        cache.invalidate(instance_id)
+
+
+def get_instance(id: str, config: RunnableConfig) -> Instance:
+    """
+    Gets an instance by its ID from the computer backend. Handles are served from
+    `instance_cache` when possible, to avoid a network round trip per step.
 
     Args:
         id: The ID of the instance to get.
@@ -40,9 +276,126 @@ def get_instance(
         The instance.
     """
     configuration = get_configuration_with_defaults(config)
-    scrapybara_api_key = configuration.get("scrapybara_api_key")
-    client = get_scrapybara_client(scrapybara_api_key)
-    return client.get(id)
+    api_key = configuration.get("scrapybara_api_key")
+    instance = instance_cache.get(id, api_key)
+    if instance is not None:
+        return instance
+    # Imported here, since the Scrapybara backend is built on this module.
+    from .backends import get_computer_backend
+
+    instance = get_computer_backend(configuration).get(id)
+    instance_cache.put(instance, api_key)
+    return instance
+
+
+async def aget_instance(id: str, config: RunnableConfig) -> AsyncInstance:
+    """
+    Async version of `get_instance`.
+
+    Args:
+        id: The ID of the instance to get.
+        config: The configuration for the runnable.
+
+    Returns:
+        The async instance.
+    """
+    configuration = get_configuration_with_defaults(config)
+    api_key = configuration.get("scrapybara_api_key")
+    cache = get_async_instance_cache()
+    instance = cache.get(id, api_key)
+    if instance is not None:
+        return instance
+    from .backends import get_computer_backend
+
+    instance = await get_computer_backend(configuration).aget(id)
+    cache.put(instance, api_key)
+    return instance
+
+
+def start_instance(
+    client: Scrapybara,
+    environment: str,
+    timeout_hours: float,
+    blocked_domains: Optional[Sequence[str]] = None,
+) -> Instance:
+    """
+    Boots a new Scrapybara instance for the given environment.
+
+    Args:
+        client: The Scrapybara client to start the instance with.
+        environment: One of "web", "ubuntu", or "windows".
+        timeout_hours: The number of hours to keep the instance running before it times out.
+        blocked_domains: Domains to block. Only applies to the "web" environment.
+
+    Returns:
+        The newly started instance.
+
+    Raises:
+        ValueError: If the environment is invalid.
+    """
+    if environment == "ubuntu":
+        return client.start_ubuntu(timeout_hours=timeout_hours)
+    elif environment == "windows":
+        return client.start_windows(timeout_hours=timeout_hours)
+    elif environment == "web":
+        return client.start_browser(
+            timeout_hours=timeout_hours, blocked_domains=list(blocked_domains or [])
+        )
+    raise ValueError(
+        f"Invalid environment. Must be one of 'web', 'ubuntu', or 'windows'. Received: {environment}"
+    )
+
+
+async def astart_instance(
+    client: AsyncScrapybara,
+    environment: str,
+    timeout_hours: float,
+    blocked_domains: Optional[Sequence[str]] = None,
+) -> AsyncInstance:
+    """
+    Async version of `start_instance`.
+
+    Args:
+        client: The async Scrapybara client to start the instance with.
+        environment: One of "web", "ubuntu", or "windows".
+        timeout_hours: The number of hours to keep the instance running before it times out.
+        blocked_domains: Domains to block. Only applies to the "web" environment.
+
+    Returns:
+        The newly started instance.
+
+    Raises:
+        ValueError: If the environment is invalid.
+    """
+    if environment == "ubuntu":
+        return await client.start_ubuntu(timeout_hours=timeout_hours)
+    elif environment == "windows":
+        return await client.start_windows(timeout_hours=timeout_hours)
+    elif environment == "web":
+        return await client.start_browser(
+            timeout_hours=timeout_hours, blocked_domains=list(blocked_domains or [])
+        )
+    raise ValueError(
+        f"Invalid environment. Must be one of 'web', 'ubuntu', or 'windows'. Received: {environment}"
+    )
+
+
+def _no_op_stream_writer(chunk: Any) -> None:
+    pass
+
+
+def get_stream_writer_from_config(config: RunnableConfig) -> StreamWriter:
+    """
+    Gets the LangGraph stream writer from a node's config. Unlike `langgraph.config.get_stream_writer`,
+    this works in async nodes on Python 3.10, and returns a no-op writer outside of a graph run.
+
+    Args:
+        config: The configuration for the runnable.
+
+    Returns:
+        The stream writer.
+    """
+    return config.get("configurable", {}).get(CONFIG_KEY_STREAM_WRITER, _no_op_stream_writer)
 
 
 def is_computer_tool_call(tool_outputs: Any) -> bool:
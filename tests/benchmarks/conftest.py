@@ -0,0 +1,27 @@
+import importlib
+
+import pytest
+
+from langgraph_cua.simulator import AsyncSimulatedScrapybara, ScriptedModel, SimulatedScrapybara
+
+
+@pytest.fixture
+def simulator(monkeypatch) -> SimulatedScrapybara:
+    """Routes every Scrapybara client lookup in the package to a `SimulatedScrapybara`."""
+    from langgraph_cua import utils
+
+    simulator = SimulatedScrapybara(seed=0)
+    async_simulator = AsyncSimulatedScrapybara(simulator)
+    monkeypatch.setattr(utils, "get_scrapybara_client", lambda api_key: simulator)
+    monkeypatch.setattr(utils, "get_async_scrapybara_client", lambda api_key: async_simulator)
+    return simulator
+
+
+@pytest.fixture
+def scripted_model(monkeypatch) -> ScriptedModel:
+    """Replaces the model used by `call_model` with a `ScriptedModel`."""
+    call_model = importlib.import_module("langgraph_cua.nodes.call_model")
+    model = ScriptedModel()
+    monkeypatch.setattr(call_model, "ChatOpenAI", model)
+    call_model.clear_chat_models()
+    return model
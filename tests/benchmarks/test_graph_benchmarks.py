@@ -0,0 +1,96 @@
+"""
+Offline benchmarks of the whole graph, against a `SimulatedScrapybara` backend and a
+`ScriptedModel`, so they measure the overhead of the graph itself. Covers per-step
+latency, memory growth over long trajectories, and concurrent-thread throughput.
+
+Run with `pytest tests/benchmarks` to see the results, and compare runs with
+`--benchmark-autosave` and `--benchmark-compare`.
+"""
+
+import asyncio
+import tracemalloc
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from langgraph_cua import InMemoryMetricsSink, create_cua, graph
+
+pytest.importorskip("pytest_benchmark")
+
+STEPS = 20
+LONG_TRAJECTORY_STEPS = 100
+CONCURRENT_THREADS = 32
+CONCURRENT_STEPS = 5
+BACKEND_LATENCY_SECONDS = 0.005
+CONFIG = {"configurable": {"scrapybara_api_key": "key"}, "recursion_limit": 1000}
+
+GRAPHS = {
+    "graph": lambda: graph,
+    "create_cua_zdr": lambda: create_cua(zdr_enabled=True),
+    "create_cua_metrics": lambda: create_cua(metrics_sink=InMemoryMetricsSink()),
+}
+
+
+def _input() -> dict:
+    return {"messages": [HumanMessage(content="Fill in the form")]}
+
+
+@pytest.mark.parametrize("graph_name", list(GRAPHS))
+def test_step_latency(benchmark, simulator, scripted_model, graph_name) -> None:
+    cua = GRAPHS[graph_name]()
+    scripted_model.steps = STEPS
+
+    result = benchmark.pedantic(
+        lambda: asyncio.run(cua.ainvoke(_input(), CONFIG)), rounds=5, warmup_rounds=1
+    )
+
+    benchmark.extra_info["steps"] = STEPS
+    # There are no stats when benchmarks are disabled, and each test runs once.
+    if benchmark.enabled:
+        benchmark.extra_info["step_latency_ms"] = benchmark.stats.stats.mean / STEPS * 1000
+    assert len(simulator.instances[result["instance_id"]].calls) == STEPS
+
+
+@pytest.mark.parametrize("graph_name", list(GRAPHS))
+def test_memory_growth(benchmark, simulator, scripted_model, graph_name) -> None:
+    cua = GRAPHS[graph_name]()
+    scripted_model.steps = LONG_TRAJECTORY_STEPS
+    checkpoint = LONG_TRAJECTORY_STEPS // 4
+
+    async def run() -> tuple:
+        traced = {}
+        async for state in cua.astream(_input(), CONFIG, stream_mode="values"):
+            tool_messages = sum(1 for message in state["messages"] if message.type == "tool")
+            if tool_messages not in traced:
+                traced[tool_messages] = tracemalloc.get_traced_memory()[0]
+        return traced[checkpoint], traced[LONG_TRAJECTORY_STEPS]
+
+    tracemalloc.start()
+    try:
+        at_checkpoint, at_end = benchmark.pedantic(lambda: asyncio.run(run()), rounds=1)
+    finally:
+        tracemalloc.stop()
+
+    bytes_per_step = (at_end - at_checkpoint) / (LONG_TRAJECTORY_STEPS - checkpoint)
+    benchmark.extra_info["bytes_per_step"] = bytes_per_step
+    # Each step adds a screenshot (about 16KB encoded) and a few messages to state.
+    assert bytes_per_step < 512 * 1024
+
+
+@pytest.mark.parametrize("graph_name", list(GRAPHS))
+def test_concurrent_throughput(benchmark, simulator, scripted_model, graph_name) -> None:
+    cua = GRAPHS[graph_name]()
+    simulator.latency_seconds = BACKEND_LATENCY_SECONDS
+    scripted_model.steps = CONCURRENT_STEPS
+
+    async def run() -> list:
+        return await asyncio.gather(
+            *(cua.ainvoke(_input(), CONFIG) for _ in range(CONCURRENT_THREADS))
+        )
+
+    results = benchmark.pedantic(lambda: asyncio.run(run()), rounds=3, warmup_rounds=1)
+
+    benchmark.extra_info["threads"] = CONCURRENT_THREADS
+    if benchmark.enabled:
+        benchmark.extra_info["threads_per_second"] = CONCURRENT_THREADS / benchmark.stats.stats.mean
+    assert len({result["instance_id"] for result in results}) == CONCURRENT_THREADS
@@ -0,0 +1,95 @@
+"""
+Measures the request payload sent to the model in full history (ZDR) mode over
+long trajectories, with and without history shaping. Payload size is the size of
+the serialized Responses API input, and latency is the time spent shaping and
+serializing the history for one step.
+
+Run with `pytest tests/benchmarks -s` to see the results.
+"""
+
+import base64
+import json
+import os
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_openai.chat_models.base import _construct_responses_api_input
+
+from langgraph_cua.history import shape_history
+
+TRAJECTORY_STEPS = 100
+REPORT_AT_STEPS = (10, 50, 100)
+SCREENSHOT_BYTES = 30_000
+
+
+def _step_messages(step: int, repeat_previous: bool, previous_url: str):
+    url = previous_url
+    if not repeat_previous:
+        url = f"data:image/png;base64,{base64.b64encode(os.urandom(SCREENSHOT_BYTES)).decode()}"
+    call_id = f"call_{step}"
+    ai = AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {
+                    "type": "computer_call",
+                    "id": f"cu_{step}",
+                    "call_id": call_id,
+                    "action": {"type": "screenshot"},
+                    "pending_safety_checks": [],
+                    "status": "completed",
+                }
+            ]
+        },
+    )
+    tool = ToolMessage(
+        content=[{"type": "input_image", "image_url": url}],
+        tool_call_id=call_id,
+        additional_kwargs={"type": "computer_call_output"},
+    )
+    return [ai, tool], url
+
+
+def _measure(shaping_kwargs):
+    messages = [HumanMessage(content="Find the cheapest flight.")]
+    url = ""
+    results = {}
+    total_bytes = 0
+    for step in range(1, TRAJECTORY_STEPS + 1):
+        # Every fourth step, the screen doesn't change.
+        new_messages, url = _step_messages(step, repeat_previous=step % 4 == 0, previous_url=url)
+        messages.extend(new_messages)
+
+        started = time.perf_counter()
+        payload = json.dumps(
+            _construct_responses_api_input(shape_history(messages, **shaping_kwargs))
+        )
+        elapsed = time.perf_counter() - started
+        total_bytes += len(payload)
+        if step in REPORT_AT_STEPS:
+            results[step] = (len(payload), elapsed)
+    return results, total_bytes
+
+
+def test_history_shaping_payload() -> None:
+    unshaped, unshaped_total = _measure({})
+    shaped, shaped_total = _measure(
+        {"keep_last_screenshots": 3, "collapse_identical_screenshots": True}
+    )
+
+    print(f"\nFull history payload per step ({SCREENSHOT_BYTES // 1000}KB screenshots)")
+    print(f"{'step':>6} {'unshaped KB':>12} {'ms':>7} {'shaped KB':>10} {'ms':>7}")
+    for step in REPORT_AT_STEPS:
+        (raw_bytes, raw_time), (shaped_bytes, shaped_time) = unshaped[step], shaped[step]
+        print(
+            f"{step:>6} {raw_bytes / 1000:>12.0f} {raw_time * 1000:>7.2f}"
+            f" {shaped_bytes / 1000:>10.0f} {shaped_time * 1000:>7.2f}"
+        )
+    print(
+        f"Total bytes over {TRAJECTORY_STEPS} steps: {unshaped_total / 1e6:.1f}MB unshaped, "
+        f"{shaped_total / 1e6:.1f}MB shaped"
+    )
+
+    # With shaping, payload size stays flat as the trajectory grows.
+    assert shaped[100][0] < 2 * shaped[10][0]
+    assert shaped_total * 10 < unshaped_total
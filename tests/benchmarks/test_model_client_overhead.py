@@ -0,0 +1,77 @@
+"""
+Measures the per-step overhead of `call_model` before a request reaches the wire,
+with a model and HTTP client built for every step, and with the shared model and
+connection pool. Requests go to a mock transport, which records when each one arrives.
+
+Run with `pytest tests/benchmarks -s` to see the results.
+"""
+
+import importlib
+import time
+
+import httpx
+import pytest
+from langchain_core.messages import HumanMessage
+
+call_model_module = importlib.import_module("langgraph_cua.nodes.call_model")
+
+STEPS = 50
+CONFIG = {"configurable": {"environment": "web", "zdr_enabled": True}}
+RESPONSE = {
+    "id": "resp_1",
+    "object": "response",
+    "created_at": 0,
+    "model": "computer-use-preview",
+    "output": [],
+    "parallel_tool_calls": True,
+    "tool_choice": "auto",
+    "tools": [],
+    "status": "completed",
+}
+
+
+class _Transport:
+    def __init__(self):
+        self.arrived_at = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.arrived_at.append(time.perf_counter())
+        return httpx.Response(200, json=RESPONSE)
+
+
+async def _time_to_wire(transport: _Transport) -> float:
+    state = {"messages": [HumanMessage(content="Open the site")]}
+    total = 0.0
+    for _ in range(STEPS):
+        started = time.perf_counter()
+        await call_model_module.call_model(state, CONFIG)
+        total += transport.arrived_at[-1] - started
+    return total / STEPS
+
+
+@pytest.mark.asyncio
+async def test_model_client_overhead(monkeypatch) -> None:
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    transport = _Transport()
+    shared_client = httpx.AsyncClient(transport=httpx.MockTransport(transport))
+
+    # A new client on every step forces the model to be rebuilt, like it was per call.
+    monkeypatch.setattr(
+        call_model_module,
+        "get_openai_http_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(transport)),
+    )
+    call_model_module.clear_chat_models()
+    fresh = await _time_to_wire(transport)
+
+    monkeypatch.setattr(call_model_module, "get_openai_http_client", lambda: shared_client)
+    call_model_module.clear_chat_models()
+    shared = await _time_to_wire(transport)
+    call_model_module.clear_chat_models()
+
+    print(
+        f"\ncall_model overhead before the request is sent, over {STEPS} steps\n"
+        f"  model per step: {fresh * 1000:8.2f}ms\n"
+        f"  shared model:   {shared * 1000:8.2f}ms"
+    )
+    assert shared < fresh
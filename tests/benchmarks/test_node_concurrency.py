@@ -0,0 +1,92 @@
+"""
+Compares concurrent-thread throughput of the sync and async VM nodes against a
+fake Scrapybara backend with a fixed per-call latency. The sync nodes run on a
+bounded thread pool, like they do when a graph is streamed asynchronously.
+
+Run with `pytest tests/benchmarks -s` to see the results.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from langgraph_cua.nodes import (
+    acreate_vm_instance,
+    atake_computer_action,
+    create_vm_instance,
+    take_computer_action,
+)
+
+CONCURRENT_THREADS = 64
+EXECUTOR_WORKERS = 8
+BACKEND_LATENCY_SECONDS = 0.02
+CONFIG = {"configurable": {"scrapybara_api_key": "key"}}
+
+
+def _action_state(instance_id: str) -> dict:
+    message = AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {
+                    "type": "computer_call",
+                    "call_id": "call_1",
+                    "action": {"type": "click", "button": "left", "x": 10, "y": 10},
+                }
+            ]
+        },
+    )
+    return {"messages": [message], "instance_id": instance_id, "stream_url": "https://stream"}
+
+
+async def _run_sync(node, states) -> float:
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS) as executor:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(loop.run_in_executor(executor, node, state, CONFIG) for state in states)
+        )
+        return time.perf_counter() - started
+
+
+async def _run_async(node, states) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(node(state, CONFIG) for state in states))
+    return time.perf_counter() - started
+
+
+def _report(name: str, sync_elapsed: float, async_elapsed: float) -> None:
+    print(
+        f"\n{name}: {CONCURRENT_THREADS} threads, {BACKEND_LATENCY_SECONDS * 1000:.0f}ms backend latency\n"
+        f"  sync  ({EXECUTOR_WORKERS} workers): {CONCURRENT_THREADS / sync_elapsed:8.1f} threads/s\n"
+        f"  async:               {CONCURRENT_THREADS / async_elapsed:8.1f} threads/s"
+    )
+
+
+@pytest.mark.asyncio
+async def test_take_computer_action_throughput(patch_scrapybara) -> None:
+    patch_scrapybara.latency = BACKEND_LATENCY_SECONDS
+    states = [
+        _action_state(patch_scrapybara._start("browser").id) for _ in range(CONCURRENT_THREADS)
+    ]
+
+    sync_elapsed = await _run_sync(take_computer_action, states)
+    async_elapsed = await _run_async(atake_computer_action, states)
+
+    _report("take_computer_action", sync_elapsed, async_elapsed)
+    assert async_elapsed < sync_elapsed
+
+
+@pytest.mark.asyncio
+async def test_create_vm_instance_throughput(patch_scrapybara) -> None:
+    patch_scrapybara.latency = BACKEND_LATENCY_SECONDS
+    states = [{"messages": []} for _ in range(CONCURRENT_THREADS)]
+
+    sync_elapsed = await _run_sync(create_vm_instance, states)
+    async_elapsed = await _run_async(acreate_vm_instance, states)
+
+    _report("create_vm_instance", sync_elapsed, async_elapsed)
+    assert async_elapsed < sync_elapsed
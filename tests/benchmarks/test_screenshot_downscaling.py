@@ -0,0 +1,82 @@
+"""
+Measures what downscaling screenshots for the model (`model_display_size`) saves: the
+size of each screenshot, the time spent resizing and encoding it, and the image tokens
+it costs, estimated with OpenAI's tiling formula for high detail images. Screenshots
+are synthetic pages of text, controls and a photo, at the display's resolution.
+
+Run with `pytest tests/benchmarks -s` to see the results.
+"""
+
+import base64
+import io
+import math
+import random
+import time
+
+import pytest
+
+from langgraph_cua.images import DISPLAY_SIZE, encode_screenshot
+
+SCREENSHOTS = 10
+MODEL_DISPLAY_SIZES = [None, (768, 576), (512, 384)]
+FORMATS = ["png", "jpeg"]
+
+
+def _page_png_base64(seed: int) -> str:
+    Image = pytest.importorskip("PIL.Image")
+    ImageDraw = pytest.importorskip("PIL.ImageDraw")
+    rng = random.Random(seed)
+    image = Image.new("RGB", DISPLAY_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, DISPLAY_SIZE[0], 48), fill=(40, 60, 120))
+    # A photo, which compresses poorly as a PNG.
+    photo = Image.effect_noise((320, 240), 48).convert("RGB")
+    image.paste(
+        Image.blend(photo, Image.linear_gradient("L").resize((320, 240)).convert("RGB"), 0.5),
+        (680, 80),
+    )
+    for y in range(72, DISPLAY_SIZE[1] - 24, 22):
+        if rng.random() < 0.15:
+            draw.rectangle((24, y, 24 + rng.randrange(80, 240), y + 18), outline="gray")
+        words = " ".join("x" * rng.randrange(2, 10) for _ in range(rng.randrange(4, 16)))
+        draw.text((24 if rng.random() < 0.85 else 280, y + 4), words, fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _image_tokens(width: int, height: int) -> int:
+    # Fit within 2048x2048, then scale down so the shortest side is at most 768px, and
+    # count the 512px tiles.
+    scale = min(1.0, 2048 / max(width, height))
+    scale = min(scale, 768 / min(width * scale, height * scale))
+    tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+    return 85 + 170 * tiles
+
+
+def test_screenshot_downscaling() -> None:
+    screenshots = [_page_png_base64(seed) for seed in range(SCREENSHOTS)]
+    results = {}
+    for format in FORMATS:
+        for size in MODEL_DISPLAY_SIZES:
+            started = time.perf_counter()
+            encoded = [encode_screenshot(s, format, 80, size) for s in screenshots]
+            elapsed = (time.perf_counter() - started) / SCREENSHOTS
+            mean_bytes = sum(e.encoded_bytes for e in encoded) / SCREENSHOTS
+            results[(format, size)] = (mean_bytes, elapsed, _image_tokens(*(size or DISPLAY_SIZE)))
+
+    print(f"\nScreenshot cost by model display size ({SCREENSHOTS} screenshots)")
+    print(f"{'format':>6} {'size':>9} {'KB':>7} {'ms':>7} {'image tokens':>13}")
+    for (format, size), (mean_bytes, elapsed, tokens) in results.items():
+        width, height = size or DISPLAY_SIZE
+        print(
+            f"{format:>6} {f'{width}x{height}':>9} {mean_bytes / 1000:>7.1f}"
+            f" {elapsed * 1000:>7.2f} {tokens:>13}"
+        )
+
+    # Downscaled text is anti-aliased, which PNG compresses worse, so only JPEG is sure to shrink
+    # at every size. Image tokens only drop once the screenshot fits in fewer tiles.
+    assert results[("jpeg", (768, 576))][0] < results[("jpeg", None)][0]
+    assert results[("jpeg", (512, 384))][0] < results[("jpeg", None)][0] / 2
+    assert results[("png", (512, 384))][0] < results[("png", None)][0]
+    assert results[("png", (512, 384))][2] < results[("png", None)][2]
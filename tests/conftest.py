@@ -0,0 +1,229 @@
+import asyncio
+import importlib
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+# A 1x1 transparent PNG, base64 encoded.
+PIXEL_PNG_BASE64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+
+
+class FakeInstance:
+    """A minimal stand-in for a Scrapybara instance, which records every call made to it."""
+
+    def __init__(self, client: "FakeScrapybara", id: str, instance_type: str):
+        self._client = client
+        self.id = id
+        self.instance_type = instance_type
+        self.status = "running"
+        self.calls: List[Dict[str, Any]] = []
+        self.call_times: List[float] = []
+        self.auth_state_id: Optional[str] = None
+        # Errors to raise from the next calls to `computer`, one per call.
+        self.errors: List[Exception] = []
+
+    def _check_computer_call(self) -> None:
+        from scrapybara.core.api_error import ApiError
+
+        # None lets a call through, to fail a later call of the step.
+        if self.errors and (error := self.errors.pop(0)) is not None:
+            raise error
+        if self.status != "running":
+            raise ApiError(status_code=409, body="Instance is not running")
+
+    def computer(self, **kwargs: Any) -> SimpleNamespace:
+        time.sleep(self._client.latency)
+        self._check_computer_call()
+        self.calls.append(kwargs)
+        self.call_times.append(time.monotonic())
+        return SimpleNamespace(base_64_image=PIXEL_PNG_BASE64, output=None, error=None)
+
+    def get_stream_url(self) -> SimpleNamespace:
+        return SimpleNamespace(stream_url=f"https://stream.test/{self.id}")
+
+    def authenticate(self, *, auth_state_id: str) -> None:
+        self.auth_state_id = auth_state_id
+
+    def stop(self) -> None:
+        self.status = "terminated"
+
+
+class AsyncFakeInstance:
+    """Async view of a `FakeInstance`, mirroring Scrapybara's async instances."""
+
+    def __init__(self, instance: FakeInstance):
+        self._instance = instance
+        self.id = instance.id
+
+    async def computer(self, **kwargs: Any) -> SimpleNamespace:
+        await asyncio.sleep(self._instance._client.latency)
+        self._instance._check_computer_call()
+        self._instance.calls.append(kwargs)
+        self._instance.call_times.append(time.monotonic())
+        return SimpleNamespace(base_64_image=PIXEL_PNG_BASE64, output=None, error=None)
+
+    async def get_stream_url(self) -> SimpleNamespace:
+        return self._instance.get_stream_url()
+
+    async def authenticate(self, *, auth_state_id: str) -> None:
+        self._instance.authenticate(auth_state_id=auth_state_id)
+
+    async def stop(self) -> None:
+        self._instance.stop()
+
+
+class FakeScrapybara:
+    """A local stand-in for the Scrapybara client."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.instances: Dict[str, FakeInstance] = {}
+        self.started: List[Dict[str, Any]] = []
+        self.get_calls = 0
+
+    def _start(self, instance_type: str, **kwargs: Any) -> FakeInstance:
+        with self._lock:
+            instance = FakeInstance(self, f"{instance_type}-{next(self._ids)}", instance_type)
+            self.instances[instance.id] = instance
+            self.started.append({"instance_type": instance_type, **kwargs})
+        return instance
+
+    def start_browser(self, **kwargs: Any) -> FakeInstance:
+        time.sleep(self.latency)
+        return self._start("browser", **kwargs)
+
+    def start_ubuntu(self, **kwargs: Any) -> FakeInstance:
+        time.sleep(self.latency)
+        return self._start("ubuntu", **kwargs)
+
+    def start_windows(self, **kwargs: Any) -> FakeInstance:
+        time.sleep(self.latency)
+        return self._start("windows", **kwargs)
+
+    def get(self, instance_id: str) -> FakeInstance:
+        with self._lock:
+            self.get_calls += 1
+        return self.instances[instance_id]
+
+
+class AsyncFakeScrapybara:
+    """Async view of a `FakeScrapybara`, sharing its instances."""
+
+    def __init__(self, client: FakeScrapybara):
+        self._client = client
+
+    async def _start(self, instance_type: str, **kwargs: Any) -> AsyncFakeInstance:
+        await asyncio.sleep(self._client.latency)
+        return AsyncFakeInstance(self._client._start(instance_type, **kwargs))
+
+    async def start_browser(self, **kwargs: Any) -> AsyncFakeInstance:
+        return await self._start("browser", **kwargs)
+
+    async def start_ubuntu(self, **kwargs: Any) -> AsyncFakeInstance:
+        return await self._start("ubuntu", **kwargs)
+
+    async def start_windows(self, **kwargs: Any) -> AsyncFakeInstance:
+        return await self._start("windows", **kwargs)
+
+    async def get(self, instance_id: str) -> AsyncFakeInstance:
+        return AsyncFakeInstance(self._client.get(instance_id))
+
+
+@pytest.fixture
+def fake_scrapybara() -> FakeScrapybara:
+    return FakeScrapybara()
+
+
+@pytest.fixture
+def patch_scrapybara(monkeypatch, fake_scrapybara):
+    """Routes every Scrapybara client lookup in the package to `fake_scrapybara`."""
+    from langgraph_cua import utils
+
+    async_client = AsyncFakeScrapybara(fake_scrapybara)
+    monkeypatch.setattr(utils, "get_scrapybara_client", lambda api_key: fake_scrapybara)
+    monkeypatch.setattr(utils, "get_async_scrapybara_client", lambda api_key: async_client)
+    return fake_scrapybara
+
+
+@pytest.fixture(autouse=True)
+def clear_instance_cache():
+    from langgraph_cua import utils
+
+    utils.instance_cache.clear()
+    yield
+    utils.instance_cache.clear()
+    for cache in list(utils._async_instance_caches.values()):
+        cache.clear()
+
+
+class FakeChatOpenAI:
+    """
+    A stand-in for `ChatOpenAI`, which records requests and replies with scripted messages.
+    A scripted response can also be a list of chunks, which `astream` yields `stream_delay`
+    seconds apart.
+    """
+
+    def __init__(self, responses: Optional[List[Any]] = None, stream_delay: float = 0.0):
+        self.responses = list(responses or [])
+        self.stream_delay = stream_delay
+        self.stream_finished_at: List[float] = []
+        self.requests: List[List[Any]] = []
+        self.request_kwargs: List[Dict[str, Any]] = []
+        self.init_kwargs: List[Dict[str, Any]] = []
+        self.tools: List[Any] = []
+
+    def __call__(self, **kwargs: Any) -> "FakeChatOpenAI":
+        self.init_kwargs.append(kwargs)
+        return self
+
+    def bind_tools(self, tools: List[Any]) -> "FakeChatOpenAI":
+        self.tools = tools
+        return self
+
+    def _next_response(self, messages: List[Any], kwargs: Dict[str, Any]) -> Any:
+        from langchain_core.messages import AIMessage
+
+        self.requests.append(list(messages))
+        self.request_kwargs.append(kwargs)
+        if self.responses:
+            return self.responses.pop(0)
+        return AIMessage(content="done", response_metadata={"id": f"resp_{len(self.requests)}"})
+
+    async def ainvoke(self, messages: List[Any], **kwargs: Any) -> Any:
+        return self._next_response(messages, kwargs)
+
+    async def astream(self, messages: List[Any], **kwargs: Any) -> Any:
+        from langchain_core.messages import AIMessageChunk
+
+        response = self._next_response(messages, kwargs)
+        chunks = (
+            response
+            if isinstance(response, list)
+            else [AIMessageChunk(**response.model_dump(exclude={"type"}))]
+        )
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(self.stream_delay)
+            # An exception in the chunks fails the stream part way through.
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+        self.stream_finished_at.append(time.monotonic())
+
+
+@pytest.fixture
+def fake_llm(monkeypatch) -> FakeChatOpenAI:
+    """Replaces the model used by `call_model` with a `FakeChatOpenAI`."""
+    call_model = importlib.import_module("langgraph_cua.nodes.call_model")
+    llm = FakeChatOpenAI()
+    monkeypatch.setattr(call_model, "ChatOpenAI", llm)
+    call_model.clear_chat_models()
+    return llm
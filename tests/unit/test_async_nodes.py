@@ -0,0 +1,117 @@
+import asyncio
+import importlib
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from langgraph_cua.history import SCREENSHOT_PLACEHOLDER_URL
+from langgraph_cua.nodes import acreate_vm_instance, atake_computer_action
+from tests.conftest import PIXEL_PNG_BASE64
+
+take_computer_action_module = importlib.import_module("langgraph_cua.nodes.take_computer_action")
+
+
+def _computer_call(*actions: dict) -> AIMessage:
+    return AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {"type": "computer_call", "call_id": f"call_{i}", "action": action}
+                for i, action in enumerate(actions, start=1)
+            ]
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_nodes_create_and_act(patch_scrapybara) -> None:
+    config = {"configurable": {"scrapybara_api_key": "key", "auth_state_id": "auth-1"}}
+
+    created = await acreate_vm_instance({"messages": []}, config)
+    state = {
+        "messages": [_computer_call({"type": "keypress", "keys": ["ENTER"]})],
+        **created,
+    }
+    update = await atake_computer_action(state, config)
+
+    instance = patch_scrapybara.instances[created["instance_id"]]
+    assert instance.calls == [{"action": "press_key", "keys": ["Return"]}]
+    assert instance.auth_state_id == "auth-1"
+    assert update["authenticated_id"] == "auth-1"
+    assert [message["tool_call_id"] for message in update["messages"]] == ["call_1"]
+    # The handle created by `acreate_vm_instance` is reused.
+    assert patch_scrapybara.get_calls == 0
+
+
+@pytest.mark.asyncio
+async def test_async_wait_does_not_block_event_loop(monkeypatch, patch_scrapybara) -> None:
+    monkeypatch.setattr(take_computer_action_module, "WAIT_ACTION_SECONDS", 0.05)
+    config = {"configurable": {"scrapybara_api_key": "key", "wait_mode": "fixed"}}
+    created = await acreate_vm_instance({"messages": []}, config)
+    state = {"messages": [_computer_call({"type": "wait"})], **created}
+
+    ticks = 0
+
+    async def ticker() -> None:
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    update = await atake_computer_action(state, config)
+    task.cancel()
+
+    assert update["messages"] is not None
+    assert ticks > 1
+
+
+@pytest.mark.asyncio
+async def test_async_action_timeout(patch_scrapybara) -> None:
+    patch_scrapybara.latency = 0.2
+    config = {"configurable": {"scrapybara_api_key": "key", "action_timeout_seconds": 0.01}}
+    instance = patch_scrapybara._start("browser")
+    state = {
+        "messages": [_computer_call({"type": "screenshot"})],
+        "instance_id": instance.id,
+        "stream_url": "https://stream",
+    }
+
+    update = await atake_computer_action(state, config)
+
+    # Timeouts are handled like any other failed action. The replacement instance times
+    # out too, so the step fails.
+    assert "messages" not in update
+    assert update["instance_id"] == instance.id
+
+
+@pytest.mark.asyncio
+async def test_async_executes_every_computer_call(patch_scrapybara) -> None:
+    config = {"configurable": {"scrapybara_api_key": "key"}}
+    instance = patch_scrapybara._start("browser")
+    state = {
+        "messages": [
+            _computer_call(
+                {"type": "click", "button": "left", "x": 1, "y": 2},
+                {"type": "screenshot"},
+                {"type": "type", "text": "hello"},
+                {"type": "keypress", "keys": ["ENTER"]},
+            )
+        ],
+        "instance_id": instance.id,
+        "stream_url": "https://stream",
+    }
+
+    update = await atake_computer_action(state, config)
+
+    # Intermediate calls skip the screenshot, and intermediate screenshots are skipped entirely.
+    assert instance.calls == [
+        {"action": "click_mouse", "button": "left", "coordinates": [1, 2], "screenshot": False},
+        {"action": "type_text", "text": "hello", "screenshot": False},
+        {"action": "press_key", "keys": ["Return"]},
+    ]
+    messages = update["messages"]
+    assert [message["tool_call_id"] for message in messages] == [f"call_{i}" for i in range(1, 5)]
+    image_urls = [message["content"][0]["image_url"] for message in messages]
+    assert image_urls[:3] == [SCREENSHOT_PLACEHOLDER_URL] * 3
+    assert image_urls[3] == f"data:image/png;base64,{PIXEL_PNG_BASE64}"
@@ -0,0 +1,143 @@
+import base64
+import subprocess
+from typing import Any, Optional, Sequence
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from langgraph_cua import ComputerBackend, XvfbBackend, create_cua, simulator
+from langgraph_cua.backends import xvfb
+from langgraph_cua.backends.xvfb import XvfbInstance, get_xdotool_args
+from langgraph_cua.nodes.take_computer_action import get_computer_call_kwargs
+from langgraph_cua.simulator import SimulatedInstance, SimulatedScrapybara
+
+
+class SimulatedBackend(ComputerBackend):
+    """A backend on top of the simulator, which relies on the default async methods."""
+
+    def __init__(self):
+        self.simulator = SimulatedScrapybara()
+
+    def start(
+        self,
+        environment: str,
+        timeout_hours: float,
+        blocked_domains: Optional[Sequence[str]] = None,
+    ) -> SimulatedInstance:
+        return self.simulator.start_ubuntu()
+
+    def get(self, instance_id: str) -> SimulatedInstance:
+        return self.simulator.get(instance_id)
+
+
+def _computer_call(action: dict) -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": "resp_1"},
+        additional_kwargs={
+            "tool_outputs": [{"type": "computer_call", "call_id": "call_1", "action": action}]
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    ("action", "args"),
+    [
+        (
+            {"type": "click", "button": "right", "x": 1, "y": 2},
+            ["mousemove", "1", "2", "click", "--repeat", "1", "3"],
+        ),
+        (
+            {"type": "double_click", "x": 1, "y": 2},
+            ["mousemove", "1", "2", "click", "--repeat", "2", "1"],
+        ),
+        (
+            {"type": "drag", "path": [{"x": 1, "y": 2}, {"x": 3, "y": 4}]},
+            ["mousemove", "1", "2", "mousedown", "1", "mousemove", "3", "4", "mouseup", "1"],
+        ),
+        ({"type": "keypress", "keys": ["CTRL", "Enter"]}, ["key", "--", "ctrl+Return"]),
+        (
+            {"type": "scroll", "x": 5, "y": 6, "scroll_x": 0, "scroll_y": -60},
+            ["mousemove", "5", "6", "click", "--repeat", "3", "4"],
+        ),
+        ({"type": "type", "text": "-hi"}, ["type", "--delay", "12", "--", "-hi"]),
+        ({"type": "wait"}, []),
+    ],
+)
+def test_xdotool_args(action: dict, args: list) -> None:
+    assert get_xdotool_args(get_computer_call_kwargs(action)) == args
+
+
+def test_xvfb_instance_runs_commands_on_its_display(monkeypatch) -> None:
+    runs = []
+
+    def run(args: Any, env: dict, **kwargs: Any) -> subprocess.CompletedProcess:
+        runs.append((args, env["DISPLAY"]))
+        return subprocess.CompletedProcess(args, 0, stdout=b"png", stderr=b"")
+
+    monkeypatch.setattr(xvfb.subprocess, "run", run)
+    instance = XvfbInstance(XvfbBackend(), 101, [])
+
+    response = instance.computer(action="move_mouse", coordinates=[1, 2])
+    silent = instance.computer(action="move_mouse", coordinates=[3, 4], screenshot=False)
+
+    assert runs == [
+        (["xdotool", "mousemove", "1", "2"], ":101"),
+        (["import", "-window", "root", "png:-"], ":101"),
+        (["xdotool", "mousemove", "3", "4"], ":101"),
+    ]
+    assert response.base_64_image == base64.b64encode(b"png").decode("ascii")
+    assert silent.base_64_image is None
+    assert instance.get_stream_url().stream_url == "x11://localhost:101"
+    instance.stop()
+    with pytest.raises(RuntimeError):
+        instance.computer(action="take_screenshot")
+
+
+def test_xvfb_backend_rejects_windows() -> None:
+    with pytest.raises(ValueError):
+        XvfbBackend().start("windows", 1)
+
+
+@pytest.mark.asyncio
+async def test_graph_uses_computer_backend(monkeypatch, fake_llm) -> None:
+    monkeypatch.delenv("SCRAPYBARA_API_KEY", raising=False)
+    backend = SimulatedBackend()
+    cua = create_cua(computer_backend=backend)
+    fake_llm.responses = [_computer_call({"type": "type", "text": "hello"})]
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="Say hello")]})
+
+    instance = backend.simulator.instances[result["instance_id"]]
+    assert [call["action"] for call in instance.calls] == ["type_text"]
+    assert result["stream_url"] == f"https://stream.simulator/{instance.id}"
+
+
+@pytest.mark.asyncio
+async def test_model_sees_backend_display_size(monkeypatch, fake_llm) -> None:
+    monkeypatch.delenv("SCRAPYBARA_API_KEY", raising=False)
+    backend = simulator.SimulatedBackend(SimulatedScrapybara(width=1280, height=800))
+    cua = create_cua(computer_backend=backend)
+    fake_llm.responses = [_computer_call({"type": "click", "button": "left", "x": 1200, "y": 700})]
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="Click")]})
+
+    assert (fake_llm.tools[0]["display_width"], fake_llm.tools[0]["display_height"]) == (1280, 800)
+    instance = backend.simulator.instances[result["instance_id"]]
+    assert instance.calls[0]["coordinates"] == [1200, 700]
+    assert XvfbBackend(width=1920, height=1080).display_size == (1920, 1080)
+    with pytest.raises(ValueError):
+        create_cua(computer_backend=backend, model_display_size=(1440, 900))
+
+
+def test_auth_state_requires_backend_support() -> None:
+    with pytest.raises(ValueError):
+        create_cua(computer_backend=XvfbBackend(), auth_state_id="auth")
+    with pytest.raises(ValueError):
+        create_cua(computer_backend=SimulatedBackend(), auth_state_id="auth")
+    create_cua(computer_backend=simulator.SimulatedBackend(), auth_state_id="auth")
+
+
+def test_vm_pool_and_computer_backend_are_exclusive() -> None:
+    with pytest.raises(ValueError):
+        create_cua(computer_backend=SimulatedBackend(), vm_pool=object())
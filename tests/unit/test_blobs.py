@@ -0,0 +1,76 @@
+import base64
+
+import pytest
+from langchain_core.messages import AIMessage, ToolMessage
+
+from langgraph_cua import InMemoryBlobStore, LocalFileBlobStore
+from langgraph_cua.blobs import make_blob_url, parse_blob_url, rehydrate_messages
+from langgraph_cua.nodes import take_computer_action
+from langgraph_cua.utils import instance_cache
+from tests.conftest import PIXEL_PNG_BASE64
+
+
+@pytest.fixture(params=["memory", "file", "mmap"])
+def blob_store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryBlobStore()
+    return LocalFileBlobStore(tmp_path, use_mmap=request.param == "mmap")
+
+
+def test_blob_store_round_trip(blob_store) -> None:
+    digest = blob_store.put(b"screenshot")
+
+    assert blob_store.put(b"screenshot") == digest
+    assert digest in blob_store
+    assert bytes(blob_store.get(digest)) == b"screenshot"
+
+    blob_store.delete(digest)
+    assert digest not in blob_store
+    with pytest.raises(KeyError):
+        blob_store.get(digest)
+
+
+def test_blob_urls() -> None:
+    url = make_blob_url("ab" * 32, "image/webp")
+
+    assert url == f"blob:image/webp;sha256,{'ab' * 32}"
+    assert parse_blob_url(url) == ("image/webp", "ab" * 32)
+    assert parse_blob_url("data:image/png;base64,AAAA") is None
+
+
+def test_take_computer_action_stores_reference(blob_store, fake_scrapybara) -> None:
+    instance = fake_scrapybara.start_browser()
+    instance_cache.put(instance)
+    message = AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {"type": "computer_call", "call_id": "call_1", "action": {"type": "screenshot"}}
+            ]
+        },
+    )
+    state = {"messages": [message], "instance_id": instance.id, "stream_url": "https://stream"}
+
+    update = take_computer_action(state, {"configurable": {"blob_store": blob_store}})
+
+    image_url = update["messages"][-1]["content"][0]["image_url"]
+    media_type, digest = parse_blob_url(image_url)
+    assert media_type == "image/png"
+    assert base64.b64encode(blob_store.get(digest)).decode() == PIXEL_PNG_BASE64
+
+
+def test_rehydrate_messages_does_not_mutate_state(blob_store) -> None:
+    digest = blob_store.put(base64.b64decode(PIXEL_PNG_BASE64))
+    tool_message = ToolMessage(
+        content=[{"type": "input_image", "image_url": make_blob_url(digest, "image/png")}],
+        tool_call_id="call_1",
+        additional_kwargs={"type": "computer_call_output"},
+    )
+    system = {"role": "system", "content": "prompt"}
+
+    rehydrated = rehydrate_messages([system, tool_message], blob_store)
+
+    assert rehydrated[0] is system
+    assert rehydrated[1].content[0]["image_url"] == f"data:image/png;base64,{PIXEL_PNG_BASE64}"
+    assert rehydrated[1].tool_call_id == "call_1"
+    assert tool_message.content[0]["image_url"].startswith("blob:")
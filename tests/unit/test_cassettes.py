@@ -0,0 +1,99 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from scrapybara.core.api_error import ApiError
+
+from langgraph_cua import Cassette, VMPool, create_cua, utils
+from langgraph_cua.backends import get_computer_backend
+from langgraph_cua.cassettes import CASSETTE_FILE
+
+CLICK = {"type": "click", "button": "left", "x": 10, "y": 20}
+
+
+def _computer_call(action: dict) -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": "resp_1"},
+        additional_kwargs={
+            "tool_outputs": [{"type": "computer_call", "call_id": "call_1", "action": action}]
+        },
+    )
+
+
+async def _run(cassette: Cassette) -> dict:
+    cua = create_cua(scrapybara_api_key="key", cassette=cassette)
+    return await cua.ainvoke({"messages": [HumanMessage(content="Click the button")]})
+
+
+@pytest.mark.asyncio
+async def test_replay_serves_recorded_run_without_network(
+    tmp_path, monkeypatch, patch_scrapybara, fake_llm
+) -> None:
+    fake_llm.responses = [_computer_call(CLICK), _computer_call(CLICK)]
+    recorded = await _run(Cassette(tmp_path, mode="record"))
+
+    interactions = [
+        json.loads(line) for line in (tmp_path / CASSETTE_FILE).read_text().splitlines()
+    ]
+    assert [i["type"] for i in interactions].count("model") == 3
+    # Both screenshots are identical, so they're stored once.
+    assert len([path for path in (tmp_path / "blobs").rglob("*") if path.is_file()]) == 1
+
+    def offline(api_key):
+        raise AssertionError("Scrapybara was called during a replay")
+
+    monkeypatch.setattr(utils, "get_scrapybara_client", offline)
+    monkeypatch.setattr(utils, "get_async_scrapybara_client", offline)
+    utils.instance_cache.clear()
+    requests = len(fake_llm.requests)
+
+    replayed = await _run(Cassette(tmp_path))
+
+    assert len(fake_llm.requests) == requests
+    assert replayed["instance_id"] == recorded["instance_id"]
+    assert [m.type for m in replayed["messages"]] == [m.type for m in recorded["messages"]]
+    assert replayed["messages"][2].content == recorded["messages"][2].content
+    assert replayed["messages"][-1].content == "done"
+
+
+def test_replay_raises_on_unrecorded_model_call(tmp_path) -> None:
+    Cassette(tmp_path, mode="record")
+
+    with pytest.raises(KeyError):
+        Cassette(tmp_path).replay_model_call("task:0")
+
+
+def test_replay_uses_recorded_latency(tmp_path) -> None:
+    recording = Cassette(tmp_path, mode="record")
+    recording.record_model_call("task:0", [], {}, AIMessage(content="done"), seconds=1.5)
+
+    assert Cassette(tmp_path, latency="recorded").replay_model_call("task:0").delay_seconds == 1.5
+    assert Cassette(tmp_path).replay_model_call("task:0").delay_seconds == 0
+
+
+def test_replay_raises_recorded_errors(tmp_path, patch_scrapybara) -> None:
+    configuration = {"scrapybara_api_key": "key", "cassette": Cassette(tmp_path, mode="record")}
+    instance = get_computer_backend(configuration).start("ubuntu", 1)
+    patch_scrapybara.instances[instance.id].status = "terminated"
+
+    def fail(**kwargs):
+        raise ApiError(status_code=409, body="Instance is not running")
+
+    patch_scrapybara.instances[instance.id].computer = fail
+    with pytest.raises(ApiError):
+        instance.computer(action="take_screenshot")
+
+    replayed = get_computer_backend({"cassette": Cassette(tmp_path)}).start("ubuntu", 1)
+    assert replayed.id == instance.id
+    with pytest.raises(ApiError) as error:
+        replayed.computer(action="take_screenshot")
+    assert error.value.status_code == 409
+
+
+def test_create_cua_rejects_cassette_with_vm_pool(tmp_path, patch_scrapybara) -> None:
+    pool = VMPool(patch_scrapybara, min_size=0, max_size=1, background_refill=False)
+
+    with pytest.raises(ValueError):
+        create_cua(vm_pool=pool, cassette=Cassette(tmp_path, mode="record"))
+    pool.close()
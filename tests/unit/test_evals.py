@@ -0,0 +1,85 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from langgraph_cua import EvalTask, create_cua, load_task_suite, run_eval
+from langgraph_cua.evals import check_success, main
+from langgraph_cua.simulator import ScriptedModel, SimulatedBackend
+
+
+def test_load_task_suite(tmp_path) -> None:
+    suite = tmp_path / "suite.json"
+    suite.write_text(
+        json.dumps(
+            {
+                "tasks": [
+                    {"id": "price", "prompt": "Find the price", "success": {"contains": "$"}},
+                    {"prompt": "Open a terminal", "environment": "ubuntu"},
+                ]
+            }
+        )
+    )
+    lines = tmp_path / "suite.jsonl"
+    lines.write_text('{"prompt": "Find the price"}\n\n{"prompt": "Open a terminal"}\n')
+
+    tasks = load_task_suite(suite)
+
+    assert tasks == [
+        EvalTask(id="price", prompt="Find the price", success={"contains": "$"}),
+        EvalTask(id="1", prompt="Open a terminal", environment="ubuntu"),
+    ]
+    assert [task.id for task in load_task_suite(lines)] == ["0", "1"]
+    with pytest.raises(ValueError):
+        EvalTask.from_dict({"prompt": "Find the price", "success": {"equals": "$1"}})
+
+
+def test_check_success() -> None:
+    state = {"messages": [HumanMessage(content="Find the price"), AIMessage(content="It's $42.")]}
+
+    assert check_success(EvalTask(id="0", prompt=""), state)
+    assert check_success(EvalTask(id="0", prompt="", success={"contains": "it's $42"}), state)
+    assert check_success(EvalTask(id="0", prompt="", success={"regex": r"\$\d+"}), state)
+    assert not check_success(EvalTask(id="0", prompt="", success={"regex": r"€\d+"}), state)
+    assert not check_success(EvalTask(id="0", prompt=""), {**state, "stall": {"steps": 3}})
+    check = EvalTask(id="0", prompt="", success={"check": "builtins:bool"})
+    assert check_success(check, state)
+
+
+@pytest.mark.asyncio
+async def test_run_eval_offline(tmp_path) -> None:
+    cua = create_cua(computer_backend=SimulatedBackend(), chat_model=ScriptedModel(steps=2))
+    tasks = [
+        EvalTask(id="done", prompt="Click twice"),
+        EvalTask(id="price", prompt="Find the price", success={"contains": "$"}),
+        EvalTask(id="terminal", prompt="Open a terminal", environment="ubuntu"),
+    ]
+
+    report = await run_eval(tasks, cua, max_vms=2, label="offline")
+
+    assert [result.id for result in report.results] == ["done", "price", "terminal"]
+    assert [result.success for result in report.results] == [True, False, True]
+    for result in report.results:
+        assert result.error is None
+        assert result.steps == 2
+        assert result.payload_bytes > 0
+        assert result.model_seconds > 0
+        assert result.action_seconds > 0
+        assert result.wall_seconds >= result.model_seconds + result.action_seconds
+    report.write(tmp_path / "report.json")
+    written = json.loads((tmp_path / "report.json").read_text())
+    assert written["label"] == "offline"
+    assert written["summary"]["succeeded"] == 2
+    assert set(written["summary"]["wall_seconds"]) == {"p50", "p95", "p99", "mean"}
+    assert written["tasks"][1]["id"] == "price"
+
+
+def test_cli_runs_offline(tmp_path) -> None:
+    suite = tmp_path / "suite.jsonl"
+    suite.write_text('{"prompt": "Click twice"}\n')
+
+    main([str(suite), "--offline", "--offline-steps", "1", "--report", str(tmp_path / "out.json")])
+
+    report = json.loads((tmp_path / "out.json").read_text())
+    assert report["summary"]["tasks"] == 1
+    assert report["tasks"][0]["steps"] == 1
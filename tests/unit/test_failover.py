@@ -0,0 +1,180 @@
+import importlib
+import logging
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from scrapybara.core.api_error import ApiError
+
+from langgraph_cua import InMemoryMetricsSink, create_cua
+from langgraph_cua.metrics import (
+    COMPUTER_CALL_FAILURES,
+    COMPUTER_CALL_RETRIES,
+    VM_FAILOVER_FAILURES,
+    VM_FAILOVERS,
+)
+from langgraph_cua.nodes import take_computer_action
+
+CLICK = {"type": "click", "button": "left", "x": 10, "y": 20}
+TYPE = {"type": "type", "text": "hello"}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    module = importlib.import_module("langgraph_cua.nodes.take_computer_action")
+    monkeypatch.setattr(module, "_backoff_seconds", lambda attempt: 0)
+
+
+def _computer_call(action: dict) -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": "resp_1"},
+        additional_kwargs={
+            "tool_outputs": [{"type": "computer_call", "call_id": "call_1", "action": action}]
+        },
+    )
+
+
+def _dead_instance_state(patch_scrapybara) -> dict:
+    instance = patch_scrapybara.start_browser()
+    instance.stop()
+    return {
+        "messages": [HumanMessage(content="Click the button")],
+        "instance_id": instance.id,
+        "stream_url": f"https://stream.test/{instance.id}",
+    }
+
+
+@pytest.mark.asyncio
+async def test_transient_error_is_retried(patch_scrapybara, fake_llm) -> None:
+    sink = InMemoryMetricsSink()
+    cua = create_cua(scrapybara_api_key="key", metrics_sink=sink)
+    fake_llm.responses = [_computer_call(CLICK)]
+    instance = patch_scrapybara.start_browser()
+    instance.errors = [ApiError(status_code=502, body="Bad gateway")]
+
+    result = await cua.ainvoke(
+        {
+            "messages": [HumanMessage(content="Click the button")],
+            "instance_id": instance.id,
+            "stream_url": "https://stream.test/browser-0",
+        }
+    )
+
+    assert result["instance_id"] == instance.id
+    assert result["messages"][2].type == "tool"
+    assert [call["action"] for call in instance.calls] == ["click_mouse"]
+    assert sink.counter(COMPUTER_CALL_RETRIES, node="take_computer_action") == 1
+    assert len(patch_scrapybara.instances) == 1
+
+
+@pytest.mark.asyncio
+async def test_dead_instance_is_replaced(patch_scrapybara, fake_llm) -> None:
+    sink = InMemoryMetricsSink()
+    cua = create_cua(scrapybara_api_key="key", auth_state_id="auth", metrics_sink=sink)
+    fake_llm.responses = [_computer_call(CLICK)]
+    state = _dead_instance_state(patch_scrapybara)
+
+    chunks = [
+        chunk
+        async for chunk in cua.astream({**state, "authenticated_id": "auth"}, stream_mode="custom")
+    ]
+
+    (failover,) = [chunk["failover"] for chunk in chunks if "failover" in chunk]
+    replacement = patch_scrapybara.instances[failover["instance_id"]]
+    assert failover["previous_instance_id"] == state["instance_id"]
+    assert {"stream_url": f"https://stream.test/{replacement.id}"} in chunks
+    assert replacement.auth_state_id == "auth"
+    assert replacement.calls == [{"action": "take_screenshot"}]
+    # The model continued from the new instance's screenshot.
+    assert fake_llm.requests[-1][-1].type == "tool"
+    assert sink.counter(VM_FAILOVERS, node="take_computer_action") == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_failover_is_logged_and_counted(
+    monkeypatch, caplog, patch_scrapybara, fake_llm
+) -> None:
+    sink = InMemoryMetricsSink()
+    cua = create_cua(scrapybara_api_key="key", metrics_sink=sink)
+    fake_llm.responses = [_computer_call(CLICK)]
+    state = _dead_instance_state(patch_scrapybara)
+
+    def fail_to_start(*args, **kwargs):
+        raise ApiError(status_code=500, body="No capacity")
+
+    monkeypatch.setattr(patch_scrapybara, "_start", fail_to_start)
+
+    with caplog.at_level(logging.WARNING, logger="langgraph_cua"):
+        result = await cua.ainvoke(state)
+
+    assert result["messages"][-1].type == "ai"
+    assert sink.counter(COMPUTER_CALL_FAILURES, node="take_computer_action") == 1
+    assert sink.counter(VM_FAILOVER_FAILURES, node="take_computer_action") == 1
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith("Failed to execute computer calls") for message in messages)
+    assert f"Failed to replace instance {state['instance_id']}" in messages
+
+
+@pytest.mark.asyncio
+async def test_failover_can_be_disabled(patch_scrapybara, fake_llm) -> None:
+    cua = create_cua(scrapybara_api_key="key", vm_failover=False)
+    fake_llm.responses = [_computer_call(CLICK)]
+    state = _dead_instance_state(patch_scrapybara)
+
+    result = await cua.ainvoke(state)
+
+    assert result["instance_id"] == state["instance_id"]
+    assert result["messages"][-1].type == "ai"
+    assert len(patch_scrapybara.instances) == 1
+
+
+def test_failed_action_on_live_instance_returns_screenshot(patch_scrapybara) -> None:
+    instance = patch_scrapybara.start_browser()
+    instance.errors = [ApiError(status_code=400, body="Invalid coordinates")]
+    config = {"configurable": {"scrapybara_api_key": "key"}}
+    state = {
+        "messages": [_computer_call(CLICK)],
+        "instance_id": instance.id,
+        "stream_url": "https://stream.test/browser-0",
+    }
+
+    update = take_computer_action(state, config)
+
+    assert update["instance_id"] == instance.id
+    assert update["messages"][0]["tool_call_id"] == "call_1"
+    assert instance.calls == [{"action": "take_screenshot"}]
+
+
+def test_retry_resumes_from_failed_call(patch_scrapybara) -> None:
+    instance = patch_scrapybara.start_browser()
+    instance.errors = [None, ApiError(status_code=502, body="Bad gateway")]
+    config = {"configurable": {"scrapybara_api_key": "key"}}
+    message = _computer_call(CLICK)
+    type_call = {"type": "computer_call", "call_id": "call_0", "action": TYPE}
+    message.additional_kwargs["tool_outputs"].insert(0, type_call)
+    state = {
+        "messages": [message],
+        "instance_id": instance.id,
+        "stream_url": "https://stream.test/browser-0",
+    }
+
+    update = take_computer_action(state, config)
+
+    assert [call["action"] for call in instance.calls] == ["type_text", "click_mouse"]
+    assert [m["tool_call_id"] for m in update["messages"]] == ["call_0", "call_1"]
+
+
+def test_gateway_timeout_is_not_retried(patch_scrapybara) -> None:
+    instance = patch_scrapybara.start_browser()
+    instance.errors = [ApiError(status_code=504, body="Gateway timeout")]
+    config = {"configurable": {"scrapybara_api_key": "key"}}
+    state = {
+        "messages": [_computer_call(CLICK)],
+        "instance_id": instance.id,
+        "stream_url": "https://stream.test/browser-0",
+    }
+
+    take_computer_action(state, config)
+
+    # The failed click isn't repeated. The instance is probed with a screenshot instead.
+    assert [call["action"] for call in instance.calls] == ["take_screenshot"]
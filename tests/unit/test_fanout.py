@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from langgraph_cua import create_cua
+from tests.conftest import AsyncFakeInstance
+
+
+def _click(step: int) -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": f"resp_{step}"},
+        additional_kwargs={
+            "tool_outputs": [
+                {
+                    "type": "computer_call",
+                    "call_id": f"call_{step}",
+                    "action": {"type": "click", "button": "left", "x": 10, "y": 20},
+                }
+            ]
+        },
+    )
+
+
+def _is_branch(branch: int):
+    return lambda state: state["fan_out_outcome"]["branch"] == branch
+
+
+def _create_cua(fan_out_success):
+    return create_cua(
+        scrapybara_api_key="key",
+        stall_threshold=2,
+        stall_action="end",
+        fan_out_branches=3,
+        fan_out_success=fan_out_success,
+    )
+
+
+async def _run_until_stall(fan_out_success) -> dict:
+    cua = _create_cua(fan_out_success)
+    return await cua.ainvoke({"messages": [HumanMessage(content="Click the button")]})
+
+
+@pytest.mark.asyncio
+async def test_winning_branch_replaces_stalled_thread(patch_scrapybara, fake_llm) -> None:
+    # The same click on an unchanged screen twice stalls the run. Every branch then finishes.
+    fake_llm.responses = [_click(1), _click(2)]
+
+    result = await _run_until_stall(_is_branch(2))
+
+    assert result["fan_out_outcome"]["winner"] == 2
+    assert result["stall"] is None
+    assert result["messages"][-1].content == "done"
+    assert "attempt 3 of 3" in result["messages"][-2].content[0]["text"]
+    winner = patch_scrapybara.instances[result["instance_id"]]
+    assert winner.id != "browser-0"
+    assert winner.status == "running"
+    # The fork replayed the thread's two clicks before the branch started.
+    assert [call["action"] for call in winner.calls] == ["click_mouse", "click_mouse"]
+    others = [i for i in patch_scrapybara.instances.values() if i is not winner]
+    assert len(others) == 2
+    assert all(instance.status == "terminated" for instance in others)
+
+
+@pytest.mark.asyncio
+async def test_thread_continues_as_first_branch_without_winner(patch_scrapybara, fake_llm) -> None:
+    fake_llm.responses = [_click(1), _click(2)]
+
+    result = await _run_until_stall(lambda state: False)
+
+    assert result["fan_out_outcome"]["winner"] is None
+    assert result["instance_id"] == "browser-0"
+    assert "attempt 1 of 3" in result["messages"][-2].content
+    statuses = {id: instance.status for id, instance in patch_scrapybara.instances.items()}
+    assert statuses.pop("browser-0") == "running"
+    assert set(statuses.values()) == {"terminated"}
+
+
+@pytest.mark.asyncio
+async def test_stops_instances_of_branches_cancelled_while_forking(
+    monkeypatch, patch_scrapybara, fake_llm
+) -> None:
+    # Branch 0 wins while the forks' instances have started, but are still being set up.
+    fake_llm.responses = [_click(1), _click(2)]
+    get_stream_url = AsyncFakeInstance.get_stream_url
+
+    async def slow_get_stream_url(self):
+        if self._instance.id != "browser-0":
+            await asyncio.sleep(0.2)
+        return await get_stream_url(self)
+
+    monkeypatch.setattr(AsyncFakeInstance, "get_stream_url", slow_get_stream_url)
+
+    result = await _run_until_stall(_is_branch(0))
+
+    assert result["fan_out_outcome"]["winner"] == 0
+    statuses = {id: instance.status for id, instance in patch_scrapybara.instances.items()}
+    assert statuses.pop("browser-0") == "running"
+    assert list(statuses.values()) == ["terminated", "terminated"]
+
+
+@pytest.mark.asyncio
+async def test_every_run_of_a_thread_can_fan_out(patch_scrapybara, fake_llm) -> None:
+    cua = _create_cua(_is_branch(1))
+    fake_llm.responses = [_click(1), _click(2)]
+    first = await cua.ainvoke({"messages": [HumanMessage(content="Click the button")]})
+    assert first["fan_out_outcome"]["winner"] == 1
+    assert len(patch_scrapybara.instances) == 3
+
+    fake_llm.responses = [_click(3), _click(4)]
+    second = await cua.ainvoke(
+        {**first, "messages": [*first["messages"], HumanMessage(content="Click it again")]}
+    )
+
+    assert second["fan_out_outcome"]["winner"] == 1
+    assert second["messages"][-1].content == "done"
+    # The second run forked two more instances.
+    assert len(patch_scrapybara.instances) == 5
+
+
+def test_fan_out_requires_stall_detection() -> None:
+    with pytest.raises(ValueError):
+        create_cua(fan_out_branches=2)
+    with pytest.raises(ValueError):
+        create_cua(stall_threshold=2, fan_out_branches=1)
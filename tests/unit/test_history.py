@@ -0,0 +1,111 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from langgraph_cua.history import SCREENSHOT_PLACEHOLDER_URL, get_screenshot_url, shape_history
+from langgraph_cua.nodes import call_model
+
+
+def _trajectory(urls):
+    messages = [HumanMessage(content="task")]
+    for i, url in enumerate(urls):
+        messages.append(AIMessage(content="", response_metadata={"id": f"resp_{i}"}))
+        messages.append(
+            ToolMessage(
+                content=[{"type": "input_image", "image_url": url}],
+                tool_call_id=f"call_{i}",
+                additional_kwargs={"type": "computer_call_output"},
+            )
+        )
+    return messages
+
+
+def _urls(messages):
+    return [url for url in map(get_screenshot_url, messages) if url is not None]
+
+
+def test_keeps_last_n_screenshots() -> None:
+    messages = _trajectory(["data:a", "data:b", "data:c", "data:d"])
+
+    shaped = shape_history(messages, keep_last_screenshots=2)
+
+    placeholder = SCREENSHOT_PLACEHOLDER_URL
+    assert _urls(shaped) == [placeholder, placeholder, "data:c", "data:d"]
+    assert [m.tool_call_id for m in shaped if m.type == "tool"] == [f"call_{i}" for i in range(4)]
+    assert _urls(messages) == ["data:a", "data:b", "data:c", "data:d"]
+
+
+def test_collapses_identical_consecutive_screenshots() -> None:
+    messages = _trajectory(["data:a", "data:a", "data:b", "data:a"])
+
+    shaped = shape_history(messages, collapse_identical_screenshots=True)
+
+    assert _urls(shaped) == [SCREENSHOT_PLACEHOLDER_URL, "data:a", "data:b", "data:a"]
+
+
+def test_collapsed_screenshots_do_not_count_towards_limit() -> None:
+    messages = _trajectory(["data:a", "data:b", "data:b"])
+
+    shaped = shape_history(messages, keep_last_screenshots=2, collapse_identical_screenshots=True)
+
+    assert _urls(shaped) == ["data:a", SCREENSHOT_PLACEHOLDER_URL, "data:b"]
+
+
+def test_pruning_every_n_screenshots_only_appends_between_prunings() -> None:
+    urls = ["data:a", "data:b", "data:b", "data:c", "data:d", "data:e", "data:f"]
+    shaped = [
+        shape_history(
+            _trajectory(urls[:n]),
+            keep_last_screenshots=1,
+            collapse_identical_screenshots=True,
+            prune_screenshots_every=3,
+        )
+        for n in range(1, len(urls) + 1)
+    ]
+
+    placeholder = SCREENSHOT_PLACEHOLDER_URL
+    assert _urls(shaped[1]) == ["data:a", "data:b"]
+    assert _urls(shaped[2]) == [placeholder, placeholder, "data:b"]
+    assert _urls(shaped[5]) == [placeholder] * 5 + ["data:e"]
+    for previous, current in zip(shaped, shaped[1:], strict=False):
+        if len(_urls(current)) % 3:
+            assert current[: len(previous)] == previous
+
+
+def test_no_shaping_by_default() -> None:
+    messages = _trajectory(["data:a", "data:a"])
+
+    assert shape_history(messages) == messages
+
+
+@pytest.mark.asyncio
+async def test_call_model_shapes_history_in_zdr_mode(fake_llm) -> None:
+    messages = _trajectory(["data:a", "data:b", "data:c"])
+    config = {
+        "configurable": {
+            "zdr_enabled": True,
+            "keep_last_screenshots": 1,
+            "prune_screenshots_every": 1,
+        }
+    }
+
+    await call_model({"messages": messages}, config)
+
+    assert _urls(fake_llm.requests[0]) == [
+        SCREENSHOT_PLACEHOLDER_URL,
+        SCREENSHOT_PLACEHOLDER_URL,
+        "data:c",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_call_model_prunes_in_batches_in_zdr_mode(fake_llm) -> None:
+    urls = ["data:a", "data:b", "data:c", "data:d", "data:e", "data:f"]
+    config = {"configurable": {"zdr_enabled": True, "keep_last_screenshots": 1}}
+
+    for n in range(1, len(urls) + 1):
+        await call_model({"messages": _trajectory(urls[:n])}, config)
+
+    requests = [_urls(request) for request in fake_llm.requests]
+    assert requests[3] == urls[:4]
+    assert requests[4] == [SCREENSHOT_PLACEHOLDER_URL] * 4 + ["data:e"]
+    assert requests[5] == [SCREENSHOT_PLACEHOLDER_URL] * 4 + ["data:e", "data:f"]
@@ -0,0 +1,174 @@
+import base64
+import io
+import random
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.constants import CONFIG_KEY_STREAM_WRITER
+
+from langgraph_cua import create_cua
+from langgraph_cua.images import DISPLAY_SIZE, aencode_screenshot, encode_screenshot
+from langgraph_cua.nodes import take_computer_action
+from langgraph_cua.nodes.take_computer_action import scale_action
+from tests.conftest import PIXEL_PNG_BASE64
+
+
+def _gradient_png_base64(width: int = 256, height: int = 192) -> str:
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.new("RGB", (width, height))
+    image.putdata([(x % 256, y % 256, (x * y) % 256) for y in range(height) for x in range(width)])
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def test_png_is_passed_through() -> None:
+    screenshot = encode_screenshot(PIXEL_PNG_BASE64, "png")
+
+    assert screenshot.base64_image == PIXEL_PNG_BASE64
+    assert screenshot.bytes_saved == 0
+    assert screenshot.original_bytes == len(base64.b64decode(PIXEL_PNG_BASE64))
+    assert screenshot.to_data_url().startswith("data:image/png;base64,")
+
+
+@pytest.mark.parametrize("format", ["jpeg", "webp"])
+def test_reencoding_shrinks_screenshots(format: str) -> None:
+    source = _gradient_png_base64()
+
+    screenshot = encode_screenshot(source, format, quality=60)
+
+    assert screenshot.encoded_bytes == len(base64.b64decode(screenshot.base64_image))
+    assert screenshot.bytes_saved > 0
+    assert screenshot.to_data_url().startswith(f"data:image/{format};base64,")
+
+
+@pytest.mark.asyncio
+async def test_async_encoding_matches_sync() -> None:
+    source = _gradient_png_base64()
+
+    assert await aencode_screenshot(source, "jpeg", 70) == encode_screenshot(source, "jpeg", 70)
+
+
+def test_invalid_format() -> None:
+    with pytest.raises(ValueError):
+        encode_screenshot(PIXEL_PNG_BASE64, "gif")
+
+
+def test_take_computer_action_reports_screenshot_bytes(fake_scrapybara) -> None:
+    pytest.importorskip("PIL")
+    from langgraph_cua.utils import instance_cache
+
+    instance = fake_scrapybara.start_browser()
+    instance_cache.put(instance)
+    chunks = []
+    message = AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {"type": "computer_call", "call_id": "call_1", "action": {"type": "screenshot"}}
+            ]
+        },
+    )
+    state = {"messages": [message], "instance_id": instance.id, "stream_url": "https://stream"}
+    config = {
+        "configurable": {"screenshot_format": "jpeg", CONFIG_KEY_STREAM_WRITER: chunks.append}
+    }
+
+    update = take_computer_action(state, config)
+
+    image_url = update["messages"][-1]["content"][0]["image_url"]
+    assert image_url.startswith("data:image/jpeg;base64,")
+    assert chunks[-1]["screenshot"]["format"] == "jpeg"
+    assert chunks[-1]["screenshot"]["original_bytes"] == len(base64.b64decode(PIXEL_PNG_BASE64))
+
+
+def _target_png_base64(x: int, y: int, size: int) -> str:
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.new("L", DISPLAY_SIZE, 255)
+    image.paste(0, (x, y, x + size, y + size))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def test_downscaling_resizes_screenshot() -> None:
+    Image = pytest.importorskip("PIL.Image")
+
+    screenshot = encode_screenshot(_target_png_base64(0, 0, 16), "png", size=(512, 384))
+
+    with Image.open(io.BytesIO(base64.b64decode(screenshot.base64_image))) as image:
+        assert image.size == (512, 384)
+    assert screenshot.size == (512, 384)
+    assert screenshot.bytes_saved > 0
+
+
+@pytest.mark.parametrize("model_display_size", [(768, 576), (512, 384), (640, 400)])
+def test_clicks_on_downscaled_targets_land_on_native_targets(model_display_size) -> None:
+    Image = pytest.importorskip("PIL.Image")
+    rng = random.Random(0)
+    target_size = 16
+
+    for _ in range(20):
+        x = rng.randrange(DISPLAY_SIZE[0] - target_size)
+        y = rng.randrange(DISPLAY_SIZE[1] - target_size)
+        screenshot = encode_screenshot(
+            _target_png_base64(x, y, target_size), "png", size=model_display_size
+        )
+        # Find the target in the model's view, as the model would, and click its centre.
+        with Image.open(io.BytesIO(base64.b64decode(screenshot.base64_image))) as image:
+            left, top, right, bottom = image.point(lambda v: 255 if v < 128 else 0).getbbox()
+        action = {"type": "click", "x": (left + right - 1) // 2, "y": (top + bottom - 1) // 2}
+
+        scaled = scale_action(action, model_display_size)
+
+        assert x <= scaled["x"] < x + target_size
+        assert y <= scaled["y"] < y + target_size
+
+
+def test_scale_action_scales_paths_and_leaves_other_actions() -> None:
+    drag = {"type": "drag", "path": [{"x": 0, "y": 0}, {"x": 511, "y": 383}]}
+    keypress = {"type": "keypress", "keys": ["enter"]}
+
+    scaled = scale_action(drag, (512, 384))
+
+    assert scaled["path"] == [{"x": 0, "y": 0}, {"x": 1022, "y": 766}]
+    assert drag["path"][1] == {"x": 511, "y": 383}
+    assert scale_action(keypress, (512, 384)) == keypress
+    assert scale_action(drag, None) is drag
+
+
+def test_scale_action_scales_scroll_distances() -> None:
+    scroll = {"type": "scroll", "x": 100, "y": 50, "scroll_x": 0, "scroll_y": 300}
+
+    scaled = scale_action(scroll, (512, 384), (1024, 1152))
+
+    assert (scaled["x"], scaled["y"]) == (200, 151)
+    assert (scaled["scroll_x"], scaled["scroll_y"]) == (0, 900)
+    assert scroll["scroll_y"] == 300
+
+
+@pytest.mark.asyncio
+async def test_model_sees_downscaled_display(patch_scrapybara, fake_llm) -> None:
+    pytest.importorskip("PIL")
+    cua = create_cua(scrapybara_api_key="key", model_display_size=(512, 384))
+    fake_llm.responses = [
+        AIMessage(
+            content="",
+            response_metadata={"id": "resp_1"},
+            additional_kwargs={
+                "tool_outputs": [
+                    {
+                        "type": "computer_call",
+                        "call_id": "call_1",
+                        "action": {"type": "click", "button": "left", "x": 10, "y": 20},
+                    }
+                ]
+            },
+        )
+    ]
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="Click")]})
+
+    assert fake_llm.tools[0]["display_width"] == 512
+    assert fake_llm.tools[0]["display_height"] == 384
+    assert patch_scrapybara.instances[result["instance_id"]].calls[0]["coordinates"] == [20, 40]
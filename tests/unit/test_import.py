@@ -1,3 +1,57 @@
+import subprocess
+import sys
+from typing import Dict
+
+# Modules which must only be imported once they're used.
+SDK_MODULES = {"scrapybara", "openai", "langchain_openai"}
+
+# The most `import langgraph_cua` may take, cumulatively, in microseconds. It only defines
+# the lazy exports, so this is far above its usual cost of about a millisecond, and far
+# below the cost of importing any of its dependencies.
+PACKAGE_IMPORT_BUDGET_US = 100_000
+
+
+def _import_times(statement: str) -> Dict[str, int]:
+    """Runs `statement` in a fresh interpreter, and returns the cumulative import time of each module it imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
 def test_import() -> None:
     """Test that the code can be imported"""
     from langgraph_cua import CUAState, create_cua, graph  # noqa: F401
+
+
+def test_graph_export_is_compiled_graph() -> None:
+    import langgraph_cua
+    from langgraph_cua import graph
+    from langgraph_cua.graph import get_graph
+
+    assert graph is get_graph()
+    assert langgraph_cua.graph is graph
+
+
+def test_package_import_is_lazy() -> None:
+    times = _import_times("import langgraph_cua")
+
+    assert times["langgraph_cua"] < PACKAGE_IMPORT_BUDGET_US
+    assert "langgraph_cua.graph" not in times
+    assert not SDK_MODULES & times.keys()
+
+
+def test_types_import_without_sdks() -> None:
+    times = _import_times("import langgraph_cua.types")
+
+    assert "langgraph_cua.types" in times
+    assert not SDK_MODULES & times.keys()
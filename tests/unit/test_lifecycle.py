@@ -0,0 +1,156 @@
+import importlib
+import os
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from langgraph_cua import VMPool, create_cua, get_vm_pool_key
+from langgraph_cua.graph import take_action_or_end
+from langgraph_cua.lifecycle import InstanceTracker, LocalFileInstanceRegistry
+from langgraph_cua.nodes import create_vm_instance, release_vm_instance
+
+CLICK = {"type": "click", "button": "left", "x": 10, "y": 20}
+
+# The modules which use the process-wide instance tracker.
+TRACKER_MODULES = [
+    "langgraph_cua.lifecycle",
+    "langgraph_cua.graph",
+    "langgraph_cua.nodes.create_vm_instance",
+    "langgraph_cua.nodes.release_vm_instance",
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _computer_call(action: dict) -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": "resp_1"},
+        additional_kwargs={
+            "tool_outputs": [{"type": "computer_call", "call_id": "call_1", "action": action}]
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_stop_policy_stops_instance_when_run_ends(patch_scrapybara, fake_llm) -> None:
+    cua = create_cua(scrapybara_api_key="key", vm_end_policy="stop")
+    fake_llm.responses = [_computer_call(CLICK)]
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="Click")]})
+
+    (instance,) = patch_scrapybara.instances.values()
+    assert instance.status == "terminated"
+    assert result["instance_id"] is None
+    assert result["stream_url"] is None
+
+
+@pytest.mark.asyncio
+async def test_keep_policy_keeps_instance(patch_scrapybara, fake_llm) -> None:
+    cua = create_cua(scrapybara_api_key="key")
+    fake_llm.responses = [_computer_call(CLICK)]
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="Click")]})
+
+    assert patch_scrapybara.instances[result["instance_id"]].status == "running"
+
+
+def test_return_to_pool_policy_releases_instance(patch_scrapybara) -> None:
+    pool = VMPool(
+        patch_scrapybara,
+        min_size=0,
+        max_size=2,
+        background_refill=False,
+        reset=lambda instance: None,
+    )
+    config = {
+        "configurable": {
+            "scrapybara_api_key": "key",
+            "vm_pool": pool,
+            "vm_end_policy": "return_to_pool",
+        }
+    }
+    created = create_vm_instance({"messages": []}, config)
+
+    update = release_vm_instance({"messages": [], **created}, config)
+
+    assert update["instance_id"] is None
+    assert pool.size(get_vm_pool_key("web")) == 1
+    assert patch_scrapybara.instances[created["instance_id"]].status == "running"
+    pool.close()
+
+
+def test_sweep_stops_idle_and_orphaned_instances(patch_scrapybara) -> None:
+    clock = FakeClock()
+    tracker = InstanceTracker(clock)
+    backend = type("Backend", (), {"get": lambda self, id: patch_scrapybara.instances[id]})()
+    idle, orphan = patch_scrapybara.start_ubuntu(), patch_scrapybara.start_ubuntu()
+    tracker.track(idle.id, backend, idle_timeout_seconds=60)
+    tracker.track(orphan.id, backend, orphan_timeout_seconds=120)
+    tracker.close()
+    tracker.mark_idle(idle.id)
+
+    clock.now = 90
+    assert tracker.sweep() == [idle.id]
+    tracker.touch(orphan.id)
+    clock.now = 200
+    assert tracker.sweep() == []
+    clock.now = 210
+    assert tracker.sweep() == [orphan.id]
+
+    assert idle.status == orphan.status == "terminated"
+    assert tracker.is_stopped(idle.id)
+    assert len(tracker) == 0
+
+
+def test_sweep_reclaims_instances_of_crashed_processes(tmp_path, patch_scrapybara) -> None:
+    registry = LocalFileInstanceRegistry(tmp_path, stale_after_seconds=60)
+    backend = type("Backend", (), {"get": lambda self, id: patch_scrapybara.instances[id]})()
+    crashed, live = InstanceTracker(), InstanceTracker()
+    crashed.close()
+    live.close()
+    orphan, running = patch_scrapybara.start_ubuntu(), patch_scrapybara.start_ubuntu()
+    crashed.track(orphan.id, backend, registry=registry)
+    live.track(running.id, backend, registry=registry)
+    stale = time.time() - 120
+    for path in tmp_path.iterdir():
+        os.utime(path, (stale, stale))
+
+    # The live process renews its own instance's heartbeat, and reclaims the orphan.
+    assert live.sweep() == [orphan.id]
+
+    assert orphan.status == "terminated"
+    assert running.status == "running"
+    assert set(registry.last_heartbeats()) == {running.id}
+    live.forget(running.id)
+    assert registry.last_heartbeats() == {}
+    with pytest.raises(ValueError):
+        LocalFileInstanceRegistry(tmp_path, stale_after_seconds=1)
+
+
+def test_stopped_instance_is_replaced_on_next_turn(monkeypatch, patch_scrapybara) -> None:
+    clock = FakeClock()
+    tracker = InstanceTracker(clock)
+    tracker.close()
+    for module in TRACKER_MODULES:
+        monkeypatch.setattr(importlib.import_module(module), "instance_tracker", tracker)
+    config = {"configurable": {"scrapybara_api_key": "key", "vm_idle_timeout_seconds": 60}}
+    created = create_vm_instance({"messages": []}, config)
+    release_vm_instance({"messages": [], **created}, config)
+    clock.now = 61
+    assert tracker.sweep() == [created["instance_id"]]
+    state = {"messages": [_computer_call(CLICK)], **created, "authenticated_id": "auth"}
+
+    assert take_action_or_end(state) == "create_vm_instance"
+    replaced = create_vm_instance(state, config)
+
+    assert replaced["instance_id"] != created["instance_id"]
+    assert replaced["authenticated_id"] is None
+    assert patch_scrapybara.instances[created["instance_id"]].status == "terminated"
@@ -0,0 +1,101 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from langgraph_cua import InMemoryMetricsSink, create_cua
+from langgraph_cua.metrics import (
+    ACTIONS,
+    MODEL_TOKENS,
+    NODE_SECONDS,
+    REQUEST_PAYLOAD_BYTES,
+    SCRAPYBARA_CALL_SECONDS,
+    SCREENSHOT_BYTES,
+    get_instrumentation,
+    instrumented,
+)
+
+CLICK = {"type": "click", "button": "left", "x": 1, "y": 2}
+
+
+def _computer_call() -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": "resp_1"},
+        usage_metadata={
+            "input_tokens": 100,
+            "output_tokens": 20,
+            "total_tokens": 120,
+            "input_token_details": {"cache_read": 80},
+        },
+        additional_kwargs={
+            "tool_outputs": [{"type": "computer_call", "call_id": "call_1", "action": CLICK}]
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_records_node_metrics(patch_scrapybara, fake_llm) -> None:
+    sink = InMemoryMetricsSink()
+    fake_llm.responses = [_computer_call()]
+    cua = create_cua(scrapybara_api_key="key", metrics_sink=sink, stream_metrics=True)
+
+    chunks = [
+        chunk
+        async for mode, chunk in cua.astream(
+            {"messages": [HumanMessage(content="click")]}, stream_mode=["custom", "values"]
+        )
+        if mode == "custom" and "metrics" in chunk
+    ]
+
+    assert sink.summary(NODE_SECONDS, node="call_model").count == 2
+    assert sink.summary(NODE_SECONDS, node="create_vm_instance").count == 1
+    assert sink.summary(NODE_SECONDS, node="take_computer_action").count == 1
+    assert (
+        sink.summary(SCRAPYBARA_CALL_SECONDS, node="take_computer_action", call="computer").count
+        == 1
+    )
+    assert sink.summary(SCREENSHOT_BYTES, node="take_computer_action").sum > 0
+    assert sink.counter(ACTIONS, action="click") == 1
+    assert sink.counter(MODEL_TOKENS, type="input") == 100
+    assert sink.counter(MODEL_TOKENS, type="cached") == 80
+    assert [chunk["metrics"]["node"] for chunk in chunks] == [
+        "call_model",
+        "create_vm_instance",
+        "take_computer_action",
+        "call_model",
+        "release_vm_instance",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_records_request_size_with_prompt(patch_scrapybara, fake_llm) -> None:
+    sink = InMemoryMetricsSink()
+    cua = create_cua(scrapybara_api_key="key", metrics_sink=sink, prompt="Be careful.")
+
+    await cua.ainvoke({"messages": [HumanMessage(content="click")]})
+
+    assert sink.summary(REQUEST_PAYLOAD_BYTES).count == 1
+    assert sink.summary(REQUEST_PAYLOAD_BYTES).sum > len("Be careful.")
+
+
+def test_disabled_without_sink() -> None:
+    @instrumented("node")
+    def node(state, config):
+        return get_instrumentation()
+
+    assert not node({}, {"configurable": {}}).enabled
+    assert node({}, {"configurable": {"metrics_sink": InMemoryMetricsSink()}}).enabled
+
+
+def test_prometheus_export() -> None:
+    sink = InMemoryMetricsSink()
+    sink.increment(ACTIONS, 2, {"action": "click"})
+    sink.observe(NODE_SECONDS, 0.5, {"node": "call_model"})
+    sink.observe(NODE_SECONDS, 1.5, {"node": "call_model"})
+
+    assert sink.to_prometheus() == (
+        "# TYPE cua_actions_total counter\n"
+        'cua_actions_total{action="click"} 2\n'
+        "# TYPE cua_node_seconds summary\n"
+        'cua_node_seconds_count{node="call_model"} 2\n'
+        'cua_node_seconds_sum{node="call_model"} 2\n'
+    )
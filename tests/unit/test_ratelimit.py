@@ -0,0 +1,116 @@
+import time
+
+import httpx
+import openai
+import pytest
+from scrapybara.core.api_error import ApiError
+
+from langgraph_cua import ratelimit
+from langgraph_cua.ratelimit import (
+    RateLimit,
+    RateLimiter,
+    acall_with_retries,
+    call_with_retries,
+    get_rate_limiter,
+    rate_limit_instance,
+)
+
+
+def _rate_limit_error(headers: dict) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class Flaky:
+    """Raises the given errors on successive calls, then succeeds."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_waits_for_token_debt() -> None:
+    limiter = RateLimiter(RateLimit(tokens_per_minute=6000))
+
+    limiter.acquire()
+    limiter.record_tokens(6010)
+    started = time.monotonic()
+    limiter.acquire()
+
+    assert time.monotonic() - started >= 0.09
+    assert limiter.stats.waits == 1
+
+
+def test_retries_after_retry_after_header() -> None:
+    limiter = RateLimiter()
+    func = Flaky(_rate_limit_error({"retry-after-ms": "50"}))
+
+    started = time.monotonic()
+    assert call_with_retries(limiter, func) == "ok"
+
+    assert time.monotonic() - started >= 0.05
+    assert func.calls == 2
+    stats = limiter.stats
+    assert (stats.rate_limited, stats.retries) == (1, 1)
+
+
+def test_gives_up_after_max_retries(monkeypatch) -> None:
+    monkeypatch.setattr(ratelimit, "BASE_BACKOFF_SECONDS", 0.001)
+    func = Flaky(*(ApiError(status_code=429, body="slow down") for _ in range(3)))
+
+    with pytest.raises(ApiError):
+        call_with_retries(RateLimiter(), func, max_retries=2)
+    assert func.calls == 3
+
+
+def test_does_not_retry_other_errors() -> None:
+    func = Flaky(ApiError(status_code=500, body="error"))
+
+    with pytest.raises(ApiError):
+        call_with_retries(RateLimiter(), func)
+    assert func.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_instance_retries(monkeypatch) -> None:
+    monkeypatch.setattr(ratelimit, "BASE_BACKOFF_SECONDS", 0.001)
+
+    class Instance:
+        id = "instance"
+
+        def __init__(self):
+            self.flaky = Flaky(ApiError(status_code=429, body="slow down"))
+
+        async def computer(self, **kwargs):
+            return self.flaky(**kwargs)
+
+    configuration = {"scrapybara_api_key": "rate-limited-key", "max_rate_limit_retries": 2}
+    instance = rate_limit_instance(Instance(), configuration)
+
+    assert instance.id == "instance"
+    assert await instance.computer(action="take_screenshot") == "ok"
+    limiter = get_rate_limiter("scrapybara", "rate-limited-key")
+    assert limiter.stats.rate_limited == 1
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_errors_without_pausing(monkeypatch) -> None:
+    monkeypatch.setattr(ratelimit, "BASE_BACKOFF_SECONDS", 0.001)
+    request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+    flaky = Flaky(openai.APIConnectionError(request=request))
+    limiter = RateLimiter()
+
+    async def func():
+        return flaky()
+
+    assert (
+        await acall_with_retries(limiter, func, transient=ratelimit.TRANSIENT_OPENAI_ERRORS) == "ok"
+    )
+    assert (limiter.stats.rate_limited, limiter.stats.retries) == (0, 1)
@@ -0,0 +1,126 @@
+import importlib
+
+import pytest
+
+from langgraph_cua import create_cua, run_many
+from langgraph_cua.simulator import ScriptedModel, computer_call_message
+
+
+class TrackingModel(ScriptedModel):
+    """Tracks how many model calls, and how many threads, are in flight at once."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.inflight = self.max_inflight = 0
+        self.threads = self.max_threads = 0
+
+    async def ainvoke(self, messages, previous_response_id=None, **kwargs):
+        if previous_response_id is None:
+            self.threads += 1
+            self.max_threads = max(self.max_threads, self.threads)
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            response = await super().ainvoke(messages, previous_response_id, **kwargs)
+        finally:
+            self.inflight -= 1
+        if not response.additional_kwargs.get("tool_outputs"):
+            self.threads -= 1
+        return response
+
+
+@pytest.fixture
+def model(monkeypatch) -> TrackingModel:
+    call_model = importlib.import_module("langgraph_cua.nodes.call_model")
+    model = TrackingModel(steps=2, latency_seconds=0.01)
+    monkeypatch.setattr(call_model, "ChatOpenAI", model)
+    call_model.clear_chat_models()
+    return model
+
+
+@pytest.mark.asyncio
+async def test_bounds_vms_and_model_calls(patch_scrapybara, model) -> None:
+    runner = run_many(
+        [f"task {i}" for i in range(6)],
+        create_cua(scrapybara_api_key="key"),
+        max_vms=2,
+        max_inflight_model_calls=1,
+    )
+
+    results = [result async for result in runner]
+
+    assert sorted(result.index for result in results) == list(range(6))
+    assert all(result.error is None for result in results)
+    assert all(result.state["messages"][-1].content == "Done." for result in results)
+    assert model.max_threads == 2
+    assert model.max_inflight == 1
+    assert len(patch_scrapybara.started) == 6
+    stats = runner.stats
+    assert stats.completed == 6
+    assert stats.throughput > 0
+    assert 0 < stats.p50_latency_seconds <= stats.p99_latency_seconds
+
+
+@pytest.mark.asyncio
+async def test_collects_errors(patch_scrapybara, model, monkeypatch) -> None:
+    monkeypatch.delenv("SCRAPYBARA_API_KEY", raising=False)
+    runner = run_many(["task"], create_cua())
+
+    [result] = [result async for result in runner]
+
+    assert isinstance(result.error, ValueError)
+    assert result.state is None
+    assert runner.stats.failed == 1
+
+
+@pytest.mark.asyncio
+async def test_stops_when_iteration_ends(patch_scrapybara, model) -> None:
+    model.latency_seconds = 0.05
+    runner = run_many(
+        ({"messages": [("user", f"task {i}")]} for i in range(10)),
+        create_cua(scrapybara_api_key="key"),
+        max_vms=3,
+    )
+
+    async for _ in runner:
+        runner.cancel()
+
+    stats = runner.stats
+    assert stats.cancelled > 0
+    # Tasks which hadn't started when the run was cancelled are never started.
+    assert len(patch_scrapybara.started) <= stats.completed + stats.cancelled < 10
+
+
+@pytest.mark.asyncio
+async def test_stops_instances_when_tasks_end(patch_scrapybara, model) -> None:
+    def running() -> int:
+        return sum(i.status == "running" for i in patch_scrapybara.instances.values())
+
+    runner = run_many(
+        [f"task {i}" for i in range(6)], create_cua(scrapybara_api_key="key"), max_vms=2
+    )
+
+    async for _ in runner:
+        assert running() <= 2
+
+    assert len(patch_scrapybara.instances) == 6
+    assert running() == 0
+
+
+@pytest.mark.asyncio
+async def test_stops_instance_of_failed_task(patch_scrapybara, model) -> None:
+    def script(step):
+        if step:
+            raise RuntimeError("Model failed")
+        return computer_call_message(
+            "resp_0", [{"type": "click", "button": "left", "x": 1, "y": 1}]
+        )
+
+    model.script = script
+    runner = run_many(["task"], create_cua(scrapybara_api_key="key"))
+
+    [result] = [result async for result in runner]
+
+    assert isinstance(result.error, RuntimeError)
+    [instance] = patch_scrapybara.instances.values()
+    assert instance.status == "terminated"
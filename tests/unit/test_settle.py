@@ -0,0 +1,133 @@
+import base64
+import io
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage
+from langgraph.constants import CONFIG_KEY_STREAM_WRITER
+
+from langgraph_cua.nodes import atake_computer_action, take_computer_action
+from langgraph_cua.settle import WaitSettings, await_stable_screen, wait_for_stable_screen
+
+PIL = pytest.importorskip("PIL.Image")
+
+SETTINGS = WaitSettings("adaptive", 1.0, 0.001, 2, frozenset())
+
+
+def _frame(shade: int) -> str:
+    # Left and right halves with different shades, so the perceptual hash differs per frame.
+    image = PIL.new("L", (64, 48), 0)
+    image.paste(shade, (0, 0, 32 + shade % 32, 48))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class LoadingInstance:
+    """An instance whose screen changes on every screenshot until `settles_after` calls."""
+
+    def __init__(self, settles_after: int):
+        self.id = "loading"
+        self.settles_after = settles_after
+        self.calls = []
+
+    def computer(self, **kwargs):
+        self.calls.append(kwargs)
+        frame = min(len(self.calls), self.settles_after)
+        return SimpleNamespace(base_64_image=_frame(40 + frame * 7))
+
+
+class AsyncLoadingInstance(LoadingInstance):
+    async def computer(self, **kwargs):
+        return LoadingInstance.computer(self, **kwargs)
+
+
+def test_returns_once_screen_is_stable() -> None:
+    instance = LoadingInstance(settles_after=3)
+
+    result = wait_for_stable_screen(instance, SETTINGS)
+
+    # Three changing frames, then two unchanged ones.
+    assert result.polls == 5
+    assert result.stable
+    assert result.response.base_64_image == _frame(40 + 3 * 7)
+
+
+def test_gives_up_at_timeout() -> None:
+    instance = LoadingInstance(settles_after=10_000)
+    settings = SETTINGS._replace(timeout_seconds=0.05, poll_interval_seconds=0.01)
+
+    result = wait_for_stable_screen(instance, settings)
+
+    assert not result.stable
+    assert 0.05 <= result.waited_seconds < 0.5
+
+
+@pytest.mark.asyncio
+async def test_async_settles_after_action() -> None:
+    instance = AsyncLoadingInstance(settles_after=2)
+    first = await instance.computer(action="click_mouse")
+
+    result = await await_stable_screen(instance, SETTINGS, first)
+
+    assert result.stable
+    assert [call["action"] for call in instance.calls] == ["click_mouse"] + ["take_screenshot"] * 3
+
+
+def _state(instance, *actions):
+    message = AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {"type": "computer_call", "call_id": f"call_{i}", "action": action}
+                for i, action in enumerate(actions)
+            ]
+        },
+    )
+    return {"messages": [message], "instance_id": instance.id, "stream_url": "https://stream"}
+
+
+def test_wait_action_reports_time_waited(patch_scrapybara) -> None:
+    instance = patch_scrapybara._start("browser")
+    chunks = []
+    config = {
+        "configurable": {
+            "wait_poll_interval_seconds": 0.001,
+            CONFIG_KEY_STREAM_WRITER: chunks.append,
+        }
+    }
+
+    update = take_computer_action(_state(instance, {"type": "wait"}), config)
+
+    assert update["messages"] is not None
+    # The screen never changes, so it settles after the minimum number of polls.
+    assert instance.calls == [{"action": "take_screenshot"}] * 3
+    assert chunks[0]["wait"]["polls"] == 3
+    assert chunks[0]["wait"]["stable"] is True
+    assert chunks[0]["wait"]["waited_seconds"] < 2
+
+
+@pytest.mark.asyncio
+async def test_settle_after_actions(patch_scrapybara) -> None:
+    instance = patch_scrapybara._start("browser")
+    config = {
+        "configurable": {
+            "wait_poll_interval_seconds": 0.001,
+            "settle_after_actions": ["click"],
+        }
+    }
+    state = _state(
+        instance,
+        {"type": "click", "button": "left", "x": 1, "y": 2},
+        {"type": "type", "text": "hi"},
+    )
+
+    await atake_computer_action(state, config)
+
+    # The intermediate click captures a screenshot to settle on, the final type does not settle.
+    assert [call["action"] for call in instance.calls] == [
+        "click_mouse",
+        "take_screenshot",
+        "take_screenshot",
+        "type_text",
+    ]
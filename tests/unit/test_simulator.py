@@ -0,0 +1,69 @@
+import base64
+
+import pytest
+from langchain_core.messages import HumanMessage
+from scrapybara.core.api_error import ApiError
+
+from langgraph_cua.images import fingerprint_screenshot, hamming_distance
+from langgraph_cua.simulator import ScriptedModel, SimulatedScrapybara, render_screenshot
+
+
+def test_screens_change_only_on_input() -> None:
+    simulator = SimulatedScrapybara()
+    instance = simulator.start_browser()
+
+    first = instance.computer(action="take_screenshot").base_64_image
+    assert instance.computer(action="move_mouse", coordinates=[1, 2]).base_64_image == first
+    clicked = instance.computer(action="click_mouse", button="left").base_64_image
+
+    assert clicked != first
+    assert simulator.get(instance.id) is instance
+    assert instance.computer(action="take_screenshot", screenshot=False).base_64_image is None
+
+
+def test_screens_have_distinct_fingerprints() -> None:
+    pytest.importorskip("PIL")
+    first, second = (
+        fingerprint_screenshot(base64.b64decode(render_screenshot(1024, 768, screen)))
+        for screen in (1, 2)
+    )
+
+    assert hamming_distance(first, second) > 10
+
+
+def test_failure_injection() -> None:
+    simulator = SimulatedScrapybara(failure_rate=1.0)
+    instance = simulator.start_ubuntu()
+
+    with pytest.raises(ApiError):
+        instance.computer(action="take_screenshot")
+    assert simulator.failures == 1
+
+    instance.stop()
+    simulator.failure_rate = 0.0
+    with pytest.raises(ApiError):
+        instance.computer(action="take_screenshot")
+
+
+@pytest.mark.asyncio
+async def test_scripted_model_follows_thread() -> None:
+    model = ScriptedModel(steps=2)
+    messages = [HumanMessage(content="task")]
+
+    first = await model.ainvoke(messages)
+    second = await model.ainvoke([], previous_response_id=first.response_metadata["id"])
+    last = await model.ainvoke([], previous_response_id=second.response_metadata["id"])
+
+    assert first.additional_kwargs["tool_outputs"][0]["action"]["type"] == "click"
+    assert second.additional_kwargs["tool_outputs"][0]["action"]["type"] == "type"
+    assert last.content == "Done."
+
+
+@pytest.mark.asyncio
+async def test_scripted_model_accepts_system_prompt_dict() -> None:
+    model = ScriptedModel(steps=1)
+    messages = [{"role": "system", "content": "Be careful."}, HumanMessage(content="task")]
+
+    response = await model.ainvoke(messages)
+
+    assert response.additional_kwargs["tool_outputs"][0]["action"]["type"] == "click"
@@ -0,0 +1,169 @@
+import base64
+import io
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from langgraph_cua import create_cua
+from langgraph_cua.stall import detect_stall, get_stall_metrics, reset_stall_metrics
+from tests.conftest import PIXEL_PNG_BASE64
+
+
+def _gradient_png_base64() -> str:
+    try:
+        from PIL import Image
+    except ImportError:
+        # Without Pillow screenshots are compared exactly, so any other image will do.
+        return "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGNoAAAAggCBd81ytgAAAABJRU5ErkJggg=="
+    image = Image.linear_gradient("L").rotate(-90).resize((64, 48))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+OTHER_PNG_BASE64 = _gradient_png_base64()
+
+
+@pytest.fixture(autouse=True)
+def clear_stall_metrics():
+    reset_stall_metrics()
+    yield
+    reset_stall_metrics()
+
+
+def _click(step: int) -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": f"resp_{step}"},
+        additional_kwargs={
+            "tool_outputs": [
+                {
+                    "type": "computer_call",
+                    "call_id": f"call_{step}",
+                    "action": {"type": "click", "button": "left", "x": 10, "y": 20},
+                }
+            ]
+        },
+    )
+
+
+def _screenshot(step: int, base64_image: str = PIXEL_PNG_BASE64) -> ToolMessage:
+    return ToolMessage(
+        content=[{"type": "input_image", "image_url": f"data:image/png;base64,{base64_image}"}],
+        tool_call_id=f"call_{step}",
+        additional_kwargs={"type": "computer_call_output"},
+    )
+
+
+def _run_steps(images, configurable):
+    config = {"configurable": configurable, "recursion_limit": 100, "metadata": {}}
+    state = {"messages": [HumanMessage(content="task")]}
+    update = {}
+    for step, image in enumerate(images):
+        config["metadata"]["langgraph_step"] = step * 3 + 3
+        state["messages"] = [*state["messages"], _click(step), _screenshot(step, image)]
+        update = detect_stall(state, config)
+        state.update({k: v for k, v in update.items() if k != "messages"})
+        if "messages" in update:
+            state["messages"] = [*state["messages"], update["messages"]]
+    return state, update
+
+
+def test_disabled_by_default() -> None:
+    state, update = _run_steps([PIXEL_PNG_BASE64] * 5, {})
+
+    assert update == {"stall": None}
+    assert get_stall_metrics().checks == 0
+
+
+def test_changing_screen_is_not_a_stall() -> None:
+    images = [PIXEL_PNG_BASE64, OTHER_PNG_BASE64] * 2
+
+    state, update = _run_steps(images, {"stall_threshold": 3, "stall_action": "end"})
+
+    assert update["stall"] is None
+    assert len(state["step_fingerprints"]) == 4
+    assert get_stall_metrics().detections == 0
+
+
+def test_detects_cycles() -> None:
+    # Toggling between two screens with the same action is a loop too.
+    images = [PIXEL_PNG_BASE64, OTHER_PNG_BASE64] * 3
+
+    state, update = _run_steps(images, {"stall_threshold": 3, "stall_action": "end"})
+
+    assert update["stall"]["repeats"] == 3
+
+
+def test_hint_then_end() -> None:
+    state, update = _run_steps([PIXEL_PNG_BASE64] * 3, {"stall_threshold": 3})
+
+    assert isinstance(update["messages"], HumanMessage)
+    assert update["step_fingerprints"] == []
+    assert state["stall_hints"] == 1
+
+    state, update = _run_steps([PIXEL_PNG_BASE64] * 6, {"stall_threshold": 3})
+
+    assert update["stall"]["reason"] == "repeated_action"
+    assert update["stall"]["repeats"] == 3
+    assert update["stall"]["actions"] == [{"type": "click", "button": "left", "x": 10, "y": 20}]
+    metrics = get_stall_metrics()
+    assert (metrics.hints_injected, metrics.runs_ended) == (2, 1)
+    # Ended at step 18 of 100, leaving room for 27 more model calls.
+    assert metrics.model_calls_saved == 27
+
+
+def test_unreadable_screenshot_is_skipped() -> None:
+    config = {"configurable": {"stall_threshold": 2}}
+    state = {"messages": [HumanMessage(content="task"), _click(0), _screenshot(0, "not base64!")]}
+
+    assert detect_stall(state, config) == {"stall": None}
+    assert get_stall_metrics().fingerprint_failures == 1
+
+
+@pytest.mark.asyncio
+async def test_graph_ends_stalled_run(patch_scrapybara, fake_llm) -> None:
+    fake_llm.responses = [_click(step) for step in range(10)]
+    cua = create_cua(scrapybara_api_key="key", stall_threshold=3, stall_action="end")
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="task")]})
+
+    assert result["stall"]["repeats"] == 3
+    assert len(fake_llm.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_graph_sends_hint_with_tool_output(patch_scrapybara, fake_llm) -> None:
+    fake_llm.responses = [_click(step) for step in range(3)]
+    cua = create_cua(scrapybara_api_key="key", stall_threshold=3)
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="task")]})
+
+    # The hint is sent along with the last screenshot, continuing the previous response.
+    hint_request = fake_llm.requests[3]
+    assert [message.type for message in hint_request] == ["tool", "human"]
+    assert fake_llm.request_kwargs[3]["previous_response_id"] == "resp_2"
+    assert result["stall"] is None
+    assert result["stall_hints"] == 1
+
+
+@pytest.mark.asyncio
+async def test_each_run_of_a_thread_starts_stall_detection_over(patch_scrapybara, fake_llm) -> None:
+    cua = create_cua(scrapybara_api_key="key", stall_threshold=3)
+    # The first run uses its hint, then repeats the click twice more before finishing.
+    fake_llm.responses = [_click(step) for step in range(5)]
+    first = await cua.ainvoke({"messages": [HumanMessage(content="task")]})
+    assert first["stall_hints"] == 1
+    assert len(first["step_fingerprints"]) == 2
+
+    fake_llm.responses = [_click(step) for step in range(5, 8)]
+    second = await cua.ainvoke(
+        {**first, "messages": [*first["messages"], HumanMessage(content="next task")]}
+    )
+
+    # The second run is only hinted after its own third click, and isn't ended.
+    assert second["stall"] is None
+    assert second["stall_hints"] == 1
+    hints = [m for m in second["messages"][len(first["messages"]) :] if m.type == "human"]
+    assert len(hints) == 2
+    assert second["messages"].index(hints[1]) == len(first["messages"]) + 7
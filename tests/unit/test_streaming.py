@@ -0,0 +1,266 @@
+import asyncio
+import importlib
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_openai.chat_models.base import (
+    _construct_lc_result_from_responses_api,
+    _convert_responses_chunk_to_generation_chunk,
+)
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseCreatedEvent,
+    ResponseOutputItemAddedEvent,
+    ResponseOutputItemDoneEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+)
+from openai.types.responses.response_computer_tool_call import ResponseComputerToolCall
+
+from langgraph_cua import create_cua
+
+call_model_module = importlib.import_module("langgraph_cua.nodes.call_model")
+take_computer_action_module = importlib.import_module("langgraph_cua.nodes.take_computer_action")
+
+CLICK = {"type": "click", "button": "left", "x": 1, "y": 2}
+
+
+def _computer_call_chunk(call_id: str, index: int) -> AIMessageChunk:
+    output = {
+        "type": "computer_call",
+        "id": f"cu_{call_id}",
+        "call_id": call_id,
+        "action": CLICK,
+        "pending_safety_checks": [],
+        "status": "completed",
+        "index": index,
+    }
+    return AIMessageChunk(content=[], additional_kwargs={"tool_outputs": [output]})
+
+
+def test_streamed_message_matches_invoked_message() -> None:
+    call = ResponseComputerToolCall(
+        id="cu_1",
+        call_id="call_1",
+        type="computer_call",
+        status="completed",
+        pending_safety_checks=[],
+        action=CLICK,
+    )
+    text = ResponseOutputMessage(
+        id="msg_1",
+        type="message",
+        role="assistant",
+        status="completed",
+        content=[ResponseOutputText(type="output_text", text="Clicking", annotations=[])],
+    )
+    fields = {
+        "id": "resp_1",
+        "created_at": 0,
+        "model": "computer-use-preview",
+        "object": "response",
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+    }
+    response = Response(**fields, output=[call, text], status="completed")
+    events = [
+        ResponseCreatedEvent(
+            type="response.created", response=Response(**fields, output=[]), sequence_number=0
+        ),
+        ResponseOutputItemDoneEvent(
+            type="response.output_item.done", item=call, output_index=0, sequence_number=1
+        ),
+        ResponseOutputItemAddedEvent(
+            type="response.output_item.added",
+            item=text.model_copy(update={"content": [], "status": "in_progress"}),
+            output_index=1,
+            sequence_number=2,
+        ),
+        ResponseTextDeltaEvent(
+            type="response.output_text.delta",
+            item_id="msg_1",
+            output_index=1,
+            content_index=0,
+            delta="Clicking",
+            sequence_number=3,
+            logprobs=[],
+        ),
+        ResponseCompletedEvent(type="response.completed", response=response, sequence_number=4),
+    ]
+    indexes = (-1, -1, -1)
+    aggregate = None
+    for event in events:
+        *indexes, generation = _convert_responses_chunk_to_generation_chunk(event, *indexes)
+        if generation is not None:
+            chunk = generation.message
+            aggregate = chunk if aggregate is None else aggregate + chunk
+
+    streamed = call_model_module._finalize_streamed_message(aggregate)
+    invoked = _construct_lc_result_from_responses_api(response).generations[0].message
+
+    assert streamed == invoked
+
+
+@pytest.mark.asyncio
+async def test_dispatches_action_before_stream_finishes(patch_scrapybara, fake_llm) -> None:
+    instance = patch_scrapybara._start("browser")
+    fake_llm.stream_delay = 0.1
+    fake_llm.responses = [
+        [
+            AIMessageChunk(content=[], response_metadata={"id": "resp_0"}),
+            _computer_call_chunk("call_0", 0),
+            _computer_call_chunk("call_1", 1),
+            AIMessageChunk(content=[{"type": "text", "text": "Clicking twice", "index": 2}]),
+        ]
+    ]
+    chunks = []
+    cua = create_cua(scrapybara_api_key="key", stream_model=True)
+
+    result = None
+    async for mode, chunk in cua.astream(
+        {
+            "messages": [HumanMessage(content="task")],
+            "instance_id": instance.id,
+            "stream_url": "https://stream",
+        },
+        stream_mode=["custom", "values"],
+    ):
+        if mode == "custom":
+            chunks.append(chunk)
+        else:
+            result = chunk
+
+    # Both clicks ran once, while the response was still streaming.
+    assert [call["action"] for call in instance.calls] == ["click_mouse", "click_mouse"]
+    assert instance.call_times[-1] < fake_llm.stream_finished_at[0]
+    ai_message = result["messages"][1]
+    assert [output["call_id"] for output in ai_message.additional_kwargs["tool_outputs"]] == [
+        "call_0",
+        "call_1",
+    ]
+    assert "index" not in ai_message.additional_kwargs["tool_outputs"][0]
+    assert [m.tool_call_id for m in result["messages"] if m.type == "tool"] == ["call_0", "call_1"]
+    (dispatch,) = [chunk["early_dispatch"] for chunk in chunks if "early_dispatch" in chunk]
+    assert dispatch["dispatched_calls"] == 2
+    assert dispatch["saved_seconds"] >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_does_not_dispatch_without_instance(patch_scrapybara, fake_llm) -> None:
+    fake_llm.responses = [
+        [
+            AIMessageChunk(content=[], response_metadata={"id": "resp_0"}),
+            _computer_call_chunk("call_0", 0),
+        ]
+    ]
+    cua = create_cua(scrapybara_api_key="key", stream_model=True)
+
+    result = await cua.ainvoke({"messages": [HumanMessage(content="task")]})
+
+    instance = patch_scrapybara.instances[result["instance_id"]]
+    assert [call["action"] for call in instance.calls] == ["click_mouse"]
+
+
+@pytest.mark.asyncio
+async def test_model_is_reused_across_steps(patch_scrapybara, fake_llm) -> None:
+    fake_llm.responses = [
+        AIMessage(
+            content="",
+            response_metadata={"id": "resp_1"},
+            additional_kwargs={
+                "tool_outputs": [{"type": "computer_call", "call_id": "call_1", "action": CLICK}]
+            },
+        )
+    ]
+    cua = create_cua(scrapybara_api_key="key")
+
+    await cua.ainvoke({"messages": [HumanMessage(content="click")]})
+
+    assert len(fake_llm.requests) == 2
+    assert len(fake_llm.init_kwargs) == 1
+    assert "model_kwargs" not in fake_llm.init_kwargs[0]
+    assert fake_llm.request_kwargs[1] == {"previous_response_id": "resp_1"}
+
+
+@pytest.mark.asyncio
+async def test_stream_failing_after_dispatch_is_not_retried(patch_scrapybara, fake_llm) -> None:
+    instance = patch_scrapybara._start("browser")
+    error = openai.APIConnectionError(request=httpx.Request("POST", "https://api.test"))
+    fake_llm.responses = [
+        [
+            AIMessageChunk(content=[], response_metadata={"id": "resp_0"}),
+            _computer_call_chunk("call_0", 0),
+            error,
+        ]
+    ]
+    cua = create_cua(scrapybara_api_key="key", stream_model=True)
+
+    with pytest.raises(call_model_module.DispatchedStreamError):
+        await cua.ainvoke(
+            {
+                "messages": [HumanMessage(content="task")],
+                "instance_id": instance.id,
+                "stream_url": "https://stream",
+            }
+        )
+
+    assert len(fake_llm.requests) == 1
+    assert [call["action"] for call in instance.calls] in ([], ["click_mouse"])
+    assert not take_computer_action_module._dispatched
+
+
+@pytest.mark.asyncio
+async def test_release_discards_calls_never_picked_up(patch_scrapybara) -> None:
+    from langgraph_cua.nodes import arelease_vm_instance
+
+    instance = patch_scrapybara._start("browser")
+    task = asyncio.ensure_future(asyncio.sleep(10))
+    take_computer_action_module._dispatched[(instance.id, "call_0")] = task
+
+    await arelease_vm_instance({"instance_id": instance.id}, {"configurable": {}})
+
+    assert not take_computer_action_module._dispatched
+    await asyncio.sleep(0)
+    assert task.cancelled()
+
+
+def test_does_not_dispatch_to_stopped_instance(monkeypatch, patch_scrapybara) -> None:
+    from langgraph_cua.lifecycle import InstanceTracker
+
+    tracker = InstanceTracker()
+    tracker.close()
+    monkeypatch.setattr(take_computer_action_module, "instance_tracker", tracker)
+    backend = type("Backend", (), {"get": lambda self, id: patch_scrapybara.instances[id]})()
+    stopped, running = patch_scrapybara._start("browser"), patch_scrapybara._start("browser")
+    tracker.track(stopped.id, backend)
+    tracker.stop_all()
+    config = {"configurable": {"scrapybara_api_key": "key"}}
+
+    def can_dispatch(instance) -> bool:
+        state = {"messages": [], "instance_id": instance.id, "stream_url": "https://stream"}
+        return take_computer_action_module.can_dispatch_early(state, config)
+
+    assert not can_dispatch(stopped)
+    assert can_dispatch(running)
+
+
+@pytest.mark.asyncio
+async def test_failover_discards_calls_dispatched_to_replaced_instance(patch_scrapybara) -> None:
+    instance = patch_scrapybara._start("browser")
+    task = asyncio.ensure_future(asyncio.sleep(10))
+    take_computer_action_module._dispatched[(instance.id, "call_0")] = task
+    state = {"messages": [], "instance_id": instance.id}
+
+    _, updates = await take_computer_action_module._afail_over(
+        instance.id, state, {"configurable": {"scrapybara_api_key": "key"}}
+    )
+
+    assert updates["instance_id"] != instance.id
+    assert not take_computer_action_module._dispatched
+    await asyncio.sleep(0)
+    assert task.cancelled()
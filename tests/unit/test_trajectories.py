@@ -0,0 +1,98 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from langgraph_cua import InMemoryTrajectoryStore, TrajectoryCache, create_cua
+from langgraph_cua.trajectories import get_task_key, replay_trajectory
+
+CLICK = {"type": "click", "button": "left", "x": 10, "y": 20}
+TYPE = {"type": "type", "text": "hello"}
+
+
+def _computer_call(step: int, action: dict) -> AIMessage:
+    return AIMessage(
+        content="",
+        response_metadata={"id": f"resp_{step}"},
+        additional_kwargs={
+            "tool_outputs": [{"type": "computer_call", "call_id": f"call_{step}", "action": action}]
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_replays_completed_run(patch_scrapybara, fake_llm) -> None:
+    cache = TrajectoryCache()
+    cua = create_cua(scrapybara_api_key="key", trajectory_cache=cache)
+    fake_llm.responses = [_computer_call(0, CLICK), _computer_call(1, TYPE)]
+
+    await cua.ainvoke({"messages": [HumanMessage(content="Open the  site")]})
+    assert len(fake_llm.requests) == 3
+    assert cache.stats.recorded == 1
+
+    # The same task, with different whitespace, replays both steps.
+    result = await cua.ainvoke({"messages": [HumanMessage(content="Open the site ")]})
+
+    assert len(fake_llm.requests) == 4
+    replay_request = fake_llm.requests[-1]
+    assert [message.type for message in replay_request] == ["human", "human"]
+    assert replay_request[-1].content[1]["type"] == "input_image"
+    assert "previous_response_id" not in fake_llm.request_kwargs[-1]
+    assert len(result["replayed_steps"]) == 2
+    instance = patch_scrapybara.instances[result["instance_id"]]
+    assert [call["action"] for call in instance.calls] == ["click_mouse", "type_text"]
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.steps_replayed, stats.mismatches) == (1, 1, 2, 0)
+    assert stats.hit_rate == 0.5
+
+
+def test_replay_stops_on_first_mismatch(patch_scrapybara) -> None:
+    cache = TrajectoryCache()
+    messages = [HumanMessage(content="task")]
+    cache.record(
+        get_task_key(messages, {"environment": "web"}),
+        [{"screen": None, "actions": [CLICK]}, {"screen": "f" * 64, "actions": [TYPE]}],
+    )
+    config = {"configurable": {"scrapybara_api_key": "key", "trajectory_cache": cache}}
+
+    update = replay_trajectory({"messages": messages}, config)
+
+    instance = patch_scrapybara.instances[update["instance_id"]]
+    assert [call["action"] for call in instance.calls] == ["click_mouse"]
+    assert update["replayed_steps"] == [{"screen": None, "actions": [CLICK]}]
+    assert cache.stats.mismatches == 1
+
+
+@pytest.mark.asyncio
+async def test_records_only_runs_accepted_by_record_if(patch_scrapybara, fake_llm) -> None:
+    cache = TrajectoryCache(record_if=lambda state: "success" in state["messages"][-1].content)
+    cua = create_cua(scrapybara_api_key="key", trajectory_cache=cache)
+    fake_llm.responses = [_computer_call(0, CLICK), AIMessage(content="I give up.")]
+
+    await cua.ainvoke({"messages": [HumanMessage(content="Open the site")]})
+
+    assert cache.stats.recorded == 0
+
+
+def test_task_key_keeps_case() -> None:
+    configuration = {"environment": "web"}
+
+    def key(text: str) -> str:
+        return get_task_key([HumanMessage(content=text)], configuration)
+
+    assert key("Type  Hunter2") == key("Type Hunter2 ")
+    assert key("Type Hunter2") != key("type hunter2")
+
+
+def test_evicts_least_recently_used() -> None:
+    store = InMemoryTrajectoryStore()
+    cache = TrajectoryCache(store, max_entries=2)
+    steps = [{"screen": None, "actions": [CLICK]}]
+
+    cache.record("a", steps)
+    cache.record("b", steps)
+    assert cache.lookup("a") == steps
+    cache.record("c", steps)
+
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") == steps
+    assert len(store) == 2
+    assert cache.stats.evictions == 1
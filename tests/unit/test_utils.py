@@ -0,0 +1,93 @@
+from langchain_core.messages import AIMessage
+
+from langgraph_cua import utils
+from langgraph_cua.nodes import take_computer_action
+from langgraph_cua.utils import InstanceCache, get_instance, get_scrapybara_client
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_scrapybara_clients_are_shared_per_api_key() -> None:
+    try:
+        assert get_scrapybara_client("key-a") is get_scrapybara_client("key-a")
+        assert get_scrapybara_client("key-a") is not get_scrapybara_client("key-b")
+    finally:
+        utils.clear_scrapybara_clients()
+
+
+def test_instance_cache_lru_and_ttl(fake_scrapybara) -> None:
+    clock = FakeClock()
+    cache = InstanceCache(max_size=2, ttl_seconds=10, clock=clock)
+    first, second, third = (fake_scrapybara.start_browser() for _ in range(3))
+
+    cache.put(first)
+    cache.put(second)
+    assert cache.get(first.id) is first
+    cache.put(third)
+    # `second` was the least recently used entry.
+    assert cache.get(second.id) is None
+    assert cache.get(first.id) is first
+
+    clock.now = 10
+    assert cache.get(first.id) is None
+    assert len(cache) == 1
+
+
+def test_get_instance_is_served_from_cache(patch_scrapybara) -> None:
+    fake_scrapybara = patch_scrapybara
+    instance = fake_scrapybara.start_browser()
+    config = {"configurable": {"scrapybara_api_key": "key"}}
+
+    assert get_instance(instance.id, config) is instance
+    assert get_instance(instance.id, config) is instance
+    assert fake_scrapybara.get_calls == 1
+
+    utils.invalidate_instance(instance.id)
+    get_instance(instance.id, config)
+    assert fake_scrapybara.get_calls == 2
+
+
+def test_cached_handles_are_not_shared_across_api_keys(patch_scrapybara) -> None:
+    fake_scrapybara = patch_scrapybara
+    instance = fake_scrapybara.start_browser()
+    utils.instance_cache.put(instance, "key-a")
+
+    assert get_instance(instance.id, {"configurable": {"scrapybara_api_key": "key-a"}}) is instance
+    assert fake_scrapybara.get_calls == 0
+    get_instance(instance.id, {"configurable": {"scrapybara_api_key": "key-b"}})
+    assert fake_scrapybara.get_calls == 1
+
+    utils.invalidate_instance(instance.id)
+    assert utils.instance_cache.get(instance.id, "key-a") is None
+    assert utils.instance_cache.get(instance.id, "key-b") is None
+
+
+def test_steady_state_step_makes_one_backend_call(patch_scrapybara) -> None:
+    fake_scrapybara = patch_scrapybara
+    instance = fake_scrapybara.start_browser()
+    utils.instance_cache.put(instance, "key")
+    message = AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_outputs": [
+                {
+                    "type": "computer_call",
+                    "call_id": "call_1",
+                    "action": {"type": "click", "button": "left", "x": 1, "y": 2},
+                }
+            ]
+        },
+    )
+    state = {"messages": [message], "instance_id": instance.id, "stream_url": "https://stream"}
+
+    update = take_computer_action(state, {"configurable": {"scrapybara_api_key": "key"}})
+
+    assert update["messages"][-1]["tool_call_id"] == "call_1"
+    assert fake_scrapybara.get_calls == 0
+    assert len(instance.calls) == 1
@@ -0,0 +1,190 @@
+import time
+
+import pytest
+from scrapybara.core.api_error import ApiError
+
+from langgraph_cua import VMPool, create_cua, get_vm_pool_key, ratelimit
+from langgraph_cua.nodes import create_vm_instance
+from langgraph_cua.ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lease_hits_warm_instance(fake_scrapybara) -> None:
+    pool = VMPool(fake_scrapybara, min_size=1, max_size=2, background_refill=False)
+    key = get_vm_pool_key("web")
+    pool.refill(key)
+    warm_id = next(iter(fake_scrapybara.instances))
+
+    instance = pool.lease(key)
+
+    assert instance.id == warm_id
+    assert pool.metrics.hits == 1
+    assert pool.metrics.misses == 0
+    assert fake_scrapybara.started[0]["blocked_domains"] == sorted(key.blocked_domains)
+    pool.close()
+
+
+def test_lease_boots_on_miss_and_refills(fake_scrapybara) -> None:
+    pool = VMPool(fake_scrapybara, min_size=2, max_size=2)
+    key = get_vm_pool_key("ubuntu")
+
+    instance = pool.lease(key)
+    pool.close(stop_instances=False)
+
+    assert instance.instance_type == "ubuntu"
+    assert pool.metrics.misses == 1
+    # One boot on the critical path, two background boots to reach min_size.
+    assert pool.metrics.boots == 3
+
+
+def test_unhealthy_instances_are_discarded(fake_scrapybara) -> None:
+    pool = VMPool(fake_scrapybara, min_size=1, max_size=1, background_refill=False)
+    key = get_vm_pool_key("web")
+    pool.refill(key)
+    dead = next(iter(fake_scrapybara.instances.values()))
+    dead.status = "error"
+
+    instance = pool.lease(key)
+
+    assert instance.id != dead.id
+    assert dead.status == "terminated"
+    assert pool.metrics.health_check_failures == 1
+    assert pool.metrics.misses == 1
+    pool.close()
+
+
+def test_idle_instances_are_evicted_after_ttl(fake_scrapybara) -> None:
+    clock = FakeClock()
+    pool = VMPool(
+        fake_scrapybara,
+        min_size=1,
+        max_size=1,
+        idle_ttl_seconds=60,
+        background_refill=False,
+        clock=clock,
+    )
+    key = get_vm_pool_key("windows")
+    pool.refill(key)
+
+    clock.now = 61
+    assert pool.evict_idle() == 1
+    assert pool.size(key) == 0
+    assert all(i.status == "terminated" for i in fake_scrapybara.instances.values())
+    pool.close()
+
+
+def test_idle_pool_is_maintained_in_the_background(fake_scrapybara) -> None:
+    clock = FakeClock()
+    pool = VMPool(
+        fake_scrapybara,
+        min_size=1,
+        max_size=1,
+        idle_ttl_seconds=60,
+        background_refill=False,
+        maintain_interval_seconds=0.01,
+        clock=clock,
+    )
+    key = get_vm_pool_key("web")
+    pool.refill(key)
+
+    clock.now = 61
+    deadline = time.monotonic() + 5
+    while pool.size(key) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.close()
+
+    assert pool.metrics.evictions == 1
+    assert all(i.status == "terminated" for i in fake_scrapybara.instances.values())
+
+
+def test_release_respects_max_size(fake_scrapybara) -> None:
+    reset = []
+    pool = VMPool(
+        fake_scrapybara, min_size=0, max_size=1, background_refill=False, reset=reset.append
+    )
+    key = get_vm_pool_key("web")
+    first, second = pool.lease(key), pool.lease(key)
+
+    assert pool.release(first, key) is True
+    assert pool.release(second, key) is False
+    assert reset == [first, second]
+    assert second.status == "terminated"
+    pool.close()
+
+
+def test_release_stops_instances_which_cannot_be_reset(fake_scrapybara) -> None:
+    def fail(instance):
+        raise RuntimeError("Reset failed")
+
+    key = get_vm_pool_key("web")
+    for reset in (None, fail):
+        pool = VMPool(fake_scrapybara, min_size=0, background_refill=False, reset=reset)
+        instance = pool.lease(key)
+
+        assert pool.release(instance, key) is False
+        assert instance.status == "terminated"
+        assert pool.size(key) == 0
+        pool.close()
+
+
+def test_invalid_bounds() -> None:
+    with pytest.raises(ValueError):
+        VMPool(object(), min_size=3, max_size=2)
+
+
+def test_create_vm_instance_leases_from_pool(fake_scrapybara) -> None:
+    pool = VMPool(fake_scrapybara, min_size=1, max_size=1, background_refill=False)
+    key = get_vm_pool_key("web", auth_state_id="auth-1")
+    pool.refill(key)
+
+    update = create_vm_instance(
+        {"messages": []},
+        {"configurable": {"vm_pool": pool, "auth_state_id": "auth-1"}},
+    )
+
+    instance = fake_scrapybara.instances[update["instance_id"]]
+    assert instance.auth_state_id == "auth-1"
+    assert update["authenticated_id"] == "auth-1"
+    assert update["stream_url"] == f"https://stream.test/{instance.id}"
+    assert pool.metrics.hits == 1
+    pool.close()
+
+
+def test_timeout_hours_must_match_pool(fake_scrapybara) -> None:
+    pool = VMPool(fake_scrapybara, min_size=0, timeout_hours=2.0, background_refill=False)
+
+    with pytest.raises(ValueError, match="timeout_hours"):
+        create_cua(vm_pool=pool)
+    with pytest.raises(ValueError, match="timeout_hours"):
+        create_vm_instance({"messages": []}, {"configurable": {"vm_pool": pool}})
+    assert fake_scrapybara.instances == {}
+    pool.close()
+
+
+def test_rate_limited_boots_are_retried(monkeypatch, fake_scrapybara) -> None:
+    monkeypatch.setattr(ratelimit, "BASE_BACKOFF_SECONDS", 0.001)
+    limiter = RateLimiter()
+    pool = VMPool(fake_scrapybara, min_size=0, max_size=1, rate_limiter=limiter)
+    start = fake_scrapybara._start
+    errors = [ApiError(status_code=429, body="Too many requests")]
+
+    def rate_limited_start(*args, **kwargs):
+        if errors:
+            raise errors.pop()
+        return start(*args, **kwargs)
+
+    monkeypatch.setattr(fake_scrapybara, "_start", rate_limited_start)
+
+    instance = pool.lease(get_vm_pool_key("web"))
+    pool.close()
+
+    assert instance.status == "running"
+    assert limiter.stats.rate_limited == 1
+    assert limiter.stats.retries == 1